@@ -17,6 +17,8 @@ import pytest
 
 from PyQt4 import QtGui, QtCore
 
+pytest_plugins = "tests.benchmark"
+
 @pytest.fixture(scope="function")
 def application(qtbot, request):
     return QtGui.qApp
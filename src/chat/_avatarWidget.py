@@ -20,7 +20,6 @@
 
 
 from PyQt4 import QtCore, QtGui
-from PyQt4.QtNetwork import QNetworkAccessManager, QNetworkRequest
 
 import base64, zlib, os
 import util
@@ -113,7 +112,6 @@ class avatarWidget(QtGui.QDialog):
 
         self.playerList = playerAvatar(parent = self.parent)
     
-        self.nams = {}
         self.avatars = {}
         
         self.finished.connect(self.cleaning)
@@ -154,16 +152,10 @@ class avatarWidget(QtGui.QDialog):
         
             #self.client.send(dict(command="edits", action="submit", file = fileDatas))        
 
-    def finishRequest(self, reply):
-
-        if reply.url().toString() in self.avatars :
-            img = QtGui.QImage()
-            img.loadFromData(reply.readAll())
-            pix = QtGui.QPixmap(img)
-            self.avatars[reply.url().toString()].setIcon(QtGui.QIcon(pix))   
-            self.avatars[reply.url().toString()].setIconSize(pix.rect().size())     
-        
-            util.addrespix(reply.url().toString(), QtGui.QPixmap(img))
+    def avatarDownloaded(self, url, pix):
+        if pix and url in self.avatars :
+            self.avatars[url].setIcon(QtGui.QIcon(pix))
+            self.avatars[url].setIconSize(pix.rect().size())
     
     def clicked(self):
         self.doit(None)
@@ -195,6 +187,8 @@ class avatarWidget(QtGui.QDialog):
     
     def avatarList(self, avatar_list):
         self.listAvatars.clear()
+        # The buttons went away with their items
+        self.avatars = {}
         button = QtGui.QPushButton()
         #self.group_layout.addWidget(button)
         self.avatars["None"] = button
@@ -211,7 +205,6 @@ class avatarWidget(QtGui.QDialog):
         
         for avatar in avatar_list :
             
-            avatarPix = util.respix(avatar["url"])
             button = QtGui.QPushButton()
 
             button.clicked.connect(self.create_connect(avatar["url"]))
@@ -224,18 +217,12 @@ class avatarWidget(QtGui.QDialog):
             
 
             button.setToolTip(avatar["tooltip"])
-            url = QtCore.QUrl(avatar["url"])            
             self.avatars[avatar["url"]] = button
             
             self.listAvatars.setItemWidget ( item, self.avatars[avatar["url"]] )
             
-            if not avatarPix :          
-                self.nams[url] = QNetworkAccessManager(button)
-                self.nams[url].finished.connect(self.finishRequest)
-                self.nams[url].get(QNetworkRequest(url))
-            else :
-                self.avatars[avatar["url"]].setIcon(QtGui.QIcon(avatarPix))   
-                self.avatars[avatar["url"]].setIconSize(avatarPix.rect().size())           
+            # Called right away if the avatar is cached
+            util.images.request(avatar["url"], lambda pix, url=avatar["url"]: self.avatarDownloaded(url, pix))
 
     def cleaning(self):
         if self != self.parent.avatarAdmin :
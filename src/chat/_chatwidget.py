@@ -23,9 +23,9 @@ logger = logging.getLogger(__name__)
 
 
 from PyQt4 import QtGui, QtCore
-from PyQt4.QtNetwork import QNetworkAccessManager, QNetworkRequest
 
 from chat.irclib import SimpleIRCClient
+from chat.ircsockets import IRCSockets
 from config import Settings
 import util
 import fa
@@ -37,7 +37,6 @@ import notificatation_system as ns
 
 IRC_PORT = 8167
 IRC_SERVER = "irc.faforever.com"
-POLLING_INTERVAL = 300   # milliseconds between irc polls
 PONG_INTERVAL = 100000   # milliseconds between pongs
 
 
@@ -55,7 +54,9 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
 
         logger.debug("Lobby instantiating.")
         BaseClass.__init__(self, *args, **kwargs)
-        SimpleIRCClient.__init__(self)
+        # The irc sockets are read as soon as data arrives, from the Qt event loop
+        self.sockets = IRCSockets(lambda sockets: self.ircobj.process_data(sockets), self)
+        SimpleIRCClient.__init__(self, self.sockets.add, self.sockets.remove, self.addTimeout)
 
         self.setupUi(self)
 
@@ -67,10 +68,6 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
         self.client = client
         self.channels = {}
 
-        #avatar downloader
-        self.nam = QNetworkAccessManager()
-        self.nam.finished.connect(self.finishDownloadAvatar)
-
         #nickserv stuff
         self.identified = False
 
@@ -104,8 +101,6 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
         self.client.publicBroadcast.connect(self.announce)
         self.client.autoJoin.connect(self.autoJoin)
         self.channelsAvailable = []
-        self.timer = QtCore.QTimer(self)
-        self.timer.timeout.connect(self.poll)
 
         # disconnection checks
         self.canDisconnect = False
@@ -114,17 +109,13 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
         # self.timeout = 0        
 
 
-    @QtCore.pyqtSlot()
-    def poll(self):
-        self.timer.stop()
-        self.once()
-        self.timer.start(POLLING_INTERVAL)
+    def addTimeout(self, delay):
+        QtCore.QTimer.singleShot(int(delay * 1000), self.ircobj.process_timeout)
 
 
     def disconnect(self):
         self.canDisconnect = True
         self.irc_disconnect()
-        self.timer.stop()
 
 
     @QtCore.pyqtSlot()
@@ -132,7 +123,6 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
         #Do the actual connecting, join all important channels
         try:
             self.irc_connect(self.ircServer, self.ircPort, self.client.login, ssl=True)
-            self.timer.start()
 
         except:
             logger.debug("Unable to connect to IRC server.")
@@ -140,21 +130,14 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
             logger.error("IRC Exception", exc_info=sys.exc_info())
 
 
-    def finishDownloadAvatar(self, reply):
-        ''' this take care of updating the avatars of players once they are downloaded '''
-        img = QtGui.QImage()
-        img.loadFromData(reply.readAll())
-        pix = util.respix(reply.url().toString())
-        if pix :
-            pix = QtGui.QIcon(QtGui.QPixmap(img))
-        else :
-            util.addrespix(reply.url().toString(), QtGui.QPixmap(img))
+    def avatarDownloaded(self, player, url, pix):
+        ''' this take care of updating the avatar of a player once it is downloaded '''
+        if not pix:
+            return
 
-        for player in util.curDownloadAvatar(reply.url().toString()) :
-            for channel in self.channels :
-                if player in self.channels[channel].chatters :
-                    self.channels[channel].chatters[player].avatarItem.setIcon(QtGui.QIcon(util.respix(reply.url().toString())))
-                    self.channels[channel].chatters[player].avatarItem.setToolTip(self.channels[channel].chatters[player].avatarTip)
+        for channel in self.channels :
+            if player in self.channels[channel].chatters :
+                self.channels[channel].chatters[player].avatarDownloaded(url, pix)
 
 
     def closeChannel(self, index):
@@ -304,9 +287,7 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
         channel = e.arguments()[1]
         listing = e.arguments()[2].split()
 
-        for user in listing:
-            self.channels[channel].addChatter(user)
-            QtGui.QApplication.processEvents()      #Added by thygrrr to improve application responsiveness on large IRC packets
+        self.channels[channel].addChatters(listing)
 
         logger.debug("Added " + str(len(listing)) + " Chatters")
 
@@ -460,7 +441,6 @@ class ChatWidget(FormClass, BaseClass, SimpleIRCClient):
         if not self.canDisconnect:
             logger.warn("IRC disconnected - reconnecting.")
             self.identified = False
-            self.timer.stop()
             self.connect()
 
     def on_privmsg(self, c, e):
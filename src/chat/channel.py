@@ -22,6 +22,8 @@ from PyQt4 import QtGui, QtCore
 import time
 from chat import user2name, logger
 from chat.chatter import Chatter
+from chat.chattermodel import ChatterModel, ChatterSortFilterProxy
+from chat.chatlog import ChatLog, ChatLine
 import re          
 import fa
 import json
@@ -30,6 +32,7 @@ import unicodedata
 QUERY_BLINK_SPEED = 250
 CHAT_TEXT_LIMIT = 350
 CHAT_REMOVEBLOCK = 50
+CHAT_RENDER_INTERVAL = 16 # ms, about a frame
 
 FormClass, BaseClass = util.loadUiType("chat/channel.ui")
 
@@ -52,6 +55,10 @@ class Channel(FormClass, BaseClass):
         self.NICKLIST_COLUMNS              = json.loads(util.readfile("chat/formatters/nicklist_columns.json"))
         self.lobby = lobby        
         self.chatters = {}
+
+        # The nick list, the chatters are also in self.chatters by name
+        self.nickModel = ChatterModel(self)
+        self.nickProxy = ChatterSortFilterProxy(self.nickModel, self)
         
         self.lasttimestamp= None
         
@@ -63,8 +70,13 @@ class Channel(FormClass, BaseClass):
         # Table width of each chatter's name cell...        
         self.maxChatterWidth = 100 # TODO: This might / should auto-adapt
 
-        #count the number of line currently in the chat
-        self.lines = 0
+        #The last lines of the chat, rendered once per frame
+        self.log = ChatLog(CHAT_TEXT_LIMIT, CHAT_REMOVEBLOCK)
+        self.scrollForced = False
+        self.renderTimer = QtCore.QTimer(self)
+        self.renderTimer.setSingleShot(True)
+        self.renderTimer.setInterval(CHAT_RENDER_INTERVAL)
+        self.renderTimer.timeout.connect(self.renderLines)
 
         # Clear window menu action
         self.lobby.client.actionClearWindow.triggered.connect(self.clearWindow)
@@ -79,7 +91,8 @@ class Channel(FormClass, BaseClass):
     def setup(self):
         if not self.private:
             # Non-query channels have a sorted nicklist
-            self.nickList.sortItems(Chatter.SORT_COLUMN)
+            self.nickList.setModel(self.nickProxy)
+            self.nickList.sortByColumn(Chatter.SORT_COLUMN, QtCore.Qt.AscendingOrder)
             
             #Properly and snugly snap all the columns
             self.nickList.horizontalHeader().setResizeMode(Chatter.RANK_COLUMN, QtGui.QHeaderView.Fixed)
@@ -93,8 +106,8 @@ class Channel(FormClass, BaseClass):
             
             self.nickList.horizontalHeader().setResizeMode(Chatter.SORT_COLUMN, QtGui.QHeaderView.Stretch)
             
-            self.nickList.itemDoubleClicked.connect(self.nickDoubleClicked)
-            self.nickList.itemPressed.connect(self.nickPressed)
+            self.nickList.doubleClicked.connect(self.nickDoubleClicked)
+            self.nickList.pressed.connect(self.nickPressed)
             
             self.nickFilter.textChanged.connect(self.filterNicks)
             
@@ -140,20 +153,17 @@ class Channel(FormClass, BaseClass):
     @QtCore.pyqtSlot()
     def clearWindow(self):
         if self.isVisible():
+            self.log.clear()
             self.chatArea.setPlainText("")
             self.lasttimestamp = 0 
         
     @QtCore.pyqtSlot()
     def filterNicks(self):
-        for chatter in self.chatters.keys():
-            self.chatters[chatter].setVisible(self.chatters[chatter].isFiltered(self.nickFilter.text().lower()))
+        self.nickProxy.setFilter(self.nickFilter.text())
             
     def updateUserCount(self):
         count = len(self.chatters.keys())
         self.nickFilter.setPlaceholderText(str(count) + " users... (type to filter)")
-            
-        if self.nickFilter.text():
-            self.filterNicks()
                         
 
     @QtCore.pyqtSlot()
@@ -204,27 +214,60 @@ class Channel(FormClass, BaseClass):
             QtGui.QDesktopServices.openUrl(url)
 
 
+    def addLine(self, kind, name, text, html, avatar=None, scroll_forced=False):
+        '''
+        Adds a formatted line to the log, it's shown with the others printed in the same frame.
+        '''
+        self.log.append(ChatLine(kind, name, text, html, avatar))
+        self.scrollForced = self.scrollForced or scroll_forced
+        if not self.renderTimer.isActive():
+            self.renderTimer.start()
+
+    @QtCore.pyqtSlot()
+    def renderLines(self):
+        '''
+        Adds the lines printed since the last frame to the chatArea, in a single edit of its document.
+        '''
+        lines, rebuild = self.log.take()
+        if not lines:
+            return
+
+        # scroll if close to the last line of the log
+        scrollBar = self.chatArea.verticalScrollBar()
+        scroll_current = scrollBar.value()
+        scroll_needed = self.scrollForced or ((scrollBar.maximum() - scroll_current) < 20)
+        self.scrollForced = False
+
+        document = self.chatArea.document()
+        for line in lines:
+            if line.avatar and not document.resource(QtGui.QTextDocument.ImageResource, QtCore.QUrl(line.avatar)):
+                pix = util.respix(line.avatar)
+                if pix:
+                    document.addResource(QtGui.QTextDocument.ImageResource, QtCore.QUrl(line.avatar), pix)
+
+        # A cursor of our own, the user's selection in the chatArea stays where it is
+        cursor = QtGui.QTextCursor(document)
+        if rebuild:
+            cursor.select(QtGui.QTextCursor.Document)
+            cursor.removeSelectedText()
+        else:
+            cursor.movePosition(QtGui.QTextCursor.End)
+        # Each line is a table row, and was a table of its own when inserted one at a time
+        cursor.insertHtml("".join("<table>%s</table>" % line.html for line in lines))
+
+        if scroll_needed:
+            scrollBar.setValue(scrollBar.maximum())
+        else:
+            scrollBar.setValue(scroll_current)
+
     @QtCore.pyqtSlot(str, str)
     def printAnnouncement(self, text, color, size, scroll_forced = True):
         '''
         Print an actual message in the chatArea of the channel
         '''                         
-        # scroll if close to the last line of the log
-        scroll_current = self.chatArea.verticalScrollBar().value()
-        scroll_needed = scroll_forced or ((self.chatArea.verticalScrollBar().maximum() - scroll_current) < 20)
-
-        cursor = self.chatArea.textCursor()
-        cursor.movePosition(QtGui.QTextCursor.End)
-        self.chatArea.setTextCursor(cursor)
-
         formatter = self.FORMATTER_ANNOUNCEMENT        
         line = formatter.format(size=size, color=color, text=util.irc_escape(text, self.lobby.a_style))        
-        self.chatArea.insertHtml(line)
-        
-        if scroll_needed:
-            self.chatArea.verticalScrollBar().setValue(self.chatArea.verticalScrollBar().maximum())
-        else:
-            self.chatArea.verticalScrollBar().setValue(scroll_current)
+        self.addLine("announcement", None, text, line, scroll_forced=scroll_forced)
 
     @QtCore.pyqtSlot(str, str)
     def printMsg(self, name, text, scroll_forced=False):
@@ -232,13 +275,6 @@ class Channel(FormClass, BaseClass):
         Print an actual message in the chatArea of the channel
         '''
         try:
-            if self.lines > CHAT_TEXT_LIMIT :
-                cursor = self.chatArea.textCursor()
-                cursor.movePosition(QtGui.QTextCursor.Start)
-                cursor.movePosition(QtGui.QTextCursor.Down, QtGui.QTextCursor.KeepAnchor, CHAT_REMOVEBLOCK)
-                cursor.removeSelectedText()
-                self.lines = self.lines - CHAT_REMOVEBLOCK
-            
             avatar = None
             
             displayName = name
@@ -255,7 +291,7 @@ class Channel(FormClass, BaseClass):
             else:
                 if name in self.chatters:
                     chatter = self.chatters[name]                
-                    color = chatter.textColor().name()
+                    color = chatter.color.name()
                     if chatter.avatar:
                         avatar = chatter.avatar["url"] 
                         avatarTip = chatter.avatarTip or ""
@@ -271,37 +307,15 @@ class Channel(FormClass, BaseClass):
                 self.pingWindow()
                 color = self.lobby.client.getColor("tous")
     
-    
-            # scroll if close to the last line of the log
-            scroll_current = self.chatArea.verticalScrollBar().value()
-            scroll_needed = scroll_forced or ((self.chatArea.verticalScrollBar().maximum() - scroll_current) < 20)
-    
-            cursor = self.chatArea.textCursor()
-            cursor.movePosition(QtGui.QTextCursor.End)
-            self.chatArea.setTextCursor(cursor)                
-            
-            if avatar :
-                pix = util.respix(avatar)
-                if pix:
-                    if not self.chatArea.document().resource(QtGui.QTextDocument.ImageResource, QtCore.QUrl(avatar)):
-                        self.chatArea.document().addResource(QtGui.QTextDocument.ImageResource,  QtCore.QUrl(avatar), pix)                        
-                    formatter = self.FORMATTER_MESSAGE_AVATAR
-                    line = formatter.format(time=self.timestamp(), avatar=avatar, name=displayName, avatarTip=avatarTip, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))                 
-                else :
-                    formatter = self.FORMATTER_MESSAGE
-                    line = formatter.format(time=self.timestamp(), name=displayName, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))        
-    
+            if avatar and util.respix(avatar):
+                formatter = self.FORMATTER_MESSAGE_AVATAR
+                line = formatter.format(time=self.timestamp(), avatar=avatar, name=displayName, avatarTip=avatarTip, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))                 
             else :
+                avatar = None
                 formatter = self.FORMATTER_MESSAGE
                 line = formatter.format(time=self.timestamp(), name=displayName, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))        
             
-            self.chatArea.insertHtml(line)
-            self.lines = self.lines + 1
-            
-            if scroll_needed:
-                self.chatArea.verticalScrollBar().setValue(self.chatArea.verticalScrollBar().maximum())
-            else:
-                self.chatArea.verticalScrollBar().setValue(scroll_current)
+            self.addLine("message", name, text, line, avatar, scroll_forced)
         except:
             pass
 
@@ -311,13 +325,6 @@ class Channel(FormClass, BaseClass):
         Print an actual message in the chatArea of the channel
         '''
         try:
-            if self.lines > CHAT_TEXT_LIMIT :
-                cursor = self.chatArea.textCursor()
-                cursor.movePosition(QtGui.QTextCursor.Start)
-                cursor.movePosition(QtGui.QTextCursor.Down, QtGui.QTextCursor.KeepAnchor, CHAT_REMOVEBLOCK)
-                cursor.removeSelectedText()
-                self.lines = self.lines - CHAT_REMOVEBLOCK        
-            
             if server_action :
                 color = self.lobby.client.getColor("server")
             elif name.lower() in self.lobby.specialUserColors:
@@ -342,35 +349,15 @@ class Channel(FormClass, BaseClass):
                     avatar = chatter.avatar["url"] 
                     avatarTip = chatter.avatarTip or ""
                 
-            # scroll if close to the last line of the log
-            scroll_current = self.chatArea.verticalScrollBar().value()
-            scroll_needed = scroll_forced or ((self.chatArea.verticalScrollBar().maximum() - scroll_current) < 20)
-            
-            cursor = self.chatArea.textCursor()
-            cursor.movePosition(QtGui.QTextCursor.End)
-            self.chatArea.setTextCursor(cursor)
-    
-            if avatar :
-                pix = util.respix(avatar)
-                if pix:            
-                    if not self.chatArea.document().resource(QtGui.QTextDocument.ImageResource, QtCore.QUrl(avatar)) :
-                        self.chatArea.document().addResource(QtGui.QTextDocument.ImageResource,  QtCore.QUrl(avatar), pix)
-                    formatter = self.FORMATTER_ACTION_AVATAR
-                    line = formatter.format(time=self.timestamp(), avatar=avatar, avatarTip=avatarTip, name=displayName, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))
-                else:            
-                    formatter = self.FORMATTER_ACTION
-                    line = formatter.format(time=self.timestamp(), name=displayName, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))
+            if avatar and util.respix(avatar):
+                formatter = self.FORMATTER_ACTION_AVATAR
+                line = formatter.format(time=self.timestamp(), avatar=avatar, avatarTip=avatarTip, name=displayName, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))
             else:            
+                avatar = None
                 formatter = self.FORMATTER_ACTION
                 line = formatter.format(time=self.timestamp(), name=displayName, color=color, width=self.maxChatterWidth, text=util.irc_escape(text, self.lobby.a_style))
             
-            self.chatArea.insertHtml(line)
-            self.lines = self.lines + 1
-    
-            if scroll_needed:
-                self.chatArea.verticalScrollBar().setValue(self.chatArea.verticalScrollBar().maximum())
-            else:
-                self.chatArea.verticalScrollBar().setValue(scroll_current)
+            self.addLine("action", name, text, line, avatar, scroll_forced)
         except:
             pass
             
@@ -390,22 +377,9 @@ class Channel(FormClass, BaseClass):
             if self.private and name != self.lobby.client.login:
                 self.pingWindow()
                 
-            # scroll if close to the last line of the log
-            scroll_current = self.chatArea.verticalScrollBar().value()
-            scroll_needed = scroll_forced or ((self.chatArea.verticalScrollBar().maximum() - scroll_current) < 20)
-            
-            cursor = self.chatArea.textCursor()
-            cursor.movePosition(QtGui.QTextCursor.End)
-            self.chatArea.setTextCursor(cursor)
-                                
             formatter = self.FORMATTER_RAW
             line = formatter.format(time=self.timestamp(), name=name, color=color, width=self.maxChatterWidth, text=text)
-            self.chatArea.insertHtml(line)
-            
-            if scroll_needed:
-                self.chatArea.verticalScrollBar().setValue(self.chatArea.verticalScrollBar().maximum())
-            else:
-                self.chatArea.verticalScrollBar().setValue(scroll_current)
+            self.addLine("raw", name, text, line, scroll_forced=scroll_forced)
         except:
             pass
         
@@ -423,19 +397,18 @@ class Channel(FormClass, BaseClass):
         return self.lasttimestamp != timestamp
         
     
-    @QtCore.pyqtSlot(QtGui.QTableWidgetItem)
-    def nickDoubleClicked(self, item):
-        chatter = self.nickList.item(item.row(), Chatter.SORT_COLUMN) #Look up the associated chatter object          
-        chatter.doubleClicked(item)
-        pass
+    @QtCore.pyqtSlot(QtCore.QModelIndex)
+    def nickDoubleClicked(self, index):
+        chatter = self.nickProxy.chatterAt(index) #Look up the associated chatter object          
+        chatter.doubleClicked(index.column())
 
 
-    @QtCore.pyqtSlot(QtGui.QTableWidgetItem)
-    def nickPressed(self, item):
+    @QtCore.pyqtSlot(QtCore.QModelIndex)
+    def nickPressed(self, index):
         if QtGui.QApplication.mouseButtons() == QtCore.Qt.RightButton:            
             #Look up the associated chatter object
-            chatter = self.nickList.item(item.row(), Chatter.SORT_COLUMN)           
-            chatter.pressed(item)
+            chatter = self.nickProxy.chatterAt(index)
+            chatter.pressed(self.nickList)
 
 
     @QtCore.pyqtSlot(list)    
@@ -488,20 +461,38 @@ class Channel(FormClass, BaseClass):
         name = user2name(user)
 
         if name not in self.chatters:
-            item = Chatter(self.nickList, user, self.lobby, None)                        
-            self.chatters[name] = item        
-            
-        self.chatters[name].update()
-
-        self.updateUserCount()
+            self.addChatters([user])
+        else:
+            self.chatters[name].update()
         
         if join and self.lobby.client.joinsparts:
             self.printAction(name, "joined the channel.", server_action=True)
+
+    def addChatters(self, users):
+        '''
+        Adds many users at once (like the ones of a NAMES reply), the nick list is sorted once
+        they're all in.
+        '''
+        chatters = []
+        for user in users:
+            name = user2name(user)
+            if name in self.chatters:
+                self.chatters[name].update()
+            else:
+                self.chatters[name] = Chatter(self.nickModel, user, self.lobby)
+                chatters.append(self.chatters[name])
+
+        if len(chatters) > 1:
+            self.nickProxy.addChatters(chatters)
+        else:
+            self.nickModel.addChatters(chatters)
+
+        self.updateUserCount()
     
     
     def removeChatter(self, name, action = None):
         if name in self.chatters:
-            self.nickList.removeRow(self.chatters[name].row())        
+            self.nickModel.removeChatter(name)
             del self.chatters[name]
 
             if action and (self.lobby.client.joinsparts or self.private):
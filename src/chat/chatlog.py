@@ -0,0 +1,71 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+The lines of a channel, kept apart from the QTextDocument that shows them.
+
+A channel keeps its last lines in a ring buffer, and adds the lines printed since the last
+frame to its document in one go. The document only gets rebuilt from the buffer once enough
+lines fell out of it, instead of having its first blocks cut every message.
+'''
+
+import collections
+
+# kind is "message", "action", "raw" or "announcement", html the formatted line, avatar the url
+# of the avatar image it shows, if any
+ChatLine = collections.namedtuple("ChatLine", "kind name text html avatar")
+
+
+class ChatLog(object):
+    '''
+    The last limit lines of a channel, and the ones not rendered yet.
+    '''
+    def __init__(self, limit, slack):
+        '''
+        slack is how many lines more than limit the document can show before it's rebuilt.
+        '''
+        self.lines = collections.deque(maxlen=limit)
+        self.slack = slack
+        self.pending = []
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def append(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+        self.pending.append(line)
+
+    def take(self):
+        '''
+        Returns (lines, rebuild): the lines to add to the end of the document, or with rebuild
+        True, all the lines the document should be replaced with.
+        '''
+        if self.dropped >= self.slack:
+            self.pending = []
+            self.dropped = 0
+            return list(self.lines), True
+        lines, self.pending = self.pending, []
+        return lines, False
+
+    def clear(self):
+        self.lines.clear()
+        self.pending = []
+        self.dropped = 0
@@ -21,7 +21,6 @@
 
 
 from PyQt4 import QtGui, QtCore
-from PyQt4.QtNetwork import QNetworkRequest
 from chat._avatarWidget import avatarWidget
 
 
@@ -33,11 +32,12 @@ import fa
 import client
 
 
-class Chatter(QtGui.QTableWidgetItem):
+class Chatter(object):
     SORT_COLUMN = 2
     AVATAR_COLUMN = 1
     RANK_COLUMN = 0
     STATUS_COLUMN = 3
+    COLUMNS = 4
 
     RANK_ELEVATION = 0
     RANK_FRIEND = 1
@@ -46,15 +46,20 @@ class Chatter(QtGui.QTableWidgetItem):
     RANK_FOE = 4
     RANK_NONPLAYER = 5
 
+    LEAGUE_ICONS = {1: "chat/rank/Aeon_Scout.png",
+                    2: "chat/rank/Aeon_T1.png",
+                    3: "chat/rank/Aeon_T2.png",
+                    4: "chat/rank/Aeon_T3.png",
+                    5: "chat/rank/Aeon_XP.png"}
+
     '''
     A chatter is the representation of a person on IRC, in a channel's nick list. There are multiple chatters per channel.
     There can be multiple chatters for every Player in the Client.
+    It's a row of the channel's ChatterModel, and keeps what the row shows.
     '''
-    def __init__(self, parent, user, lobby, *args, **kwargs):
-        QtGui.QTableWidgetItem.__init__(self, *args, **kwargs)
-                
+    def __init__(self, model, user, lobby):
         #TODO: for now, userflags and ranks aren't properly interpreted :-/ This is impractical if an operator reconnects too late.
-        self.parent = parent
+        self.model = model
         self.lobby = lobby
 
         if user[0] in self.lobby.OPERATOR_COLORS:
@@ -71,81 +76,56 @@ class Chatter(QtGui.QTableWidgetItem):
         self.league = None
         self.clan = ""
         self.avatarTip = ""
-        
-        self.setup()
-    
-    def setup(self):
-        self.setText(self.name)
-        self.setFlags(QtCore.Qt.ItemIsEnabled)        
-        self.setTextAlignment(QtCore.Qt.AlignLeft)
-
-        row = self.parent.rowCount()
-        self.parent.insertRow(row)
-        
-        self.parent.setItem(row, Chatter.SORT_COLUMN, self)
-        
-        self.avatarItem = QtGui.QTableWidgetItem()
-        self.avatarItem.setFlags(QtCore.Qt.ItemIsEnabled)
-        self.avatarItem.setTextAlignment(QtCore.Qt.AlignHCenter)
-        
-        self.rankItem = QtGui.QTableWidgetItem()
-        self.rankItem.setFlags(QtCore.Qt.ItemIsEnabled)
-        self.rankItem.setTextAlignment(QtCore.Qt.AlignHCenter)
-
-        self.statusItem = QtGui.QTableWidgetItem()
-        self.statusItem.setFlags(QtCore.Qt.ItemIsEnabled)
-        self.statusItem.setTextAlignment(QtCore.Qt.AlignHCenter)
 
+        # What the row shows, by column
+        self.text = self.name
+        self.color = None
+        self.icons = [None] * Chatter.COLUMNS
+        self.tooltips = [None] * Chatter.COLUMNS
+        self.sortKey = None
 
-        self.parent.setItem(self.row(), Chatter.RANK_COLUMN, self.rankItem)
-        self.parent.setItem(self.row(), Chatter.AVATAR_COLUMN, self.avatarItem)
-        self.parent.setItem(self.row(), Chatter.STATUS_COLUMN, self.statusItem)
-
-        self.update()        
-
+        # What each part of the row last showed, see shows()
+        self.shown = {}
+        
+        self.update()
+
+
+    def data(self, column, role):
+        ''' The data of the chatter's row, for ChatterModel '''
+        if role == QtCore.Qt.DisplayRole:
+            if column == Chatter.SORT_COLUMN:
+                return self.text
+            return None
+        if role == QtCore.Qt.DecorationRole:
+            return self.icons[column]
+        if role == QtCore.Qt.ToolTipRole:
+            return self.tooltips[column]
+        if role == QtCore.Qt.ForegroundRole:
+            if column == Chatter.SORT_COLUMN:
+                return self.color
+            return None
+        if role == QtCore.Qt.TextAlignmentRole:
+            if column == Chatter.SORT_COLUMN:
+                return QtCore.Qt.AlignLeft
+            return QtCore.Qt.AlignHCenter
+        return None
 
     def isFiltered(self, filter):
         if filter in self.clan.lower() or filter in self.name.lower():
             return True
         return False
 
-    def setVisible(self, visible):        
-        if visible:
-            self.tableWidget().showRow(self.row())
-        else:
-            self.tableWidget().hideRow(self.row())
-              
-    def __ge__(self, other):
-        ''' Comparison operator used for item list sorting '''        
-        return not self.__lt__(other)
-    
-    
-    def __lt__(self, other):
-        ''' Comparison operator used for item list sorting '''
-        firstStatus = self.getUserRank(self)
-        secondStatus = self.getUserRank(other)
-        # if not same rank sort
-        if firstStatus != secondStatus:
-            return firstStatus < secondStatus
-
-        # List self below all friends and above every other player
-        if self.name == self.lobby.client.login: return True
-        if other.name == self.lobby.client.login: return False
-        
-        # Default: Alphabetical
-        return self.name.lower() < other.name.lower()
-
-    def getUserRank(self, user):
+    def getUserRank(self):
         # TODO: Add subdivision for admin?
-        if user.elevation:
+        if self.elevation:
             return self.RANK_ELEVATION
-        if self.lobby.client.isFriend(user.name):
+        if self.lobby.client.isFriend(self.name):
             return self.RANK_FRIEND
         if self.lobby.client.isClanMember(self.name):
             return self.RANK_CLAN_MEMBER
-        if self.lobby.client.isFoe(user.name):
+        if self.lobby.client.isFoe(self.name):
             return self.RANK_FOE
-        if self.lobby.client.isPlayer(user.name):
+        if self.lobby.client.isPlayer(self.name):
             return self.RANK_USER
         return self.RANK_NONPLAYER
 
@@ -160,28 +140,49 @@ class Chatter(QtGui.QTableWidgetItem):
             avatarPix = util.respix(url) 
                     
             if avatarPix :
-                self.avatarItem.setIcon(QtGui.QIcon(avatarPix))            
-                self.avatarItem.setToolTip(self.avatarTip)
+                self.icons[Chatter.AVATAR_COLUMN] = QtGui.QIcon(avatarPix)
+                self.tooltips[Chatter.AVATAR_COLUMN] = self.avatarTip
             else:                           
-                if util.addcurDownloadAvatar(url, self.name) :                
-                    self.lobby.nam.get(QNetworkRequest(QtCore.QUrl(url)))            
+                util.images.request(url, lambda pix, name=self.name, url=url: self.lobby.avatarDownloaded(name, url, pix))
         else:
             # No avatar set.
-            self.avatarItem.setIcon(QtGui.QIcon()) 
-            self.avatarItem.setToolTip(None)
+            self.icons[Chatter.AVATAR_COLUMN] = None
+            self.tooltips[Chatter.AVATAR_COLUMN] = None
+
+    def avatarDownloaded(self, url, pix):
+        # The player may have changed avatars in the meantime
+        if self.avatar and self.avatar["url"] == url:
+            self.icons[Chatter.AVATAR_COLUMN] = QtGui.QIcon(pix)
+            self.tooltips[Chatter.AVATAR_COLUMN] = self.avatarTip
+            self.model.chatterChanged(self)
             
-                        
-                            
+    def shows(self, part, state):
+        '''
+        True if part of the chatter (its "rank", "status", ...) already shows state. Remembers
+        state as shown otherwise, the caller is about to show it.
+        '''
+        if self.shown.get(part, Chatter) == state:
+            return True
+        self.shown[part] = state
+        return False
+
+    def showing(self):
+        # The icons are only replaced when they change, comparing them as objects is enough
+        return (self.text, self.color, self.sortKey, tuple(self.icons), tuple(self.tooltips))
+
     def update(self):
         '''
-        updates the appearance of this chatter in the nicklist according to its lobby and irc states 
-        '''        
+        updates the appearance of this chatter in the nicklist according to its lobby and irc states.
+        Only the parts whose state changed since the last update are touched, and the row is only
+        redrawn if something did change.
+        '''
+        before = self.showing()
 
         country = self.lobby.client.getUserCountry(self.name)
 
-        if  country != None :
-            self.setIcon(util.icon("chat/countries/%s.png" % country.lower()))
-            self.setToolTip(country)
+        if country != None and not self.shows("country", country):
+            self.icons[Chatter.SORT_COLUMN] = util.icon("chat/countries/%s.png" % country.lower())
+            self.tooltips[Chatter.SORT_COLUMN] = country
             
         
         if self.lobby.client.getUserAvatar(self.name) != self.avatar:            
@@ -191,27 +192,37 @@ class Chatter(QtGui.QTableWidgetItem):
         self.rating = self.lobby.client.getUserRanking(self.name)
 
         self.clan = self.lobby.client.getUserClan(self.name)
-        if self.clan != "":
-            self.setText("[%s]%s" % (self.clan,self.name))
+        if not self.shows("clan", self.clan):
+            if self.clan != "":
+                self.text = "[%s]%s" % (self.clan,self.name)
+            else:
+                self.text = self.name
 
         # Color handling
-        self.setChatUserColor(self.name)
+        color = self.chatUserColor(self.name)
+        if not self.shows("color", color):
+            self.color = QtGui.QColor(color)
+
+        # Sorting: by rank, self above the others of the same rank, then alphabetical
+        self.sortKey = (self.getUserRank(), self.name != self.lobby.client.login, self.name.lower())
 
         rating = self.rating
 
         # Status icon handling
         if self.name in client.instance.urls:
             url = client.instance.urls[self.name]
+            status = None
             if url:
                 if url.scheme() == "fafgame":
-                    self.statusItem.setIcon(util.icon("chat/status/lobby.png"))
-                    self.statusItem.setToolTip("In Game Lobby<br/>"+url.toString())
+                    status = ("chat/status/lobby.png", "In Game Lobby<br/>"+url.toString())
                 elif url.scheme() == "faflive":
-                    self.statusItem.setIcon(util.icon("chat/status/playing.png"))
-                    self.statusItem.setToolTip("Playing Game<br/>"+url.toString())
-        else:
-                self.statusItem.setIcon(QtGui.QIcon())
-                self.statusItem.setToolTip("Idle")
+                    status = ("chat/status/playing.png", "Playing Game<br/>"+url.toString())
+            if status and not self.shows("status", status):
+                self.icons[Chatter.STATUS_COLUMN] = util.icon(status[0])
+                self.tooltips[Chatter.STATUS_COLUMN] = status[1]
+        elif not self.shows("status", "idle"):
+                self.icons[Chatter.STATUS_COLUMN] = None
+                self.tooltips[Chatter.STATUS_COLUMN] = "Idle"
             
 
         #Rating icon choice
@@ -219,47 +230,34 @@ class Chatter(QtGui.QTableWidgetItem):
         if rating != None:            
                 league = self.lobby.client.getUserLeague(self.name)
                 
-                self.rankItem.setToolTip("Global Rating: " + str(int(rating)))  
-                
                 if league != None :        
-                    self.rankItem.setToolTip("Division : " + league["division"]+ "\nGlobal Rating: " + str(int(rating)))
-                    if league["league"] == 1 :
-                        self.league = "chat/rank/Aeon_Scout.png"
-                        self.rankItem.setIcon(util.icon("chat/rank/Aeon_Scout.png"))
-                    elif league["league"] == 2 :
-                        self.league = "chat/rank/Aeon_T1.png"
-                        self.rankItem.setIcon(util.icon("chat/rank/Aeon_T1.png"))
-                    elif league["league"] == 3 :
-                        self.league = "chat/rank/Aeon_T2.png"
-                        self.rankItem.setIcon(util.icon("chat/rank/Aeon_T2.png"))
-                    elif league["league"] == 4 :
-                        self.league = "chat/rank/Aeon_T3.png"
-                        self.rankItem.setIcon(util.icon("chat/rank/Aeon_T3.png"))
-                    elif league["league"] == 5 :                
-                        self.league = "chat/rank/Aeon_XP.png"        
-                        self.rankItem.setIcon(util.icon("chat/rank/Aeon_XP.png"))
+                    self.league = Chatter.LEAGUE_ICONS.get(league["league"], self.league)
+                    rank = (self.league, "Division : " + league["division"]+ "\nGlobal Rating: " + str(int(rating)))
                 else :
                     self.league = "chat/rank/newplayer.png"
-                    self.rankItem.setIcon(util.icon("chat/rank/newplayer.png"))
+                    rank = (self.league, "Global Rating: " + str(int(rating)))
                     
         else:
-                self.rankItem.setIcon(util.icon("chat/rank/civilian.png"))
-                self.rankItem.setToolTip("IRC User")
+                rank = ("chat/rank/civilian.png", "IRC User")
+
+        if not self.shows("rank", rank):
+            if rank[0]:
+                self.icons[Chatter.RANK_COLUMN] = util.icon(rank[0])
+            self.tooltips[Chatter.RANK_COLUMN] = rank[1]
 
-    def setChatUserColor(self, username):
+        if self.showing() != before:
+            self.model.chatterChanged(self)
+
+    def chatUserColor(self, username):
         if self.lobby.client.isFriend(username):
             if self.elevation in self.lobby.OPERATOR_COLORS:
-                self.setTextColor(QtGui.QColor(self.lobby.client.getColor("friend_mod")))
-                return
-            self.setTextColor(QtGui.QColor(self.lobby.client.getColor("friend")))
-            return
+                return self.lobby.client.getColor("friend_mod")
+            return self.lobby.client.getColor("friend")
         if self.elevation in self.lobby.OPERATOR_COLORS:
-            self.setTextColor(QtGui.QColor(self.lobby.OPERATOR_COLORS[self.elevation]))
-            return
+            return self.lobby.OPERATOR_COLORS[self.elevation]
         if self.name in self.lobby.client.colors :
-            self.setTextColor(QtGui.QColor(self.lobby.client.getColor(self.name)))
-            return
-        self.setTextColor(QtGui.QColor(self.lobby.client.getUserColor(self.name)))
+            return self.lobby.client.getColor(self.name)
+        return self.lobby.client.getUserColor(self.name)
 
     def joinChannel(self):
         channel, ok = QtGui.QInputDialog.getText(self.lobby.client, "QInputDialog.getText()", "Channel :", QtGui.QLineEdit.Normal)
@@ -295,15 +293,15 @@ class Chatter(QtGui.QTableWidgetItem):
     def closeLobby(self):
         self.lobby.client.closeLobby(self.name)
 
-    def doubleClicked(self, item):
+    def doubleClicked(self, column):
         # filter yourself
         if self.lobby.client.login == self.name:
             return
         # Chatter name clicked
-        if item == self:
+        if column == Chatter.SORT_COLUMN:
             self.lobby.openQuery(self.name, True)  # open and activate query window
 
-        elif item == self.statusItem:
+        elif column == Chatter.STATUS_COLUMN:
             if self.name in client.instance.urls:
                 url = client.instance.urls[self.name]
                 if url.scheme() == "fafgame":
@@ -314,8 +312,8 @@ class Chatter(QtGui.QTableWidgetItem):
 
 
         
-    def pressed(self, item):        
-        menu = QtGui.QMenu(self.parent)
+    def pressed(self, parent):        
+        menu = QtGui.QMenu(parent)
 
         # Actions for stats
         
@@ -0,0 +1,125 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+The nick list of a channel: a table model of its chatters, and the proxy that sorts and filters
+it for the view. The model doesn't keep any order of its own, the rows are sorted by the
+proxy on the sort key each Chatter computes when it's updated.
+'''
+
+from PyQt4 import QtCore, QtGui
+
+from chat.chatter import Chatter
+
+
+class ChatterModel(QtCore.QAbstractTableModel):
+    '''
+    The chatters of a channel, a row each.
+    '''
+    def __init__(self, *args, **kwargs):
+        QtCore.QAbstractTableModel.__init__(self, *args, **kwargs)
+        self.chatters = []
+        self.rows = {}  # The row of each chatter, by name
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.chatters)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return Chatter.COLUMNS
+
+    def flags(self, index):
+        return QtCore.Qt.ItemIsEnabled
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        return self.chatters[index.row()].data(index.column(), role)
+
+    def addChatters(self, chatters):
+        ''' Appends the chatters that aren't in the model yet, in a single insertion '''
+        chatters = [chatter for chatter in chatters if chatter.name not in self.rows]
+        if not chatters:
+            return
+        first = len(self.chatters)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(chatters) - 1)
+        for row, chatter in enumerate(chatters, first):
+            self.rows[chatter.name] = row
+            self.chatters.append(chatter)
+        self.endInsertRows()
+
+    def removeChatter(self, name):
+        row = self.rows.get(name)
+        if row is None:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.chatters[row]
+        del self.rows[name]
+        for later in self.chatters[row:]:
+            self.rows[later.name] -= 1
+        self.endRemoveRows()
+
+    def chatterAt(self, index):
+        return self.chatters[index.row()]
+
+    def chatterChanged(self, chatter):
+        row = self.rows.get(chatter.name)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, Chatter.COLUMNS - 1))
+
+
+class ChatterSortFilterProxy(QtGui.QSortFilterProxyModel):
+    '''
+    Sorts a ChatterModel on the chatters' sort keys, and hides the ones that don't match the
+    nick filter.
+    '''
+    def __init__(self, model, *args, **kwargs):
+        QtGui.QSortFilterProxyModel.__init__(self, *args, **kwargs)
+        self.filter = ""
+        self.setSourceModel(model)
+        self.setDynamicSortFilter(True)
+
+    def setFilter(self, text):
+        self.filter = text.lower()
+        self.invalidateFilter()
+
+    def lessThan(self, left, right):
+        chatters = self.sourceModel().chatters
+        return chatters[left.row()].sortKey < chatters[right.row()].sortKey
+
+    def filterAcceptsRow(self, row, parent):
+        return not self.filter or self.sourceModel().chatters[row].isFiltered(self.filter)
+
+    def chatterAt(self, index):
+        ''' The chatter at an index of the view '''
+        return self.sourceModel().chatterAt(self.mapToSource(index))
+
+    def addChatters(self, chatters):
+        '''
+        Adds many chatters to the source model, the rows are sorted once they're all in rather
+        than one insertion at a time.
+        '''
+        self.setDynamicSortFilter(False)
+        try:
+            self.sourceModel().addChatters(chatters)
+        finally:
+            self.setDynamicSortFilter(True)
+        self.invalidate()
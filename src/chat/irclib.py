@@ -342,10 +342,24 @@ class IRC:
     def _handle_event(self, connection, event):
         """[Internal]"""
         h = self.handlers
-        for handler in h.get("all_events", []) + h.get(event.eventtype(), []):
+        for handler in h.get("all_events", []) + h.get(event._eventtype, []):
             if handler[1](connection, event) == "NO MORE":
                 return
 
+    def _wants_raw_messages(self, connection):
+        """[Internal] Whether any handler gets all_raw_messages events.
+
+        A SimpleIRCClient's dispatcher only does without an
+        on_all_raw_messages method.
+        """
+        if connection.handlers.get("all_raw_messages") or self.handlers.get("all_raw_messages"):
+            return True
+        for priority, handler in self.handlers.get("all_events", []):
+            client = getattr(handler, "im_self", None)
+            if not isinstance(client, SimpleIRCClient) or hasattr(client, "on_all_raw_messages"):
+                return True
+        return False
+
     def _remove_connection(self, connection):
         """[Internal]"""
         self.connections.remove(connection)
@@ -386,6 +400,56 @@ class ServerNotConnectedError(ServerConnectionError):
 # use \n as message separator!  :P
 _linesep_regexp = re.compile("\r?\n")
 
+class LineFramer:
+    """[Internal] Splits the data read from a socket into lines.
+
+    The unfinished last line is kept in a bytearray until the rest of
+    it arrives, and only the new data is searched for line ends, so a
+    long line arriving in many reads isn't scanned and copied again for
+    each of them. With an encoding, the completed lines are decoded in
+    one go (undecodable bytes are replaced).
+    """
+    def __init__(self, encoding=None):
+        self.buffer = bytearray()
+        self.encoding = encoding
+
+    def feed(self, data):
+        """Adds data, returns the lines it completed (without \r\n)."""
+        start = len(self.buffer)
+        self.buffer += data
+        end = self.buffer.rfind("\n", start)
+        if end < 0:
+            return []
+        block = str(self.buffer[:end])
+        del self.buffer[:end + 1]
+        if self.encoding:
+            block = block.decode(self.encoding, "replace")
+        if "\r" not in block:
+            return block.split("\n")
+        return [line[:-1] if line.endswith("\r") else line for line in block.split("\n")]
+
+    def __len__(self):
+        return len(self.buffer)
+
+def _parse_message(line):
+    """[Internal] Splits a message into (prefix, command, arguments).
+
+    Gives what _rfc_1459_command_regexp matches, with string methods:
+    the command is lower case, arguments is None if there are none
+    (or only blanks).
+    """
+    head, trailing_sep, trailing = line.partition(" :")
+    words = head.split()
+    prefix = None
+    if line[0] == ":":
+        prefix = words.pop(0)[1:]
+    command = words.pop(0).lower()
+    if trailing_sep:
+        words.append(trailing)
+    elif not words:
+        return prefix, command, None
+    return prefix, command, words
+
 class ServerConnection(Connection):
     """This class represents an IRC server connection.
 
@@ -398,6 +462,10 @@ class ServerConnection(Connection):
         self.connected = 0  # Not connected yet.
         self.socket = None
         self.ssl = None
+        self.framer = LineFramer("utf-8")     # utf-8 support hacked in by thygrrr (may break in some scenarios - see chardet python package)
+        self.handlers = {}
+        self.real_server_name = ""
+        self.real_nickname = None
 
     def connect(self, server, port, nickname, password=None, username=None,
                 ircname=None, localaddress="", localport=0, ssl=False, ipv6=False):
@@ -432,7 +500,7 @@ class ServerConnection(Connection):
         if self.connected:
             self.disconnect("Changing servers")
 
-        self.previous_buffer = ""
+        self.framer = LineFramer("utf-8")
         self.handlers = {}
         self.real_server_name = ""
         self.real_nickname = nickname
@@ -509,6 +577,11 @@ class ServerConnection(Connection):
         try:
             if self.ssl:
                 new_data = self.ssl.read(2**14)
+                # Data ssl already decrypted doesn't make the socket
+                # readable again, read it now or it waits for the next
+                # packet.
+                while self.ssl.pending():
+                    new_data += self.ssl.read(2**14)
             else:
                 new_data = self.socket.recv(2**14)
         except socket.error, x:
@@ -520,46 +593,30 @@ class ServerConnection(Connection):
             self.disconnect("Connection reset by peer")
             return
 
-        lines = _linesep_regexp.split(self.previous_buffer + new_data)
-
-        # Save the last, unfinished line.
-        self.previous_buffer = lines.pop()
+        self._process_input(new_data)
 
-        for line in lines:
+    def _process_input(self, data):
+        """[Internal] Handles the messages completed by data."""
+        handle_event = self._handle_event
+        # Usually nothing listens to them, a busy channel spends a good
+        # share of its time on raw message events otherwise.
+        raw_messages = self.irclibobj._wants_raw_messages(self)
+        for line in self.framer.feed(data):
             if DEBUG:
                 print "FROM SERVER:", line
 
             if not line:
                 continue
 
-            try:
-                line = line.decode("utf-8", "replace")     # utf-8 support hacked in by thygrrr (may break in some scenarios - see chardet python package)
-            except:            
-                print "irclib: non-utf-8 line, unexpected encoding error " + line
-                line = "** encoding error - replaced by irclib.py **"
-                
-            prefix = None
-            command = None
-            arguments = None
-            self._handle_event(Event("all_raw_messages",
-                                     self.get_server_name(),
-                                     None,
-                                     [line]))
-
-            m = _rfc_1459_command_regexp.match(line)
-            if m.group("prefix"):
-                prefix = m.group("prefix")
-                if not self.real_server_name:
-                    self.real_server_name = prefix
-
-            if m.group("command"):
-                command = m.group("command").lower()
-
-            if m.group("argument"):
-                a = m.group("argument").split(" :", 1)
-                arguments = a[0].split()
-                if len(a) == 2:
-                    arguments.append(a[1])
+            if raw_messages:
+                handle_event(Event("all_raw_messages",
+                                   self.real_server_name,
+                                   None,
+                                   [line]))
+
+            prefix, command, arguments = _parse_message(line)
+            if prefix and not self.real_server_name:
+                self.real_server_name = prefix
 
             # Translate numerics into more readable strings.
             if command in numeric_events:
@@ -573,9 +630,13 @@ class ServerConnection(Connection):
                 # in a nicknameinuse callback.
                 self.real_nickname = arguments[0]
 
-            if command in ["privmsg", "notice"]:
+            if command in ("privmsg", "notice"):
                 target, message = arguments[0], arguments[1]
-                messages = _ctcp_dequote(message)
+                # Most messages aren't quoted, they're left as they are
+                if _CTCP_DELIMITER in message or _LOW_LEVEL_QUOTE in message:
+                    messages = _ctcp_dequote(message)
+                else:
+                    messages = [message]
 
                 if command == "privmsg":
                     if is_channel(target):
@@ -597,14 +658,14 @@ class ServerConnection(Connection):
                         if DEBUG:
                             print "command: %s, source: %s, target: %s, arguments: %s" % (
                                 command, prefix, target, m)
-                        self._handle_event(Event(command, prefix, target, m))
+                        handle_event(Event(command, prefix, target, m))
                         if command == "ctcp" and m[0] == "ACTION":
-                            self._handle_event(Event("action", prefix, target, m[1:]))
+                            handle_event(Event("action", prefix, target, m[1:]))
                     else:
                         if DEBUG:
                             print "command: %s, source: %s, target: %s, arguments: %s" % (
                                 command, prefix, target, [m])
-                        self._handle_event(Event(command, prefix, target, [m]))
+                        handle_event(Event(command, prefix, target, [m]))
             else:
                 target = None
 
@@ -623,13 +684,13 @@ class ServerConnection(Connection):
                 if DEBUG:
                     print "command: %s, source: %s, target: %s, arguments: %s" % (
                         command, prefix, target, arguments)
-                self._handle_event(Event(command, prefix, target, arguments))
+                handle_event(Event(command, prefix, target, arguments))
 
     def _handle_event(self, event):
         """[Internal]"""
         self.irclibobj._handle_event(self, event)
-        if event.eventtype() in self.handlers:
-            for fn in self.handlers[event.eventtype()]:
+        if self.handlers and event._eventtype in self.handlers:
+            for fn in self.handlers[event._eventtype]:
                 fn(self, event)
 
     def is_connected(self):
@@ -684,6 +745,8 @@ class ServerConnection(Connection):
 
         self.quit(message)
 
+        if self.irclibobj.fn_to_remove_socket:
+            self.irclibobj.fn_to_remove_socket(self.socket)
         try:
             self.socket.close()
         except socket.error, x:
@@ -1061,8 +1124,12 @@ class SimpleIRCClient:
 
         dcc_connections -- A list of DCCConnection instances.
     """
-    def __init__(self):
-        self.ircobj = IRC()
+    def __init__(self, fn_to_add_socket=None, fn_to_remove_socket=None,
+                 fn_to_add_timeout=None):
+        """The arguments are passed to the IRC object, see IRC.__init__."""
+        self.ircobj = IRC(fn_to_add_socket, fn_to_remove_socket,
+                          fn_to_add_timeout)
+        self._event_handlers = {}
         self.connection = self.ircobj.server()
         self.dcc_connections = []
         self.ircobj.add_global_handler("all_events", self._dispatcher, -10)
@@ -1070,13 +1137,18 @@ class SimpleIRCClient:
 
     def _dispatcher(self, c, e):
         """[Internal]"""
-        m = "on_" + e.eventtype()
-        if hasattr(self, m):
-            getattr(self, m)(c, e)
-        else:
-            if m != "on_all_raw_messages":
-                if hasattr(self, "on_default"):
-                    self.on_default(c, e)
+        eventtype = e.eventtype()
+        # Looked up once per event type, there are a couple of events
+        # for every message.
+        try:
+            handler = self._event_handlers[eventtype]
+        except KeyError:
+            handler = getattr(self, "on_" + eventtype, None)
+            if handler is None and eventtype != "all_raw_messages":
+                handler = getattr(self, "on_default", None)
+            self._event_handlers[eventtype] = handler
+        if handler is not None:
+            handler(c, e)
 
     def _dcc_disconnect(self, c, e):
         self.dcc_connections.remove(c)
@@ -1151,8 +1223,11 @@ class SimpleIRCClient:
         self.ircobj.process_once()
 
 
-class Event:
+class Event(object):
     """Class representing an IRC event."""
+    # There's one for every message, and more
+    __slots__ = ("_eventtype", "_source", "_target", "_arguments")
+
     def __init__(self, eventtype, source, target, arguments=None):
         """Constructor of Event objects.
 
@@ -0,0 +1,55 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+'''
+Reads the sockets of an irclib IRC object from the Qt event loop: each socket gets a
+QSocketNotifier, and is only read when data arrived on it. Nothing polls.
+'''
+
+from PyQt4 import QtCore
+
+
+class IRCSockets(QtCore.QObject):
+    '''
+    The QSocketNotifiers of the sockets irclib hands to add() and remove(). process(sockets) is
+    called with the socket that became readable, usually irclib's IRC.process_data.
+    '''
+    def __init__(self, process, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.process = process
+        self.notifiers = {}
+
+    def add(self, socket):
+        notifier = QtCore.QSocketNotifier(socket.fileno(), QtCore.QSocketNotifier.Read, self)
+        notifier.activated.connect(self.socketReadable)
+        self.notifiers[socket.fileno()] = (notifier, socket)
+
+    def remove(self, socket):
+        if socket is None:
+            return
+        notifier, _ = self.notifiers.pop(socket.fileno(), (None, None))
+        if notifier:
+            # This can happen from the notifier's own activated signal
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+
+    @QtCore.pyqtSlot(int)
+    def socketReadable(self, fd):
+        if fd in self.notifiers:
+            self.process([self.notifiers[fd][1]])
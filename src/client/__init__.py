@@ -34,6 +34,8 @@ LOBBY_HOST = Settings.get('HOST', 'LOBBY')
 LOBBY_PORT = Settings.get('PORT', 'LOBBY')
 LOCAL_REPLAY_PORT = Settings.get('LOCAL_REPLAY_PORT', 'LOBBY')
 GAME_PORT_DEFAULT = Settings.get('GAME_PORT_DEFAULT', 'LOBBY')
+GAME_TRAFFIC_THREAD = Settings.get('IO_THREAD', 'PROXY')
+GAME_TRAFFIC_PROBES = Settings.get('LATENCY_PROBES', 'PROXY')
 
 # Important URLs
 MUMBLE_URL = "mumble://{login}@mumble.faforever.com/Games?version=1.2.0" 
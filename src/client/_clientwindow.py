@@ -30,14 +30,18 @@ from types import IntType, FloatType, ListType, DictType
 
 from client import ClientState, MUMBLE_URL, WEBSITE_URL, WIKI_URL, \
     FORUMS_URL, UNITDB_URL, SUPPORT_URL, TICKET_URL, GAME_PORT_DEFAULT, LOBBY_HOST, \
-    LOBBY_PORT, LOCAL_REPLAY_PORT, STEAMLINK_URL, GITHUB_URL
+    LOBBY_PORT, LOCAL_REPLAY_PORT, STEAMLINK_URL, GITHUB_URL, GAME_TRAFFIC_THREAD, GAME_TRAFFIC_PROBES
 
 import logging
 logger = logging.getLogger(__name__)
 
 HEARTBEAT = 20000
 
+# ms to collect player state changes for before refreshing the nick lists, about one frame
+USERS_UPDATE_INTERVAL = 16
+
 import util
+from util.coalescer import Coalescer
 import secondaryServer
 
 import json
@@ -210,6 +214,10 @@ class ClientWindow(FormClass, BaseClass):
         self.resizeTimer.timeout.connect(self.resized)
         self.preferedSize = 0
 
+        #Players whose state changed, usersUpdated is emitted for all of them at once
+        self.changedUsers = Coalescer(USERS_UPDATE_INTERVAL, self)
+        self.changedUsers.flushed.connect(self.usersUpdated)
+
         #Process used to run Forged Alliance (managed in module fa)
         fa.instance.started.connect(self.startedFA)
         fa.instance.finished.connect(self.finishedFA)
@@ -301,8 +309,14 @@ class ClientWindow(FormClass, BaseClass):
         self.loadSettingsPrelogin()
         self.loadSettings()
 
-        #Local proxy servers
-        self.proxyServer = fa.proxies.proxies(self)
+        #Local proxy servers, optionally running on their own event loop (the relay server joins them in doConnect)
+        if GAME_TRAFFIC_THREAD:
+            self.gameTraffic = fa.iothread.GameTrafficThread(probes=GAME_TRAFFIC_PROBES)
+            self.proxyServer = self.gameTraffic.adopt(fa.proxies.proxies(client=self))
+            self.gameTraffic.start()
+        else:
+            self.gameTraffic = None
+            self.proxyServer = fa.proxies.proxies(self)
 
         self.players = {}       # Player names known to the client, contains the player_info messages sent by the server
         self.urls = {}          # user game location URLs - TODO: Should go in self.players
@@ -524,6 +538,7 @@ class ClientWindow(FormClass, BaseClass):
 
         #download manager
         self.downloader = downloadManager.downloadManager(self)
+        self.previews = fa.previews.MapPreviewService(self.downloader, self)
 
         # Initialize chat
         self.chat = chat.Lobby(self)
@@ -654,6 +669,12 @@ class ClientWindow(FormClass, BaseClass):
             self.progress.setLabelText("Removing UPnP port mappings")
             fa.upnp.removePortMappings()
 
+        #Hand the game traffic sockets back to the GUI thread so they can be closed below
+        if self.gameTraffic:
+            self.progress.setLabelText("Stopping game traffic thread")
+            self.gameTraffic.stop()
+            self.gameTraffic = None
+
         #Terminate local ReplayServer
         if self.replayServer:
             self.progress.setLabelText("Terminating local replay server")
@@ -678,6 +699,9 @@ class ClientWindow(FormClass, BaseClass):
             self.tray.deleteLater()
             self.tray = None
 
+        #Close the image cache, this logs its hit and miss counts
+        util.images.close()
+
         #Terminate UI
         if self.isVisible():
             self.progress.setLabelText("Closing main window")
@@ -1019,6 +1043,9 @@ class ClientWindow(FormClass, BaseClass):
         if not self.relayServer.doListen():
             return False
 
+        if self.gameTraffic and self.relayServer.thread() != self.gameTraffic:
+            self.gameTraffic.adopt(self.relayServer)
+
         self.progress.setCancelButtonText("Cancel")
         self.progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
         self.progress.setAutoClose(False)
@@ -1248,6 +1275,7 @@ class ClientWindow(FormClass, BaseClass):
     # CAVEAT: This will break if the theme is loaded after the client package is imported
     colors = json.loads(util.readfile("client/colors.json"))
     randomcolors = json.loads(util.readfile("client/randomcolors.json"))
+    nameColors = {}  # The random color of each name, seeding random for every nick list update is slow
 
     def getUserClan(self, name):
         '''
@@ -1316,8 +1344,10 @@ class ClientWindow(FormClass, BaseClass):
 
     def getRandomColor(self, name):
         '''Generate a random color from a name'''
-        random.seed(name)
-        return random.choice(self.randomcolors)
+        if name not in self.nameColors:
+            random.seed(name)
+            self.nameColors[name] = random.choice(self.randomcolors)
+        return self.nameColors[name]
 
     def getColor(self, name):
         if name in self.colors:
@@ -1573,7 +1603,7 @@ class ClientWindow(FormClass, BaseClass):
             oldplayers = self.players.keys()
             self.players = {}
             self.urls = {}
-            self.usersUpdated.emit(oldplayers)
+            self.updateUsers(oldplayers)
 
             self.disconnected.emit()
 
@@ -1639,33 +1669,40 @@ class ClientWindow(FormClass, BaseClass):
         ''' Send an invitation to be part of my team'''
         self.send(dict(command="social", teaminvite=player))
 
+    def updateUsers(self, names):
+        '''
+        Marks players whose state changed. usersUpdated is emitted once for all the players
+        marked in the same USERS_UPDATE_INTERVAL, rather than for every message about them.
+        '''
+        self.changedUsers.add(names)
+
     def addFriend(self, friend):
         '''Adding a new friend by user'''
         self.friends.append(friend)
         self.send(dict(command="social", friends=self.friends))  # FIXME: WTF
         #self.writeToServer("ADD_FRIEND", friend)
-        self.usersUpdated.emit([friend])
+        self.updateUsers([friend])
 
     def addFoe(self, foe):
         '''Adding a new foe by user'''
         self.foes.append(foe)
         self.send(dict(command="social", foes=self.foes))  # FIXME: WTF
         #self.writeToServer("ADD_FRIEND", friend)
-        self.usersUpdated.emit([foe])
+        self.updateUsers([foe])
 
     def remFriend(self, friend):
         '''Removal of a friend by user'''
         self.friends.remove(friend)
         #self.writeToServer("REMOVE_FRIEND", friend)
         self.send(dict(command="social", friends=self.friends))  # FIXME: WTF
-        self.usersUpdated.emit([friend])
+        self.updateUsers([friend])
 
     def remFoe(self, foe):
         '''Removal of a foe by user'''
         self.foes.remove(foe)
         #self.writeToServer("REMOVE_FRIEND", friend)
         self.send(dict(command="social", foes=self.foes))  # FIXME: WTF
-        self.usersUpdated.emit([foe])
+        self.updateUsers([foe])
 
 
     def process(self, action, stream):
@@ -1944,13 +1981,16 @@ class ClientWindow(FormClass, BaseClass):
         self.teamInvitation.emit(message)
 
     def handle_social(self, message):
+        # Only the players who became or stopped being friends/foes look any different
         if "friends" in message:
+            changed = set(self.friends).symmetric_difference(message["friends"])
             self.friends = message["friends"]
-            self.usersUpdated.emit(self.players.keys())
+            self.updateUsers([name for name in changed if name in self.players])
 
         if "foes" in message:
+            changed = set(self.foes).symmetric_difference(message["foes"])
             self.foes = message["foes"]
-            self.usersUpdated.emit(self.players.keys())
+            self.updateUsers([name for name in changed if name in self.players])
 
         if "autojoin" in message:
             self.autoJoin.emit(message["autojoin"])
@@ -1965,7 +2005,7 @@ class ClientWindow(FormClass, BaseClass):
     def handle_player_info(self, message):
         name = message["login"]
         self.players[name] = message
-        self.usersUpdated.emit([name])
+        self.updateUsers([name])
         # Once we have the users clan, initialise the clanlist.
         if name == self.login:
             self.initClanlist()
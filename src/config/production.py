@@ -28,7 +28,9 @@ defaults = {
     },
     'PROXY': {
         'HOST': 'proxy.faforever.com',
-        'PORT': 9134
+        'PORT': 9134,
+        'IO_THREAD': True,
+        'LATENCY_PROBES': False
     },
     'LOBBY': {
         'HOST': 'lobby.faforever.com',
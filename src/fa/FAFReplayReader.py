@@ -1,10 +1,16 @@
 
 from PyQt4.QtCore import QIODevice, QDataStream, QByteArray
 from struct import unpack
+import bisect
 import zlib
 import json
 
+from fa.FAFReplayWriter import MAGIC_INDEXED, CHUNK_HEADER, INDEX_ENTRY, INDEX_FOOTER, INDEX_MAGIC
+
 VERSION = 2
+MAGIC = b'FAF_REPLAY_v%03d\0' % VERSION
+
+EXTRACT_CHUNK_SIZE = 64 * 1024
 
 # Reading state
 STATE_FAFHEADER = 1
@@ -12,10 +18,15 @@ STATE_SCFAHEADER = 2
 STATE_SCFADATA = 3
 
 class FAFReplayReader(QIODevice):
+    '''
+    Reads the SCFA replay out of a v2 or v3 .fafreplay. For v3 files on a random access device,
+    seekTick() jumps straight to the chunk holding a given tick.
+    '''
     def __init__(self, target_device):
         super(FAFReplayReader, self).__init__()
 
-        super(FAFReplayReader, self).open(QIODevice.ReadOnly)
+        # Unbuffered, so nothing read ahead is left over after seekTick()
+        super(FAFReplayReader, self).open(QIODevice.ReadOnly | QIODevice.Unbuffered)
         self._target_device = target_device
 
         self._state = STATE_FAFHEADER
@@ -31,6 +42,13 @@ class FAFReplayReader(QIODevice):
 
         self._zlib_stream = zlib.decompressobj()
 
+        # v3 only
+        self._indexed = False
+        self._chunk = b''
+        self._chunk_pos = 0
+        self._finished = False
+        self._index = None
+
     @property
     def header(self):
         assert isinstance(self._fafheader, dict) and 'Header not parsed yet, because stream not read.'
@@ -42,7 +60,9 @@ class FAFReplayReader(QIODevice):
         ds = QDataStream(QByteArray(self._fafheader))
         ds.setByteOrder(QDataStream.LittleEndian)
 
-        assert ds.readRawData(16) == 'FAF_REPLAY_v%03d\0' % VERSION
+        magic = ds.readRawData(16)
+        assert magic in (MAGIC, MAGIC_INDEXED)
+        self._indexed = magic == MAGIC_INDEXED
 
         self._scfa_header_off = ds.readUInt32()
         self._scfa_data_off = ds.readUInt32()
@@ -56,6 +76,9 @@ class FAFReplayReader(QIODevice):
         self._pos += len(data)
         return data
 
+    def isSequential(self):
+        return True
+
     def readData(self, nbytes):
         if self._state == STATE_FAFHEADER:
             required = 36 - len(self._fafheader)
@@ -85,11 +108,140 @@ class FAFReplayReader(QIODevice):
                 self._state = STATE_SCFADATA
             return data
         
+        elif self._state == STATE_SCFADATA and self._indexed:
+            if self._chunk_pos == len(self._chunk) and not self._nextChunk():
+                return b''
+            data = self._chunk[self._chunk_pos:self._chunk_pos + nbytes]
+            self._chunk_pos += len(data)
+            return data
+
         elif self._state == STATE_SCFADATA:
             uncomp = self._zlib_stream.unconsumed_tail
             uncomp += self._readTarget(nbytes - len(uncomp))
             return self._zlib_stream.decompress( uncomp, nbytes)
         
+    def _nextChunk(self):
+        ''' Inflates the next v3 chunk, returns False at the end of the data '''
+        if self._finished:
+            return False
+        head = self._readTarget(CHUNK_HEADER.size)
+        if len(head) < CHUNK_HEADER.size:
+            # Unfinished file, cut off after the last complete chunk
+            self._finished = True
+            return False
+        _, raw_size, comp_size = CHUNK_HEADER.unpack(head)
+        compressed = self._readTarget(comp_size)
+        if not raw_size or len(compressed) < comp_size:
+            self._finished = True
+            return False
+        self._chunk = zlib.decompress(compressed)
+        self._chunk_pos = 0
+        return True
+
+    def _atEnd(self):
+        if self._indexed:
+            return self._finished
+        return self._target_device.atEnd() and not self._zlib_stream.unconsumed_tail
+
+    def _readFAFHeader(self):
+        if self._state == STATE_FAFHEADER:
+            self.readData(0)
+            if self._state == STATE_FAFHEADER:
+                raise IOError("Truncated replay header")
+
+    def _dataStart(self):
+        ''' Position of the scfa data in the target device '''
+        return self._target_device.pos() - self._pos + self._scfa_data_off
+
+    def tickIndex(self):
+        '''
+        Returns the (tick, data offset) of each chunk of a v3 replay. Unfinished files have no index
+        at the end, it is then rebuilt from the chunk headers.
+        '''
+        self._readFAFHeader()
+        if not self._indexed:
+            return []
+        if self._index is None:
+            device = self._target_device
+            resume = device.pos()
+            data_start = self._dataStart()
+            self._index = []
+
+            device.seek(device.size() - INDEX_FOOTER.size)
+            index_pos, count, magic = INDEX_FOOTER.unpack(device.read(INDEX_FOOTER.size) or b'\0' * INDEX_FOOTER.size)
+            if magic == INDEX_MAGIC:
+                device.seek(data_start + index_pos)
+                entries = device.read(count * INDEX_ENTRY.size)
+                self._index = [INDEX_ENTRY.unpack_from(entries, i * INDEX_ENTRY.size) for i in xrange(count)]
+            else:
+                offset = 0
+                device.seek(data_start)
+                head = device.read(CHUNK_HEADER.size)
+                while len(head) == CHUNK_HEADER.size:
+                    tick, raw_size, comp_size = CHUNK_HEADER.unpack(head)
+                    if not raw_size or data_start + offset + CHUNK_HEADER.size + comp_size > device.size():
+                        break
+                    self._index.append((tick, offset))
+                    offset += CHUNK_HEADER.size + comp_size
+                    device.seek(data_start + offset)
+                    head = device.read(CHUNK_HEADER.size)
+            device.seek(resume)
+        return self._index
+
+    def seekTick(self, tick):
+        '''
+        Positions the reader at the start of the last chunk beginning at or before tick, and returns the
+        tick that chunk starts at. The SCFA operations following it belong to that tick. The target device
+        must allow random access.
+        '''
+        index = self.tickIndex()
+        if not index:
+            raise IOError("Replay has no tick index")
+        ticks = [t for t, _ in index]
+        i = max(0, bisect.bisect_right(ticks, tick) - 1)
+        # Chunks cut by sync() may start mid tick, take the first one for that tick
+        i = bisect.bisect_left(ticks, ticks[i])
+        chunk_tick, offset = index[i]
+
+        self._target_device.seek(self._dataStart() + offset)
+        self._pos = self._scfa_data_off + offset
+        self._state = STATE_SCFADATA
+        self._chunk = b''
+        self._chunk_pos = 0
+        self._finished = False
+        return chunk_tick
+
+    def extract(self, device):
+        ''' Writes the rest of the SCFA replay to device, returns the number of bytes written '''
+        written = 0
+        while True:
+            data = self.read(EXTRACT_CHUNK_SIZE)
+            if data:
+                device.write(data)
+                written += len(data)
+            elif self._atEnd():
+                return written
+
     def close(self):
         self._target_device.close()
-        super(FAFReplayReader, self).close()
\ No newline at end of file
+        super(FAFReplayReader, self).close()
+
+
+def isBinaryFAFReplay(filename):
+    ''' True for the v2 and v3 formats, False for v1 (json line followed by base64 data) '''
+    with open(filename, "rb") as fh:
+        return fh.read(len(MAGIC)) in (MAGIC, MAGIC_INDEXED)
+
+
+def readReplayInfoLine(filename):
+    '''
+    Returns the FAF json header of a .fafreplay file as a single line, for both the v1 format
+    (json line followed by base64 data) and v2/v3 (binary, as written by FAFReplayWriter).
+    '''
+    with open(filename, "rb") as fh:
+        start = fh.read(len(MAGIC))
+        if start not in (MAGIC, MAGIC_INDEXED):
+            return start + fh.readline()
+        fh.seek(32)
+        json_len = unpack('<l', fh.read(4))[0]
+        return fh.read(json_len) + "\n"
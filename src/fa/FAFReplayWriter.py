@@ -1,71 +1,54 @@
 
 from PyQt4.QtCore import QIODevice, QDataStream, QByteArray
+import struct
 import zlib
 import json
 
+from fa.scfareplay import parse_header, Incomplete
+
 VERSION = 2
+MAGIC = b'FAF_REPLAY_v%03d\0' % VERSION
+
+# v3 stores the tick stream in independently compressed chunks, followed by a tick index
+VERSION_INDEXED = 3
+MAGIC_INDEXED = b'FAF_REPLAY_v%03d\0' % VERSION_INDEXED
+
+# magic, scfa header offset, scfa data offset, compression, reserved, faf json header length
+PREFIX = struct.Struct('<16sII4sII')
+
+# v3 only. Offsets are relative to the scfa data offset, so the FAF header can be rewritten.
+# Each chunk: first tick, uncompressed size, compressed size, then the zlib data.
+# An empty chunk holding the total tick count ends the data.
+CHUNK_HEADER = struct.Struct('<III')
+# Then one (tick, offset) entry per chunk, and a footer pointing at them
+INDEX_ENTRY = struct.Struct('<IQ')
+INDEX_FOOTER = struct.Struct('<QI4s')
+INDEX_MAGIC = b'FAFI'
+
+# Chunks are cut after the first tick advance beyond either limit
+CHUNK_SIZE = 256 * 1024
+CHUNK_TICKS = 600
+
+# SCFA operations are a type byte and a uint16 size (including these 3 bytes), type 0 advances the tick count
+SCFA_OP_HEADER = struct.Struct('<BH')
+SCFA_OP_ADVANCE = 0
+_UINT32 = struct.Struct('<I')
+
+COPY_CHUNK_SIZE = 64 * 1024
 
 class NoSCFAHeader(Exception):
     pass
 
 def TryGetSCFAReplayHeader(byteArray):
-    stream = QDataStream(byteArray)
-    stream.setByteOrder(QDataStream.LittleEndian)
-
-    def readUI8():
-        r = ord(stream.readUInt8())
-        if stream.atEnd():
-            raise NoSCFAHeader()
-        return r
-
-    def readUI32():
-        r = stream.readUInt32()
-        if stream.atEnd():
-            raise NoSCFAHeader()
-        return r
-
-    def readNulStr():
-        byte = readUI8()
-        buf = bytearray()
-        while byte != 0:
-            buf += bytearray([byte])
-            byte = readUI8()
-        return buf.decode()
-
-    def skip(nbytes):
-        stream.skipRawData(nbytes)
-
-    readNulStr() # engine version
-    readNulStr() #
-    readNulStr() # Replay v1.9\r\n/maps/Map/File.scmap
-    readNulStr() # foek knoes
-
-    mods_size = readUI32()
-    skip(mods_size)
-
-    scenario_size = readUI32()
-    skip(scenario_size)
-
-    n_sources = readUI8()
-    for i in range(n_sources):
-        readNulStr() # name
-        readUI32() # timeouts rem
-
-    readUI8() # cheats
-
-    n_armies = readUI8()
-    for i in range(n_armies):
-        data_size = readUI32()
-        skip(data_size)
-        readUI8() # source_id
-        readUI8() # unknown
-
-    readUI32() # random_seed
-
-    size = stream.device().pos()
+    try:
+        size = parse_header(byteArray.data()).size
+    except Incomplete:
+        raise NoSCFAHeader()
     return byteArray[:size], byteArray[size:]
 
 class FAFReplayWriter(QIODevice):
+    MAGIC = MAGIC
+
     def __init__(self, target_device):
         super(FAFReplayWriter, self).__init__()
 
@@ -95,7 +78,7 @@ class FAFReplayWriter(QIODevice):
         assert isinstance(header, dict)
         self._header_given = True
 
-        self._target_device.write(b'FAF_REPLAY_v%03d\0' % VERSION)
+        self._target_device.write(self.MAGIC)
 
         self._faf_header = json.dumps(header).encode()
 
@@ -132,13 +115,128 @@ class FAFReplayWriter(QIODevice):
                 head, ticks = TryGetSCFAReplayHeader(self._scfa_lazybuf)
                 self._scfa_header = head
                 self._finalizeHeader()
-                self._target_device.write(self._zlib_stream.compress(ticks))
+                self._writeTicks(ticks.data())
                 self._scfa_lazybuf = None
             except NoSCFAHeader:
                 pass
         else:
-            self._target_device.write(self._zlib_stream.compress(p_str))
+            self._writeTicks(p_str)
         return len(p_str)
 
+    def _writeTicks(self, data):
+        self._target_device.write(self._zlib_stream.compress(data))
+
+    def hasSCFAHeader(self):
+        return self._header_written
+
+    def sync(self):
+        '''
+        Flushes the compressor so everything written so far can be decompressed from the target,
+        e.g. if the client dies before close() is called.
+        '''
+        if self._header_written:
+            self._target_device.write(self._zlib_stream.flush(zlib.Z_SYNC_FLUSH))
+            self._target_device.flush()
+
     def close(self):
         self._target_device.write(self._zlib_stream.flush())
+
+
+def rewriteHeader(source_device, target_device, header):
+    '''
+    Copies the v2 or v3 replay in source_device to target_device with its FAF header replaced.
+    The compressed replay data is copied in chunks, it isn't decompressed.
+    '''
+    magic, scfa_header_off, scfa_data_off, compression, reserved, _ = PREFIX.unpack(source_device.read(PREFIX.size))
+    assert magic in (MAGIC, MAGIC_INDEXED)
+
+    faf_header = json.dumps(header).encode()
+    header_off = PREFIX.size + len(faf_header)
+    target_device.write(PREFIX.pack(magic, header_off, header_off + scfa_data_off - scfa_header_off, compression, reserved, len(faf_header)))
+    target_device.write(faf_header)
+
+    source_device.seek(scfa_header_off)
+    data = source_device.read(COPY_CHUNK_SIZE)
+    while data:
+        target_device.write(data)
+        data = source_device.read(COPY_CHUNK_SIZE)
+
+
+class FAFReplayWriterV3(FAFReplayWriter):
+    '''
+    Writes the v3 format: the tick stream is compressed in chunks starting right after a tick advance,
+    and a (tick, offset) index at the end lets FAFReplayReader.seekTick() jump into the replay
+    inflating a single chunk.
+    '''
+    MAGIC = MAGIC_INDEXED
+
+    def __init__(self, target_device):
+        super(FAFReplayWriterV3, self).__init__(target_device)
+
+        self._pending = bytearray()
+        self._scan_pos = 0
+        self._tick = 0
+        self._chunk_tick = 0
+        self._data_pos = 0
+        self._index = []
+        # Set if the stream doesn't parse as SCFA operations, it is then chunked by size only
+        self._opaque = False
+
+    def _writeTicks(self, data):
+        self._pending += data
+        buf = self._pending
+        end = len(buf)
+        pos = self._scan_pos
+        while not self._opaque and end - pos >= SCFA_OP_HEADER.size:
+            op, size = SCFA_OP_HEADER.unpack_from(buf, pos)
+            if size < SCFA_OP_HEADER.size:
+                self._opaque = True
+                break
+            if end - pos < size:
+                break
+            pos += size
+            if op == SCFA_OP_ADVANCE and size >= SCFA_OP_HEADER.size + _UINT32.size:
+                self._tick += _UINT32.unpack_from(buf, pos - size + SCFA_OP_HEADER.size)[0]
+                if pos >= CHUNK_SIZE or self._tick - self._chunk_tick >= CHUNK_TICKS:
+                    self._writeChunk(pos)
+                    end = len(buf)
+                    pos = 0
+        self._scan_pos = pos
+
+        if self._opaque:
+            while len(buf) >= CHUNK_SIZE:
+                self._writeChunk(CHUNK_SIZE)
+
+    def _writeChunk(self, size):
+        raw = bytes(self._pending[:size])
+        del self._pending[:size]
+        self._scan_pos = max(0, self._scan_pos - size)
+
+        compressed = zlib.compress(raw)
+        self._index.append((self._chunk_tick, self._data_pos))
+        self._target_device.write(CHUNK_HEADER.pack(self._chunk_tick, len(raw), len(compressed)))
+        self._target_device.write(compressed)
+        self._data_pos += CHUNK_HEADER.size + len(compressed)
+        self._chunk_tick = self._tick
+
+    def sync(self):
+        '''
+        Writes out all complete operations as a chunk, so they can be read back from the target
+        even if close() is never called.
+        '''
+        if self._header_written:
+            size = len(self._pending) if self._opaque else self._scan_pos
+            if size:
+                self._writeChunk(size)
+            self._target_device.flush()
+
+    def close(self):
+        if not self._header_written:
+            return
+        if self._pending:
+            self._writeChunk(len(self._pending))
+        self._target_device.write(CHUNK_HEADER.pack(self._tick, 0, 0))
+        index_pos = self._data_pos + CHUNK_HEADER.size
+        for tick, offset in self._index:
+            self._target_device.write(INDEX_ENTRY.pack(tick, offset))
+        self._target_device.write(INDEX_FOOTER.pack(index_pos, len(self._index), INDEX_MAGIC))
@@ -36,9 +36,11 @@ from replay import replay
 
 import check
 import maps
+import previews
 import replayserver
 import relayserver
 import proxies
+import iothread
 import updater
 import upnp
 import faction
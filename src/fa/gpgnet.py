@@ -0,0 +1,170 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+Codec for the GPGNet protocol spoken by ForgedAlliance.exe on its local lobby connection.
+
+A message is a little endian int32 length + header (the command name), an int32 field count,
+then per field a type byte followed by either an int32 (type 0) or an int32 length + string
+(type 1, or type 2 for the prefixed payloads of NAT packets). Tabs and newlines in strings travel
+as "/t" and "/n".
+
+This module doesn't depend on Qt, so it can be tested and benchmarked on its own.
+'''
+
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+# FA never sends more fields than this; anything bigger means we lost track of the stream
+MAX_FIELDS = 100
+
+# Headers are command names ("GameState", "PlayerOption"...), a bigger size is garbage too
+MAX_HEADER_SIZE = 1024
+
+FIELD_INT = 0
+FIELD_STRING = 1
+FIELD_NAT_PAYLOAD = 2
+
+_INT32 = struct.Struct("<i")
+_UINT32 = struct.Struct("<I")
+_FIELD_HEADER = struct.Struct("<bi")
+
+# Payloads of SendNatPacket fields after the first are prefixed with this byte
+NAT_PAYLOAD_PREFIX = "\x08"
+
+
+def _escape(s):
+    return s.replace("\t", "/t").replace("\n", "/n")
+
+
+def _unescape(s):
+    return s.replace("/t", "\t").replace("/n", "\n")
+
+
+def encode(header, fields):
+    ''' Encodes a message for FA; produces the same bytes as relayserver.Packet.Pack() '''
+    header = _escape(str(header))
+    buf = bytearray(_INT32.pack(len(header)))
+    buf += header
+    buf += _INT32.pack(len(fields))
+    for field in fields:
+        if type(field) is int:
+            buf += _FIELD_HEADER.pack(FIELD_INT, field)
+        else:
+            field = _escape(str(field))
+            buf += _FIELD_HEADER.pack(FIELD_STRING, len(field))
+            buf += field
+    return str(buf)
+
+
+def encode_udp(header, fields):
+    ''' Encodes a SendNatPacket message; produces the same bytes as relayserver.Packet.PackUdp() '''
+    header = _escape(str(header))
+    buf = bytearray(_INT32.pack(len(header)))
+    buf += header
+    buf += _INT32.pack(len(fields))
+    for i, field in enumerate(fields):
+        if type(field) is int:
+            buf += _FIELD_HEADER.pack(FIELD_INT, field)
+        elif i:
+            field = _escape(str(field))
+            buf += _FIELD_HEADER.pack(FIELD_NAT_PAYLOAD, len(field) + 1)
+            buf += NAT_PAYLOAD_PREFIX
+            buf += field
+        else:
+            field = _escape(str(field))
+            buf += _FIELD_HEADER.pack(FIELD_STRING, len(field))
+            buf += field
+    return str(buf)
+
+
+class Decoder(object):
+    '''
+    Incremental decoder for the messages FA sends. Bytes are handed to feed() as they arrive
+    on the socket; complete messages are returned as (header, fields) tuples, and incomplete
+    trailing data is kept until the next call. If the stream turns out to be garbage, everything
+    buffered after the last good message is dropped.
+    '''
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        consumed = self._decode(messages)
+        if consumed is None:
+            self.buffer = bytearray()
+        elif consumed:
+            del self.buffer[:consumed]
+        return messages
+
+    def reset(self):
+        self.buffer = bytearray()
+
+    def _decode(self, messages):
+        buf = self.buffer
+        end = len(buf)
+        view = memoryview(buf)
+        unpack_int = _INT32.unpack_from
+        start = 0
+        try:
+            while True:
+                pos = start
+                if end - pos < 4:
+                    return start
+                header_size, = _UINT32.unpack_from(view, pos)
+                if header_size > MAX_HEADER_SIZE:
+                    logger.error("Big error reading FA datas ! (%i bytes header)", header_size)
+                    return None
+                pos += 4
+                if end - pos < header_size + 4:
+                    return start
+                header = view[pos:pos + header_size].tobytes()
+                pos += header_size
+                count, = unpack_int(view, pos)
+                pos += 4
+                if count > MAX_FIELDS or count < 0:
+                    logger.error("Big error reading FA datas ! (%r with %i fields)", header, count)
+                    return None
+
+                fields = []
+                for _ in xrange(count):
+                    # Both field kinds start with a type byte and an int32 (value or string length)
+                    if end - pos < 5:
+                        return start
+                    value, = unpack_int(view, pos + 1)
+                    if not buf[pos]:
+                        fields.append(value)
+                        pos += 5
+                    else:
+                        if value < 0:
+                            logger.error("Big error reading FA datas ! (%r with a %i bytes field)", header, value)
+                            return None
+                        pos += 5
+                        if end - pos < value:
+                            return start
+                        fields.append(_unescape(view[pos:pos + value].tobytes()))
+                        pos += value
+
+                messages.append((header, fields))
+                start = pos
+        finally:
+            # Release the export so feed() may resize the buffer
+            view = None
@@ -0,0 +1,186 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+from PyQt4 import QtCore
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# How often the loop latency probes wake up, and how often their histograms are logged
+PROBE_INTERVAL = 50
+PROBE_REPORT_INTERVAL = 300000
+
+
+class LatencyHistogram(object):
+    '''
+    Power-of-two millisecond buckets: bucket 0 counts samples below 1 ms,
+    bucket n counts samples in [2^(n-1), 2^n) ms. The last bucket is open ended.
+    '''
+    BUCKETS = 12
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.BUCKETS
+        self.total = 0
+        self.worst = 0.0
+
+    def record(self, seconds):
+        ms = int(seconds * 1000)
+        bucket = min(ms.bit_length(), self.BUCKETS - 1) if ms > 0 else 0
+        self.counts[bucket] += 1
+        self.total += 1
+        if seconds > self.worst:
+            self.worst = seconds
+
+    def percentile(self, p):
+        ''' Upper bound in ms of the bucket containing the p-th percentile sample '''
+        if not self.total:
+            return 0
+        wanted = self.total * p / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return 1 << bucket
+        return 1 << (self.BUCKETS - 1)
+
+    def __str__(self):
+        buckets = " ".join("<%d:%d" % (1 << i, c) for i, c in enumerate(self.counts) if c)
+        return "n=%d p50<%dms p99<%dms max=%dms [%s]" % (self.total, self.percentile(50), self.percentile(99), self.worst * 1000, buckets)
+
+
+class LoopLatencyProbe(QtCore.QObject):
+    '''
+    Measures how late a repeating timer fires on the event loop of the thread this object lives in.
+    A stalled loop (e.g. a long processEvents() spin on the GUI thread) shows up as late ticks. That's
+    how long a packet arriving at that moment waits before it's read, not the time it takes to forward
+    one. The probes wake their loop up every PROBE_INTERVAL, so they're only there for debugging.
+    '''
+    report = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, name, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.name = name
+        self.histogram = LatencyHistogram()
+        self.timer = None
+        self.last = None
+        self.lastReport = None
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        # Called in the probe's own thread so the timer gets that thread's affinity
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.tick)
+        self.last = self.lastReport = time.time()
+        self.timer.start(PROBE_INTERVAL)
+
+    @QtCore.pyqtSlot()
+    def stop(self):
+        if self.timer:
+            self.timer.stop()
+            self.timer = None
+
+    @QtCore.pyqtSlot()
+    def tick(self):
+        now = time.time()
+        self.histogram.record(max(0.0, now - self.last - PROBE_INTERVAL / 1000.0))
+        self.last = now
+        if (now - self.lastReport) * 1000 >= PROBE_REPORT_INTERVAL:
+            self.report.emit(self.name, str(self.histogram))
+            self.histogram.reset()
+            self.lastReport = now
+
+
+class GameTrafficThread(QtCore.QThread):
+    '''
+    Runs the game traffic sockets (UDP proxies, P2P forwarder and FA relay) on their own event loop,
+    so packets keep flowing while the GUI thread is busy. Objects handed to adopt() must not have
+    a parent. The GUI only hears from them through queued signals.
+
+    With probes, the lateness of both the GUI and the game traffic loops is logged every 5 minutes.
+    '''
+    released = QtCore.pyqtSignal()
+
+    def __init__(self, probes=False, *args, **kwargs):
+        QtCore.QThread.__init__(self, *args, **kwargs)
+        self.setObjectName("GameTraffic")
+        self.adopted = []
+        self.guiThread = QtCore.QThread.currentThread()
+
+        # Worker living in this thread, used to hand the adopted objects back on shutdown
+        self.worker = _ThreadWorker(self)
+        self.worker.moveToThread(self)
+        self.released.connect(self.worker.release, QtCore.Qt.BlockingQueuedConnection)
+
+        self.probe = self.guiProbe = None
+        if probes:
+            self.probe = LoopLatencyProbe("game traffic")
+            self.probe.moveToThread(self)
+            self.probe.report.connect(self.logLatency)
+            self.started.connect(self.probe.start)
+
+            self.guiProbe = LoopLatencyProbe("gui")
+            self.guiProbe.report.connect(self.logLatency)
+            self.guiProbe.start()
+
+    def adopt(self, obj):
+        ''' Moves obj (and its children) to the game traffic event loop '''
+        obj.moveToThread(self)
+        self.adopted.append(obj)
+        return obj
+
+    def run(self):
+        logger.info("game traffic thread started")
+        self.exec_()
+        logger.info("game traffic thread stopped")
+
+    def stop(self):
+        '''
+        Moves all adopted objects back to the GUI thread and stops the event loop.
+        Afterwards they can be closed and deleted from the GUI thread like before.
+        '''
+        if self.guiProbe:
+            self.guiProbe.stop()
+        if self.isRunning():
+            self.released.emit()
+            self.quit()
+            self.wait()
+
+    @QtCore.pyqtSlot(str, str)
+    def logLatency(self, name, histogram):
+        logger.info("event loop latency (%s): %s", name, histogram)
+
+
+class _ThreadWorker(QtCore.QObject):
+    def __init__(self, thread):
+        QtCore.QObject.__init__(self)
+        self.traffic = thread
+
+    @QtCore.pyqtSlot()
+    def release(self):
+        if self.traffic.probe:
+            self.traffic.probe.stop()
+            self.traffic.probe.moveToThread(self.traffic.guiThread)
+        for obj in self.traffic.adopted:
+            obj.moveToThread(self.traffic.guiThread)
+        self.traffic.adopted = []
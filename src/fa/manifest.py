@@ -0,0 +1,115 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+md5 manifest of the files the legacy updater keeps up to date.
+
+Hashes are remembered along with the size and mtime of the file they were computed from, and
+only recomputed when those change. Like gpgnet, this module doesn't depend on Qt.
+'''
+
+import hashlib
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from util.jsonstore import JsonStore
+
+logger = logging.getLogger(__name__)
+
+# hashlib lets go of the GIL while hashing big blocks, so a few threads keep a few disks (or cores) busy
+HASH_THREADS = 4
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def md5File(path):
+    ''' The md5 hex digest of the file at path '''
+    m = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), ""):
+            m.update(block)
+    return m.hexdigest()
+
+
+class HashManifest(JsonStore):
+    '''
+    md5s of files by path, kept in a json file between runs.
+    '''
+    kind = "md5 manifest"
+
+    def md5s(self, paths, poll=None):
+        '''
+        Returns a dict of the md5s of paths, None for the ones that don't exist. Files that changed since
+        they were last hashed are hashed on a thread pool, poll is called while waiting for it.
+        '''
+        result = {}
+        stale = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                result[path] = None
+                continue
+
+            entry = self.entries.get(path)
+            if entry and entry[0] == st.st_size and entry[1] == st.st_mtime:
+                result[path] = entry[2]
+            else:
+                stale.append((path, st.st_size, st.st_mtime))
+
+        if stale:
+            logger.info("Hashing %d of %d files" % (len(stale), len(paths)))
+            pool = ThreadPool(min(HASH_THREADS, len(stale)))
+            try:
+                hashing = pool.map_async(md5File, [path for path, _, _ in stale])
+                while not hashing.ready():
+                    if poll:
+                        poll()
+                    hashing.wait(0.05)
+                digests = hashing.get()
+            finally:
+                pool.close()
+                pool.join()
+
+            for (path, size, mtime), digest in zip(stale, digests):
+                self.entries[path] = [size, mtime, digest]
+                result[path] = digest
+            self.dirty = True
+
+        return result
+
+    def md5sAsync(self, paths, callback):
+        '''
+        Like md5s, but returns right away. callback(md5s, error) is called from another thread once it's done, error
+        being the exception that stopped it, if any.
+        '''
+        def run():
+            try:
+                result = self.md5s(paths)
+            except Exception, e:
+                logger.exception("Hashing failed")
+                callback(None, e)
+            else:
+                callback(result, None)
+
+        thread = threading.Thread(target=run, name="md5s")
+        thread.daemon = True
+        thread.start()
+        return thread
@@ -0,0 +1,207 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+The registry of locally installed maps behind the lookups in fa.maps.
+
+The map folders are listed once, into a dict keyed by the case folded folder name. The files
+of a map are listed the first time they're asked for. A QFileSystemWatcher keeps both current:
+a changed maps folder is listed again (keeping what's known about the maps that are still
+there), a changed map folder has its files listed again on next use. A maps folder that doesn't
+exist yet can't be watched, it's listed on the first lookup after it appears.
+'''
+
+import logging
+import os
+import re
+
+from PyQt4 import QtCore
+
+logger = logging.getLogger(__name__)
+
+# The files a map folder needs, after the map name
+MAP_FILE_SUFFIXES = (".scmap", "_save.lua", "_scenario.lua", "_script.lua")
+
+_VERSION = re.compile(r"\.v(\d+)$", re.IGNORECASE)
+
+
+def mapVersion(name):
+    ''' The version in a map folder name like "name.v0003", or None '''
+    match = _VERSION.search(name)
+    return int(match.group(1)) if match else None
+
+
+class LocalMap(object):
+    '''
+    A map folder on disk.
+    '''
+    def __init__(self, folder, base=False):
+        self.folder = folder
+        self.name = os.path.basename(folder)
+        self.base = base
+        self.version = mapVersion(self.name)
+        self._files = None
+
+    @property
+    def files(self):
+        ''' The names of the files in the folder, by their lower case name '''
+        if self._files is None:
+            try:
+                self._files = dict((infile.lower(), infile) for infile in os.listdir(self.folder))
+            except OSError:
+                self._files = {}
+        return self._files
+
+    def forget(self):
+        ''' Lists the files again on next use '''
+        self._files = None
+
+    def fileEndingWith(self, suffix):
+        for lower in sorted(self.files):
+            if lower.endswith(suffix):
+                return self.files[lower]
+        return None
+
+    @property
+    def scenarioFile(self):
+        return self.fileEndingWith("_scenario.lua")
+
+    @property
+    def saveFile(self):
+        return self.fileEndingWith("_save.lua")
+
+    def isValid(self):
+        ''' True if the folder has all the files a map needs '''
+        baseName = self.name.split('.')[0].lower()
+        return all(baseName + suffix in self.files for suffix in MAP_FILE_SUFFIXES)
+
+    def previews(self):
+        ''' The paths of the previews in the folder, by kind ("small", "large" or "dds") '''
+        names = {"small": self.name.lower() + ".small.png",
+                 "large": self.name.lower() + ".large.png",
+                 "dds": self.name.lower() + ".dds"}
+        return dict((kind, os.path.join(self.folder, self.files[name]))
+                    for kind, name in names.items() if name in self.files)
+
+
+class MapRegistry(QtCore.QObject):
+    '''
+    The maps in a few maps folders, looked up by name whatever its case. Earlier folders win
+    when the same map is in several.
+    '''
+    def __init__(self, folders, *args, **kwargs):
+        '''
+        folders is a list of (path, base) pairs, base being True for the maps that come with the game.
+        '''
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.folders = list(folders)
+        self.index = dict((path, {}) for path, _ in self.folders)
+        self.watched = {}
+        self.missing = set()
+
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.directoryChanged)
+
+        for path, base in self.folders:
+            self.scan(path)
+
+    def scan(self, path=None):
+        '''
+        Lists the given maps folder again, or all of them.
+        '''
+        if path is None:
+            for path, _ in self.folders:
+                self.scan(path)
+            return
+
+        base = dict(self.folders)[path]
+        try:
+            names = os.listdir(path)
+        except OSError:
+            names = []
+            self.missing.add(path)
+        else:
+            self.missing.discard(path)
+
+        old = self.index[path]
+        new = {}
+        for name in names:
+            local = old.get(name.lower())
+            if local is None or local.name != name:
+                local = LocalMap(os.path.join(path, name), base)
+            new[name.lower()] = local
+        self.index[path] = new
+
+        for local in old.values():
+            if new.get(local.name.lower()) is not local:
+                self.unwatch(local)
+
+        if path not in self.missing and path not in self.watcher.directories():
+            self.watcher.addPath(path)
+        logger.debug("%d maps in %s" % (len(new), path))
+
+    def appeared(self):
+        ''' Lists the maps folders that didn't exist before, if they do now '''
+        for path in [path for path in self.missing if os.path.isdir(path)]:
+            self.scan(path)
+
+    def get(self, name):
+        ''' The LocalMap for name, or None '''
+        self.appeared()
+        key = name.lower()
+        for path, _ in self.folders:
+            local = self.index[path].get(key)
+            if local is not None:
+                return self.watch(local)
+        return None
+
+    def at(self, folder):
+        ''' The LocalMap for a folder that may or may not be in the maps folders '''
+        local = self.get(os.path.basename(os.path.normpath(folder)))
+        if local is not None and os.path.normcase(os.path.normpath(local.folder)) == os.path.normcase(os.path.normpath(folder)):
+            return local
+        return LocalMap(folder)
+
+    def names(self, path=None):
+        ''' The map folder names, in the given maps folder or in all of them '''
+        self.appeared()
+        if path is not None:
+            return [local.name for local in self.index.get(path, {}).values()]
+        return [local.name for path, _ in self.folders for local in self.index[path].values()]
+
+    def __contains__(self, name):
+        self.appeared()
+        return any(name.lower() in self.index[path] for path, _ in self.folders)
+
+    def watch(self, local):
+        # Only maps that were looked at are watched, there can be thousands of the others
+        if local.folder not in self.watched and os.path.isdir(local.folder):
+            self.watched[local.folder] = local
+            self.watcher.addPath(local.folder)
+        return local
+
+    def unwatch(self, local):
+        if self.watched.pop(local.folder, None) is not None:
+            self.watcher.removePath(local.folder)
+
+    @QtCore.pyqtSlot(str)
+    def directoryChanged(self, path):
+        if path in self.index:
+            self.scan(path)
+        elif path in self.watched:
+            self.watched[path].forget()
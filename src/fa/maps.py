@@ -27,8 +27,9 @@ logger= logging.getLogger(__name__)
 
 
 from PyQt4 import QtCore, QtGui, QtNetwork
-import cStringIO
 import util
+from util import downloadengine
+from fa.mapregistry import MapRegistry
 import os, stat
 import struct
 import shutil
@@ -100,9 +101,19 @@ maps = { # A Lookup table for info (names, sizes, players) of the official Forge
                  "x1mp_017" : ["Eye Of The Storm", "512x512", 4],
                  }
 
-__exist_maps = None
+_registry = None
 
 
+def registry():
+    '''
+    The MapRegistry of the user and base maps folders, made again if the game folder changed.
+    '''
+    global _registry
+    folders = [(getUserMapsFolder(), False), (getBaseMapsFolder(), True)]
+    if _registry is None or _registry.folders != folders:
+        _registry = MapRegistry(folders)
+    return _registry
+
 
 def isBase(mapname):
     '''
@@ -113,10 +124,7 @@ def isBase(mapname):
     return False
 
 def getUserMaps():
-    maps = []
-    if os.path.isdir(getUserMapsFolder()) :
-            maps = os.listdir(getUserMapsFolder())
-    return maps
+    return registry().names(getUserMapsFolder())
 
 def getDisplayName(mapname):
     '''
@@ -151,59 +159,28 @@ def getScenarioFile(folder):
     ''' 
     Return the scenario.lua file
     '''
-    for infile in os.listdir(folder) :
-        if infile.lower().endswith("_scenario.lua") :
-            return infile 
-    return None
+    return registry().at(folder).scenarioFile
 
 def getSaveFile(folder):
     ''' 
     Return the save.lua file
     '''
-    for infile in os.listdir(folder) :
-        if infile.lower().endswith("_save.lua") :
-            return infile 
-    return None
+    return registry().at(folder).saveFile
 
 def isMapFolderValid(folder):
     '''
     Check if the folder got all the files needed to be a map folder.
     '''
-    baseName = os.path.basename(folder).split('.')[0]
-
-    checklist1 = False
-    checklist2 = False
-    checklist3 = False
-    checklist4 = False
-
-    for infile in os.listdir(folder) :
-        if infile.lower() == (baseName.lower() + ".scmap") :
-            checklist1 = True
-        if infile.lower() == (baseName.lower() + "_save.lua") :
-            checklist2 = True
-        if infile.lower() == (baseName.lower() + "_scenario.lua") :
-            checklist3 = True
-        if infile.lower() == (baseName.lower() + "_script.lua") :
-            checklist4 = True 
-
-    if checklist1 and checklist2 and checklist3 and checklist4 :
-        return True
-    else :
-        return False
+    return registry().at(folder).isValid()
 
 
 def existMaps(force = False):
-    global __exist_maps
-    if force or __exist_maps == None:
-        
-        __exist_maps = getUserMaps()
-
-        if os.path.isdir(getBaseMapsFolder()) :
-            if __exist_maps == None :
-                __exist_maps = os.listdir(getBaseMapsFolder())
-            else : 
-                __exist_maps.extend(os.listdir(getBaseMapsFolder()))
-    return __exist_maps        
+    '''
+    The names of all the installed maps. force lists the maps folders again first.
+    '''
+    if force:
+        registry().scan()
+    return registry().names()
     
 
 
@@ -213,22 +190,15 @@ def isMapAvailable(mapname):
     '''
     if isBase(mapname):
         return True
-    
-    if os.path.isdir(getUserMapsFolder()):
-        for infile in os.listdir(getUserMapsFolder()) :
-            if infile.lower() == mapname.lower(): 
-                return True
 
-    return False    
+    local = registry().get(mapname)
+    return local is not None and not local.base
 
 def mapExists(mapname):
     '''
     improved isMapAvailable
     '''
-    for map in existMaps():
-        if mapname == map.lower():
-            return True
-    return False
+    return mapname in registry()
     
 
 def folderForMap(mapname):
@@ -237,11 +207,10 @@ def folderForMap(mapname):
     '''
     if isBase(mapname):
         return os.path.join(getBaseMapsFolder(), mapname)
-    
-    if os.path.isdir(getUserMapsFolder()):
-        for infile in os.listdir(getUserMapsFolder()) :
-            if infile.lower() == mapname.lower(): 
-                return os.path.join(getUserMapsFolder(), mapname)
+
+    local = registry().get(mapname)
+    if local is not None and not local.base:
+        return local.folder
 
     return None
 
@@ -262,24 +231,33 @@ def getUserMapsFolder():
     return os.path.join(util.PERSONAL_DIR, "My Games", "Gas Powered Games", "Supreme Commander Forged Alliance", "Maps") 
 
 
+def bgraToRgb(bgra):
+    '''
+    Converts bgra8888 pixel data to rgb888, one strided slice assignment per channel
+    '''
+    bgra = bytearray(bgra)
+    pixels = len(bgra) // 4
+    rgb = bytearray(pixels * 3)
+    rgb[0::3] = bgra[2:pixels * 4:4]
+    rgb[1::3] = bgra[1:pixels * 4:4]
+    rgb[2::3] = bgra[0:pixels * 4:4]
+    return rgb
+
+
 def genPrevFromDDS(sourcename, destname,small=False):
     '''
-    this opens supcom's dds file (format: bgra8888) and saves to png
+    this opens supcom's dds file (format: bgra8888) and saves to png.
+    Only uses QImage, so it can run outside the GUI thread.
     '''
     try:
-        img = bytearray()
-        buf = bytearray(16)
-        file = open(sourcename,"rb")
-        file.seek(128) # skip header
-        while file.readinto(buf):
-            img += buf[:3] + buf[4:7] + buf[8:11] + buf[12:15]
-        file.close()
+        with open(sourcename,"rb") as file:
+            file.seek(128) # skip header
+            img = bgraToRgb(file.read())
 
         size = int((len(img)/3) ** (1.0/2))
+        imageFile = QtGui.QImage(img,size,size,size*3,QtGui.QImage.Format_RGB888)
         if small:
-            imageFile = QtGui.QImage(img,size,size,QtGui.QImage.Format_RGB888).rgbSwapped().scaled(100,100,transformMode = QtCore.Qt.SmoothTransformation)
-        else:
-            imageFile = QtGui.QImage(img,size,size,QtGui.QImage.Format_RGB888).rgbSwapped()
+            imageFile = imageFile.scaled(100,100,transformMode = QtCore.Qt.SmoothTransformation)
         imageFile.save(destname)
     except IOError:
         pass # cant open the
@@ -450,31 +428,34 @@ def __exportPreviewFromMap(mapname, positions=None):
 iconExtensions = ["png"] #, "jpg" removed to have less of those costly 404 misses.
 
 
-def __downloadPreviewFromWeb(name):
+def previewUrl(name, extension="png"):
     '''
-    Downloads a preview image from the web for the given map name
+    The url of the vault preview of the given map name
     '''
     #This is done so generated previews always have a lower case name. This doesn't solve the underlying problem (case folding Windows vs. Unix vs. FAF)
-    name = name.lower()
+    return VAULT_PREVIEW_ROOT + urllib2.quote(name.lower()) + "." + extension
 
+
+def __downloadPreviewFromWeb(name):
+    '''
+    Downloads a preview image from the web for the given map name, into the image cache
+    '''
     logger.debug("Searching web preview for: " + name)
         
     for extension in iconExtensions:
+        url = previewUrl(name, extension)
+        if util.images.isMissing(url):
+            continue
         try:
-            header = urllib2.Request(VAULT_PREVIEW_ROOT + urllib2.quote(name) + "." + extension, headers={'User-Agent' : "FAF Client"})   
+            header = urllib2.Request(url, headers={'User-Agent' : "FAF Client"})
             req = urllib2.urlopen(header)
-            img = os.path.join(util.CACHE_DIR, name + "." + extension)
-            with open(img, 'wb') as fp:
-                shutil.copyfileobj(req, fp)
-                fp.flush()
-                os.fsync(fp.fileno())       #probably works fine without the flush and fsync
-                fp.close()
-                
-                #Create alpha-mapped preview image
-                im = QtGui.QImage(img) #.scaled(100,100)
-                im.save(img)
-                logger.debug("Web Preview " + extension + " used for: " + name)
-                return img
+            img = util.images.store(url, req.read(), req.info().getheader("ETag"), req.info().getheader("Last-Modified"))
+            logger.debug("Web Preview " + extension + " used for: " + name)
+            return img
+        except HTTPError, e:
+            if e.code == 404:
+                util.images.storeMissing(url)
+            logger.debug("Web preview download failed for " + name)
         except:
             logger.debug("Web preview download failed for " + name)
             pass    #don't bother if anything goes wrong
@@ -482,14 +463,45 @@ def __downloadPreviewFromWeb(name):
     logger.debug("Web Preview not found for: " + name)
     return None
      
+def cachedPreview(mapname):
+    '''
+    Returns the path of the cached preview image for mapname, if there is one: generated from the local map,
+    or downloaded from the vault and not due for revalidation yet
+    '''
+    for extension in iconExtensions:
+        img = os.path.join(util.CACHE_DIR, mapname + "." + extension)
+        if os.path.isfile(img):
+            return img
+        img = util.images.path(previewUrl(mapname, extension), fresh=True)
+        if img:
+            return img
+    return None
+
+
+def generatePreview(mapname):
+    '''
+    Generates the preview of a locally installed map into the cache, and returns its path.
+    Doesn't touch QPixmaps, so it's safe to call from a worker thread.
+    '''
+    try:
+        img = __exportPreviewFromMap(mapname)
+        if img :
+            img = img["cache"]
+            if img and os.path.isfile(img):
+                return img
+    except:
+        logger.error("Error raised in maps.generatePreview(...) for " + mapname)
+        logger.error("Map Preview Exception", exc_info=sys.exc_info())
+    return None
+
+
 def preview(mapname, pixmap = False, force=False):
     try:
         # Try to load directly from cache
-        for extension in iconExtensions:
-            img = os.path.join(util.CACHE_DIR, mapname + "." + extension)
-            if os.path.isfile(img):
-                logger.debug("Using cached preview image for: " + mapname)
-                return util.icon(img, False, pixmap)
+        img = cachedPreview(mapname)
+        if img:
+            logger.debug("Using cached preview image for: " + mapname)
+            return util.icon(img, False, pixmap)
         if force :
         # Try to download from web
             img = __downloadPreviewFromWeb(mapname)
@@ -498,13 +510,10 @@ def preview(mapname, pixmap = False, force=False):
                 return util.icon(img, False, pixmap)
     
         # Try to find in local map folder    
-        img = __exportPreviewFromMap(mapname)
-       
-        if img :
-            img = __exportPreviewFromMap(mapname)["cache"]
-            if img and os.path.isfile(img):
-                logger.debug("Using fresh preview image for: " + mapname)
-                return util.icon(img, False, pixmap)
+        img = generatePreview(mapname)
+        if img:
+            logger.debug("Using fresh preview image for: " + mapname)
+            return util.icon(img, False, pixmap)
         
         return None
     except:
@@ -560,8 +569,7 @@ class Downloader(QtCore.QObject):
 
 def downloadMap(name, silent=False):
     ''' 
-    Download a map from the vault with the given name
-    LATER: This type of method is so common, it could be put into a nice util method.
+    Download a map from the vault with the given name, through util.downloads
     '''
     link = name2link(name)
     url = VAULT_DOWNLOAD_ROOT + link
@@ -578,70 +586,57 @@ def downloadMap(name, silent=False):
     progress.setAutoReset(False)
        
     
-    try:
-        req = urllib2.Request(url, headers={'User-Agent' : "FAF Client"})         
-        zipwebfile  = urllib2.urlopen(req)
-        meta = zipwebfile.info()
-        file_size = int(meta.getheaders("Content-Length")[0])
-
-        
-        progress.setMinimum(0)
-        progress.setMaximum(file_size)
-        progress.setModal(1)
-        progress.setWindowTitle("Downloading Map")
-        progress.setLabelText(name)
-        progress.show()
-    
-        #Download the file as a series of 8 KiB chunks, then uncompress it.
-        output = cStringIO.StringIO()
-        file_size_dl = 0
-        block_sz = 8192       
-
-        while progress.isVisible():
-            read_buffer = zipwebfile.read(block_sz)
-            if not read_buffer:
-                break
-            file_size_dl += len(read_buffer)
-            output.write(read_buffer)
-            progress.setValue(file_size_dl)
-    
-        progress.close()
-        if file_size_dl == file_size:
-            zfile = zipfile.ZipFile(output)
-            zfile.extractall(getUserMapsFolder())
-            zfile.close()
-
-            #check for eventual sound files
-            if folderForMap(name):
-                if "sounds" in os.listdir(folderForMap(name)) :
-                    root_src_dir = os.path.join(folderForMap(name), "sounds")
-                    for src_dir, _, files in os.walk(root_src_dir):
-                        dst_dir = src_dir.replace(root_src_dir, util.SOUND_DIR)
-                        for file_ in files:
-                            src_file = os.path.join(src_dir, file_)
-                            dst_file = os.path.join(dst_dir, file_)
-                            if os.path.exists(dst_file):
-                                os.remove(dst_file)
-                            shutil.move(src_file, dst_dir)
-
-                
-            logger.debug("Successfully downloaded and extracted map from: " + url)
-        else:
+    progress.setModal(1)
+    progress.setWindowTitle("Downloading Map")
+    progress.setLabelText(name)
+    progress.show()
+
+    #Download the file to disk (resuming an earlier attempt, if any), then uncompress it from there.
+    zippath = os.path.join(util.DOWNLOAD_DIR, os.path.basename(link))
+    download = util.downloads.download(url, zippath)
+    downloaded = downloadengine.wait([download], progress)
+    progress.close()
+
+    if not downloaded:
+        if download.aborted:
             logger.warn("Map download cancelled for: " + url)
-            return False
-
-
-
-    except:
-        logger.warn("Map download or extraction failed for: " + url)
-        if sys.exc_type is HTTPError:
-            logger.warning("Vault download failed with HTTPError, map probably not in vault (or broken).")
+        elif download.status == 404:
+            logger.warning("Vault download failed with HTTP 404, map probably not in vault (or broken).")
             QtGui.QMessageBox.information(None, "Map not downloadable", "<b>This map was not found in the vault (or is broken).</b><br/>You need to get it from somewhere else in order to use it." )
         else:
-            logger.error("Download Exception", exc_info=sys.exc_info())
+            logger.warn("Map download failed for: " + url)
             QtGui.QMessageBox.information(None, "Map installation failed", "<b>This map could not be installed (please report this map or bug).</b>" )
         return False
 
+    try:
+        zfile = zipfile.ZipFile(zippath)
+        zfile.extractall(getUserMapsFolder())
+        zfile.close()
+        os.remove(zippath)
+
+        # Don't wait for the file system watcher to notice the new map
+        registry().scan(getUserMapsFolder())
+
+        #check for eventual sound files
+        if folderForMap(name):
+            if "sounds" in os.listdir(folderForMap(name)) :
+                root_src_dir = os.path.join(folderForMap(name), "sounds")
+                for src_dir, _, files in os.walk(root_src_dir):
+                    dst_dir = src_dir.replace(root_src_dir, util.SOUND_DIR)
+                    for file_ in files:
+                        src_file = os.path.join(src_dir, file_)
+                        dst_file = os.path.join(dst_dir, file_)
+                        if os.path.exists(dst_file):
+                            os.remove(dst_file)
+                        shutil.move(src_file, dst_dir)
+
+        logger.debug("Successfully downloaded and extracted map from: " + url)
+    except:
+        logger.warn("Map extraction failed for: " + url)
+        logger.error("Download Exception", exc_info=sys.exc_info())
+        QtGui.QMessageBox.information(None, "Map installation failed", "<b>This map could not be installed (please report this map or bug).</b>" )
+        return False
+
     #Count the map downloads
     try:
         url = VAULT_COUNTER_ROOT + "?map=" + urllib2.quote(link)
@@ -0,0 +1,129 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+from PyQt4 import QtCore, QtGui
+
+import logging
+
+import util
+from fa import maps
+
+logger = logging.getLogger(__name__)
+
+# Generating a preview is mostly disk I/O and zlib/PNG work in Qt, which releases the GIL
+PREVIEW_THREADS = 4
+
+
+class PreviewFuture(QtCore.QObject):
+    '''
+    The preview icon of one map, which may still be in the works. There's only ever one per map name,
+    so everyone asking for the same map waits on the same generation or download.
+    '''
+    finished = QtCore.pyqtSignal(QtGui.QIcon)
+
+    def __init__(self, mapname, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.mapname = mapname
+        self.icon = None
+        self.done = False
+
+    def setIcon(self, icon):
+        self.icon = icon
+        self.done = True
+        self.finished.emit(icon)
+
+    def then(self, callback):
+        ''' Calls callback with the icon once it's there, right away if it already is '''
+        if self.done:
+            callback(self.icon)
+        else:
+            self.finished.connect(callback)
+
+
+class _GenerateTask(QtCore.QRunnable):
+    def __init__(self, service, mapname):
+        QtCore.QRunnable.__init__(self)
+        self.service = service
+        self.mapname = mapname
+
+    def run(self):
+        self.service.generated.emit(self.mapname, maps.generatePreview(self.mapname) or "")
+
+
+class MapPreviewService(QtCore.QObject):
+    '''
+    Hands out map previews without blocking the GUI thread. Cached previews are returned right away,
+    local maps get their preview generated on a worker pool, and anything else is downloaded.
+    '''
+    generated = QtCore.pyqtSignal(str, str)
+
+    def __init__(self, downloader, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.downloader = downloader
+        self.futures = {}
+
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(PREVIEW_THREADS)
+
+        # Emitted from the pool threads, delivered in ours
+        self.generated.connect(self.previewGenerated, QtCore.Qt.QueuedConnection)
+
+    def request(self, mapname):
+        ''' Returns the PreviewFuture for mapname '''
+        future = self.futures.get(mapname)
+        if future is not None:
+            return future
+
+        future = PreviewFuture(mapname, self)
+        self.futures[mapname] = future
+
+        cached = maps.cachedPreview(mapname)
+        if cached:
+            future.setIcon(util.icon(cached, False))
+        else:
+            self.pool.start(_GenerateTask(self, mapname))
+        return future
+
+    def icon(self, mapname):
+        ''' Returns the preview icon if it's ready, None otherwise (and gets it ready) '''
+        future = self.request(mapname)
+        return future.icon if future.done else None
+
+    @QtCore.pyqtSlot(str, str)
+    def previewGenerated(self, mapname, path):
+        future = self.futures[mapname]
+        if path:
+            future.setIcon(util.icon(path, False))
+        else:
+            logger.debug("No local map for preview of " + mapname + ", downloading it")
+            self.downloader.downloadMapPreview(mapname, lambda pixmap: self.previewDownloaded(mapname, pixmap))
+
+    def previewDownloaded(self, mapname, pixmap):
+        future = self.futures[mapname]
+        if pixmap:
+            future.setIcon(QtGui.QIcon(pixmap))
+        else:
+            # The placeholder is handed to whoever waits, but not kept as the preview: the next
+            # request tries again, the map may have been installed by then
+            del self.futures[mapname]
+            future.setParent(None)
+            future.setIcon(util.icon("games/unknown_map.png"))
+
+    def waitForDone(self):
+        self.pool.waitForDone()
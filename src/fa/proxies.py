@@ -20,29 +20,103 @@
 from PyQt4 import QtCore, QtGui, QtNetwork
 
 import functools
+import socket
 
 import logging
 import time
 import random
 import json
+import struct
+import binascii
 
 from config import Settings
+from scheduler import DeadlineScheduler
 
 FAF_PROXY_HOST = Settings.get('HOST', 'PROXY')
 FAF_PROXY_PORT = Settings.get('PORT', 'PROXY')
 
 UNIT16 = 8
 
+# Every P2P control datagram starts with this prefix, followed by a one byte opcode and an 8 byte tag.
+P2P_ESCAPE_PREFIX = "\xff" * 15
+
+P2P_OP_TAG_OFFER = chr(1)
+P2P_OP_TAG_ACK = chr(2)
+P2P_OP_TAG_DECLINE = chr(3)
+P2P_OP_TAG_CONFIRM = chr(11)
+P2P_OP_RECONNECT_BY_INTERMEDIARY = chr(17)
+P2P_OP_RECONNECT_BY_INTERMEDIARY_2 = chr(18)
+P2P_OP_RECONNECT = chr(23) # ask peer to update address
+
+# How often (in seconds) peers with outbound traffic are checked for a dead inbound side,
+# and how often the peer state may be dumped to the log when something changed
+P2P_CHECK_INTERVAL = 1
+P2P_DUMP_INTERVAL = 20
+P2P_DUMP_INTERVAL_MAX = 180
+
+# IPv4 address and port of the originator, as appended to reconnect-by-intermediary-2 messages
+P2P_ADDR_STRUCT = struct.Struct(">IH")
+
+# The prefix, opcode and tag every control datagram has, and the address reconnect-by-intermediary-2 adds
+P2P_CONTROL_SIZE = len(P2P_ESCAPE_PREFIX) + 1 + 8
+P2P_CONTROL_ADDR_SIZE = P2P_CONTROL_SIZE + P2P_ADDR_STRUCT.size
+
+
+def p2p_parse_addr(addr):
+    ''' Turns an "a.b.c.d:port" string into the (ipv4_int, port) key used to index peers '''
+    host, port = addr.rsplit(':', 1)
+    return struct.unpack(">I", socket.inet_aton(host))[0], int(port)
+
+
+def p2p_format_addr(key):
+    return socket.inet_ntoa(struct.pack(">I", key[0])) + ":" + str(key[1])
+
+
+class P2PPeer(object):
+    '''
+    State of a single forwarded P2P connection, indexed by its public (ipv4_int, port) key.
+    '''
+    __slots__ = ('key', 'public_addr_qt', 'public_port', 'local_sock', 'local_port', 'pub_last_recv',
+                 'num_tag_offers', 'tag_offer_due', 'sent_since_check', 'try_reconn_timestamp', 'try_ind_reconn_timestamp',
+                 'reconnect_attempts', 'ind_reconnect_attempts', 'our_reconn_tag', 'our_reconn_tag_ack',
+                 'our_reconn_tag_declined', 'their_reconn_tag', 'connected', 'peeruid', 'currently_reconnecting')
+
+    def __init__(self, key, public_addr_qt, local_sock):
+        now = time.time()
+        self.key = key
+        self.public_addr_qt = public_addr_qt
+        self.public_port = key[1]
+        self.local_sock = local_sock
+        self.local_port = local_sock.localPort()
+        self.pub_last_recv = now
+        self.num_tag_offers = 0
+        self.tag_offer_due = 1
+        self.sent_since_check = 0
+        self.try_reconn_timestamp = now
+        self.try_ind_reconn_timestamp = now
+        self.reconnect_attempts = 0
+        self.ind_reconnect_attempts = 0
+        self.our_reconn_tag = None
+        self.our_reconn_tag_ack = 0
+        self.our_reconn_tag_declined = 0
+        self.their_reconn_tag = None
+        self.connected = 0
+        self.peeruid = 0
+        self.currently_reconnecting = 0
+
+    def __str__(self):
+        return p2p_format_addr(self.key)
+
 
 class proxies(QtCore.QObject):
     __logger = logging.getLogger(__name__)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, client=None):
         super(proxies, self).__init__(parent)
 
-        self.client = parent
+        # Without a parent, the proxies can be moved to a fa.iothread.GameTrafficThread
+        self.client = client or parent
 
-        self.reconn_escape_prefix = QtCore.QByteArray.fromHex("ffffffffffffffffffffffffffffff");
         self.p2p_game_launched = 0
         self.p2p_bottleneck_ = 0
         self.p2p_state_debug_timestamp = time.time()
@@ -56,6 +130,22 @@ class proxies(QtCore.QObject):
         self.p2p_proxy_enable = 1
 
         self.p2p_want_dump_state = 0
+        self.p2p_successful_reconnects = 0
+        self.p2p_by_public = {}
+        self.p2p_by_local = {}
+        self.p2p_localhost = QtNetwork.QHostAddress(QtNetwork.QHostAddress.LocalHost)
+        self.p2p_local_game_port = 0
+        # Reconnect checks, tag offer rate limiting and state dumps run off deadlines, not per packet
+        self.p2p_scheduler = DeadlineScheduler(self)
+        self.p2p_control_handlers = {
+            P2P_OP_TAG_OFFER: self.p2p_on_tag_offer,
+            P2P_OP_TAG_CONFIRM: self.p2p_on_tag_offer,
+            P2P_OP_TAG_ACK: self.p2p_on_tag_ack,
+            P2P_OP_TAG_DECLINE: self.p2p_on_tag_decline,
+            P2P_OP_RECONNECT_BY_INTERMEDIARY: self.p2p_on_reconnect_by_intermediary,
+            P2P_OP_RECONNECT_BY_INTERMEDIARY_2: self.p2p_on_reconnect_by_intermediary_2,
+            P2P_OP_RECONNECT: self.p2p_on_reconnect,
+        }
 
         self.proxy_lastdata = time.time()
         self.proxies = {}
@@ -130,21 +220,21 @@ class proxies(QtCore.QObject):
         return self.proxies[port].localPort()
 
     def p2p_dump_peer(self, p2p):
-        self.__logger.debug("uid={0:6d} pub={1:23s} port={2:5d} last_pub={3:4d} toffer={4:2d} tack={5:1d} ratt={6:2d} iratt={7:2d} conn={8:1d} reconning: {9:1d}".format(p2p['peeruid'], p2p['public_addr'] + ":" + str(p2p['public_port']), p2p['local_port'], int(time.time() - p2p['pub_last_recv']), p2p['num_tag_offers'], p2p['our_reconn_tag_ack'], p2p['reconnect_attempts'], p2p['ind_reconnect_attempts'], p2p['connected'], p2p['currently_reconnecting']));
+        self.__logger.debug("uid={0:6d} pub={1:23s} port={2:5d} last_pub={3:4d} toffer={4:2d} tack={5:1d} ratt={6:2d} iratt={7:2d} conn={8:1d} reconning: {9:1d}".format(p2p.peeruid, str(p2p), p2p.local_port, int(time.time() - p2p.pub_last_recv), p2p.num_tag_offers, p2p.our_reconn_tag_ack, p2p.reconnect_attempts, p2p.ind_reconnect_attempts, p2p.connected, p2p.currently_reconnecting))
 
     def p2p_all_disconnected_time_min(self):
         min_t = 100000
-        for k, p2p in self.p2p_by_public.iteritems():
+        for p2p in self.p2p_by_public.itervalues():
             if self.p2p_is_fully_connected(p2p):
-                t = time.time() - p2p['pub_last_recv'];
+                t = time.time() - p2p.pub_last_recv
                 if t < min_t: min_t = t
         return min_t
 
     def p2p_is_fully_connected(self, p2p):
-        return p2p['our_reconn_tag_ack'] and not p2p['reconnect_attempts'] and p2p['peeruid'] and p2p['connected'] and time.time() - p2p['pub_last_recv'] < 10
+        return p2p.our_reconn_tag_ack and not p2p.reconnect_attempts and p2p.peeruid and p2p.connected and time.time() - p2p.pub_last_recv < 10
 
     def p2p_is_eligible_for_reconnect(self, p2p):
-        return p2p['our_reconn_tag_ack'] and p2p['peeruid'] and p2p['connected']
+        return p2p.our_reconn_tag_ack and p2p.peeruid and p2p.connected
 
     def p2p_bottleneck(self):
         self.p2p_bottleneck_ = 1
@@ -152,60 +242,65 @@ class proxies(QtCore.QObject):
     def p2p_bottleneck_cleared(self):
         self.p2p_bottleneck_ = 0
 
+    def p2p_send_control(self, opcode, payload, host, port):
+        self.p2p_public_sock.writeDatagram(P2P_ESCAPE_PREFIX + opcode + payload, host, port)
+
     def p2p_try_reconnect(self, p2p, by_intermediate):
         self.p2p_want_dump_state = 1
-        psock = self.p2p_public_sock
-        if 'our_reconn_tag' in p2p and p2p['our_reconn_tag_ack']:
-            stamp_name = 'try_reconn_timestamp'
+        if p2p.our_reconn_tag is not None and p2p.our_reconn_tag_ack:
             if by_intermediate:
-                stamp_name = 'try_ind_reconn_timestamp'
-                
-            if p2p[stamp_name] + self.P2P_RECONNECT_RATELIMIT < time.time():
+                last_try = p2p.try_ind_reconn_timestamp
+            else:
+                last_try = p2p.try_reconn_timestamp
+
+            if last_try + self.P2P_RECONNECT_RATELIMIT < time.time():
                 if by_intermediate:
-                    self.__logger.info("attempting reconnect by intermediary to " + p2p['public_addr'] + ":" + str(p2p['public_port']))
+                    self.__logger.info("attempting reconnect by intermediary to %s", p2p)
                     # we only send one reconnect-by-intermediary message
                     # at a time, because the peer will broadcast to
                     # all his peers
-                    count_to = p2p['reconnect_attempts'] - self.P2P_INDIRECT_RECONNECT_AFTER
+                    count_to = p2p.reconnect_attempts - self.P2P_INDIRECT_RECONNECT_AFTER
                     count = 0
                     # we do the antipattern here, and iterate instead
                     # of indexing, because p2p_by_public isnt guaranteed
                     # to only contain active game connections (since
                     # we are currently attempting reconnects)
                     while count <= count_to:
-                        for dest_inter, p2p_inter in self.p2p_by_public.iteritems():
+                        for p2p_inter in self.p2p_by_public.itervalues():
                             if self.p2p_is_fully_connected(p2p_inter):
                                 if count == count_to:
-                                    p = QtCore.QByteArray(self.reconn_escape_prefix)
-                                    p.append(chr(17))
-                                    p.append(p2p['our_reconn_tag'])
-                                    psock.writeDatagram(p, p2p_inter['public_addr_qt'], p2p_inter['public_port'])
-                                    p2p['ind_reconnect_attempts'] += 1
+                                    self.p2p_send_control(P2P_OP_RECONNECT_BY_INTERMEDIARY, p2p.our_reconn_tag, p2p_inter.public_addr_qt, p2p_inter.public_port)
+                                    p2p.ind_reconnect_attempts += 1
                                     count += 1
                                     break
                                 count += 1
                         if count == 0:
                             break
+                    p2p.try_ind_reconn_timestamp = time.time()
                 else:
-                    self.__logger.info("attempting to reconnect to " + p2p['public_addr'] + ":" + str(p2p['public_port']))
-                    p = QtCore.QByteArray(self.reconn_escape_prefix)
-                    p.append(chr(23)) # 23 = ask peer to update address
-                    p.append(p2p['our_reconn_tag'])
-                    psock.writeDatagram(p, p2p['public_addr_qt'], p2p['public_port'])
-                    p2p['reconnect_attempts'] += 1
-
-                p2p[stamp_name] = time.time()
-
+                    self.__logger.info("attempting to reconnect to %s", p2p)
+                    self.p2p_send_control(P2P_OP_RECONNECT, p2p.our_reconn_tag, p2p.public_addr_qt, p2p.public_port)
+                    p2p.reconnect_attempts += 1
+                    p2p.try_reconn_timestamp = time.time()
 
     # forward all datagrams to the remote address:port associated with this local port
     def p2p_read_local(self, p2p):
         psock = self.p2p_public_sock
-        lsock = p2p['local_sock']
+        lsock = p2p.local_sock
         while lsock.hasPendingDatagrams():
-            size = lsock.pendingDatagramSize()
-            dgram, _, _ = lsock.readDatagram(size)
-            psock.writeDatagram(dgram, p2p['public_addr_qt'], p2p['public_port'])
-
+            dgram, _, _ = lsock.readDatagram(lsock.pendingDatagramSize())
+            psock.writeDatagram(dgram, p2p.public_addr_qt, p2p.public_port)
+        p2p.sent_since_check = 1
+
+    def p2p_check_peers(self):
+        self.p2p_scheduler.call_later(P2P_CHECK_INTERVAL, self.p2p_check_peers)
+        for p2p in self.p2p_by_public.values():
+            if p2p.sent_since_check:
+                p2p.sent_since_check = 0
+                if self.p2p_bottleneck_:
+                    self.p2p_check_peer(p2p)
+
+    def p2p_check_peer(self, p2p):
         # no incoming traffic (from public_sock) for 10 seconds (for all p2p peers) is trouble
         # this condition is true on the peer that got a new IP address...it will still be sending
         # messages to former peers, but will not receive any
@@ -215,253 +310,223 @@ class proxies(QtCore.QObject):
         # new connection, and thus our reconn request will go to the old IP and will not
         # matter
         #
-        # we also only act if FA.exe reports bottleneck
-        
-        if time.time() - p2p['pub_last_recv'] > 10 and self.p2p_bottleneck_:
-            if p2p['currently_reconnecting']:
-                if p2p['reconnect_attempts'] >= self.P2P_INDIRECT_RECONNECT_AFTER:
+        # we also only act if FA.exe reports bottleneck, and only for peers we sent
+        # traffic to since the last check
+        if time.time() - p2p.pub_last_recv > 10:
+            if p2p.currently_reconnecting:
+                if p2p.reconnect_attempts >= self.P2P_INDIRECT_RECONNECT_AFTER:
                     self.p2p_try_reconnect(p2p, 1)
-                if p2p['reconnect_attempts'] < self.P2P_DIRECT_RECONNECT_ATTEMPTS:
+                if p2p.reconnect_attempts < self.P2P_DIRECT_RECONNECT_ATTEMPTS:
                     self.p2p_try_reconnect(p2p, 0)
             elif self.p2p_game_launched and self.p2p_all_disconnected_time_min() > 10:
-                for k, p2p in self.p2p_by_public.iteritems():
+                for p2p in self.p2p_by_public.itervalues():
                     if self.p2p_is_eligible_for_reconnect(p2p):
-                        p2p['reconnect_attempts'] = 0
-                        p2p['ind_reconnect_attempts'] = 0
-                        p2p['currently_reconnecting'] = 1
+                        p2p.reconnect_attempts = 0
+                        p2p.ind_reconnect_attempts = 0
+                        p2p.currently_reconnecting = 1
                         self.p2p_try_reconnect(p2p, 0)
                 self.p2p_successful_reconnects = 0
-        if self.p2p_want_dump_state and time.time() - self.p2p_state_debug_timestamp > 20 or time.time() - self.p2p_state_debug_timestamp > 180:
-            self.p2p_state_debug_timestamp = time.time()
-            for dbg_dest, dbg_p2p in self.p2p_by_public.iteritems():
-                self.p2p_dump_peer(dbg_p2p);
+
+    def p2p_dump_state(self):
+        self.p2p_scheduler.call_later(P2P_DUMP_INTERVAL, self.p2p_dump_state)
+        now = time.time()
+        if self.p2p_want_dump_state or now - self.p2p_state_debug_timestamp >= P2P_DUMP_INTERVAL_MAX:
+            self.p2p_state_debug_timestamp = now
+            for dbg_p2p in self.p2p_by_public.itervalues():
+                self.p2p_dump_peer(dbg_p2p)
             self.p2p_want_dump_state = 0
 
-    def p2p_handle_public(self, dgram, host, port, p2p):
-        psock = self.p2p_public_sock
-        if dgram.startsWith(self.reconn_escape_prefix):
-            hexdump = ''.join([hex(ord(dgram[i])).replace('0x',' ') for i in range(0, len(dgram))])
-            self.__logger.debug("recv prefixed dgram " + hexdump)
-            # one of our prefixed messages
-            if dgram.at(15) == chr(1) or dgram.at(15) == chr(11):
-                # if chr(1) their tag offer, we send ack if we dont have tag or tag matches
-                # if chr(11) their tag confirm request, we only send ack if tag matches
-
-                # in case we got a new IP and FA.exe keeps sending to the peer,
-                # remote thinks we are a new connection
-                # and will try to send us his tag. we must refuse, since their temp connection
-                # will cease to exist after our reconn message and we want to retain the
-                # original tag. only accepting the very first tag should do the trick
-                theirtag = dgram.mid(16, 8)
-                if 'their_reconn_tag' in p2p and p2p['their_reconn_tag'] != theirtag or dgram.at(15) == chr(11) and not 'their_reconn_tag' in p2p:
-                    self.__logger.info("peer wants to send a different tag now. we ignore")
-                    p = QtCore.QByteArray(self.reconn_escape_prefix)
-                    p.append(chr(3)) # decline
-                    p.append(theirtag)
-                    psock.writeDatagram(p, host, port)
-                else:
-                    self.__logger.info("peer " + host.toString() + ":" + str(port) + " offers tag")
-                    # but in case they send the same tag twice, we assume our ack got lost
-                    p2p['their_reconn_tag'] = theirtag
-                    p = QtCore.QByteArray(self.reconn_escape_prefix)
-                    p.append(chr(2)) # 2 = ack tag
-                    p.append(theirtag)
-                    psock.writeDatagram(p, host, port)
-            elif dgram.at(15) == chr(2):
-                # their ack of our tag, we send nothing
-                tag = dgram.mid(16, 8)
-
-                if p2p['our_reconn_tag'] == tag:
-                    self.__logger.info("peer " + host.toString() + ":" + str(port) + " acks our tag")
-                    p2p['our_reconn_tag_ack'] = 1
-                    p2p['num_tag_offers'] = 0
-                    if p2p['reconnect_attempts']:
-                        self.p2p_successful_reconnects += 1
-                    p2p['reconnect_attempts'] = 0
-                    p2p['currently_reconnecting'] = 0
-                    self.p2p_want_dump_state = 1
-                else:
-                    self.__logger.error("peer " + host.toString() + ":" + str(port) + " acks a tag which we didnt send")
-            elif dgram.at(15) == chr(3):
-                # they decline our tag
-                tag = dgram.mid(16, 8)
-                
-                if p2p['our_reconn_tag'] == tag:
-                    self.__logger.info("peer " + host.toString() + ":" + str(port) + " declines our tag")
-                    p2p['our_reconn_tag_declined'] = 1
+    def p2p_handle_control(self, dgram, host, port, p2p):
+        if self.__logger.isEnabledFor(logging.DEBUG):
+            self.__logger.debug("recv prefixed dgram %s", binascii.hexlify(dgram))
+        if len(dgram) < P2P_CONTROL_SIZE:
+            self.__logger.error("dropping truncated p2p_reconn message from %s", p2p)
+            return
+        handler = self.p2p_control_handlers.get(dgram[15:16])
+        if handler:
+            handler(dgram, host, port, p2p)
+        else:
+            self.__logger.error("unknown p2p_reconn message")
+
+    def p2p_on_tag_offer(self, dgram, host, port, p2p):
+        # if P2P_OP_TAG_OFFER their tag offer, we send ack if we dont have tag or tag matches
+        # if P2P_OP_TAG_CONFIRM their tag confirm request, we only send ack if tag matches
+
+        # in case we got a new IP and FA.exe keeps sending to the peer,
+        # remote thinks we are a new connection
+        # and will try to send us his tag. we must refuse, since their temp connection
+        # will cease to exist after our reconn message and we want to retain the
+        # original tag. only accepting the very first tag should do the trick
+        theirtag = dgram[16:24]
+        if p2p.their_reconn_tag is not None and p2p.their_reconn_tag != theirtag or dgram[15] == P2P_OP_TAG_CONFIRM and p2p.their_reconn_tag is None:
+            self.__logger.info("peer wants to send a different tag now. we ignore")
+            self.p2p_send_control(P2P_OP_TAG_DECLINE, theirtag, host, port)
+        else:
+            self.__logger.info("peer %s offers tag", p2p)
+            # but in case they send the same tag twice, we assume our ack got lost
+            p2p.their_reconn_tag = theirtag
+            self.p2p_send_control(P2P_OP_TAG_ACK, theirtag, host, port)
+
+    def p2p_on_tag_ack(self, dgram, host, port, p2p):
+        # their ack of our tag, we send nothing
+        if p2p.our_reconn_tag == dgram[16:24]:
+            self.__logger.info("peer %s acks our tag", p2p)
+            p2p.our_reconn_tag_ack = 1
+            p2p.num_tag_offers = 0
+            p2p.tag_offer_due = 1
+            if p2p.reconnect_attempts:
+                self.p2p_successful_reconnects += 1
+            p2p.reconnect_attempts = 0
+            p2p.currently_reconnecting = 0
+            self.p2p_want_dump_state = 1
+        else:
+            self.__logger.error("peer %s acks a tag which we didnt send", p2p)
+
+    def p2p_on_tag_decline(self, dgram, host, port, p2p):
+        # they decline our tag
+        if p2p.our_reconn_tag == dgram[16:24]:
+            self.__logger.info("peer %s declines our tag", p2p)
+            p2p.our_reconn_tag_declined = 1
+        else:
+            self.__logger.info("peer %s declines a tag we did not send", p2p)
+
+    def p2p_on_reconnect_by_intermediary(self, dgram, host, port, p2p):
+        # reconnect-by-intermediary message
+        # we need this for udp hole punching
+        # in a situation where the disconnected peer attempts to
+        # reconnect to a peer whose NAT requires udp hole punching
+        # the reconnect would fail, because no hole has been punched
+        # for the new IP address. But in this case the disconnected peer
+        # does not require hole punching, because otherwise the
+        # p2p udp channel would not have been possible without a proxy
+        # anyway. The disconnected peer announces his (promiscuous)
+        # new IP:port to a third peer to which it already has reestablished
+        # a connection, which in turn forwards it to all peers to which
+        # he still has the old and good connections. the peer that
+        # needs to initiate the udp hole punch gets the new IP:port via
+        # this third peer. this does not work in a 1v1 where the
+        # peer that does not require hole punching gets disconnected though
+        # (that special case requires another third party: the server
+        # and an additional mechanism). the same failure happens in a XvX where
+        # the disconnected peer is the only one that did not require
+        # hole punching
+        #
+        # the format of this message is the same as for the reconnect
+        # message and the tag is the same as it would be in the reconnect
+        # message. on the second leg, when the third party forwards this
+        # reconnect-by-intermediary message it includes the originator IP:port
+        # of this message in its reconnect-by-intermediary-2 message
+        payload = dgram[16:24] + P2P_ADDR_STRUCT.pack(*p2p.key)
+        for other in self.p2p_by_public.itervalues():
+            if other is not p2p:
+                self.__logger.info("passing on reconn-by-intermediary to %s", other)
+                self.p2p_send_control(P2P_OP_RECONNECT_BY_INTERMEDIARY_2, payload, other.public_addr_qt, other.public_port)
+
+    def p2p_on_reconnect_by_intermediary_2(self, dgram, host, port, p2p):
+        # reconnect-by-intermediary-2 message (see above)
+        # we use the IP:port from the payload instead of the UDP header
+        if len(dgram) < P2P_CONTROL_ADDR_SIZE:
+            self.__logger.error("dropping truncated reconn-by-intermediary-2 from %s", p2p)
+            return
+        tag = dgram[16:24]
+        sender_key = P2P_ADDR_STRUCT.unpack_from(dgram, 24)
+        self.__logger.info("reconn-by-intermediary-2 from %s for %s", p2p, p2p_format_addr(sender_key))
+        found = 0
+        update_peer = None
+        for other in self.p2p_by_public.itervalues():
+            if other.their_reconn_tag == tag:
+                found = 1
+                if other.key != sender_key:
+                    self.__logger.info("update peer from %s to %s", other, p2p_format_addr(sender_key))
+                    update_peer = other
                 else:
-                    self.__logger.info("peer " + host.toString() + ":" + str(port) + " declines a tag we did not send")
-            elif dgram.at(15) == chr(17):
-                # reconnect-by-intermediary message
-                # we need this for udp hole punching
-                # in a situation where the disconnected peer attempts to
-                # reconnect to a peer whose NAT requires udp hole punching
-                # the reconnect would fail, because no hole has been punched
-                # for the new IP address. But in this case the disconnected peer
-                # does not require hole punching, because otherwise the
-                # p2p udp channel would not have been possible without a proxy
-                # anyway. The disconnected peer announces his (promiscuous)
-                # new IP:port to a third peer to which it already has reestablished
-                # a connection, which in turn forwards it to all peers to which
-                # he still has the old and good connections. the peer that
-                # needs to initiate the udp hole punch gets the new IP:port via
-                # this third peer. this does not work in a 1v1 where the
-                # peer that does not require hole punching gets disconnected though
-                # (that special case requires another third party: the server
-                # and an additional mechanism). the same failure happens in a XvX where
-                # the disconnected peer is the only one that did not require
-                # hole punching
-                #
-                # the format of this message is the same as for the reconnect
-                # message and the tag is the same as it would be in the reconnect
-                # message. on the second leg, when the third party forwards this
-                # reconnect-by-intermediary message it includes the originator IP:port
-                # of this message in its reconnect-by-intermediary-2 message
-                for k, p2p in self.p2p_by_public.iteritems():
-                    if p2p['public_addr_qt'] != host or p2p['public_port'] != port:
-                        self.__logger.info("passing on reconn-by-intermediary to " + p2p['public_addr'] + ":" + str(p2p['public_port']))
-                        p = QtCore.QByteArray(self.reconn_escape_prefix)
-                        p.append(chr(18)) # 18 = reconn-by-intermediary-2
-                        p.append(dgram.mid(16, 8))
-                        h32 = host.toIPv4Address()
-                        for ii in range(4, 0, -1):
-                            p.append(chr(h32 >> ii * 8 - 8 & 0xff))
-                        p.append(chr(port >> 8 & 0xff))
-                        p.append(chr(port & 0xff))
-                        psock.writeDatagram(p, p2p['public_addr_qt'], p2p['public_port'])
-
-            elif dgram.at(15) == chr(18):
-                # reconnect-by-intermediary-2 message (see above)
-                # we use the IP:port from the payload instead of the UDP header
-                tag = dgram.mid(16, 8)
-                sender_host32 = 0
-                for i in range(0, 4):
-                    sender_host32 |= ord(dgram.at(24 + i)) << (3 - i) * 8
-                sender_host = QtNetwork.QHostAddress(sender_host32)
-                sender_port = 0
-                sender_port |= ord(dgram.at(28)) << 8
-                sender_port |= ord(dgram.at(29))
-                self.__logger.info("reconn-by-intermediary-2 from " + host.toString() + ":" + str(port) + " for " + sender_host.toString() + ":" + str(sender_port))
-                found = 0
-                update_dest_old = None
-                update_dest_new = None
-                for dest, p2p in self.p2p_by_public.iteritems():
-                    if 'their_reconn_tag' in p2p and p2p['their_reconn_tag'] == tag:
-                        found = 1
-                        if p2p['public_addr_qt'] != sender_host or p2p['public_port'] != sender_port:
-                            self.__logger.info("update peer from " + p2p['public_addr'] + ":" + str(p2p['public_port']) + " to " + sender_host.toString() + ":" + str(sender_port))
-                            p2p['public_addr_qt'] = sender_host
-                            p2p['public_addr'] = sender_host.toString()
-                            p2p['public_port'] = sender_port
-                            update_dest_old = dest
-                            update_dest_new = sender_host.toString() + ":" + str(sender_port)
-                        else:
-                            self.__logger.info("ignore duplicate update")
-                if not found:
-                    self.__logger.error("cannot match tag to any connection...update not for us")
-                if update_dest_old:
-                    self.p2p_by_public[update_dest_new] = self.p2p_by_public[update_dest_old]
-                    del self.p2p_by_public[update_dest_old]
-                    self.p2p_want_dump_state = 1
-            elif dgram.at(15) == chr(23):
-                # if the tag matches our current conn we do nothing
-                # this can happen if peer sends too many update messages due to network lag
-                # or his IP address didnt change in the first place
-                # also in a 1v1 situation, both peers experience no network traffic
-                # on their public socket and both try to reconnect
-                # but the reconnect message
-                self.__logger.info("reconnect request from peer " + host.toString() + ":" + str(port))
-                if 'their_reconn_tag' in p2p:
-                    if p2p['their_reconn_tag'] == dgram.mid(16, 8):
-                        self.__logger.info("but tag matches the current connection")
-                        return
-
-                # at this point we should be able to find the tag in another forwarder
-                # and update this other forwarder with a new address
-
-                update_dest_old = None
-                update_dest_new = None
-                for dest, p2p_other in self.p2p_by_public.iteritems():
-                    if 'their_reconn_tag' in p2p_other:
-                        if p2p_other['their_reconn_tag'] == dgram.mid(16, 8):
-                            p2p_other['public_addr'] = host.toString()
-                            p2p_other['public_addr_qt'] = host
-                            p2p_other['public_port'] = port
-                            update_dest_old = dest
-                            update_dest_new = host.toString() + ":" + str(port)
-                            break
-                if update_dest_old:
-                    tmp = self.p2p_by_public[update_dest_old]
-                    del self.p2p_by_public[update_dest_old]
+                    self.__logger.info("ignore duplicate update")
+        if not found:
+            self.__logger.error("cannot match tag to any connection...update not for us")
+        if update_peer:
+            self.p2p_rekey_peer(update_peer, sender_key, QtNetwork.QHostAddress(sender_key[0]))
+            self.p2p_want_dump_state = 1
+
+    def p2p_on_reconnect(self, dgram, host, port, p2p):
+        # if the tag matches our current conn we do nothing
+        # this can happen if peer sends too many update messages due to network lag
+        # or his IP address didnt change in the first place
+        # also in a 1v1 situation, both peers experience no network traffic
+        # on their public socket and both try to reconnect
+        # but the reconnect message
+        self.__logger.info("reconnect request from peer %s", p2p)
+        tag = dgram[16:24]
+        if p2p.their_reconn_tag is not None and p2p.their_reconn_tag == tag:
+            self.__logger.info("but tag matches the current connection")
+            return
+
+        # at this point we should be able to find the tag in another forwarder
+        # and update this other forwarder with a new address
+        for other in self.p2p_by_public.itervalues():
+            if other.their_reconn_tag == tag:
+                # now we can close the current forwarder, which was intended to be temporary anyway
+                # (implement me, for now we trust in the garbage collector)
+                self.p2p_rekey_peer(other, p2p.key, host)
+                self.__logger.info("p2p peer address updated sucessfully (at least we hope)")
+                self.p2p_want_dump_state = 1
+                return
+        self.__logger.error("cannot find peer address update tag among existing connections")
 
-                    # now we can close the current forwarder, which was intended to be temporary anyway
-                    # (implement me, for now we trust in the garbage collector)
+    def p2p_rekey_peer(self, p2p, key, host):
+        del self.p2p_by_public[p2p.key]
+        p2p.key = key
+        p2p.public_addr_qt = host
+        p2p.public_port = key[1]
+        self.p2p_by_public[key] = p2p
 
-                    self.p2p_by_public[update_dest_new] = tmp
-                    self.__logger.info("p2p peer address updated sucessfully (at least we hope)")
-                    self.p2p_want_dump_state = 1
-                else:
-                    self.__logger.error("cannot find peer address update tag among existing connections")
-            else:
-                self.__logger.error("unknown p2p_reconn message")
+    def p2p_offer_tag(self, p2p):
+        # offer tag if we are connected to peer
+        #
+        # during reconnect:
+        # if we currently are attempting to reconnect to
+        # this peer we try to get our tag acked again so as to
+        # confirm that our reconnect attempt was successful
+        # (we dont continue our reconnect attempts as long as
+        # we continue to receive data after a successful reconnect
+        # but we will reset reconnect counters after we receive
+        # the new ack)
+        # we leave our_reconn_tag_ack alone, because the reconnect
+        # logic must have that ack for the previous connection
+        #
+        # tag_offer_due is cleared here and set again by the scheduler once the rate limit expired,
+        # or by the peer's ack after we gave up
+        p2p.tag_offer_due = 0
+        if p2p.num_tag_offers >= self.P2P_MAX_TAG_OFFERS:
+            self.__logger.info("giving up on tag offers for %s", p2p)
+            return
+
+        self.p2p_scheduler.call_later(self.P2P_TAG_OFFER_RATELIMIT, self.p2p_tag_offer_ready, p2p)
+        if p2p.our_reconn_tag is None:
+            p2p.our_reconn_tag = ''.join([chr(random.randint(0, 255)) for i in range(0, 8)])
+
+        self.__logger.info("sending tag to peer %s", p2p)
+        if p2p.our_reconn_tag_ack:
+            # we only want to get an ack from a peer that acked
+            # us before
+            self.p2p_send_control(P2P_OP_TAG_CONFIRM, p2p.our_reconn_tag, p2p.public_addr_qt, p2p.public_port)
         else:
-            p2p['pub_last_recv'] = time.time()
-            p2p['local_sock'].writeDatagram(dgram, QtNetwork.QHostAddress.LocalHost, self.client.gamePort + 1)
-
-            # offer tag if we are connected to peer
-            #
-            # during reconnect:
-            # if we currently are attempting to reconnect to
-            # this peer we try to get our tag acked again so as to
-            # confirm that our reconnect attempt was successful
-            # (we dont continue our reconnect attempts as long as
-            # we continue to receive data after a successful reconnect
-            # but we will reset reconnect counters after we receive
-            # the new ack)
-            # we leave our_reconn_tag_ack alone, because the reconnect
-            # logic must have that ack for the previous connection
-
-            if p2p['connected'] and (p2p['currently_reconnecting'] or not p2p['our_reconn_tag_ack'] and not 'our_reconn_tag_declined' in p2p):
-                if 'tag_offer_timestamp' in p2p and p2p['tag_offer_timestamp'] + self.P2P_TAG_OFFER_RATELIMIT >= time.time():
-                    return
-                if p2p['num_tag_offers'] == self.P2P_MAX_TAG_OFFERS:
-                    self.__logger.info("giving up on tag offers for " + host.toString() + ":" + str(port))
-                    p2p['num_tag_offers'] += 1
-                    return
-                elif p2p['num_tag_offers'] > self.P2P_MAX_TAG_OFFERS:
-                    return
-
-                p2p['tag_offer_timestamp'] = time.time()
-                if not 'our_reconn_tag' in p2p:
-                    tag = ''.join([chr(random.randint(0, 255)) for i in range(0, 8)])
-                    p2p['our_reconn_tag'] = tag
-                else:
-                    tag = p2p['our_reconn_tag']
+            self.p2p_send_control(P2P_OP_TAG_OFFER, p2p.our_reconn_tag, p2p.public_addr_qt, p2p.public_port)
+        p2p.num_tag_offers += 1
 
-                p = QtCore.QByteArray(self.reconn_escape_prefix)
-                if p2p['our_reconn_tag_ack']:
-                    # we only want to get an ack from a peer that acked
-                    # us before
-                    p.append(chr(11)) # 11 = confirm tag
-                else:
-                    p.append(chr(1)) # 1 = offer tag
-                p.append(tag)
-                self.__logger.info("sending tag to peer " + host.toString() + ":" + str(port))
-                psock.writeDatagram(p, host, port)
-                p2p['num_tag_offers'] += 1
+    def p2p_tag_offer_ready(self, p2p):
+        p2p.tag_offer_due = 1
 
     # find local socket by sender address:port and forward datagram
     def p2p_read_public(self):
         psock = self.p2p_public_sock
+        by_public = self.p2p_by_public
+        localhost = self.p2p_localhost
+        now = time.time()
         while psock.hasPendingDatagrams():
-            size = psock.pendingDatagramSize()
-            dgram, host, port = psock.readDatagram(size)
-            remote_str = host.toString() + ':' + str(port)
-            if remote_str in self.p2p_by_public:
-                #self.__logger.info("UDP forward " + remote_str + "->127.0.0.1:" + str(self.client.gamePort + 1))
-                p2p = self.p2p_by_public[remote_str]
-                self.p2p_handle_public(QtCore.QByteArray(dgram), host, port, p2p)
-            else:
+            dgram, host, port = psock.readDatagram(psock.pendingDatagramSize())
+            key = (host.toIPv4Address(), port)
+            p2p = by_public.get(key)
+            if p2p is None:
                 # (for all scenarios)
                 # hm, unexpected packet from different port now, we just create more forwarders
                 # traffic from 2 different ports on 1 IP often happens during normal game launch, so we
@@ -478,88 +543,87 @@ class proxies(QtCore.QObject):
                 # connection with the peer, but these new tags will be forgotten after the
                 # reconnect message has been processed. while our conn is temporary the remote
                 # peer has to make sure he is not learning any new tags from us
-                self.p2p_translate_to_local(remote_str, None)
-                if remote_str in self.p2p_by_public:
-                    #self.__logger.info("UDP forward " + remote_str + "->127.0.0.1:" + str(self.client.gamePort + 1))
-                    p2p = self.p2p_by_public[remote_str]
-                    self.p2p_handle_public(QtCore.QByteArray(dgram), host, port, p2p);
-                else:
-                    self.__logger.error("STILL no local forward for " + remote_str)
+                p2p = self.p2p_create_peer(key, host)
+                if p2p is None:
+                    self.__logger.error("STILL no local forward for %s", p2p_format_addr(key))
+                    continue
+
+            if dgram.startswith(P2P_ESCAPE_PREFIX):
+                # one of our prefixed messages
+                self.p2p_handle_control(dgram, host, port, p2p)
+                continue
+
+            # plain game traffic: hand the datagram to FA as is
+            p2p.pub_last_recv = now
+            p2p.local_sock.writeDatagram(dgram, localhost, self.p2p_local_game_port)
+
+            if p2p.tag_offer_due and p2p.connected and (p2p.currently_reconnecting or not p2p.our_reconn_tag_ack and not p2p.our_reconn_tag_declined):
+                self.p2p_offer_tag(p2p)
 
     def p2p_set_uid_for_peer(self, pubaddr, uid):
-        if pubaddr in self.p2p_by_public:
-            self.p2p_by_public[pubaddr]['peeruid'] = uid
+        key = p2p_parse_addr(pubaddr)
+        if key in self.p2p_by_public:
+            self.p2p_by_public[key].peeruid = uid
             self.p2p_want_dump_state = 1
         else:
             self.__logger.error("request to memorize UID " + str(uid) + " for peer " + pubaddr + " but we dont know the peer")
 
     def p2p_set_connected_state(self, uid, connected):
         num_found = 0
-        remove_pub = [ ]
-        remove_loc = [ ]
-        
-        for pub, p2p in self.p2p_by_public.iteritems():
-            if p2p['peeruid'] == uid:
-                if not connected and p2p['connected']:
-                    remove_pub.append(pub)
-                    remove_loc.append(p2p['local_port'])
-                p2p['connected'] = connected
+        remove = [ ]
+
+        for p2p in self.p2p_by_public.itervalues():
+            if p2p.peeruid == uid:
+                if not connected and p2p.connected:
+                    remove.append(p2p)
+                p2p.connected = connected
                 self.p2p_want_dump_state = 1
                 num_found += 1
         if num_found != 1:
             self.__logger.error("request to set connected state " + str(connected) + " for UID " + str(uid) + " but we have " + str(num_found) + " connections to peer")
-        for p in remove_pub:
+        for p2p in remove:
             # rely on the garbage collector, maybe fixme
-            self.__logger.info("remove p2p peer " + p);
-            del self.p2p_by_public[p]
-        for l in remove_loc:
-            del self.p2p_by_local["127.0.0.1:" + str(l)]
+            self.__logger.info("remove p2p peer %s", p2p)
+            del self.p2p_by_public[p2p.key]
+            del self.p2p_by_local[p2p.local_port]
 
     def p2p_set_game_launched(self, launching):
         self.p2p_game_launched = 1
 
+    def p2p_create_peer(self, key, host):
+        lsock = QtNetwork.QUdpSocket(self)
+        if not lsock.bind(QtNetwork.QHostAddress.LocalHost, 0):
+            self.__logger.error("cannot bind local udp socket (any port)")
+            return None
+        p2p = P2PPeer(key, host, lsock)
+        lsock.readyRead.connect(functools.partial(self.p2p_read_local, p2p))
+        self.p2p_by_public[key] = p2p
+        self.p2p_by_local[p2p.local_port] = p2p
+        self.__logger.info("created new p2p proxy port for %s on 127.0.0.1:%i", p2p, p2p.local_port)
+        self.p2p_want_dump_state = 1
+        return p2p
+
     # address translation during lobby phase
     def p2p_translate_to_local(self, dest, relay):
-        if dest in self.p2p_by_public:
-            return '127.0.0.1:' + str(self.p2p_by_public[dest]['local_port'])
-        else:
-            p2p = { }
-            p2p['relay'] = 0
-            p2p['public_addr'] = dest.split(':', 1)[0]
-            p2p['public_addr_qt'] = QtNetwork.QHostAddress(p2p['public_addr'])
-            p2p['public_port'] = int(dest.split(':', 1)[1])
-            p2p['pub_last_recv'] = time.time()
-            p2p['num_tag_offers'] = 0
-            lsock = p2p['local_sock'] = QtNetwork.QUdpSocket(self)
-            if not lsock.bind(QtNetwork.QHostAddress.LocalHost, 0):
-                self.__logger.error("cannot bind local udp socket (any port)")
+        key = p2p_parse_addr(dest)
+        p2p = self.p2p_by_public.get(key)
+        if p2p is None:
+            p2p = self.p2p_create_peer(key, QtNetwork.QHostAddress(key[0]))
+            if p2p is None:
                 return None
-            lsock.readyRead.connect(functools.partial(self.p2p_read_local, p2p))
-            localport = lsock.localPort()
-            p2p['local_port'] = localport
-            p2p['try_reconn_timestamp'] = time.time()
-            p2p['try_ind_reconn_timestamp'] = time.time()
-            p2p['reconnect_attempts'] = 0
-            p2p['ind_reconnect_attempts'] = 0
-            p2p['our_reconn_tag_ack'] = 0
-            p2p['connected'] = 0
-            p2p['peeruid'] = 0
-            p2p['currently_reconnecting'] = 0
-            self.p2p_by_public[dest] = p2p;
-            self.p2p_by_local["127.0.0.1:" + str(localport)] = p2p;
-            self.__logger.info("created new p2p proxy port for " + dest + " on 127.0.0.1:" + str(localport))
-            self.p2p_want_dump_state = 1
-            return '127.0.0.1:' + str(localport)
+        return '127.0.0.1:' + str(p2p.local_port)
 
     # address translation during lobby phase
     def p2p_translate_to_public(self, local):
-        if local in self.p2p_by_local:
-            return str(self.p2p_by_local[local]['public_addr']) + ':' + str(self.p2p_by_local[local]['public_port'])
+        p2p = self.p2p_by_local.get(int(local.rsplit(':', 1)[1]))
+        if p2p:
+            return str(p2p)
         else:
             self.__logger.error("no public address found for " + local)
             return None
 
     def p2p_state_finish(self, relay):
+        self.p2p_scheduler.clear()
         self.p2p_public_sock.close()
         self.p2p_by_local  = { }
         self.p2p_by_public = { }
@@ -571,14 +635,18 @@ class proxies(QtCore.QObject):
         self.p2p_public_sock = QtNetwork.QUdpSocket(self)
         if not self.p2p_public_sock.bind(QtNetwork.QHostAddress.Any, self.client.gamePort):
             self.__logger.error("cannot bind to port %i" % self.client.gamePort)
-            errored = True
         self.p2p_public_sock.readyRead.connect(self.p2p_read_public)
+        self.p2p_local_game_port = self.client.gamePort + 1
         self.p2p_by_public = {}
         self.p2p_by_local  = {}
         self.p2p_game_launched = 0
         self.p2p_bottleneck_ = 0
         self.p2p_proxy_enable = 1
         self.p2p_want_dump_state = 0
+        self.p2p_state_debug_timestamp = time.time()
+        self.p2p_scheduler.clear()
+        self.p2p_scheduler.call_later(P2P_CHECK_INTERVAL, self.p2p_check_peers)
+        self.p2p_scheduler.call_later(P2P_DUMP_INTERVAL, self.p2p_dump_state)
 
     def releaseSocket(self, port):
         self.proxiesDestination[port] = None
@@ -23,13 +23,29 @@ import logging
 import json
 from config import Settings
 
+import gpgnet
+
 import struct
 
 FAF_SERVER_HOST = Settings.get('HOST', 'RELAY_SERVER')
 FAF_SERVER_PORT = Settings.get('PORT', 'RELAY_SERVER')
 
+_jsonEncoder = json.JSONEncoder()
+_blockHeader = struct.Struct(">II")
+
+
+def frameForServer(message):
+    '''
+    Frames a message the way QDataStream (Qt_4_2) writes a uint32 block size followed by a QString
+    '''
+    payload = _jsonEncoder.encode(message).encode("utf-16-be")
+    return _blockHeader.pack(len(payload) + 4, len(payload)) + payload
+
 
 class Packet():
+    '''
+    Reference GPGNet encoder, superseded by fa.gpgnet.encode / encode_udp which produce the same bytes.
+    '''
     def __init__(self, header=None , data=None, *values, **kwvalues):
         
         self._data = data  
@@ -115,18 +131,16 @@ class Relayer(QtCore.QObject):
 
         # for unpacking FA protocol
         self.blockSizeFromServer = 0
-        self.headerSizeRead = False
-        self.headerRead = False
-        self.chunkSizeRead = False
-        self.fieldTypeRead = False
-        self.fieldSizeRead = False
-        self.blockSize = 0
-        self.fieldSize = 0
-        self.chunkSize = 0
-        self.fieldType = 0
-        self.chunks = []
+        self.decoder = gpgnet.Decoder()
 
         self.pingTimer = None
+
+        # Messages for the server are framed right away, but written in one go per event loop pass
+        self.outgoing = []
+        self.flushPending = False
+        self.messagesSent = 0
+        self.bytesSent = 0
+        self.flushes = 0
         
         #self.inputSocket.setSocketOption(QtNetwork.QTcpSocket.KeepAliveOption, 1)
         self.inputSocket.readyRead.connect(self.readData)
@@ -183,89 +197,13 @@ class Relayer(QtCore.QObject):
         if self.inputSocket.bytesAvailable() == 0 :
             self.__logger.info("data reception read done - too or not enough data")
             return
-        
-        ins = QtCore.QDataStream(self.inputSocket)
-        ins.setByteOrder(QtCore.QDataStream.LittleEndian)  
 
-        while ins.atEnd() == False :
-            if self.inputSocket.isValid() :
-                if self.headerSizeRead == False :
-                    if self.inputSocket.bytesAvailable() < 4:
-                        return
-                
-                    self.blockSize = ins.readUInt32()
-                    self.headerSizeRead = True
-                    
-                if self.headerRead == False :
-                
-                    if self.inputSocket.bytesAvailable() < self.blockSize :
-                        return
-                
-                    self.action = ins.readRawData(self.blockSize)
-                    self.headerRead = True
-                    
-                if self.chunkSizeRead == False :
-                    if self.inputSocket.bytesAvailable() < 4:
-                        return
-                
-                    self.chunkSize = ins.readInt32()
-                    self.chunks = []
-                    self.chunkSizeRead = True
-                
-                if self.chunkSize > 100 :
-                    self.__logger.info("Big error reading FA datas !")
-                    self.inputSocket.readAll()
-                    self.fieldSize = 0
-                    self.blockSize = 0
-                    self.chunkSize = 0  
-                    self.noSocket = True                         
-                    return
-                
-                for _ in range(len(self.chunks), self.chunkSize):
-                    if self.fieldTypeRead == False :
-                        if self.inputSocket.bytesAvailable() < 1 :
-                            return
-                                
-                        self.fieldType = ins.readBool()
-                        self.fieldTypeRead = True
-                    
-                    if not self.fieldType :
-                     
-                        if self.inputSocket.bytesAvailable() < 4 :
-                            return
-                        number = ins.readInt32()
-                        self.chunks.append(number)
-                        self.fieldTypeRead = False         
+        for action, chunks in self.decoder.feed(self.inputSocket.readAll().data()):
+            if not self.testing:
+                self.sendToServer(action, chunks)
+            else:
+                self.sendToLocal(action, chunks)
 
-                    else :
-                        if self.fieldSizeRead == False :      
-                            if self.inputSocket.bytesAvailable() < 4 :
-                                return  
-                              
-                            self.fieldSize =  ins.readInt32()
-                            self.fieldSizeRead = True
-                
-                        if self.inputSocket.bytesAvailable() < self.fieldSize :
-                            return
-
-                        datastring = ins.readRawData(self.fieldSize)
-                        fixedStr = datastring.replace("/t","\t").replace("/n","\n")
-                        self.chunks.append(fixedStr)               
-                        self.fieldTypeRead = False
-                        self.fieldSizeRead = False  
-      
-                if not self.testing:
-                    self.sendToServer(self.action, self.chunks)
-                else:
-                    self.sendToLocal(self.action, self.chunks)
-                self.action = None
-                self.chunks = []
-                self.headerSizeRead = False
-                self.headerRead = False
-                self.chunkSizeRead = False
-                self.fieldTypeRead = False
-                self.fieldSizeRead = False
-                
     def ping(self):
         self.sendToServer("ping", [])
 
@@ -273,20 +211,17 @@ class Relayer(QtCore.QObject):
         if action == 'GameState':
             if chunks[0] == 'Idle':
                 self.client.proxyServer.setUid(1)
-                reply = Packet("CreateLobby", [0, 0, "FAF Local Mode", 0, 1])
-                self.inputSocket.write(reply.Pack())
+                self.inputSocket.write(gpgnet.encode("CreateLobby", [0, 0, "FAF Local Mode", 0, 1]))
 
             elif chunks[0] == 'Lobby':
-                reply = Packet("HostGame", ["SCMP_007"])
-                self.inputSocket.write(reply.Pack())
+                self.inputSocket.write(gpgnet.encode("HostGame", ["SCMP_007"]))
                 if self.testing == True:
                     self.client.proxyServer.testingProxy()
                     for i in range(len(self.client.proxyServer.proxies)):
                         udpport = self.client.proxyServer.bindSocket(i, 1)
                         self.__logger.info("Asking to send data on proxy port %i" % udpport)
                         acts = [("127.0.0.1:%i" % udpport), "port %i" % udpport, udpport]
-                        reply = Packet("ConnectToPeer", acts)
-                        self.inputSocket.write(reply.Pack())
+                        self.inputSocket.write(gpgnet.encode("ConnectToPeer", acts))
                 else:
                     self.client.proxyServer.stopTesting()                    
 
@@ -309,23 +244,34 @@ class Relayer(QtCore.QObject):
             elif action == "BottleneckCleared":
                 self.client.proxyServer.p2p_bottleneck_cleared()
 
-        data = json.dumps(dict(action=action, chuncks=chunks))
+        message = dict(action=action, chuncks=chunks)
         # Relay to faforever.com
         if self.relaySocket.isOpen():
             if action != "ping" and action != "pong" :
-                self.__logger.info("Command transmitted from FA to server : " + data)
-            
-            block = QtCore.QByteArray()
-            out = QtCore.QDataStream(block, QtCore.QIODevice.ReadWrite)
-            out.setVersion(QtCore.QDataStream.Qt_4_2)
-            out.writeUInt32(0)
-            out.writeQString(data)
-            out.device().seek(0)        
-            out.writeUInt32(block.size() - 4)
-            self.bytesToSend = block.size() - 4
-            self.relaySocket.writeData(block)
+                self.__logger.debug("Command transmitted from FA to server : %s", message)
+
+            self.outgoing.append(frameForServer(message))
+            self.messagesSent += 1
+            if not self.flushPending:
+                self.flushPending = True
+                QtCore.QTimer.singleShot(0, self.flush)
         else :
-            self.__logger.warn("Error transmitting datas to server : " + data)
+            self.__logger.warn("Error transmitting datas to server : %s", message)
+
+    @QtCore.pyqtSlot()
+    def flush(self):
+        ''' Writes all messages queued by sendToServer since the last flush in a single socket write '''
+        self.flushPending = False
+        if not self.outgoing:
+            return
+        block = "".join(self.outgoing)
+        self.outgoing = []
+        if self.relaySocket.isOpen():
+            self.relaySocket.write(block)
+            self.bytesSent += len(block)
+            self.flushes += 1
+        else:
+            self.__logger.warn("Error transmitting %i bytes to server, relay socket closed", len(block))
 
     def handleAction(self, commands):    
         key = commands["key"]
@@ -337,8 +283,7 @@ class Relayer(QtCore.QObject):
         elif key == "SendNatPacket" :
             if self.p2p_proxy_enable:
                 acts[0] = self.client.proxyServer.p2p_translate_to_local(acts[0], self)
-            reply = Packet(key, acts)
-            self.inputSocket.write(reply.PackUdp())
+            self.inputSocket.write(gpgnet.encode_udp(key, acts))
 
         elif key == "P2PReconnect" :
             # notify p2p proxy of new relay
@@ -350,16 +295,14 @@ class Relayer(QtCore.QObject):
             peeruid = int(acts[2])
             acts[0] = self.client.proxyServer.p2p_translate_to_local(acts[0], self)
             self.client.proxyServer.p2p_set_uid_for_peer(peer_real_addr, peeruid)
-            reply = Packet(key, acts)
-            self.inputSocket.write(reply.Pack())
+            self.inputSocket.write(gpgnet.encode(key, acts))
 
         elif self.p2p_proxy_enable and key == "ConnectToPeer" :
             peer_real_addr = acts[0]
             peeruid = int(acts[2])
             acts[0] = self.client.proxyServer.p2p_translate_to_local(acts[0], self)
             self.client.proxyServer.p2p_set_uid_for_peer(peer_real_addr, peeruid)
-            reply = Packet(key, acts)
-            self.inputSocket.write(reply.Pack())
+            self.inputSocket.write(gpgnet.encode(key, acts))
 
         elif key == "CreateLobby":
             uid = int(acts[3])     
@@ -367,8 +310,7 @@ class Relayer(QtCore.QObject):
             self.__logger.info("Setting uid : " + str(uid))
             if self.p2p_proxy_enable:
                 acts[1] = self.client.gamePort + 1
-            reply = Packet(key, acts)
-            self.inputSocket.write(reply.Pack())
+            self.inputSocket.write(gpgnet.encode(key, acts))
             
             
         elif key == "ConnectToProxy" :
@@ -379,8 +321,7 @@ class Relayer(QtCore.QObject):
                 
                 newActs = [("127.0.0.1:%i" % udpport), login, uid]
                 
-                reply = Packet("ConnectToPeer", newActs)
-                self.inputSocket.write(reply.Pack())
+                self.inputSocket.write(gpgnet.encode("ConnectToPeer", newActs))
                 
         elif key == "JoinProxy" :
             port = acts[0]
@@ -390,12 +331,10 @@ class Relayer(QtCore.QObject):
             
             newActs = [("127.0.0.1:%i" % udpport), login, uid]
             
-            reply = Packet("JoinGame", newActs)
-            self.inputSocket.write(reply.Pack())                
+            self.inputSocket.write(gpgnet.encode("JoinGame", newActs))                
             
         else :
-            reply = Packet(key, acts)
-            self.inputSocket.write(reply.Pack())
+            self.inputSocket.write(gpgnet.encode(key, acts))
 
     def done(self):
         self.__logger.info("remove relay")
@@ -408,6 +347,8 @@ class Relayer(QtCore.QObject):
     def inputDisconnected(self):
         self.__logger.info("FA disconnected locally.")
         self.client.proxyServer.closeSocket()
+        self.flush()
+        self.__logger.info("relayed %i messages (%i bytes) to the server in %i writes", self.messagesSent, self.bytesSent, self.flushes)
         self.relaySocket.disconnectFromHost()
         if self.pingTimer :
             self.pingTimer.stop()
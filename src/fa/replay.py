@@ -22,6 +22,7 @@ from PyQt4 import QtCore, QtGui
 import fa
 from fa.check import check
 from fa.replayparser import replayParser
+from fa.FAFReplayReader import FAFReplayReader, isBinaryFAFReplay
 import util
 import mods
 
@@ -46,24 +47,35 @@ def replay(source, detach=False):
         if isinstance(source, basestring):
             if os.path.isfile(source):
                 if source.endswith(".fafreplay"):  # the new way of doing things
-                    replay = open(source, "rt")
-                    info = json.loads(replay.readline())
+                    scfa_replay = QtCore.QFile(os.path.join(util.CACHE_DIR, "temp.scfareplay"))
+                    scfa_replay.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Truncate)
 
-                    binary = QtCore.qUncompress(QtCore.QByteArray.fromBase64(replay.read()))
-                    logger.info("Extracted " + str(binary.size()) + " bytes of binary data from .fafreplay.")
-                    replay.close()
+                    if isBinaryFAFReplay(source):
+                        # Binary format, as recorded by the client itself
+                        replay = QtCore.QFile(source)
+                        replay.open(QtCore.QIODevice.ReadOnly)
+                        reader = FAFReplayReader(replay)
+                        size = reader.extract(scfa_replay)
+                        info = reader.header if size else {}
+                        reader.close()
+                    else:
+                        replay = open(source, "rt")
+                        info = json.loads(replay.readline())
 
-                    if binary.size() == 0:
-                        logger.info("Invalid replay")
-                        QtGui.QMessageBox.critical(None, "FA Forever Replay", "Sorry, this replay is corrupted.")
-                        return False
+                        binary = QtCore.qUncompress(QtCore.QByteArray.fromBase64(replay.read()))
+                        replay.close()
+                        size = binary.size()
+                        scfa_replay.write(binary)
 
-                    scfa_replay = QtCore.QFile(os.path.join(util.CACHE_DIR, "temp.scfareplay"))
-                    scfa_replay.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Truncate)
-                    scfa_replay.write(binary)
+                    logger.info("Extracted " + str(size) + " bytes of binary data from .fafreplay.")
                     scfa_replay.flush()
                     scfa_replay.close()
 
+                    if size == 0:
+                        logger.info("Invalid replay")
+                        QtGui.QMessageBox.critical(None, "FA Forever Replay", "Sorry, this replay is corrupted.")
+                        return False
+
                     mapname = info.get('mapname', None)
                     mod = info['featured_mod']
                     replay_id = info['uid']
@@ -20,35 +20,18 @@
 
 
 
-import struct
+from fa.scfareplay import read_version
+
+# The version line is the first thing in the file, this is plenty to find its end
+VERSION_READ_SIZE = 256
 
 class replayParser:
     def __init__(self, filepath):
         self.file = filepath
-    
-    def __readLine(self, offset, bin):
-        line = ''
-        while True :
-            
-            char = struct.unpack("s", bin[offset:offset+1])
-    
-            offset = offset + 1
-            if char[0] == '\r' :
-                #offset = offset + 2
-                break
-            elif char[0] == '\x00' :
-                #offset = offset + 3
-                break
-            else :
-                line = line + char[0]
-        return offset, line
-        
+
     def getVersion(self):
-        f = open(self.file, 'rb')
-        bin = f.read() 
-        offset= 0
-        offset, supcomVersion = self.__readLine(offset, bin)  
-        f.close()
+        with open(self.file, 'rb') as f:
+            supcomVersion = read_version(f.read(VERSION_READ_SIZE))
         if (supcomVersion.startswith("Supreme Commander v1") == False) :     
             return None
         else :
@@ -30,6 +30,7 @@ import json
 import time
 
 from config import Settings
+from fa.FAFReplayWriter import FAFReplayWriter, PREFIX, rewriteHeader
 
 INTERNET_REPLAY_SERVER_HOST = Settings.get('HOST', 'ONLINE_REPLAY_SERVER')
 INTERNET_REPLAY_SERVER_PORT = Settings.get('PORT', 'ONLINE_REPLAY_SERVER')
@@ -37,10 +38,18 @@ INTERNET_REPLAY_SERVER_PORT = Settings.get('PORT', 'ONLINE_REPLAY_SERVER')
 from . import DEFAULT_LIVE_REPLAY
 from . import DEFAULT_RECORD_REPLAY
 
+# Live replays are streamed into <name>.fafreplay.part files in util.REPLAY_DIR, and flushed every so often
+REPLAY_PART_SUFFIX = ".part"
+REPLAY_SYNC_INTERVAL = 1024 * 1024
+
 class ReplayRecorder(QtCore.QObject): 
     """
     This is a simple class that takes all the FA replay data input from its inputSocket, writes it to a file,
     and relays it to an internet server via its relaySocket.
+
+    The replay is compressed into a .part file as it arrives, so memory use doesn't grow with game length.
+    When FA disconnects, the final metadata is written in front of the compressed data and the file
+    renamed into place. If the client dies mid-game, ReplayServer picks up the .part file on the next start.
     """
     __logger = logging.getLogger(__name__)
 
@@ -55,8 +64,13 @@ class ReplayRecorder(QtCore.QObject):
         
               
         #Create a file to write the replay data into
-        self.replayData = QtCore.QByteArray()
         self.replayInfo = fa.instance.info
+        self.replayDataSize = 0
+        self.unsyncedSize = 0
+        self.replayFile = None
+        self.replayWriter = None
+        if util.settings.value("fa.record_replay", DEFAULT_RECORD_REPLAY, type=bool):
+            self.startReplayFile()
                  
         # Open the relay socket to our server
         self.relaySocket = QtNetwork.QTcpSocket(self.parent)
@@ -77,34 +91,43 @@ class ReplayRecorder(QtCore.QObject):
         self.relaySocket.deleteLater()
            
                  
+    def startReplayFile(self):
+        filename = os.path.join(util.REPLAY_DIR, "live-%d.fafreplay%s" % (int(time.time() * 1000), REPLAY_PART_SUFFIX))
+        self.replayFile = QtCore.QFile(filename)
+        if not self.replayFile.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Truncate):
+            self.__logger.error("Can't record replay into " + filename)
+            self.replayFile = None
+            return
+        self.replayWriter = FAFReplayWriter(self.replayFile)
+        self.replayWriter.writeHeader(dict(self.replayInfo or {}))
+        self.__logger.info("Recording replay into " + filename)
+
     def readDatas(self):        
         read = self.inputSocket.read(self.inputSocket.bytesAvailable()) #CAVEAT: readAll() was seemingly truncating data here
         
         if not isinstance(read, basestring):
             self.__logger.warning("Read failure on inputSocket: " + str(bytes))
             return
-        
-        #Convert data into a bytearray for easier processing
-        datas = QtCore.QByteArray(read)
-        
-        # Record locally
-        if self.replayData.isEmpty():
-            #This prefix means "P"osting replay in the livereplay protocol of FA, this needs to be stripped from the local file            
-            if datas.startsWith("P/"):    
-                rest = datas.indexOf("\x00") + 1
-                self.__logger.info("Stripping prefix '" + str(datas.left(rest)) + "' from replay.")
-                self.replayData.append(datas.right(datas.size() - rest))
-            else:
-                self.replayData.append(datas)                
-        else:
-            #Write to buffer
-            self.replayData.append(datas)
 
         # Relay to faforever.com
         if self.relaySocket.isOpen():
-            self.relaySocket.write(datas)
-        
+            self.relaySocket.write(read)
+
+        # Record locally
+        if self.replayDataSize == 0:
+            #This prefix means "P"osting replay in the livereplay protocol of FA, this needs to be stripped from the local file            
+            if read.startswith("P/"):
+                rest = read.find("\x00") + 1
+                self.__logger.info("Stripping prefix '" + read[:rest] + "' from replay.")
+                read = read[rest:]
 
+        self.replayDataSize += len(read)
+        if self.replayWriter:
+            self.replayWriter.write(read)
+            self.unsyncedSize += len(read)
+            if self.unsyncedSize >= REPLAY_SYNC_INTERVAL:
+                self.replayWriter.sync()
+                self.unsyncedSize = 0
 
     def done(self):
         self.__logger.info("closing replay file")
@@ -134,34 +157,81 @@ class ReplayRecorder(QtCore.QObject):
 
         self.relaySocket.disconnectFromHost()
         
-        if settings.value("fa.record_replay", DEFAULT_RECORD_REPLAY, type=bool):
+        if self.replayWriter:
             self.writeReplayFile()
         
         self.done()
 
 
     def writeReplayFile(self):
+        self.replayWriter.close()
+        self.replayFile.close()
+        partname = self.replayFile.fileName()
+
+        if not self.replayWriter.hasSCFAHeader():
+            self.__logger.warn("No replay data received, discarding " + partname)
+            self.replayFile.remove()
+            return
+
         # Update info block if possible.
-        if fa.instance.info and fa.instance.info['uid'] == self.replayInfo['uid']:
+        if fa.instance.info and (not self.replayInfo or fa.instance.info['uid'] == self.replayInfo.get('uid')):
             if fa.instance.info.setdefault('complete', False):
                 self.__logger.info("Found Complete Replay Info")
             else:
                 self.__logger.warn("Replay Info not Complete")
             
             self.replayInfo = fa.instance.info
-                 
+
+        # Without any game info (the header in the .part file is {} then), the replay keeps its live- name
+        self.replayInfo = self.replayInfo or {}
         self.replayInfo['game_end'] = time.time()
         
-        filename = os.path.join(util.REPLAY_DIR, str(self.replayInfo['uid']) + "-" + self.replayInfo['recorder'] + ".fafreplay")
-        self.__logger.info("Writing local replay as " + filename + ", containing " + str(self.replayData.size()) + " bytes of replay data.")
-               
-        replay  = QtCore.QFile(filename)
-        replay.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Text)
-        replay.write(json.dumps(self.replayInfo))
-        replay.write('\n')
-        replay.write(QtCore.qCompress(self.replayData).toBase64())
-        replay.close()
-        
+        if 'uid' in self.replayInfo and 'recorder' in self.replayInfo:
+            filename = os.path.join(util.REPLAY_DIR, str(self.replayInfo['uid']) + "-" + self.replayInfo['recorder'] + ".fafreplay")
+        else:
+            filename = partname[:-len(REPLAY_PART_SUFFIX)]
+        self.__logger.info("Writing local replay as " + filename + ", containing " + str(self.replayDataSize) + " bytes of replay data.")
+
+        if finalizeReplayFile(partname, filename, self.replayInfo):
+            QtCore.QFile.remove(partname)
+
+
+def finalizeReplayFile(partname, filename, info):
+    '''
+    Writes the replay recorded in partname to filename, with info as its header.
+    The new file is only moved into place once it's complete.
+    '''
+    source = QtCore.QFile(partname)
+    target = QtCore.QFile(filename + REPLAY_PART_SUFFIX + "2")
+    if not source.open(QtCore.QIODevice.ReadOnly) or not target.open(QtCore.QIODevice.WriteOnly | QtCore.QIODevice.Truncate):
+        logging.getLogger(__name__).error("Can't finalize replay " + partname)
+        return False
+    rewriteHeader(source, target, info)
+    source.close()
+    target.close()
+
+    if QtCore.QFile.exists(filename):
+        QtCore.QFile.remove(filename)
+    return target.rename(filename)
+
+
+def recoverReplayFiles():
+    '''
+    Turns replays left behind by a client that died mid-game into regular (incomplete) replays
+    '''
+    for infile in os.listdir(util.REPLAY_DIR):
+        if infile.endswith(".fafreplay" + REPLAY_PART_SUFFIX):
+            partname = os.path.join(util.REPLAY_DIR, infile)
+            try:
+                if os.path.getsize(partname) <= PREFIX.size:
+                    # FA died before sending the SCFA header, nothing worth keeping
+                    os.remove(partname)
+                else:
+                    logging.getLogger(__name__).warn("Recovering interrupted replay " + partname)
+                    os.rename(partname, partname[:-len(REPLAY_PART_SUFFIX)])
+            except OSError:
+                logging.getLogger(__name__).exception("Can't recover " + partname)
+
 
 class ReplayServer(QtNetwork.QTcpServer):
     """
@@ -176,6 +246,7 @@ class ReplayServer(QtNetwork.QTcpServer):
         self.client = client                
         self.__logger.debug("initializing...")
         self.newConnection.connect(self.acceptConnection)
+        recoverReplayFiles()
         
         
     def doListen(self,local_port):
@@ -0,0 +1,227 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+Parser for SCFA replays (.scfareplay, or the data inside a .fafreplay).
+
+A replay is a header (engine version, map, mods, scenario, command sources, armies, random seed)
+followed by a stream of operations: a type byte, a little endian uint16 size that includes these
+3 bytes, and the payload. Ticks advance with OP_ADVANCE, and OP_SET_COMMAND_SOURCE says which
+player the following operations come from.
+
+Like gpgnet, this module doesn't depend on Qt.
+'''
+
+import collections
+import struct
+
+OP_ADVANCE = 0
+OP_SET_COMMAND_SOURCE = 1
+OP_COMMAND_SOURCE_TERMINATED = 2
+OP_VERIFY_CHECKSUM = 3
+OP_REQUEST_PAUSE = 4
+OP_RESUME = 5
+OP_SINGLE_STEP = 6
+OP_CREATE_UNIT = 7
+OP_CREATE_PROP = 8
+OP_DESTROY_ENTITY = 9
+OP_WARP_ENTITY = 10
+OP_PROCESS_INFO_PAIR = 11
+OP_ISSUE_COMMAND = 12
+OP_ISSUE_FACTORY_COMMAND = 13
+OP_INCREASE_COMMAND_COUNT = 14
+OP_DECREASE_COMMAND_COUNT = 15
+OP_SET_COMMAND_TARGET = 16
+OP_SET_COMMAND_TYPE = 17
+OP_SET_COMMAND_CELLS = 18
+OP_REMOVE_COMMAND_FROM_QUEUE = 19
+OP_DEBUG_COMMAND = 20
+OP_EXECUTE_LUA_IN_SIM = 21
+OP_LUA_SIM_CALLBACK = 22
+OP_END_GAME = 23
+
+# Operations counted as player actions for APM
+ACTION_OPS = frozenset([OP_ISSUE_COMMAND, OP_ISSUE_FACTORY_COMMAND, OP_INCREASE_COMMAND_COUNT,
+                        OP_DECREASE_COMMAND_COUNT, OP_SET_COMMAND_TARGET, OP_SET_COMMAND_TYPE,
+                        OP_SET_COMMAND_CELLS, OP_REMOVE_COMMAND_FROM_QUEUE, OP_EXECUTE_LUA_IN_SIM,
+                        OP_LUA_SIM_CALLBACK])
+
+TICKS_PER_SECOND = 10
+
+_OP_HEADER = struct.Struct('<BH')
+_UINT32 = struct.Struct('<I')
+_CHECKSUM = struct.Struct('<16sI')
+
+# type: one of the OP_ constants. tick: tick count when the operation ran. source: current command source.
+# data: the tick count for OP_ADVANCE, the source for OP_SET_COMMAND_SOURCE, (hex md5, tick) for
+# OP_VERIFY_CHECKSUM, otherwise the raw payload as a memoryview.
+Operation = collections.namedtuple('Operation', 'type tick source data')
+
+Header = collections.namedtuple('Header', 'version replay_version map mods scenario sources cheats armies seed size')
+
+
+class Incomplete(Exception):
+    ''' The data ends before the header does '''
+    pass
+
+
+def _read_str(data, pos):
+    end = data.find('\0', pos)
+    if end < 0:
+        raise Incomplete()
+    return data[pos:end], end + 1
+
+
+def _read_uint32(data, pos):
+    if len(data) - pos < 4:
+        raise Incomplete()
+    return _UINT32.unpack_from(data, pos)[0], pos + 4
+
+
+def _read_uint8(data, pos):
+    if len(data) <= pos:
+        raise Incomplete()
+    return ord(data[pos]), pos + 1
+
+
+def _read_blob(data, pos):
+    size, pos = _read_uint32(data, pos)
+    if len(data) - pos < size:
+        raise Incomplete()
+    return data[pos:pos + size], pos + size
+
+
+def parse_header(data):
+    '''
+    Parses the header at the start of data (a str). Raises Incomplete if it doesn't hold the whole
+    header yet. Header.size is where the operations start.
+    '''
+    version, pos = _read_str(data, 0)
+    _, pos = _read_str(data, pos)
+    replay_version, pos = _read_str(data, pos)  # Replay v1.9\r\n/maps/Map/File.scmap
+    _, pos = _read_str(data, pos)
+    replay_version, _, scmap = replay_version.partition("\r\n")
+
+    mods, pos = _read_blob(data, pos)
+    scenario, pos = _read_blob(data, pos)
+
+    count, pos = _read_uint8(data, pos)
+    sources = []
+    for _ in xrange(count):
+        name, pos = _read_str(data, pos)
+        _, pos = _read_uint32(data, pos)  # timeouts remaining
+        sources.append(name)
+
+    cheats, pos = _read_uint8(data, pos)
+
+    count, pos = _read_uint8(data, pos)
+    armies = []
+    for _ in xrange(count):
+        army, pos = _read_blob(data, pos)
+        source, pos = _read_uint8(data, pos)
+        _, pos = _read_uint8(data, pos)
+        armies.append((army, source))
+
+    seed, pos = _read_uint32(data, pos)
+    return Header(version, replay_version, scmap, mods, scenario, sources, bool(cheats), armies, seed, pos)
+
+
+def read_version(data):
+    ''' Returns the engine version line ("Supreme Commander v1.50.3599") at the start of data '''
+    end = len(data)
+    for sep in ('\r', '\0'):
+        found = data.find(sep, 0, end)
+        if found >= 0:
+            end = found
+    return data[:end]
+
+
+def operations(data, pos=0, tick=0, source=None):
+    '''
+    Generator over the operations in data (anything supporting the buffer interface) from pos on.
+    Parsing a chunk from the middle of a replay (e.g. after FAFReplayReader.seekTick()) works by
+    passing the tick it starts at. A truncated last operation is dropped.
+    '''
+    view = memoryview(data)
+    end = len(view)
+    unpack_header = _OP_HEADER.unpack_from
+    unpack_uint32 = _UINT32.unpack_from
+    while end - pos >= 3:
+        op, size = unpack_header(view, pos)
+        if size < 3 or end - pos < size:
+            return
+        if op == OP_ADVANCE:
+            ticks = unpack_uint32(view, pos + 3)[0]
+            yield Operation(op, tick, source, ticks)
+            tick += ticks
+        elif op == OP_SET_COMMAND_SOURCE:
+            source = ord(view[pos + 3])
+            yield Operation(op, tick, source, source)
+        elif op == OP_VERIFY_CHECKSUM:
+            checksum, checked_tick = _CHECKSUM.unpack_from(view, pos + 3)
+            yield Operation(op, tick, source, (checksum.encode("hex"), checked_tick))
+        else:
+            yield Operation(op, tick, source, view[pos + 3:pos + size])
+        pos += size
+
+
+class ReplayStats(object):
+    '''
+    Game length, actions per command source and desyncs of a replay, gathered in one pass
+    over its operations.
+    '''
+    def __init__(self):
+        self.ticks = 0
+        self.source = None
+        self.actions = collections.Counter()
+        self.checksums = {}
+        self.desyncs = []
+        self.ended = False
+
+    def feed(self, data, pos=0):
+        ''' Can be called repeatedly with consecutive pieces of the operation stream, each ending on an operation boundary '''
+        actions = self.actions
+        checksums = self.checksums
+        for op in operations(data, pos, self.ticks, self.source):
+            if op.type in ACTION_OPS:
+                actions[op.source] += 1
+            elif op.type == OP_ADVANCE:
+                self.ticks = op.tick + op.data
+            elif op.type == OP_SET_COMMAND_SOURCE:
+                self.source = op.source
+            elif op.type == OP_VERIFY_CHECKSUM:
+                checksum, tick = op.data
+                if checksums.setdefault(tick, checksum) != checksum and (not self.desyncs or self.desyncs[-1] != tick):
+                    self.desyncs.append(tick)
+            elif op.type == OP_END_GAME:
+                self.ended = True
+        return self
+
+    @property
+    def seconds(self):
+        return self.ticks / float(TICKS_PER_SECOND)
+
+    def apm(self, source):
+        if not self.ticks:
+            return 0.0
+        return self.actions[source] * 60.0 / self.seconds
+
+
+def stats(data):
+    ''' Parses a whole SCFA replay (header and operations) into ReplayStats '''
+    return ReplayStats().feed(data, parse_header(data).size)
@@ -0,0 +1,97 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+from PyQt4 import QtCore
+
+import heapq
+import itertools
+import logging
+import time
+
+
+class DeadlineScheduler(QtCore.QObject):
+    '''
+    Runs callbacks once their deadline has passed. All pending deadlines share a single
+    single-shot QTimer armed for the earliest one, so nothing runs (and no clock is read)
+    between deadlines.
+    '''
+    __logger = logging.getLogger(__name__)
+
+    def __init__(self, parent=None, clock=time.time):
+        QtCore.QObject.__init__(self, parent)
+        self.clock = clock
+        self.heap = []
+        self.counter = itertools.count()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.fire)
+
+    def call_at(self, deadline, callback, *args):
+        ''' Returns a handle that can be passed to cancel() '''
+        entry = [deadline, next(self.counter), callback, args]
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.rearm()
+        return entry
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def cancel(self, entry):
+        # Cancelled entries stay in the heap and are skipped when they come due
+        entry[2] = None
+
+    def clear(self):
+        self.heap = []
+        self.timer.stop()
+
+    def __len__(self):
+        return sum(1 for entry in self.heap if entry[2] is not None)
+
+    def run_due(self, now=None):
+        ''' Runs all callbacks whose deadline is at or before now, returns how many ran '''
+        if now is None:
+            now = self.clock()
+        ran = 0
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            _, _, callback, args = heapq.heappop(heap)
+            if callback is None:
+                continue
+            try:
+                callback(*args)
+            except:
+                self.__logger.exception("scheduled callback failed")
+            ran += 1
+        return ran
+
+    @QtCore.pyqtSlot()
+    def fire(self):
+        self.run_due()
+        self.rearm()
+
+    def rearm(self):
+        heap = self.heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if heap:
+            self.timer.start(max(0, int((heap[0][0] - self.clock()) * 1000)))
+        else:
+            self.timer.stop()
@@ -30,18 +30,17 @@ patched, and all required files for a given mod are installed
 """
 import os
 
+import struct
 import time
-import shutil
 from types import FloatType, IntType, ListType
 import logging
-import urllib2
 import sys
-import tempfile
 import json
 
 from PyQt4 import QtGui, QtCore, QtNetwork
 
 import fa.path
+from fa.manifest import HashManifest
 import util
 import modvault
 
@@ -53,6 +52,16 @@ logger = logging.getLogger(__name__)
 # This contains a complete dump of everything that was supplied to logOutput
 debugLog = []
 
+# md5s of the files in the update directories, shared by all updaters
+_manifest = None
+
+
+def localManifest():
+    global _manifest
+    if _manifest is None:
+        _manifest = HashManifest(os.path.join(util.CACHE_DIR, "md5manifest.json"))
+    return _manifest
+
 
 FormClass, BaseClass = util.loadUiType("fa/updater/updater.ui")
 class UpdaterProgressDialog(FormClass, BaseClass):
@@ -99,17 +108,93 @@ def dumpHTML():
     return "<br/>".join(debugLog)
 
 
-# A set of exceptions we use to see what goes wrong during asynchronous data transfer waits
-class UpdaterCancellation(StandardError):
-    pass
+# SEND_FILE blocks are written to disk as they arrive, in chunks of up to this many bytes
+RECEIVE_CHUNK_SIZE = 1024 * 1024
 
+# The SEND_FILE header (action, path, file name and size) is expected within this many bytes of the block
+HEADER_PEEK_SIZE = 4096
 
-class UpdaterFailure(StandardError):
-    pass
 
+def _readQString(data, offset):
+    """
+    Reads a QString as QDataStream writes it from data at offset. Returns it and the offset after it, or None if data ends first.
+    """
+    if len(data) < offset + 4:
+        return None
+    length, = struct.unpack(">I", data[offset:offset + 4])
+    offset += 4
+    if length == 0xFFFFFFFF:
+        return u"", offset
+    if len(data) < offset + length:
+        return None
+    return data[offset:offset + length].decode("utf-16-be"), offset + length
+
+
+def sendFileHeader(data):
+    """
+    Reads the header of a SEND_FILE block from the start of data (the block, after its size).
+    Returns (path, fileToCopy, size, headerSize), None if data ends before the header does,
+    or False if the block is something else.
+    """
+    read = _readQString(data, 0)
+    if read is None:
+        return None
+    action, offset = read
+    if action != "SEND_FILE":
+        return False
+
+    path = _readQString(data, offset)
+    if path is None:
+        return None
+    fileToCopy = _readQString(data, path[1])
+    if fileToCopy is None or len(data) < fileToCopy[1] + 4:
+        return None
+    size, = struct.unpack(">i", data[fileToCopy[1]:fileToCopy[1] + 4])
+    return path[0], fileToCopy[0], size, fileToCopy[1] + 4
+
+
+class IncomingFile(object):
+    """
+    A file the update server is sending. It's written to a part file as it arrives, and only replaces
+    the old one once it's complete. If the part file can't be written, the data is skipped.
+    """
+    def __init__(self, directory, name, size):
+        self.directory = directory
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.partPath = self.path + ".part"
+        self.size = size
+        self.received = 0
+        try:
+            self.file = open(self.partPath, "wb")
+        except IOError:
+            self.file = None
+
+    @property
+    def remaining(self):
+        return self.size - self.received
+
+    def write(self, data):
+        self.received += len(data)
+        if self.file is not None:
+            self.file.write(data)
+
+    def commit(self):
+        """ Moves the complete file in place, returns False if it couldn't be written """
+        if self.file is None:
+            return False
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.partPath, self.path)
+        return True
+
+    def discard(self):
+        if self.file is None:
+            return
+        self.file.close()
+        os.remove(self.partPath)
 
-class UpdaterTimeout(StandardError):
-    pass
 
 
 def validateAndAdd(path, combobox):
@@ -142,12 +227,20 @@ def constructPathChoicesSC(combobox):
 class Updater(QtCore.QObject):
     """
     This is the class that does the actual installation work.
+
+    It's driven by the update server's answers: start() connects and returns right away, and
+    finished is emitted with the result once the update is over. run() waits for that.
     """
     # Network configuration
     SOCKET  = 9001
     HOST    = "lobby.faforever.com"
     TIMEOUT = 20  #seconds
 
+    # Sent to the server with HELLO. A server that knows them answers with the ones it supports
+    # (CAPABILITIES), older ones ignore HELLO. With UPDATE_MANIFEST, a whole file group is requested
+    # at once, otherwise each file is requested on its own.
+    CAPABILITIES = ["UPDATE_MANIFEST"]
+
     # Return codes to expect from run()
     RESULT_SUCCESS = 0  #Update successful
     RESULT_NONE = -1  #Update operation is still ongoing
@@ -157,6 +250,12 @@ class Updater(QtCore.QObject):
     RESULT_BUSY = 4  #Server is currently busy
     RESULT_PASS = 5  #User refuses to update by canceling the wizard
 
+    # Emitted once, with the result
+    finished = QtCore.pyqtSignal(int)
+
+    # md5s of the current file group (or the error that stopped hashing them), from the hashing thread
+    hashed = QtCore.pyqtSignal(object, object)
+
 
     def __init__(self, featured_mod, version=None, modversions=None, sim=False, silent=False, *args, **kwargs):
         """
@@ -167,8 +266,15 @@ class Updater(QtCore.QObject):
         self.path = fa.path.getGameFolderFA()
 
         self.filesToUpdate = []
+        self.fileGroups = []
+        self.filegroup = None
+        self.localPaths = {}
+        self.downloads = []
 
         self.lastData = time.time()
+        self.watchdog = QtCore.QTimer(self)
+        self.watchdog.setInterval(1000)
+        self.watchdog.timeout.connect(self.checkTimeout)
 
         self.featured_mod = featured_mod
         self.version = version
@@ -178,11 +284,14 @@ class Updater(QtCore.QObject):
         self.modpath = None
 
         self.blockSize = 0
+        self.incoming = None
+        self.capabilities = set()
         self.updateSocket = QtNetwork.QTcpSocket()
         self.updateSocket.setSocketOption(QtNetwork.QTcpSocket.KeepAliveOption, 1)
         self.updateSocket.setSocketOption(QtNetwork.QTcpSocket.LowDelayOption, 1)
 
         self.result = self.RESULT_NONE
+        self.done = False
 
         self.destination = None
 
@@ -200,280 +309,279 @@ class Updater(QtCore.QObject):
 
         self.bytesToSend = 0
 
+        self.hashed.connect(self.filesHashed)
+
 
     def run(self, *args, **kwargs):
+        """
+        Runs the update to the end in a local event loop, and returns the result.
+        """
+        loop = QtCore.QEventLoop()
+        self.finished.connect(loop.quit)
+        self.start()
+        if not self.done:
+            loop.exec_()
+        return self.result
+
+
+    def start(self):
         clearLog()
         log("Update started at " + timestamp())
         log("Using appdata: " + util.APPDATA_DIR)
 
         self.progress.show()
-        QtGui.QApplication.processEvents()
-
-
-        #Actual network code adapted from previous version
         self.progress.setLabelText("Connecting to update server...")
+        self.progress.canceled.connect(self.cancel)
+
+        self.updateSocket.connected.connect(self.connected)
         self.updateSocket.error.connect(self.handleServerError)
         self.updateSocket.readyRead.connect(self.readDataFromServer)
         self.updateSocket.disconnected.connect(self.disconnected)
         self.updateSocket.error.connect(self.errored)
 
+        self.lastData = time.time()
+        self.watchdog.start()
         self.updateSocket.connectToHost(self.HOST, self.SOCKET)
 
-        while not (self.updateSocket.state() == QtNetwork.QAbstractSocket.ConnectedState) and self.progress.isVisible():
-            QtGui.QApplication.processEvents()
 
-        if not self.progress.wasCanceled():
-            log("Connected to update server at " + timestamp())
+    @QtCore.pyqtSlot()
+    def connected(self):
+        log("Connected to update server at " + timestamp())
 
-            self.doUpdate()
+        if self.sim:
+            self.writeToServer("REQUEST_SIM_PATH", self.featured_mod)
+            return
 
-            self.progress.setLabelText("Cleaning up.")
-            self.updateSocket.close()
-            self.progress.close()
-        else:
-            log("Cancelled connecting to server.")
-            self.result = self.RESULT_CANCEL
+        #Prepare FAF directory & all necessary files
+        #self.prepareBinFAF() # removed for feature/new-patcher
 
-        log("Update finished at " + timestamp())
-        return self.result
+        # The server answers requests in order, so CAPABILITIES (if any) is here before the first file list
+        self.writeToServer("HELLO", json.dumps(self.CAPABILITIES))
 
-    def fetchFile(self, url, toFile):
-        try:
-            progress = QtGui.QProgressDialog()
-            progress.setCancelButtonText("Cancel")
-            progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
-            progress.setAutoClose(True)
-            progress.setAutoReset(False)
-
-            req = urllib2.Request(url, headers={'User-Agent': "FAF Client"})
-            downloadedfile = urllib2.urlopen(req)
-            meta = downloadedfile.info()
-
-            #Fix for #241, sometimes the server sends an error and no content-length.
-            file_size = int(meta.getheaders("Content-Length")[0])
-            progress.setMinimum(0)
-            progress.setMaximum(file_size)
-            progress.setModal(1)
-            progress.setWindowTitle("Downloading Update")
-            label = QtGui.QLabel()
-            label.setOpenExternalLinks(True)
-            progress.setLabel(label)
-            progress.setLabelText('Downloading FA file : <a href="' + url + '">' + url + '</a><br/>File size: ' + str(
-                int(file_size / 1024 / 1024)) + ' MiB')
-            progress.show()
-
-            #Download the file as a series of up to 4 KiB chunks, then uncompress it.
-
-            output = tempfile.NamedTemporaryFile(mode='w+b', delete=False)
-
-            file_size_dl = 0
-            block_sz = 4096
-
-            while progress.isVisible():
-                QtGui.QApplication.processEvents()
-                read_buffer = downloadedfile.read(block_sz)
-                if not read_buffer:
-                    break
-                file_size_dl += len(read_buffer)
-                output.write(read_buffer)
-                progress.setValue(file_size_dl)
-
-            output.flush()
-            os.fsync(output.fileno())
-            output.close()
-
-            shutil.move(output.name, toFile)
-
-            if (progress.value() == file_size) or progress.value() == -1:
-                logger.debug("File downloaded successfully.")
-                return True
-            else:
-                QtGui.QMessageBox.information(None, "Aborted", "Download not complete.")
-                logger.warn("File download not complete.")
-                return False
-        except:
-            logger.error("Updater error: ", exc_info=sys.exc_info())
-            QtGui.QMessageBox.information(None, "Download Failed",
-                                          "The file wasn't properly sent by the server. <br/><b>Try again later.</b>")
-            return False
+        #Update the mod if it's requested. bin/FAF and gamedata/FAFGAMEDATA were removed for feature/new-patcher
+        if self.featured_mod and self.featured_mod not in ("faf", "ladder1v1"):  #HACK - ladder1v1 "is" FAF. :-)
+            self.fileGroups = [("bin", self.featured_mod), ("gamedata", self.featured_mod + "Gamedata")]
+        self.nextFileGroup()
 
 
-    def updateFiles(self, destination, filegroup):
-        """
-        Updates the files in a given file group, in the destination subdirectory of the Forged Alliance path.
-        If existing=True, the existing contents of the directory will be added to the current self.filesToUpdate
-        list. 
-        """
-        QtGui.QApplication.processEvents()
+    def nextFileGroup(self):
+        if not self.fileGroups:
+            log("Updates applied successfully.")
+            self.finish(self.RESULT_SUCCESS)
+            return
 
-        self.progress.setLabelText("Updating files: " + filegroup)
-        self.destination = destination
+        destination, filegroup = self.fileGroups.pop(0)
+        self.updateFiles(destination, filegroup)
 
-        self.writeToServer("GET_FILES_TO_UPDATE", filegroup)
-        self.waitForFileList()
 
-        #Ensure our list is unique
-        self.filesToUpdate = list(set(self.filesToUpdate))
+    @QtCore.pyqtSlot()
+    def cancel(self):
+        if self.done:
+            return  # Closing the dialog cancels it too
+        log("CANCELLED: Operation aborted by the user.")
+        self.finish(self.RESULT_CANCEL)
 
-        targetdir = os.path.join(util.APPDATA_DIR, destination)
-        if not os.path.exists(targetdir):
-            os.makedirs(targetdir)
 
-        for fileToUpdate in self.filesToUpdate:
-            md5File = util.md5(os.path.join(util.APPDATA_DIR, destination, fileToUpdate))
-            if md5File == None:
-                if self.version:
-                    if self.featured_mod == "faf" or self.featured_mod == "ladder1v1" or filegroup == "FAF" or filegroup == "FAFGAMEDATA":
-                        self.writeToServer("REQUEST_VERSION", destination, fileToUpdate, str(self.version))
-                    else:
-                        self.writeToServer("REQUEST_MOD_VERSION", destination, fileToUpdate,
-                                           json.dumps(self.modversions))
-                else:
+    @QtCore.pyqtSlot()
+    def checkTimeout(self):
+        if time.time() - self.lastData > self.TIMEOUT:
+            log("TIMEOUT: No answer from the server in %d seconds." % self.TIMEOUT)
+            self.finish(self.RESULT_FAILURE)
 
-                    self.writeToServer("REQUEST_PATH", destination, fileToUpdate)
-            else:
-                if self.version:
-                    if self.featured_mod == "faf" or self.featured_mod == "ladder1v1" or filegroup == "FAF" or filegroup == "FAFGAMEDATA":
-                        self.writeToServer("PATCH_TO", destination, fileToUpdate, md5File, str(self.version))
-                    else:
 
-                        self.writeToServer("MOD_PATCH_TO", destination, fileToUpdate, md5File,
-                                           json.dumps(self.modversions))
-                else:
-                    self.writeToServer("UPDATE", destination, fileToUpdate, md5File)
+    def finish(self, result):
+        """
+        Ends the update (only the first call counts), tells the user what went wrong if anything did, and emits finished.
+        """
+        if self.done:
+            return
+        self.done = True
+        self.result = result
 
-        self.waitUntilFilesAreUpdated()
+        self.watchdog.stop()
+        for download in list(self.downloads):
+            download.abort()
+        if self.incoming is not None:
+            self.incoming.discard()
+            self.incoming = None
+        self.updateSocket.close()
 
+        #Hide progress dialog if it's still showing.
+        self.progress.close()
 
-    def waitForSimModPath(self):
+        # Integrated handlers for the various things that could go wrong
+        if self.result == self.RESULT_CANCEL:
+            pass  #The user knows damn well what happened here.
+        elif self.result == self.RESULT_PASS:
+            QtGui.QMessageBox.information(QtGui.QApplication.activeWindow(), "Installation Required",
+                                          "You can't play without a legal version of Forged Alliance.")
+        elif self.result == self.RESULT_BUSY:
+            QtGui.QMessageBox.information(QtGui.QApplication.activeWindow(), "Server Busy",
+                                          "The Server is busy preparing new patch files.<br/>Try again later.")
+        elif self.result == self.RESULT_FAILURE:
+            failureDialog()
+
+        log("Update finished at " + timestamp())
+        self.finished.emit(self.result)
+
+
+    def fetchFile(self, url, toFile, md5=None):
         """
-        A simple loop that waits until the server has transmitted a sim mod path.
+        Starts downloading url to toFile, and returns the Download. The file is written next to toFile as it arrives,
+        and only replaces it once it's complete (and checked, with an md5).
         """
-        self.lastData = time.time()
+        self.progress.setLabelText("Downloading FA file: " + url)
+        download = util.downloads.download(url, toFile, md5)
+        download.progress.connect(self.downloadProgress)
+        self.downloads.append(download)
+        return download
 
-        self.progress.setValue(0)
-        self.progress.setMinimum(0)
-        self.progress.setMaximum(0)
 
-        while self.modpath == None:
-            if self.progress.wasCanceled():
-                raise UpdaterCancellation("Operation aborted while waiting for sim mod path.")
+    @QtCore.pyqtSlot(int, int)
+    def downloadProgress(self, received, total):
+        # The server is quiet while we download from the content server
+        self.lastData = time.time()
+        self.progress.setMaximum(sum(download.total for download in self.downloads)
+                                 if all(download.total for download in self.downloads) else 0)
+        self.progress.setValue(sum(download.received for download in self.downloads))
+
 
-            if self.result != self.RESULT_NONE:
-                raise UpdaterFailure("Operation failed while waiting for sim mod path.")
+    def fileFetched(self, download, fileToCopy):
+        self.downloads.remove(download)
+        if self.done:
+            return
 
-            if time.time() - self.lastData > self.TIMEOUT:
-                raise UpdaterTimeout("Operation timed out while waiting for sim mod path.")
+        if not download.succeeded:
+            log("ERROR: Download of %s failed: %s" % (fileToCopy, download.error))
+            self.finish(self.RESULT_FAILURE)
+            return
 
-            QtGui.QApplication.processEvents()
+        log("%s is downloaded." % fileToCopy)
+        self.fileUpdated(fileToCopy)
 
 
-    def waitForFileList(self):
+    def updateFiles(self, destination, filegroup):
         """
-        A simple loop that waits until the server has transmitted a file list.
+        Updates the files in a given file group, in the destination subdirectory of the Forged Alliance path.
+        Asks for the list of files here, the rest happens as the server answers.
         """
-        self.lastData = time.time()
-
+        self.progress.setLabelText("Updating files: " + filegroup)
         self.progress.setValue(0)
         self.progress.setMinimum(0)
         self.progress.setMaximum(0)
 
-        while len(self.filesToUpdate) == 0:
-            if self.progress.wasCanceled():
-                raise UpdaterCancellation("Operation aborted while waiting for file list.")
-
-            if self.result != self.RESULT_NONE:
-                raise UpdaterFailure("Operation failed while waiting for file list.")
+        self.destination = destination
+        self.filegroup = filegroup
+        self.writeToServer("GET_FILES_TO_UPDATE", filegroup)
 
-            if time.time() - self.lastData > self.TIMEOUT:
-                raise UpdaterTimeout("Operation timed out while waiting for file list.")
 
-            QtGui.QApplication.processEvents()
+    def checkFiles(self):
+        """
+        Hashes the listed files (only the ones that changed since the last update) on another thread.
+        """
+        if not self.filesToUpdate:
+            self.nextFileGroup()
+            return
 
         log("Files to update: [" + ', '.join(self.filesToUpdate) + "]")
 
+        targetdir = os.path.join(util.APPDATA_DIR, self.destination)
+        if not os.path.exists(targetdir):
+            os.makedirs(targetdir)
 
-    def waitUntilFilesAreUpdated(self):
-        """
-        A simple loop that updates the progress bar while the server sends actual file data
-        """
-        self.lastData = time.time()
+        # Hashing big files can take a while, and the server has nothing to say until we're done
+        self.watchdog.stop()
+        self.progress.setLabelText("Checking files: " + self.filegroup)
+        self.localPaths = dict((fileToUpdate, os.path.join(targetdir, fileToUpdate)) for fileToUpdate in self.filesToUpdate)
+        localManifest().md5sAsync(self.localPaths.values(), self.hashed.emit)
 
-        self.progress.setValue(0)
-        self.progress.setMinimum(0)
-        self.progress.setMaximum(0)
 
-        while len(self.filesToUpdate) > 0:
-            if self.progress.wasCanceled():
-                raise UpdaterCancellation("Operation aborted while waiting for data.")
+    @QtCore.pyqtSlot(object, object)
+    def filesHashed(self, md5s, error):
+        if self.done:
+            return
+
+        if error is not None:
+            log("EXCEPTION: %s(%s)" % (error.__class__.__name__, str(error.args)))
+            self.finish(self.RESULT_FAILURE)
+            return
+
+        localManifest().save()
+        md5s = dict((fileToUpdate, md5s[path]) for fileToUpdate, path in self.localPaths.items())
 
-            if (self.result != self.RESULT_NONE):
-                raise UpdaterFailure("Operation failed while waiting for data.")
+        self.progress.setLabelText("Updating files: " + self.filegroup)
+        if "UPDATE_MANIFEST" in self.capabilities:
+            self.requestManifest(self.destination, self.filegroup, md5s)
+        else:
+            self.requestFiles(self.destination, self.filegroup, md5s)
 
-            if (time.time() - self.lastData > self.TIMEOUT):
-                raise UpdaterTimeout("Connection timed out while waiting for data.")
 
-            QtGui.QApplication.processEvents()
+    def fileUpdated(self, fileToUpdate):
+        if str(fileToUpdate) not in self.filesToUpdate:
+            log("Ignoring answer for %s, it isn't being updated." % fileToUpdate)
+            return
+        self.filesToUpdate.remove(str(fileToUpdate))
+        if not self.filesToUpdate:
+            self.nextFileGroup()
 
-        log("Updates applied successfully.")
 
+    def isFAFGroup(self, filegroup):
+        return self.featured_mod == "faf" or self.featured_mod == "ladder1v1" or filegroup == "FAF" or filegroup == "FAFGAMEDATA"
+
+
+    def requestFiles(self, destination, filegroup, md5s):
+        for fileToUpdate in list(self.filesToUpdate):
+            self.requestFile(destination, filegroup, fileToUpdate, md5s[fileToUpdate])
 
-    def doUpdate(self):
-        """ The core function that does most of the actual update work."""
-        try:
-            if self.sim:
-                self.writeToServer("REQUEST_SIM_PATH", self.featured_mod)
-                self.waitForSimModPath()
-                if self.result == self.RESULT_SUCCESS:
-                    if modvault.downloadMod(self.modpath):
-                        self.writeToServer("ADD_DOWNLOAD_SIM_MOD", self.featured_mod)
 
+    def requestFile(self, destination, filegroup, fileToUpdate, md5File):
+        """
+        Asks the server for the file, or for a patch from the version we have (md5File) to the one we need.
+        """
+        if md5File == None:
+            if self.version:
+                if self.isFAFGroup(filegroup):
+                    self.writeToServer("REQUEST_VERSION", destination, fileToUpdate, str(self.version))
+                else:
+                    self.writeToServer("REQUEST_MOD_VERSION", destination, fileToUpdate,
+                                       json.dumps(self.modversions))
             else:
-                #Prepare FAF directory & all necessary files
-                #self.prepareBinFAF() # removed for feature/new-patcher
-
-                #Update the mod if it's requested
-                if self.featured_mod == "faf" or self.featured_mod == "ladder1v1":  #HACK - ladder1v1 "is" FAF. :-)
-                    #self.updateFiles("bin", "FAF")  # removed for feature/new-patcher
-                    #self.updateFiles("gamedata", "FAFGAMEDATA") # removed for feature/new-patcher
-                    pass
-                elif self.featured_mod:
-                    #self.updateFiles("bin", "FAF")  # removed for feature/new-patcher
-                    #self.updateFiles("gamedata", "FAFGAMEDATA") # removed for feature/new-patcher
-                    self.updateFiles("bin", self.featured_mod)
-                    self.updateFiles("gamedata", self.featured_mod + "Gamedata")
-
-        except UpdaterTimeout, et:
-            log("TIMEOUT: %s(%s)" % (et.__class__.__name__, str(et.args)))
-            self.result = self.RESULT_FAILURE
-        except UpdaterCancellation, ec:
-            log("CANCELLED: %s(%s)" % (ec.__class__.__name__, str(ec.args)))
-            self.result = self.RESULT_CANCEL
-        except Exception, e:
-            log("EXCEPTION: %s(%s)" % (e.__class__.__name__, str(e.args)))
-            self.result = self.RESULT_FAILURE
+
+                self.writeToServer("REQUEST_PATH", destination, fileToUpdate)
         else:
-            self.result = self.RESULT_SUCCESS
-        finally:
-            self.updateSocket.close()
+            if self.version:
+                if self.isFAFGroup(filegroup):
+                    self.writeToServer("PATCH_TO", destination, fileToUpdate, md5File, str(self.version))
+                else:
 
-        #Hide progress dialog if it's still showing.
-        self.progress.close()
+                    self.writeToServer("MOD_PATCH_TO", destination, fileToUpdate, md5File,
+                                       json.dumps(self.modversions))
+            else:
+                self.writeToServer("UPDATE", destination, fileToUpdate, md5File)
 
-        # Integrated handlers for the various things that could go wrong                              
-        if self.result == self.RESULT_CANCEL:
-            pass  #The user knows damn well what happened here.
-        elif self.result == self.RESULT_PASS:
-            QtGui.QMessageBox.information(QtGui.QApplication.activeWindow(), "Installation Required",
-                                          "You can't play without a legal version of Forged Alliance.")
-        elif self.result == self.RESULT_BUSY:
-            QtGui.QMessageBox.information(QtGui.QApplication.activeWindow(), "Server Busy",
-                                          "The Server is busy preparing new patch files.<br/>Try again later.")
-        elif self.result == self.RESULT_FAILURE:
-            failureDialog()
 
-        # If nothing terribly bad happened until now, the operation is a success and/or the client can display what's up.                           
-        return self.result
+    def requestManifest(self, destination, filegroup, md5s):
+        """
+        Sends the md5s of a whole file group (None for missing files) in a single UPDATE_MANIFEST request.
+        The server answers it file by file, like the single file requests.
+        """
+        if not self.version:
+            versions = {}
+        elif self.isFAFGroup(filegroup):
+            versions = {"version": str(self.version)}
+        else:
+            versions = {"modversions": self.modversions}
+
+        self.writeToServer("UPDATE_MANIFEST", destination, filegroup, json.dumps(md5s), json.dumps(versions))
+
+
+    @QtCore.pyqtSlot()
+    def downloadSimMod(self):
+        # The mod comes from the content server, the update server has nothing to say meanwhile
+        self.watchdog.stop()
+        if modvault.downloadMod(self.modpath):
+            self.writeToServer("ADD_DOWNLOAD_SIM_MOD", self.featured_mod)
+        self.finish(self.RESULT_SUCCESS)
 
 
     @QtCore.pyqtSlot('QAbstractSocket::SocketError')
@@ -492,7 +600,7 @@ class Updater(QtCore.QObject):
         else:
             log("The following error occurred: %s." % self.updateSocket.errorString())
 
-        self.result = self.RESULT_FAILURE
+        self.finish(self.RESULT_FAILURE)
 
 
 
@@ -505,29 +613,38 @@ class Updater(QtCore.QObject):
         if action == "PATH_TO_SIM_MOD":
             path = stream.readQString()
             self.modpath = path
-            self.result = self.RESULT_SUCCESS
+            # Downloading waits for the download, let this slot return first
+            QtCore.QTimer.singleShot(0, self.downloadSimMod)
             return
 
         elif action == "SIM_MOD_NOT_FOUND":
             log("Error: Unknown sim mod requested.")
             self.modpath = ""
-            self.result = self.RESULT_FAILURE
+            self.finish(self.RESULT_FAILURE)
+            return
+
+        elif action == "CAPABILITIES":
+            self.capabilities = set(json.loads(stream.readQString())) & set(self.CAPABILITIES)
+            log("Server supports: " + ', '.join(sorted(self.capabilities)))
             return
 
         elif action == "LIST_FILES_TO_UP":
             self.filesToUpdate = eval(str(stream.readQString()))
             if (self.filesToUpdate == None):
                 self.filesToUpdate = []
+            #Ensure our list is unique
+            self.filesToUpdate = list(set(self.filesToUpdate))
+            self.checkFiles()
             return
 
         elif action == "UNKNOWN_APP":
             log("Error: Unknown app/mod requested.")
-            self.result = self.RESULT_FAILURE
+            self.finish(self.RESULT_FAILURE)
             return
 
         elif action == "THIS_PATCH_IS_IN_CREATION EXCEPTION":
             log("Error: Patch is in creation.")
-            self.result = self.RESULT_BUSY
+            self.finish(self.RESULT_BUSY)
             return
 
         elif action == "VERSION_PATCH_NOT_FOUND":
@@ -553,14 +670,13 @@ class Updater(QtCore.QObject):
             response = stream.readQString()
             log("file : " + response)
             log("%s is up to date." % response)
-            self.filesToUpdate.remove(str(response))
+            self.fileUpdated(response)
             return
 
         elif action == "ERROR_FILE":
             response = stream.readQString()
             log("ERROR: File not found on server : %s." % response)
-            self.filesToUpdate.remove(str(response))
-            self.result = self.RESULT_FAILURE
+            self.finish(self.RESULT_FAILURE)
             return
 
         elif action == "SEND_FILE_PATH":
@@ -572,35 +688,39 @@ class Updater(QtCore.QObject):
             path = util.LUA_DIR if path == "bin" else path
 
             toFile = os.path.join(util.APPDATA_DIR, str(path), str(fileToCopy))
-            self.fetchFile(url, toFile)
-            self.filesToUpdate.remove(str(fileToCopy))
+            download = self.fetchFile(url, toFile)
+            download.finished.connect(lambda: self.fileFetched(download, fileToCopy))
 
-        elif action == "SEND_FILE":
-            path = stream.readQString()
+        # SEND_FILE is streamed to disk by readDataFromServer, see receiveFile
+        else:
+            log("Unexpected server command received: " + action)
+            self.finish(self.RESULT_FAILURE)
 
-            #HACK for feature/new-patcher
-            path = util.LUA_DIR if path == "bin" else path
 
-            fileToCopy = stream.readQString()
-            size = stream.readInt()
-            fileDatas = stream.readRawData(size)
+    def receiveFile(self, path, fileToCopy, size):
+        """
+        Starts receiving the payload of a SEND_FILE block, which readDataFromServer then writes to disk chunk by chunk.
+        """
+        log("handleAction(SEND_FILE) - %d bytes" % size)
 
-            toFile = os.path.join(util.APPDATA_DIR, str(path), str(fileToCopy))
+        #HACK for feature/new-patcher
+        path = util.LUA_DIR if path == "bin" else path
 
-            writeFile = QtCore.QFile(toFile)
+        self.incoming = IncomingFile(os.path.join(util.APPDATA_DIR, str(path)), str(fileToCopy), size)
+        self.progress.setLabelText("Downloading " + fileToCopy)
+        self.progress.setMinimum(0)
+        self.progress.setMaximum(size)
+        self.progress.setValue(0)
 
-            if (writeFile.open(QtCore.QIODevice.WriteOnly)):
-                writeFile.write(fileDatas)
-                writeFile.close()
-            else:
-                logger.warn("%s is not writeable in in %s. Skipping." % (
-                fileToCopy, path))  #This may or may not be desirable behavior
 
-            log("%s is copied in %s." % (fileToCopy, path))
-            self.filesToUpdate.remove(str(fileToCopy))
+    def fileReceived(self):
+        incoming, self.incoming = self.incoming, None
+        if incoming.commit():
+            log("%s is copied in %s." % (incoming.name, incoming.directory))
         else:
-            log("Unexpected server command received: " + action)
-            self.result = self.RESULT_FAILURE
+            logger.warn("%s is not writeable in in %s. Skipping." % (
+            incoming.name, incoming.directory))  #This may or may not be desirable behavior
+        self.fileUpdated(incoming.name)
 
 
     @QtCore.pyqtSlot()
@@ -610,7 +730,7 @@ class Updater(QtCore.QObject):
         ins = QtCore.QDataStream(self.updateSocket)
         ins.setVersion(QtCore.QDataStream.Qt_4_2)
 
-        while not ins.atEnd():
+        while not self.done and not ins.atEnd():
             #log("Bytes Available: %d" % self.updateSocket.bytesAvailable())                    
 
             # Nothing was read yet, commence a new block.
@@ -632,28 +752,48 @@ class Updater(QtCore.QObject):
                     self.progress.setMinimum(0)
                     self.progress.setMaximum(0)
 
-            # Update our Gui at least once before proceeding (we might be receiving a huge file and this is not the first time we get here)   
-            self.lastData = time.time()
-            QtGui.QApplication.processEvents()
+            try:
+                # Files can be huge, they go to disk as they arrive instead of piling up in the socket
+                if self.incoming is None:
+                    peekSize = min(HEADER_PEEK_SIZE, self.blockSize)
+                    header = sendFileHeader(str(self.updateSocket.peek(peekSize)))
+                    if header is None and self.updateSocket.bytesAvailable() < peekSize:
+                        return  #until the rest of the header is here
+                    if header:
+                        path, fileToCopy, size, headerSize = header
+                        self.updateSocket.read(headerSize)
+                        self.receiveFile(path, fileToCopy, size)
+
+                if self.incoming is not None:
+                    chunk = min(self.updateSocket.bytesAvailable(), self.incoming.remaining, RECEIVE_CHUNK_SIZE)
+                    self.incoming.write(str(self.updateSocket.read(chunk)))
+                    self.progress.setValue(self.incoming.received)
+                    if self.incoming.remaining == 0:
+                        self.blockSize = 0
+                        self.fileReceived()
+                    continue
+            except Exception, e:
+                log("EXCEPTION: %s(%s)" % (e.__class__.__name__, str(e.args)))
+                self.finish(self.RESULT_FAILURE)
+                return
 
             #We have an incoming block, wait for enough bytes to accumulate                    
             if self.updateSocket.bytesAvailable() < self.blockSize:
                 self.progress.setValue(self.updateSocket.bytesAvailable())
-                return  #until later, this slot is reentrant
+                return  #until later, this slot is called again as more data arrives
 
             #Enough bytes accumulated. Carry on.
             self.progress.setValue(self.blockSize)
 
-            # Update our Gui at least once before proceeding (we might have to write a big file)
-            self.lastData = time.time()
-            QtGui.QApplication.processEvents()
-
             # Find out what the server just sent us, and process it.
             action = ins.readQString()
-            self.handleAction(self.blockSize, action, ins)
-
-            # Prepare to read the next block
-            self.blockSize = 0
+            blockSize, self.blockSize = self.blockSize, 0
+            try:
+                self.handleAction(blockSize, action, ins)
+            except Exception, e:
+                log("EXCEPTION: %s(%s)" % (e.__class__.__name__, str(e.args)))
+                self.finish(self.RESULT_FAILURE)
+                return
 
             self.progress.setValue(0)
             self.progress.setMinimum(0)
@@ -663,6 +803,7 @@ class Updater(QtCore.QObject):
     def writeToServer(self, action, *args, **kw):
         log(("writeToServer(" + action + ", [" + ', '.join(args) + "])"))
         self.lastData = time.time()
+        self.watchdog.start()
 
         block = QtCore.QByteArray()
         out = QtCore.QDataStream(block, QtCore.QIODevice.ReadWrite)
@@ -698,9 +839,8 @@ class Updater(QtCore.QObject):
 
     @QtCore.pyqtSlot(QtNetwork.QAbstractSocket.SocketError)
     def errored(self, error):
-        #This isn't necessarily an error so we won't change self.result here.
+        #handleServerError ends the update, this just keeps the details.
         log("TCP Error " + self.updateSocket.errorString())
-        self.result = self.RESULT_FAILURE
 
 
 def timestamp():
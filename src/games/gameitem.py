@@ -120,6 +120,7 @@ class GameItem(QtGui.QListWidgetItem):
         self.nTeams         = 0
         self.options        = []
         self.players        = []
+        self.previewFuture  = None
         
         self.setHidden(True)
 
@@ -240,7 +241,8 @@ class GameItem(QtGui.QListWidgetItem):
 
         # Just jump out if we've left the game, but tell the client that all players need their states updated
         if self.state == "closed":
-            client.usersUpdated.emit(self.players)
+            client.updateUsers(self.players)
+            self.waitForPreview()
             return
             
         self.players = []
@@ -271,11 +273,14 @@ class GameItem(QtGui.QListWidgetItem):
         if refresh_icon:
             if self.access == "password" or self.private:
                 icon = util.icon("games/private_game.png")
+                self.waitForPreview()
             else:            
-                icon = maps.preview(self.mapname)
-                if not icon:
-                    self.client.downloader.downloadMap(self.mapname, self)
+                icon = self.client.previews.icon(self.mapname)
+                if icon:
+                    self.waitForPreview()
+                else:
                     icon = util.icon("games/unknown_map.png")
+                    self.waitForPreview(self.client.previews.request(self.mapname))
                              
             self.setIcon(icon)
         
@@ -411,9 +416,26 @@ class GameItem(QtGui.QListWidgetItem):
         # Determine which players are affected by this game's state change            
         newplayers = set(self.players)            
         affectedplayers = oldplayers | newplayers
-        client.usersUpdated.emit(list(affectedplayers))
+        client.updateUsers(list(affectedplayers))
         
         
+    def waitForPreview(self, future=None):
+        ''' Waits for the preview in future (if any), and no longer for the one of the previous map '''
+        if future is self.previewFuture:
+            return
+        if self.previewFuture is not None:
+            self.previewFuture.finished.disconnect(self.previewReady)
+        self.previewFuture = future
+        if future is not None:
+            future.then(self.previewReady)
+
+    def previewReady(self, icon):
+        self.previewFuture = None
+        # The game may have become private while the preview was being made
+        if not (self.access == "password" or self.private):
+            self.setIcon(icon)
+
+
     def editTooltip(self):
         
         observerlist    = []
@@ -363,11 +363,8 @@ class ModItem(QtGui.QListWidgetItem):
         if self.thumbstr == "":
             self.setIcon(util.icon("games/unknown_map.png"))
         else:
-            img = getIcon(os.path.basename(urllib2.unquote(self.thumbstr)))
-            if img:
-                self.setIcon(util.icon(img, False))
-            else:
-                self.parent.client.downloader.downloadModPreview(self.thumbstr, self)
+            # Set right away if it's in the image cache already
+            self.parent.client.downloader.downloadModPreview(self.thumbstr, self)
         self.updateVisibility()
 
     def updateIcon(self):
@@ -0,0 +1,119 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+Index of the mod_info.lua of the installed mods, kept on disk between runs.
+
+The parsed info of a mod is remembered along with the size and mtime of the zip file, or of
+the mod_info.lua of a mod folder, and the mod is only parsed again when those change. Like
+fa.manifest, this module doesn't depend on Qt.
+'''
+
+import logging
+import os
+from multiprocessing.pool import ThreadPool
+
+from util.jsonstore import JsonStore
+
+logger = logging.getLogger(__name__)
+
+# Reading zip members and files lets go of the GIL, parsing doesn't: a few threads are enough
+PARSE_THREADS = 4
+
+
+def modStamp(path):
+    '''
+    The [size, mtime] that tells whether the mod at path changed. For a folder, that's its
+    mod_info.lua if it has one: the folder mtime doesn't change when a file in it is edited.
+    '''
+    if os.path.isdir(path):
+        modinfo = os.path.join(path, "mod_info.lua")
+        if os.path.isfile(modinfo):
+            path = modinfo
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime]
+
+
+def _text(value):
+    '''
+    value with its byte strings made unicode, the way json gives them back. mod_info.lua files
+    are mostly utf-8, but some were saved in latin-1, and any byte is valid latin-1.
+    '''
+    if isinstance(value, str):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return value.decode("latin-1")
+    if isinstance(value, dict):
+        return dict((_text(key), _text(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_text(item) for item in value]
+    return value
+
+
+class ModIndex(JsonStore):
+    '''
+    Parsed mod info by mod path, kept in a json file between runs.
+    '''
+    kind = "mod index"
+
+    def infos(self, paths, parse):
+        '''
+        Returns a dict of the info of the mods at paths, None for the ones that aren't mods. parse(path)
+        is called for the mods that are new or changed since they were last parsed, on a thread pool,
+        and returns the info dict or None. Paths that don't exist are left out.
+        '''
+        result = {}
+        stale = []
+        for path in paths:
+            try:
+                stamp = modStamp(path)
+            except OSError:
+                continue
+
+            entry = self.entries.get(path)
+            if entry and entry[:2] == stamp:
+                result[path] = entry[2]
+            else:
+                stale.append((path, stamp))
+
+        if stale:
+            logger.info("Parsing %d of %d mods" % (len(stale), len(paths)))
+            pool = ThreadPool(min(PARSE_THREADS, len(stale)))
+            try:
+                parsed = pool.map(parse, [path for path, _ in stale])
+            finally:
+                pool.close()
+                pool.join()
+
+            for (path, stamp), info in zip(stale, parsed):
+                info = _text(info)
+                self.entries[path] = stamp + [info]
+                result[path] = info
+            self.dirty = True
+
+        return result
+
+    def forget(self, path):
+        if self.entries.pop(path, None) is not None:
+            self.dirty = True
+
+    def prune(self, paths):
+        ''' Forgets the mods that aren't in paths anymore '''
+        for path in set(self.entries) - set(paths):
+            self.forget(path)
@@ -26,11 +26,12 @@ from PyQt4 import QtCore, QtGui
 
 from util import strtodate, datetostr, now, PREFSFILENAME
 import util
+from util import downloadengine
 import logging
 from vault import luaparser
+from modvault.modindex import ModIndex
 import warnings
 
-import cStringIO
 import zipfile
 
 logger = logging.getLogger(__name__)
@@ -80,20 +81,15 @@ def getAllModFolders(): #returns a list of names of installed mods
     
 def getInstalledMods():
     installedMods[:] = []
-    for f in getAllModFolders():
-        m = None
-        if os.path.isdir(os.path.join(MODFOLDER,f)):
-            try:
-                m = getModInfoFromFolder(f)
-            except:
-                continue
-        else:
-            try:
-                m = getModInfoFromZip(f)
-            except:
-                continue
-        if m:
-            installedMods.append(m)
+    paths = [os.path.join(MODFOLDER, f) for f in getAllModFolders()]
+    index = modIndex()
+    infos = index.infos(paths, readModInfo)
+    index.prune(paths)
+    index.save()
+    for path in paths:
+        info = infos.get(path)
+        if info:
+            installedMods.append(modFromInfo(os.path.basename(path), info))
     logger.debug("getting installed mods. Count: %d" % len(installedMods))
     return installedMods
         
@@ -118,13 +114,6 @@ def fullPathToIcon(path):
     p = os.path.normpath(os.path.abspath(path))
     return p[len(MODFOLDER)-5:].replace('\\','/')
 
-def getIcon(name):
-    img = os.path.join(util.CACHE_DIR, name)
-    if os.path.isfile(img):
-        logger.debug("Using cached preview image for: " + name)
-        return img
-    return None
-
 def getModInfo(modinfofile):
     modinfo = modinfofile.parse({"name":"name","uid":"uid","version":"version","author":"author",
                                  "description":"description","ui_only":"ui_only",
@@ -151,58 +140,75 @@ def parseModInfo(folder):
     modinfofile = luaparser.luaParser(os.path.join(folder,"mod_info.lua"))
     return getModInfo(modinfofile)
 
-modCache = {}
+_index = None
 
-def getModInfoFromZip(zfile):
-    '''get the mod info from a zip file'''
-    if zfile in modCache:
-        return modCache[zfile]
-    
-    r = None
-    if zipfile.is_zipfile(os.path.join(MODFOLDER,zfile)) :
-        zip = zipfile.ZipFile(os.path.join(MODFOLDER,zfile), "r", zipfile.ZIP_DEFLATED)
-        if zip.testzip() == None :
-            for member in zip.namelist() :
-                filename = os.path.basename(member)
-                if not filename:
-                    continue
-                if filename == "mod_info.lua":
-                    modinfofile = luaparser.luaParser("mod_info.lua")
-                    modinfofile.iszip = True
-                    modinfofile.zip = zip
-                    r = getModInfo(modinfofile)
-    if r == None:
-        logger.debug("mod_info.lua not found in zip file %s" % zfile)
+def modIndex():
+    global _index
+    if _index is None:
+        _index = ModIndex(os.path.join(util.CACHE_DIR, "modindex.json"))
+    return _index
+
+def parseModInfoFromZip(zfile):
+    '''
+    Like parseModInfo, for a zipped mod. The zip isn't tested as a whole, a broken mod_info.lua
+    member fails when it's read.
+    '''
+    if not zipfile.is_zipfile(zfile):
         return None
-    f, info = r
-    if f.error:
-        logger.debug("Error in parsing mod_info.lua in %s" % zfile)
+    zip = zipfile.ZipFile(zfile, "r", zipfile.ZIP_DEFLATED)
+    try:
+        for member in zip.namelist():
+            if os.path.basename(member) == "mod_info.lua":
+                modinfofile = luaparser.luaParser("mod_info.lua")
+                modinfofile.iszip = True
+                modinfofile.zip = zip
+                return getModInfo(modinfofile)
         return None
-    m = ModInfo(**info)
-    print zfile
-    m.setFolder(zfile)
-    m.update()
-    modCache[zfile] = m
-    return m
-
-def getModInfoFromFolder(modfolder): # modfolder must be local to MODFOLDER
-    if modfolder in modCache:
-        return modCache[modfolder]
+    finally:
+        zip.close()
 
-    r = parseModInfo(os.path.join(MODFOLDER,modfolder))
+def readModInfo(path):
+    '''
+    The info dict of the mod folder or zip file at path, or None if it isn't a valid mod
+    '''
+    try:
+        if os.path.isdir(path):
+            r = parseModInfo(path)
+        else:
+            r = parseModInfoFromZip(path)
+    except Exception:
+        logger.exception("Couldn't read mod %s" % path)
+        return None
     if r == None:
-        logger.debug("mod_info.lua not found in %s folder" % modfolder)
+        logger.debug("mod_info.lua not found in %s" % path)
         return None
     f, info = r
     if f.error:
-        logger.debug("Error in parsing %s/mod_info.lua" % modfolder)
+        logger.debug("Error in parsing mod_info.lua in %s" % path)
         return None
+    return info
+
+def modFromInfo(localfolder, info):
     m = ModInfo(**info)
-    m.setFolder(modfolder)
+    m.setFolder(localfolder)
     m.update()
-    modCache[modfolder] = m
     return m
 
+def getModInfoFromIndex(localfolder):
+    path = os.path.join(MODFOLDER, localfolder)
+    info = modIndex().infos([path], readModInfo).get(path)
+    modIndex().save()
+    if not info:
+        return None
+    return modFromInfo(localfolder, info)
+
+def getModInfoFromZip(zfile):
+    '''get the mod info from a zip file'''
+    return getModInfoFromIndex(zfile)
+
+def getModInfoFromFolder(modfolder): # modfolder must be local to MODFOLDER
+    return getModInfoFromIndex(modfolder)
+
 def getActiveMods(uimods=None): # returns a list of ModInfo's containing information of the mods
     """uimods:
         None - return all active mods
@@ -356,38 +362,31 @@ def downloadMod(item): #most of this function is stolen from fa.maps.downloadMap
     progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
     progress.setAutoClose(False)
     progress.setAutoReset(False)
-    
+    progress.setModal(1)
+    progress.setWindowTitle("Downloading Mod")
+    progress.setLabelText(link)
+    progress.show()
+
+    #Download the file to disk (resuming an earlier attempt, if any), then uncompress it from there.
+    zippath = os.path.join(util.DOWNLOAD_DIR, os.path.basename(link))
+    download = util.downloads.download(link, zippath)
+    downloaded = downloadengine.wait([download], progress)
+    progress.close()
+
+    if not downloaded:
+        if download.aborted:
+            logger.warn("Mod download cancelled for: " + link)
+        elif download.status == 404:
+            logger.warning("ModVault download failed with HTTP 404, mod probably not in vault (or broken).")
+            QtGui.QMessageBox.information(None, "Mod not downloadable", "<b>This mod was not found in the vault (or is broken).</b><br/>You need to get it from somewhere else in order to use it." )
+        else:
+            logger.warn("Mod download failed for: " + link)
+            QtGui.QMessageBox.information(None, "Mod installation failed", "<b>This mod could not be installed (please report this map or bug).</b>")
+        return False
+
     try:
-        req = urllib2.Request(link, headers={'User-Agent' : "FAF Client"})         
-        zipwebfile  = urllib2.urlopen(req)
-
-        meta = zipwebfile.info()
-        file_size = int(meta.getheaders("Content-Length")[0])
-        progress.setMinimum(0)
-        progress.setMaximum(file_size)
-        progress.setModal(1)
-        progress.setWindowTitle("Downloading Mod")
-        progress.setLabelText(link)
-    
-        progress.show()
-
-        #Download the file as a series of 8 KiB chunks, then uncompress it.
-        output = cStringIO.StringIO()
-        file_size_dl = 0
-        block_sz = 8192       
-
-        while progress.isVisible():
-            read_buffer = zipwebfile.read(block_sz)
-            if not read_buffer:
-                break
-            file_size_dl += len(read_buffer)
-            output.write(read_buffer)
-            progress.setValue(file_size_dl)
-    
-        progress.close()
-        
-        if file_size_dl == file_size:
-            zfile = zipfile.ZipFile(output)
+        zfile = zipfile.ZipFile(zippath)
+        try:
             dirname = zfile.namelist()[0].split('/',1)[0]
             if os.path.exists(os.path.join(MODFOLDER, dirname)):
                 oldmod = getModInfoFromFolder(dirname)
@@ -397,24 +396,18 @@ def downloadMod(item): #most of this function is stolen from fa.maps.downloadMap
                     return False
                 removeMod(oldmod)
             zfile.extractall(MODFOLDER)
-            logger.debug("Successfully downloaded and extracted mod from: " + link)
-            return True
-        else:    
-            logger.warn("Mod download cancelled for: " + link)
-            return False
+        finally:
+            zfile.close()
+        os.remove(zippath)
+        logger.debug("Successfully downloaded and extracted mod from: " + link)
+        return True
 
     except:
-        logger.warn("Mod download or extraction failed for: " + link)        
-        if sys.exc_type is urllib2.HTTPError:
-            logger.warning("ModVault download failed with HTTPError, mod probably not in vault (or broken).")
-            QtGui.QMessageBox.information(None, "Mod not downloadable", "<b>This mod was not found in the vault (or is broken).</b><br/>You need to get it from somewhere else in order to use it." )
-        else:                
-            logger.error("Download Exception", exc_info=sys.exc_info())
-            QtGui.QMessageBox.information(None, "Mod installation failed", "<b>This mod could not be installed (please report this map or bug).</b>")
+        logger.warn("Mod extraction failed for: " + link)
+        logger.error("Download Exception", exc_info=sys.exc_info())
+        QtGui.QMessageBox.information(None, "Mod installation failed", "<b>This mod could not be installed (please report this map or bug).</b>")
         return False
 
-    return True
-    
 
 def removeMod(mod):
     logger.debug("removing mod %s" % mod.name)
@@ -427,8 +420,8 @@ def removeMod(mod):
         logger.debug("Can't remove mod. Mod not found.")
         return False
     shutil.rmtree(real.absfolder)
-    if real.localfolder in modCache:
-        del modCache[real.localfolder]
+    modIndex().forget(real.absfolder)
+    modIndex().save()
     installedMods.remove(real)
     return True
     #we don't update the installed mods, because the operating system takes
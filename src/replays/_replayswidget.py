@@ -23,6 +23,8 @@
 from PyQt4 import QtCore, QtGui, QtNetwork
 from PyQt4.QtNetwork import QNetworkAccessManager, QNetworkRequest, QNetworkReply
 from fa.replay import replay
+from replays.localindex import LocalReplayIndex
+from replays.replaymodel import MapPreviewLoader, LocalReplayModel, OnlineReplayModel
 import util
 import os
 import fa
@@ -37,6 +39,10 @@ LIVEREPLAY_DELAY = 5 #livereplay delay in minutes
 LIVEREPLAY_DELAY_TIME = LIVEREPLAY_DELAY * 60 #livereplay delay for time() (in seconds)
 LIVEREPLAY_DELAY_QTIMER = LIVEREPLAY_DELAY * 60000 #livereplay delay for Qtimer (in milliseconds)
 
+LOCAL_REPLAY_INDEX = os.path.join(util.CACHE_DIR, "local_replays.sqlite")
+LOCAL_REPLAY_ICON_COLUMN_WIDTH = 150
+LOCAL_REPLAY_REFRESH_DELAY = 500 #wait for the replay directory to settle before updating the index (in milliseconds)
+
 from replays.replayitem import ReplayItem, ReplayItemDelegate
 
 # Replays uses the new Inheritance Based UI creation pattern
@@ -61,7 +67,11 @@ class ReplaysWidget(BaseClass, FormClass):
         client.replayVault.connect(self.replayVault)    
         
         self.onlineReplays = {}
+        self.previews = MapPreviewLoader(client.previews, self)
+        self.onlineModel = OnlineReplayModel(self.previews, self)
+        self.onlineTree.setModel(self.onlineModel)
         self.onlineTree.setItemDelegate(ReplayItemDelegate(self))
+        self.onlineModel.rowsInserted.connect(self.onlineRowsInserted)
         self.replayDownload = QNetworkAccessManager()
         self.replayDownload.finished.connect(self.finishRequest)
         
@@ -70,9 +80,17 @@ class ReplaysWidget(BaseClass, FormClass):
         self.playerName.returnPressed.connect(self.searchVault)
         self.mapName.returnPressed.connect(self.searchVault)
         
-        self.myTree.itemDoubleClicked.connect(self.myTreeDoubleClicked)
-        self.myTree.itemPressed.connect(self.myTreePressed)
-        self.myTree.header().setResizeMode(0, QtGui.QHeaderView.ResizeToContents)
+        # Local replays are listed from an index that's kept up to date as the replay directory changes
+        self.replayIndex = LocalReplayIndex(LOCAL_REPLAY_INDEX, util.REPLAY_DIR)
+        self.myModel = LocalReplayModel(self.replayIndex, self.previews, self)
+        self.myTree.setModel(self.myModel)
+        self.replayIndexLoaded = False
+
+        self.myTree.doubleClicked.connect(self.myTreeDoubleClicked)
+        self.myTree.pressed.connect(self.myTreePressed)
+        # Sizing column 0 to its contents would ask for the map preview of every loaded row
+        self.myTree.header().setResizeMode(0, QtGui.QHeaderView.Interactive)
+        self.myTree.setColumnWidth(0, LOCAL_REPLAY_ICON_COLUMN_WIDTH)
         self.myTree.header().setResizeMode(1, QtGui.QHeaderView.ResizeToContents)
         self.myTree.header().setResizeMode(2, QtGui.QHeaderView.Stretch)
         self.myTree.header().setResizeMode(3, QtGui.QHeaderView.ResizeToContents)
@@ -85,8 +103,8 @@ class ReplaysWidget(BaseClass, FormClass):
         
         self.games = {}
         
-        self.onlineTree.itemDoubleClicked.connect(self.onlineTreeDoubleClicked)
-        self.onlineTree.itemPressed.connect(self.onlineTreeClicked)
+        self.onlineTree.doubleClicked.connect(self.onlineTreeDoubleClicked)
+        self.onlineTree.pressed.connect(self.onlineTreeClicked)
         
         # replay vault connection to server
         self.searching = False
@@ -97,7 +115,14 @@ class ReplaysWidget(BaseClass, FormClass):
         self.replayVaultSocket.disconnected.connect(self.disconnected)
         self.replayVaultSocket.error.connect(self.errored) 
 
-        
+        # Refresh the local replays once the replay directory stops changing
+        self.replayDirWatcher = QtCore.QFileSystemWatcher([util.REPLAY_DIR], self)
+        self.replayDirTimer = QtCore.QTimer(self)
+        self.replayDirTimer.setSingleShot(True)
+        self.replayDirTimer.setInterval(LOCAL_REPLAY_REFRESH_DELAY)
+        self.replayDirTimer.timeout.connect(self.updatemyTree)
+        self.replayDirWatcher.directoryChanged.connect(self.replayDirTimer.start)
+
         logger.info("Replays Widget instantiated.")
 
         
@@ -106,7 +131,7 @@ class ReplaysWidget(BaseClass, FormClass):
         self.searching = True
         self.connectToModVault()
         self.send(dict(command="search", rating = self.minRating.value(), map = self.mapName.text(), player = self.playerName.text(), mod = self.modList.currentText()))
-        self.onlineTree.clear()
+        self.onlineModel.setReplays([])
 
     def reloadView(self):
         if self.searching != True:
@@ -125,7 +150,19 @@ class ReplaysWidget(BaseClass, FormClass):
             faf_replay.close()  
             replay(os.path.join(util.CACHE_DIR, "temp.fafreplay"))
 
-    def onlineTreeClicked(self, item):
+    def selectedOnlineReplay(self):
+        return self.onlineModel.replay(self.onlineTree.currentIndex())
+
+    @QtCore.pyqtSlot(QtCore.QModelIndex, int, int)
+    def onlineRowsInserted(self, parent, first, last):
+        if parent.isValid():
+            for row in range(first, last + 1):
+                self.onlineTree.setFirstColumnSpanned(row, parent, True)
+
+    def onlineTreeClicked(self, index):
+        item = self.onlineModel.replay(index)
+        if item is None:
+            return
         if QtGui.QApplication.mouseButtons() == QtCore.Qt.RightButton :
             item.pressed(item)           
         else :
@@ -137,8 +174,9 @@ class ReplaysWidget(BaseClass, FormClass):
                     self.replayInfos.clear()
                     self.replayInfos.setHtml(item.replayInfo)
                 
-    def onlineTreeDoubleClicked(self, item):
-        if hasattr(item, "url") :
+    def onlineTreeDoubleClicked(self, index):
+        item = self.onlineModel.replay(index)
+        if item is not None:
             self.replayDownload.get(QNetworkRequest(QtCore.QUrl(item.url))) 
 
 
@@ -191,165 +229,31 @@ class ReplaysWidget(BaseClass, FormClass):
                 
     def updateOnlineTree(self):
         self.replayInfos.clear()
-        self.onlineTree.clear()
-        buckets = {}
-        for uid in self.onlineReplays :
-            bucket = buckets.setdefault(self.onlineReplays[uid].startDate, [])
-            bucket.append(self.onlineReplays[uid])
-            
-        for bucket in buckets.keys():
-            bucket_item = QtGui.QTreeWidgetItem()
-            self.onlineTree.addTopLevelItem(bucket_item)
-            
-            bucket_item.setIcon(0, util.icon("replays/bucket.png"))                                
-            bucket_item.setText(0, "<font color='white'>" + bucket+"</font>")
-            bucket_item.setText(1,"<font color='white'>" + str(len(buckets[bucket])) + " replays</font>")
-            
-            
-            
-            for replay in buckets[bucket]:
-                bucket_item.addChild(replay)
-                replay.setFirstColumnSpanned(True)
-                replay.setIcon(0, replay.icon)
-                
-            bucket_item.setExpanded(True)
+        self.onlineModel.setReplays(self.onlineReplays.values())
+        for row in range(self.onlineModel.rowCount()):
+            self.onlineTree.expand(self.onlineModel.index(row, 0))
     
-    def loadLocalCache(self):
-        cache_fname = os.path.join(util.CACHE_DIR, "local_replays_metadata")
-        cache = {}
-        if os.path.exists(cache_fname):
-            with open(cache_fname, "rt") as fh:
-                for line in fh:
-                    filename, metadata = line.split(':', 1)
-                    cache[filename] = metadata
-        return cache
-
-    def saveLocalCache(self, cache_hit, cache_add):
-        with open(os.path.join(util.CACHE_DIR, "local_replays_metadata"), "wt") as fh:
-            for filename, metadata in cache_hit.iteritems():
-                fh.write(filename + ":" + metadata)
-            for filename, metadata in cache_add.iteritems():
-                fh.write(filename + ":" + metadata)
-
     def updatemyTree(self):
-        self.myTree.clear()
-        
-        # We put the replays into buckets by day first, then we add them to the treewidget.
-        buckets = {}
-        
-        cache = self.loadLocalCache()
-        cache_add = {}
-        cache_hit = {}
-        # Iterate
-        for infile in os.listdir(util.REPLAY_DIR):            
-            if infile.endswith(".scfareplay"):
-                bucket = buckets.setdefault("legacy", [])
-                
-                item = QtGui.QTreeWidgetItem()
-                item.setText(1, infile)
-                item.filename = os.path.join(util.REPLAY_DIR, infile)
-                item.setIcon(0, util.icon("replays/replay.png"))
-                item.setTextColor(0, QtGui.QColor(client.instance.getColor("default")))
-                                
-                bucket.append(item)
-                
-            elif infile.endswith(".fafreplay"):
-                item = QtGui.QTreeWidgetItem()
-                try:
-                    item.filename = os.path.join(util.REPLAY_DIR, infile)
-                    basename = os.path.basename(item.filename)
-                    if basename in cache:
-                        oneline = cache[basename]
-                        cache_hit[basename] = oneline
-                    else:
-                        with open(item.filename, "rt") as fh:
-                            oneline = fh.readline()
-                            cache_add[basename] = oneline
-
-                    item.info = json.loads(oneline)
-
-                    # Parse replayinfo into data
-                    if item.info.get('complete', False):
-                        game_date = time.strftime("%Y-%m-%d", time.localtime(item.info['game_time']))
-                        game_hour = time.strftime("%H:%M", time.localtime(item.info['game_time']))
-                        
-                        bucket = buckets.setdefault(game_date, [])                    
-                        
-                        icon = fa.maps.preview(item.info['mapname'])
-                        if icon:
-                            item.setIcon(0, icon)
-                        else:
-                            self.client.downloader.downloadMap(item.info['mapname'], item, True)
-                            item.setIcon(0,util.icon("games/unknown_map.png"))                                                      
-                        item.setToolTip(0, fa.maps.getDisplayName(item.info['mapname']))
-                        item.setText(0, game_hour)
-                        item.setTextColor(0, QtGui.QColor(client.instance.getColor("default")))
-                        
-                        item.setText(1, item.info['title'])
-                        item.setToolTip(1, infile)
-    
-                        # Hacky way to quickly assemble a list of all the players, but including the observers
-                        playerlist = []
-                        for _, players in item.info['teams'].items():
-                            playerlist.extend(players)
-                        item.setText(2, ", ".join(playerlist))
-                        item.setToolTip(2, ", ".join(playerlist))
-                        
-                        # Add additional info
-                        item.setText(3, item.info['featured_mod'])
-                        item.setTextAlignment(3, QtCore.Qt.AlignCenter)
-                        item.setTextColor(1, QtGui.QColor(client.instance.getUserColor(item.info.get('recorder', ""))))
-                    else:
-                        bucket = buckets.setdefault("incomplete", [])                    
-                        item.setIcon(0, util.icon("replays/replay.png"))
-                        item.setText(1, infile)
-                        item.setText(2, "(replay doesn't have complete metadata)")
-                        item.setTextColor(1, QtGui.QColor("yellow")) #FIXME: Needs to come from theme
-
-                except:
-                    bucket = buckets.setdefault("broken", [])                    
-                    item.setIcon(0, util.icon("replays/broken.png"))
-                    item.setText(1, infile)
-                    item.setTextColor(1, QtGui.QColor("red"))   #FIXME: Needs to come from theme
-                    item.setText(2, "(replay parse error)")
-                    item.setTextColor(2, QtGui.QColor("gray"))  #FIXME: Needs to come from theme
-                    logger.error("Replay parse error for " + infile)
-
-                bucket.append(item)
-                    
-                
-            
-        if len(cache_add) > 10 or len(cache) - len(cache_hit) > 10:
-            self.saveLocalCache(cache_hit, cache_add)
-        # Now, create a top level treewidgetitem for every bucket, and put the bucket's contents into them         
-        for bucket in buckets.keys():
-            bucket_item = QtGui.QTreeWidgetItem()
-            
-            if bucket == "broken":
-                bucket_item.setTextColor(0, QtGui.QColor("red")) #FIXME: Needs to come from theme
-                bucket_item.setText(1, "(not watchable)")
-                bucket_item.setTextColor(1, QtGui.QColor(client.instance.getColor("default")))
-            elif bucket == "incomplete":
-                bucket_item.setTextColor(0, QtGui.QColor("yellow")) #FIXME: Needs to come from theme
-                bucket_item.setText(1, "(watchable)")
-                bucket_item.setTextColor(1, QtGui.QColor(client.instance.getColor("default")))
-            elif bucket == "legacy":
-                bucket_item.setTextColor(0, QtGui.QColor(client.instance.getColor("default")))
-                bucket_item.setTextColor(1, QtGui.QColor(client.instance.getColor("default")))
-                bucket_item.setText(1, "(old replay system)")
-            else:
-                bucket_item.setTextColor(0, QtGui.QColor(client.instance.getColor("player")))
-                
-            bucket_item.setIcon(0, util.icon("replays/bucket.png"))                                
-            bucket_item.setText(0, bucket)
-            bucket_item.setText(3, str(len(buckets[bucket])) + " replays")
-            bucket_item.setTextColor(3, QtGui.QColor(client.instance.getColor("default")))
-                
-            self.myTree.addTopLevelItem(bucket_item)
-            #self.myTree.setFirstItemColumnSpanned(bucket_item, True)
-                
-            for replay in buckets[bucket]:
-                bucket_item.addChild(replay)
+        '''
+        Updates the local replay index, and reloads myTree if anything changed.
+        Replays are only fetched from the index as the view needs them.
+        '''
+        if not self.replayIndex.refresh() and self.replayIndexLoaded:
+            return
+        self.replayIndexLoaded = True
+
+        expanded = []
+        for row in range(self.myModel.rowCount()):
+            index = self.myModel.index(row, 0)
+            if self.myTree.isExpanded(index):
+                expanded.append(self.myModel.bucketName(index))
+
+        self.myModel.reload()
+
+        for bucket in expanded:
+            index = self.myModel.bucketIndex(bucket)
+            if index.isValid():
+                self.myTree.expand(index)
 
 
     def displayReplay(self):
@@ -386,10 +290,10 @@ class ReplaysWidget(BaseClass, FormClass):
                              
             item.setToolTip(1, tip)
             
-            icon = fa.maps.preview(info['mapname'])
+            icon = self.client.previews.icon(info['mapname'])
             item.setToolTip(0, fa.maps.getDisplayName(info['mapname']))
-            if not icon:           
-                self.client.downloader.downloadMap(item.info['mapname'], item, True)
+            if not icon:
+                self.client.previews.request(info['mapname']).then(lambda icon, item=item: item.setIcon(0, icon))
                 icon = util.icon("games/unknown_map.png")
 
             item.setText(0,time.strftime("%H:%M", time.localtime(item.info['game_time'])))
@@ -486,16 +390,15 @@ class ReplaysWidget(BaseClass, FormClass):
 
 
     
-    @QtCore.pyqtSlot(QtGui.QListWidgetItem)
-    def myTreePressed(self, item):
+    @QtCore.pyqtSlot(QtCore.QModelIndex)
+    def myTreePressed(self, index):
         if QtGui.QApplication.mouseButtons() != QtCore.Qt.RightButton:
             return
                     
-        if item.isDisabled():
-            return
-
-        if self.myTree.indexOfTopLevelItem(item) != -1:
+        item = self.myModel.replay(index)
+        if item is None:
             return
+        filename = os.path.join(self.replayIndex.replay_dir, item.filename)
         
         menu = QtGui.QMenu(self.myTree)
         
@@ -508,8 +411,8 @@ class ReplaysWidget(BaseClass, FormClass):
         menu.addAction(actionExplorer)
             
         # Triggers
-        actionReplay.triggered.connect(lambda : self.myTreeDoubleClicked(item, 0))
-        actionExplorer.triggered.connect(lambda : util.showInExplorer(item.filename))
+        actionReplay.triggered.connect(lambda : replay(filename))
+        actionExplorer.triggered.connect(lambda : util.showInExplorer(filename))
       
         # Adding to menu
         menu.addAction(actionReplay)
@@ -521,13 +424,11 @@ class ReplaysWidget(BaseClass, FormClass):
 
 
 
-    @QtCore.pyqtSlot(QtGui.QTreeWidgetItem, int)
-    def myTreeDoubleClicked(self, item, column):
-        if item.isDisabled():
-            return
-
-        if self.myTree.indexOfTopLevelItem(item) == -1:
-            replay(item.filename)
+    @QtCore.pyqtSlot(QtCore.QModelIndex)
+    def myTreeDoubleClicked(self, index):
+        item = self.myModel.replay(index)
+        if item is not None:
+            replay(os.path.join(self.replayIndex.replay_dir, item.filename))
                 
                 
     @QtCore.pyqtSlot(QtGui.QTreeWidgetItem, int)
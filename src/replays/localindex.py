@@ -0,0 +1,134 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+import collections
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from fa.FAFReplayReader import readReplayInfoLine
+
+logger = logging.getLogger(__name__)
+
+# Bump when the table layout or the way rows are derived from replays changes, the index is then rebuilt
+SCHEMA_VERSION = 1
+
+# Buckets for replays that can't be sorted by date
+BUCKET_LEGACY = "legacy"
+BUCKET_INCOMPLETE = "incomplete"
+BUCKET_BROKEN = "broken"
+
+COLUMNS = ("filename", "mtime", "size", "bucket", "game_time", "title", "mapname", "featured_mod", "players", "recorder")
+
+LocalReplay = collections.namedtuple("LocalReplay", COLUMNS)
+
+
+def describeReplay(replay_dir, filename, mtime, size):
+    ''' Reads the header of a replay file into a LocalReplay row '''
+    if filename.endswith(".scfareplay"):
+        return LocalReplay(filename, mtime, size, BUCKET_LEGACY, None, None, None, None, None, None)
+
+    try:
+        info = json.loads(readReplayInfoLine(os.path.join(replay_dir, filename)))
+        if not info.get('complete', False):
+            return LocalReplay(filename, mtime, size, BUCKET_INCOMPLETE, None, None, None, None, None, None)
+
+        # Everyone in the game, including the observers
+        players = []
+        for _, team in info['teams'].items():
+            players.extend(team)
+
+        return LocalReplay(filename, mtime, size,
+                           time.strftime("%Y-%m-%d", time.localtime(info['game_time'])), info['game_time'],
+                           info['title'], info['mapname'], info['featured_mod'], ", ".join(players),
+                           info.get('recorder', ""))
+    except:
+        logger.error("Replay parse error for " + filename)
+        return LocalReplay(filename, mtime, size, BUCKET_BROKEN, None, None, None, None, None, None)
+
+
+class LocalReplayIndex(object):
+    '''
+    SQLite index of the headers of the replays in a directory. refresh() only reads the replays
+    that were added or changed (by mtime and size) since it last ran, so listing thousands of
+    replays doesn't mean parsing thousands of files.
+    '''
+    def __init__(self, path, replay_dir):
+        # Unicode, so listing it gives unicode filenames that sqlite accepts
+        if isinstance(replay_dir, str):
+            replay_dir = replay_dir.decode(sys.getfilesystemencoding())
+        self.replay_dir = replay_dir
+        self.db = sqlite3.connect(path)
+
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            logger.info("Creating local replay index in " + path)
+            with self.db:
+                self.db.execute("DROP TABLE IF EXISTS replays")
+                self.db.execute("CREATE TABLE replays (filename TEXT PRIMARY KEY, mtime REAL, size INTEGER, bucket TEXT, "
+                                "game_time REAL, title TEXT, mapname TEXT, featured_mod TEXT, players TEXT, recorder TEXT)")
+                self.db.execute("CREATE INDEX replays_bucket ON replays (bucket, game_time)")
+                self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def refresh(self):
+        ''' Brings the index up to date with the replay directory, returns the number of rows that changed '''
+        known = dict((row[0], (row[1], row[2])) for row in self.db.execute("SELECT filename, mtime, size FROM replays"))
+        seen = set()
+        changed = 0
+
+        with self.db:
+            for infile in os.listdir(self.replay_dir):
+                if not infile.endswith((".fafreplay", ".scfareplay")):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.replay_dir, infile))
+                except OSError:
+                    continue
+
+                seen.add(infile)
+                if known.get(infile) == (st.st_mtime, st.st_size):
+                    continue
+
+                self.db.execute("INSERT OR REPLACE INTO replays VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                describeReplay(self.replay_dir, infile, st.st_mtime, st.st_size))
+                changed += 1
+
+            gone = [(filename,) for filename in known if filename not in seen]
+            self.db.executemany("DELETE FROM replays WHERE filename = ?", gone)
+
+        if changed or gone:
+            logger.info("Local replay index: %d replays updated, %d removed" % (changed, len(gone)))
+        return changed + len(gone)
+
+    def buckets(self):
+        ''' Returns (bucket, number of replays) pairs, newest dates first '''
+        return self.db.execute("SELECT bucket, COUNT(*) FROM replays GROUP BY bucket ORDER BY bucket DESC").fetchall()
+
+    def replays(self, bucket, start=0, count=-1):
+        ''' Returns the LocalReplays in a bucket, newest first. start and count select a page of them. '''
+        cursor = self.db.execute("SELECT * FROM replays WHERE bucket = ? ORDER BY game_time DESC, filename LIMIT ? OFFSET ?",
+                                 (bucket, count, start))
+        return [LocalReplay(*row) for row in cursor]
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM replays").fetchone()[0]
+
+    def close(self):
+        self.db.close()
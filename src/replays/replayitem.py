@@ -86,14 +86,15 @@ class ReplayItemDelegate(QtGui.QStyledItemDelegate):
 
 
 
-class ReplayItem(QtGui.QTreeWidgetItem):
-
+class ReplayItem(object):
+    '''
+    A replay from the online vault, shown in the onlineTree by replays.replaymodel.OnlineReplayModel.
+    '''
     
     FORMATTER_REPLAY        = unicode(util.readfile("replays/formatters/replay.qthtml"))
 
     
-    def __init__(self, uid, parent, *args, **kwargs):
-        QtGui.QTreeWidgetItem.__init__(self, *args, **kwargs)
+    def __init__(self, uid, parent):
 
         
         self.uid            = uid
@@ -120,8 +121,6 @@ class ReplayItem(QtGui.QTreeWidgetItem):
 
         self.options        = []
         self.players        = []
-        
-        self.setHidden(True)
 
     
     def update(self, message, client):
@@ -139,14 +138,8 @@ class ReplayItem(QtGui.QTreeWidgetItem):
         self.startDate  = time.strftime("%Y-%m-%d", time.localtime(message['start']))
         self.mod        = message["mod"]
          
-        # Map preview code
+        # The map preview is loaded by the model, once the replay is visible
         self.mapdisplayname = maps.getDisplayName(self.mapname)
-      
-        self.icon = maps.preview(self.mapname)
-        if not self.icon:
-            self.client.downloader.downloadMap(self.mapname, self, True)
-            self.icon = util.icon("games/unknown_map.png")        
-        #self.setIcon(0, self.icon)
         
         self.moddisplayname = self.mod
         self.modoptions = []
@@ -276,7 +269,7 @@ class ReplayItem(QtGui.QTreeWidgetItem):
         self.replayInfo = ('<h2>Replay UID : %i</h2></br></br><table border="0" cellpadding="0" cellspacing="5"><tbody><tr>%s</tr></tbody></table>') % (self.uid, teams)
         
         
-        if self.isSelected() :
+        if self.parent.selectedOnlineReplay() is self :
             self.parent.replayInfos.clear()
             self.parent.replayInfos.setHtml(self.replayInfo)
 
@@ -291,19 +284,6 @@ class ReplayItem(QtGui.QTreeWidgetItem):
     def downloadReplay(self):
         QtGui.QDesktopServices.openUrl(QtCore.QUrl(self.url))
 
-    def display(self, column):
-        if column == 0 :
-            return self.viewtext
-        if column == 1 :
-            return self.viewtext   
- 
-    def data(self, column, role):
-        if role == QtCore.Qt.DisplayRole:
-            return self.display(column)  
-        elif role == QtCore.Qt.UserRole :
-            return self
-        return super(ReplayItem, self).data(column, role)
- 
     def permutations(self, items):
         """Yields all permutations of the items."""
         if items == []:
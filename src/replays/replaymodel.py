@@ -0,0 +1,337 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+from PyQt4 import QtCore, QtGui
+import time
+
+import fa
+import util
+import client
+
+from replays.localindex import BUCKET_LEGACY, BUCKET_INCOMPLETE, BUCKET_BROKEN
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Replays are added to an expanded bucket this many at a time, as the view scrolls down to them
+PAGE_SIZE = 100
+
+
+class MapPreviewLoader(QtCore.QObject):
+    '''
+    Gets map previews from the fa.previews.MapPreviewService only for the rows a view actually paints.
+    icon() hands out a placeholder until the preview is ready, then previewLoaded is emitted.
+    '''
+    previewLoaded = QtCore.pyqtSignal(str)
+
+    def __init__(self, previews, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.previews = previews
+        self.waiting = set()
+        self.placeholder = util.icon("games/unknown_map.png")
+
+    def icon(self, mapname):
+        future = self.previews.request(mapname)
+        if future.done:
+            return future.icon
+
+        if mapname not in self.waiting:
+            self.waiting.add(mapname)
+            future.finished.connect(lambda icon, mapname=mapname: self.loaded(mapname))
+        return self.placeholder
+
+    def loaded(self, mapname):
+        # A preview that couldn't be had is asked for again, with a new future
+        self.waiting.discard(mapname)
+        self.previewLoaded.emit(mapname)
+
+
+class _Bucket(object):
+    def __init__(self, row, name, count):
+        self.row = row
+        self.name = name
+        self.count = count
+        self.children = []
+
+
+class BucketModel(QtCore.QAbstractItemModel):
+    '''
+    Two level model: buckets (e.g. days) on top, and their replays below. A bucket only holds
+    the replays that were fetched so far, fetchMore() adds them a page at a time. Subclasses
+    provide the bucket contents and the data of both levels.
+    '''
+    COLUMNS = 1
+
+    def __init__(self, previews, *args, **kwargs):
+        QtCore.QAbstractItemModel.__init__(self, *args, **kwargs)
+        self.buckets = []
+        self.previews = previews
+        self.previews.previewLoaded.connect(self.previewLoaded)
+
+    def setBuckets(self, buckets):
+        ''' Resets the model to the given (name, count) pairs, with no replays fetched yet '''
+        self.beginResetModel()
+        self.buckets = [_Bucket(row, name, count) for row, (name, count) in enumerate(buckets)]
+        self.endResetModel()
+
+    def fetchReplays(self, bucket, start, count):
+        ''' The replays of the named bucket from start on, at most count of them '''
+        return []
+
+    def bucketData(self, bucket, column, role):
+        return None
+
+    def replayData(self, replay, column, role):
+        return None
+
+    def replay(self, index):
+        ''' The replay at index, None for buckets '''
+        bucket = index.internalPointer() if index.isValid() else None
+        if bucket is None:
+            return None
+        return bucket.children[index.row()]
+
+    def bucketIndex(self, name):
+        for bucket in self.buckets:
+            if bucket.name == name:
+                return self.createIndex(bucket.row, 0)
+        return QtCore.QModelIndex()
+
+    def bucketName(self, index):
+        if not index.isValid() or index.internalPointer() is not None:
+            return None
+        return self.buckets[index.row()].name
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column)
+        return self.createIndex(row, column, self.buckets[parent.row()])
+
+    def parent(self, index):
+        bucket = index.internalPointer() if index.isValid() else None
+        if bucket is None:
+            return QtCore.QModelIndex()
+        return self.createIndex(bucket.row, 0)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return len(self.buckets)
+        if parent.internalPointer() is None:
+            return len(self.buckets[parent.row()].children)
+        return 0
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return self.COLUMNS
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return bool(self.buckets)
+        if parent.internalPointer() is None:
+            return self.buckets[parent.row()].count > 0
+        return False
+
+    def canFetchMore(self, parent):
+        if not parent.isValid() or parent.internalPointer() is not None:
+            return False
+        bucket = self.buckets[parent.row()]
+        return len(bucket.children) < bucket.count
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        bucket = self.buckets[parent.row()]
+        start = len(bucket.children)
+        replays = self.fetchReplays(bucket.name, start, min(PAGE_SIZE, bucket.count - start))
+        if not replays:
+            # The source has fewer replays than it claimed, don't try again
+            bucket.count = start
+            return
+        self.beginInsertRows(parent, start, start + len(replays) - 1)
+        bucket.children.extend(replays)
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        bucket = index.internalPointer()
+        if bucket is None:
+            return self.bucketData(self.buckets[index.row()], index.column(), role)
+        return self.replayData(bucket.children[index.row()], index.column(), role)
+
+    @QtCore.pyqtSlot(str)
+    def previewLoaded(self, mapname):
+        # The preview is in the first column of the replays on that map
+        for bucket in self.buckets:
+            for row, replay in enumerate(bucket.children):
+                if getattr(replay, "mapname", None) == mapname:
+                    index = self.createIndex(row, 0, bucket)
+                    self.dataChanged.emit(index, index)
+
+
+class LocalReplayModel(BucketModel):
+    '''
+    The local replays, as listed by a replays.localindex.LocalReplayIndex. Buckets are days,
+    plus the legacy, incomplete and broken buckets.
+    '''
+    COLUMNS = 4
+
+    def __init__(self, replayIndex, *args, **kwargs):
+        BucketModel.__init__(self, *args, **kwargs)
+        self.replayIndex = replayIndex
+
+    def reload(self):
+        self.setBuckets(self.replayIndex.buckets())
+
+    def fetchReplays(self, bucket, start, count):
+        return self.replayIndex.replays(bucket, start, count)
+
+    def bucketData(self, bucket, column, role):
+        if role == QtCore.Qt.DisplayRole:
+            if column == 0:
+                return bucket.name
+            if column == 1:
+                if bucket.name == BUCKET_BROKEN:
+                    return "(not watchable)"
+                if bucket.name == BUCKET_INCOMPLETE:
+                    return "(watchable)"
+                if bucket.name == BUCKET_LEGACY:
+                    return "(old replay system)"
+            if column == 3:
+                return str(bucket.count) + " replays"
+
+        elif role == QtCore.Qt.DecorationRole and column == 0:
+            return util.icon("replays/bucket.png")
+
+        elif role == QtCore.Qt.ForegroundRole:
+            if column == 0:
+                if bucket.name == BUCKET_BROKEN:
+                    return QtGui.QColor("red") #FIXME: Needs to come from theme
+                if bucket.name == BUCKET_INCOMPLETE:
+                    return QtGui.QColor("yellow") #FIXME: Needs to come from theme
+                if bucket.name != BUCKET_LEGACY:
+                    return QtGui.QColor(client.instance.getColor("player"))
+            return QtGui.QColor(client.instance.getColor("default"))
+
+        return None
+
+    def replayData(self, replay, column, role):
+        if replay.bucket == BUCKET_LEGACY:
+            if role == QtCore.Qt.DisplayRole and column == 1:
+                return replay.filename
+            if role == QtCore.Qt.DecorationRole and column == 0:
+                return util.icon("replays/replay.png")
+            if role == QtCore.Qt.ForegroundRole and column == 0:
+                return QtGui.QColor(client.instance.getColor("default"))
+
+        elif replay.bucket == BUCKET_INCOMPLETE:
+            if role == QtCore.Qt.DisplayRole:
+                if column == 1:
+                    return replay.filename
+                if column == 2:
+                    return "(replay doesn't have complete metadata)"
+            if role == QtCore.Qt.DecorationRole and column == 0:
+                return util.icon("replays/replay.png")
+            if role == QtCore.Qt.ForegroundRole and column == 1:
+                return QtGui.QColor("yellow") #FIXME: Needs to come from theme
+
+        elif replay.bucket == BUCKET_BROKEN:
+            if role == QtCore.Qt.DisplayRole:
+                if column == 1:
+                    return replay.filename
+                if column == 2:
+                    return "(replay parse error)"
+            if role == QtCore.Qt.DecorationRole and column == 0:
+                return util.icon("replays/broken.png")
+            if role == QtCore.Qt.ForegroundRole:
+                if column == 1:
+                    return QtGui.QColor("red")   #FIXME: Needs to come from theme
+                if column == 2:
+                    return QtGui.QColor("gray")  #FIXME: Needs to come from theme
+
+        else:
+            if role == QtCore.Qt.DisplayRole:
+                if column == 0:
+                    return time.strftime("%H:%M", time.localtime(replay.game_time))
+                if column == 1:
+                    return replay.title
+                if column == 2:
+                    return replay.players
+                if column == 3:
+                    return replay.featured_mod
+            elif role == QtCore.Qt.DecorationRole and column == 0:
+                return self.previews.icon(replay.mapname)
+            elif role == QtCore.Qt.ToolTipRole:
+                if column == 0:
+                    return fa.maps.getDisplayName(replay.mapname)
+                if column == 1:
+                    return replay.filename
+                if column == 2:
+                    return replay.players
+            elif role == QtCore.Qt.ForegroundRole:
+                if column == 0:
+                    return QtGui.QColor(client.instance.getColor("default"))
+                if column == 1:
+                    return QtGui.QColor(client.instance.getUserColor(replay.recorder))
+            elif role == QtCore.Qt.TextAlignmentRole and column == 3:
+                return QtCore.Qt.AlignCenter
+
+        return None
+
+
+class OnlineReplayModel(BucketModel):
+    '''
+    Results of a replay vault query (replays.replayitem.ReplayItems), bucketed by day, newest first.
+    '''
+    COLUMNS = 2
+
+    def __init__(self, *args, **kwargs):
+        BucketModel.__init__(self, *args, **kwargs)
+        self.results = {}
+
+    def setReplays(self, replays):
+        self.results = {}
+        for replay in replays:
+            self.results.setdefault(replay.startDate, []).append(replay)
+        for bucket in self.results.values():
+            bucket.sort(key=lambda replay: replay.uid, reverse=True)
+        self.setBuckets(sorted(((day, len(bucket)) for day, bucket in self.results.items()), reverse=True))
+
+    def fetchReplays(self, bucket, start, count):
+        return self.results[bucket][start:start + count]
+
+    def bucketData(self, bucket, column, role):
+        if role == QtCore.Qt.DisplayRole:
+            if column == 0:
+                return "<font color='white'>" + bucket.name + "</font>"
+            if column == 1:
+                return "<font color='white'>" + str(bucket.count) + " replays</font>"
+        elif role == QtCore.Qt.DecorationRole and column == 0:
+            return util.icon("replays/bucket.png")
+        return None
+
+    def replayData(self, replay, column, role):
+        if role == QtCore.Qt.DisplayRole:
+            return replay.viewtext
+        elif role == QtCore.Qt.DecorationRole and column == 0:
+            return self.previews.icon(replay.mapname)
+        elif role == QtCore.Qt.UserRole:
+            return replay
+        return None
@@ -20,6 +20,7 @@
 
 
 from PyQt4 import QtGui, QtCore, QtNetwork
+import collections
 import time
 import json
 import logging
@@ -30,22 +31,17 @@ logger = logging.getLogger(__name__)
 def log(string):
     logger.debug(string)
 
-# A set of exceptions we use to see what goes wrong during asynchronous data transfer waits
-class Cancellation(StandardError):
-    pass
-
-class Failure(StandardError):
-    pass    
-
-class Timeout(StandardError):
-    pass
-    
 
 class SecondaryServer(QtCore.QObject):
+    '''
+    Sends json commands to one of the secondary servers, one connection per command. Commands sent while
+    one is waiting for its answer are queued. An answer is passed to the requester's handle_<command> method.
+    '''
 
     # Network configuration
     HOST    = "lobby.faforever.com"
     TIMEOUT = 20  #seconds
+    INVISIBLE_TIMEOUT = 5  #seconds, for requests the user didn't ask for
 
     # Return codes to expect from run()
     RESULT_SUCCESS = 0      # successful
@@ -72,10 +68,19 @@ class SecondaryServer(QtCore.QObject):
         self.result = self.RESULT_NONE
         self.command = None
         self.message = None
+
+        self.queue = collections.deque()
+        self.current = None
+        self.progress = None
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.timedOut)
         
         self.blockSize = 0
         self.serverSocket = QtNetwork.QTcpSocket()
 
+        self.serverSocket.connected.connect(self.connected)
         self.serverSocket.error.connect(self.handleServerError)
         self.serverSocket.readyRead.connect(self.readDataFromServer)
         self.serverSocket.disconnected.connect(self.disconnected)
@@ -86,79 +91,75 @@ class SecondaryServer(QtCore.QObject):
         self.invisible = True
     
     def send(self, command, *args, **kwargs):
-        ''' actually do the settings'''
-                  
-        if self.serverSocket.state() == QtNetwork.QAbstractSocket.ConnectedState:
-            logger.info("A request is pending. Cancelling command")
-            return
-        
+        ''' Queues command, it's sent as soon as the ones before it are answered '''
+        self.queue.append(command)
+        if self.current is None:
+            self.sendNext()
+
+    def sendNext(self):
+        self.current = self.queue.popleft()
         self.result = self.RESULT_NONE
         self.command = None
         self.message = None
-        
-        self.progress = QtGui.QProgressDialog()        
-        self.progress.setCancelButtonText(None)
-        self.progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
-        self.progress.setAutoClose(False)
-        self.progress.setAutoReset(True)
-        self.progress.setModal(1)
-        self.progress.setWindowTitle("Connecting to %s server" % self.name)
+        self.blockSize = 0
+
         if not self.invisible:
+            self.progress = QtGui.QProgressDialog()
+            self.progress.setCancelButtonText(None)
+            self.progress.setWindowFlags(QtCore.Qt.CustomizeWindowHint | QtCore.Qt.WindowTitleHint)
+            self.progress.setAutoClose(False)
+            self.progress.setAutoReset(True)
+            self.progress.setModal(1)
+            self.progress.setWindowTitle("Connecting to %s server" % self.name)
+            self.progress.canceled.connect(self.cancel)
             self.progress.show()
-            self.progress.setLabelText("Connecting to server...")     
-           
-        self.lastData = time.time()
-        
+            self.progress.setLabelText("Connecting to server...")
 
-        self.serverSocket.connectToHost(self.HOST, self.socketPort)                         
+        self.lastData = time.time()
+        self.timer.start((self.INVISIBLE_TIMEOUT if self.invisible else self.TIMEOUT) * 1000)
+        self.serverSocket.connectToHost(self.HOST, self.socketPort)
 
-        if not self.invisible:
-            while not (self.serverSocket.state() == QtNetwork.QAbstractSocket.ConnectedState) and self.progress.isVisible():                
-                QtGui.QApplication.processEvents()
-            if not self.progress.wasCanceled():
-                self.doCommand(command)                     
-            else:
-                self.result = self.RESULT_CANCEL       
-            self.progress.setLabelText("Cleaning up.")
-            self.progress.close()                
-                         
-        else:
-            started = time.time()
-            cancelled = False
-            while not (self.serverSocket.state() == QtNetwork.QAbstractSocket.ConnectedState):
-                QtGui.QApplication.processEvents()
-                if time.time() - started > 5:
-                    cancelled = True
-                    self.result = self.RESULT_CANCEL
-                    break
-            if not cancelled:
-                self.doCommand(command)
-
-        return self.result  
-
-    def doCommand(self, command):
-        ''' The core function that does most of the actual work.'''
-        self.sendJson(command)
-        self.waitForInfo()
-              
-    def waitForInfo(self):
-        '''
-        A simple loop that waits until the server has transmitted our info.
-        '''        
-        if not self.invisible:
+    @QtCore.pyqtSlot()
+    def connected(self):
+        if self.current is None:
+            return
+        if self.progress is not None:
             self.progress.setValue(0)
             self.progress.setMinimum(0)
             self.progress.setMaximum(0)
-        while self.result == self.RESULT_NONE :
-            if not self.invisible:
-                if (self.progress.wasCanceled()) : logger.error("Operation aborted while waiting for info.")
-                if (time.time() - self.lastData > self.TIMEOUT) : logger.error("Operation timed out while waiting for info.")
-            QtGui.QApplication.processEvents()
+        self.sendJson(self.current)
+
+    @QtCore.pyqtSlot()
+    def cancel(self):
+        self.finishRequest(self.RESULT_CANCEL)
+
+    @QtCore.pyqtSlot()
+    def timedOut(self):
+        logger.error("Operation timed out while waiting for info.")
+        self.finishRequest(self.RESULT_FAILURE)
+
+    def finishRequest(self, result):
+        '''
+        Ends the request in flight (only the first call counts), hands its answer to the requester and sends the next one.
+        '''
+        if self.current is None:
+            return
         logger.debug("Finishing request")
-        self.result = self.RESULT_NONE
-        
-        if self.command != None and self.message != None:
+        self.current = None
+        self.result = result
+
+        self.timer.stop()
+        self.serverSocket.abort()
+        if self.progress is not None:
+            self.progress.close()
+            self.progress = None
+
+        if self.result == self.RESULT_SUCCESS and self.command != None and self.message != None:
             getattr(self.requester, self.command)(self.message)
+
+        # The requester may have sent the next one already
+        if self.current is None and self.queue:
+            self.sendNext()
             
     def sendJson(self, message):
         data = json.dumps(message)
@@ -221,9 +222,8 @@ class SecondaryServer(QtCore.QObject):
         if hasattr(self.requester, cmd):
             self.command = cmd
             self.message = message
-        
-        self.serverSocket.abort()        
-        self.result = self.RESULT_SUCCESS
+
+        self.finishRequest(self.RESULT_SUCCESS)
             
         
         
@@ -244,7 +244,7 @@ class SecondaryServer(QtCore.QObject):
         else:
             log("The following error occurred: %s." % self.serverSocket.errorString())    
 
-        self.result = self.RESULT_FAILURE  
+        self.finishRequest(self.RESULT_FAILURE)
 
     @QtCore.pyqtSlot()
     def disconnected(self):
@@ -254,4 +254,5 @@ class SecondaryServer(QtCore.QObject):
 
     @QtCore.pyqtSlot(QtNetwork.QAbstractSocket.SocketError)
     def errored(self, error):
-        self.result = self.RESULT_FAILURE
+        #handleServerError ends the request
+        pass
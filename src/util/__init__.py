@@ -56,6 +56,9 @@ THEME_DIR = os.path.join(APPDATA_DIR, "themes")
 #This contains cached data downloaded while communicating with the lobby - at the moment, mostly map preview pngs.
 CACHE_DIR = os.path.join(APPDATA_DIR, "cache")
 
+#This contains maps and mods while they're being downloaded, so interrupted downloads can be resumed.
+DOWNLOAD_DIR = os.path.join(CACHE_DIR, "downloads")
+
 #This contains cached data downloaded for FA extras
 EXTRA_DIR = os.path.join(APPDATA_DIR, "extra")
 
@@ -89,9 +92,6 @@ if not os.path.exists(LOCALFOLDER):
                                "Gas Powered Games", "Supreme Commander Forged Alliance")
 PREFSFILENAME = os.path.join(LOCALFOLDER, "game.prefs")
 
-DOWNLOADED_RES_PIX = {}
-DOWNLOADING_RES_PIX = {}
-
 # This should be "My Documents" for most users. However, users with accents in their names can't even use these folders in Supcom
 # so we are nice and create a new home for them in the APPDATA_DIR
 try:
@@ -122,6 +122,9 @@ if not os.path.isdir(LUA_DIR):
 if not os.path.isdir(CACHE_DIR):
     os.makedirs(CACHE_DIR)
 
+if not os.path.isdir(DOWNLOAD_DIR):
+    os.makedirs(DOWNLOAD_DIR)
+
 if not os.path.isdir(THEME_DIR):
     os.makedirs(THEME_DIR)
 
@@ -186,7 +189,6 @@ def clearDirectory(directory, confirm=True):
 
 
 # Theme and settings
-__pixmapcache = {}
 __theme = None
 __themedir = None
 
@@ -198,6 +200,14 @@ settings = QtCore.QSettings("ForgedAllianceForever", "FA Lobby")
 from PyQt4 import QtNetwork
 network = QtNetwork.QNetworkAccessManager()
 
+# Public image cache, for pixmaps loaded from files as well as downloaded ones
+import imagecache
+images = imagecache.ImageCache(os.path.join(CACHE_DIR, "images"))
+
+# Public download engine, for maps, mods and featured mod files
+import downloadengine
+downloads = downloadengine.DownloadEngine()
+
 def clean_slate(path):
     if os.path.exists(path):
         logger.info("Wiping " + path)
@@ -275,46 +285,25 @@ def listThemes():
     return themes
 
 
-def curDownloadAvatar(url):
-    if url in DOWNLOADING_RES_PIX:
-        return DOWNLOADING_RES_PIX[url]
-    return None
-
-
-def removeCurrentDownloadAvatar(url, player, item):
-    if url in DOWNLOADING_RES_PIX:
-        DOWNLOADING_RES_PIX[url].remove(player)
-
-
-def addcurDownloadAvatar(url, player):
-    if url in DOWNLOADING_RES_PIX:
-        if not player in DOWNLOADING_RES_PIX[url]:
-            DOWNLOADING_RES_PIX[url].append(player)
-        return False
-    else:
-        DOWNLOADING_RES_PIX[url] = []
-        DOWNLOADING_RES_PIX[url].append(player)
-        return True
-
-
 def addrespix(url, pixmap):
-    DOWNLOADED_RES_PIX[url] = pixmap
+    images.memory.put(url, pixmap)
 
 
 def respix(url):
-    if url in DOWNLOADED_RES_PIX:
-        return DOWNLOADED_RES_PIX[url]
-    return None
+    '''
+    Returns the downloaded pixmap for url if it's in memory, or None. Called for every chat line,
+    so it never touches the disk: images.request() loads or downloads the missing ones.
+    '''
+    return images.memory.get(url)
 
 
 def pixmap(filename, themed=True):
     '''
     This function loads a pixmap from a themed directory, or anywhere.
-    It also stores them in a cache dictionary (may or may not be necessary depending on how Qt works under the hood)
+    It also stores them in the memory tier of the image cache, which evicts the least recently used ones.
     '''
-    try:
-        return __pixmapcache[filename]
-    except:
+    pix = images.memory.get(filename)
+    if pix is None:
         if themed:
             if __themedir and os.path.isfile(os.path.join(__themedir, filename)):
                 pix = QtGui.QPixmap(os.path.join(__themedir, filename))
@@ -323,9 +312,8 @@ def pixmap(filename, themed=True):
         else:
             pix = QtGui.QPixmap(filename)  #Unthemed means this can come from any location
 
-        __pixmapcache[filename] = pix
-        return pix
-    return None
+        images.memory.put(filename, pix)
+    return pix
 
 
 def loadUi(filename, themed=True):
@@ -532,50 +520,8 @@ def showInExplorer(location):
     subprocess.Popen(_command)
 
 
-html_escape_table = {
-    "&": "&amp;",
-    '"': "&quot;",
-    "'": "&apos;",
-    ">": "&gt;",
-    "<": "&lt;"
-}
-
-
-def html_escape(text):
-    """Produce entities within text."""
-    return "".join(html_escape_table.get(c, c) for c in text)
-
-
-def irc_escape(text, a_style=""):
-    #first, strip any and all html
-    text = html_escape(text)
-
-    #taken from django and adapted
-    url_re = re.compile(
-        r'^((https?|faflive|fafgame|fafmap|ftp|ts3server)://)?'  # protocols    
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'  # domain name, then TLDs
-        r'(?:ac|ad|ae|aero|af|ag|ai|al|am|an|ao|aq|ar|arpa|as|asia|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|biz|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cat|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|com|coop|cr|cu|cv|cw|cx|cy|cz|de|dj|dk|dm|do|dz|ec|edu|ee|eg|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gov|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|info|int|io|iq|ir|is|it|je|jm|jo|jobs|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mil|mk|ml|mm|mn|mo|mobi|mp|mq|mr|ms|mt|mu|museum|mv|mw|mx|my|mz|na|name|nc|ne|net|nf|ng|ni|nl|no|np|nr|nu|nz|om|org|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|pro|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|sk|sl|sm|sn|so|sr|st|su|sv|sx|sy|sz|tc|td|tel|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|travel|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|xxx|ye|yt|za|zm|zw)'
-        r'|localhost'  # localhost...
-        r'|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-        r'(?::\d+)?'  # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-
-    # Tired of bothering with end-of-word cases in this regex
-    # I'm splitting the whole string and matching each fragment start-to-end as a whole
-    strings = text.split()
-    result = []
-    for fragment in strings:
-        match = url_re.match(fragment)
-        if match:
-            if "://" in fragment:  #slight hack to get those protocol-less URLs on board. Better: With groups!
-                rpl = '<a href="{0}" style="{1}">{0}</a>'.format(fragment, a_style)
-            else:
-                rpl = '<a href="http://{0}" style="{1}">{0}</a>'.format(fragment, a_style)
-
-            fragment = fragment.replace(match.group(0), rpl)
-
-        result.append(fragment)
-    return " ".join(result)
+# Escaping and linkifying of chat text
+from ircformat import html_escape, irc_escape
 
 
 def md5text(text):
@@ -0,0 +1,53 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+'''
+Collects items that come in bursts (like the names of the players a batch of server messages
+is about) and hands them on once per interval, rather than one signal per message.
+'''
+
+from PyQt4 import QtCore
+
+
+class Coalescer(QtCore.QObject):
+    '''
+    flushed is emitted with the distinct items added since the last time, at most once per
+    interval (in ms). Nothing runs while no items are added.
+    '''
+    flushed = QtCore.pyqtSignal(list)
+
+    def __init__(self, interval, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.pending = set()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def add(self, items):
+        self.pending.update(items)
+        if self.pending and not self.timer.isActive():
+            self.timer.start()
+
+    @QtCore.pyqtSlot()
+    def flush(self):
+        self.timer.stop()
+        items, self.pending = list(self.pending), set()
+        if items:
+            self.flushed.emit(items)
@@ -0,0 +1,312 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+The download engine behind util.downloads, used for maps, mods and featured mod files.
+
+Downloads run on one QNetworkAccessManager, which keeps connections to the content server
+alive between them, a few at a time. They're written to disk as they arrive, into a ".part"
+file next to their destination, and pick up where they stopped (with an HTTP Range request)
+when the connection drops or a later attempt finds the part file.
+'''
+
+import collections
+import hashlib
+import logging
+import os
+
+from PyQt4 import QtCore, QtNetwork
+
+logger = logging.getLogger(__name__)
+
+# Transfers running at the same time, the rest wait in line
+MAX_TRANSFERS = 4
+
+# Attempts per download before giving up, each one resuming the last
+MAX_ATTEMPTS = 3
+
+# Milliseconds before the next attempt, times the attempts so far
+RETRY_DELAY = 1000
+
+MAX_REDIRECTS = 5
+
+PART_SUFFIX = ".part"
+
+# Statuses that won't change by trying again
+PERMANENT_FAILURES = frozenset([401, 403, 404, 410])
+
+_REDIRECTS = frozenset([301, 302, 303, 307, 308])
+
+_HASH_BLOCK_SIZE = 64 * 1024
+
+
+class Download(QtCore.QObject):
+    '''
+    A file being downloaded by a DownloadEngine. Emits progress(received, total), total being 0
+    while unknown, and finished() once it succeeded, failed or was aborted. error is None if it
+    succeeded, status is the last HTTP status code.
+    '''
+    progress = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, engine, url, path, md5=None):
+        QtCore.QObject.__init__(self, engine)
+        self.engine = engine
+        self.url = url
+        self.path = path
+        self.partPath = path + PART_SUFFIX
+        self.md5 = md5.lower() if md5 else None
+
+        self.received = 0
+        self.total = 0
+        self.status = None
+        self.error = None
+        self.done = False
+        self.aborted = False
+
+        self.attempts = 0
+        self.redirects = 0
+        self.offset = 0
+        self.reply = None
+        self.file = None
+        self.hash = None
+
+    @property
+    def succeeded(self):
+        return self.done and self.error is None
+
+    def abort(self):
+        ''' Stops the download, keeping what it got so far for the next attempt '''
+        if self.done:
+            return
+        self.aborted = True
+        if self.reply is not None:
+            self.reply.abort()
+        else:
+            self._done("Aborted")
+
+    def start(self, url=None):
+        if self.aborted:
+            return
+        if url is None:
+            self.attempts += 1
+            url = self.url
+
+        directory = os.path.dirname(self.partPath)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.offset = os.path.getsize(self.partPath) if os.path.isfile(self.partPath) else 0
+        self.status = None
+
+        request = QtNetwork.QNetworkRequest(QtCore.QUrl(url))
+        request.setRawHeader("User-Agent", "FAF Client")
+        if self.offset:
+            request.setRawHeader("Range", "bytes=%d-" % self.offset)
+
+        self.reply = self.engine.network.get(request)
+        self.reply.metaDataChanged.connect(self._metaData)
+        self.reply.readyRead.connect(self._read)
+        self.reply.downloadProgress.connect(self._progress)
+        self.reply.finished.connect(self._finished)
+
+    def _hashPart(self):
+        ''' Starts the md5 with what's already in the part file '''
+        self.hash = hashlib.md5()
+        with open(self.partPath, "rb") as part:
+            for block in iter(lambda: part.read(_HASH_BLOCK_SIZE), ""):
+                self.hash.update(block)
+
+    @QtCore.pyqtSlot()
+    def _metaData(self):
+        self.status = self.reply.attribute(QtNetwork.QNetworkRequest.HttpStatusCodeAttribute)
+        if self.file is not None:
+            return
+
+        if self.status == 206:
+            logger.debug("Resuming %s at %d bytes" % (self.url, self.offset))
+            if self.md5:
+                self._hashPart()
+            self.file = open(self.partPath, "ab")
+        elif self.status == 200:
+            # Either a fresh start, or the server can't resume
+            self.offset = 0
+            self.hash = hashlib.md5() if self.md5 else None
+            self.file = open(self.partPath, "wb")
+
+    @QtCore.pyqtSlot()
+    def _read(self):
+        data = self.reply.readAll()
+        if self.file is None:
+            # Body of a redirect or an error page
+            return
+        data = str(data)
+        self.file.write(data)
+        if self.hash:
+            self.hash.update(data)
+
+    @QtCore.pyqtSlot(int, int)
+    def _progress(self, received, total):
+        if self.file is None:
+            return
+        self.received = self.offset + received
+        if total > 0:
+            self.total = self.offset + total
+        self.progress.emit(self.received, self.total)
+
+    @QtCore.pyqtSlot()
+    def _finished(self):
+        reply, self.reply = self.reply, None
+        reply.deleteLater()
+        if self.file is not None:
+            self._read()
+            self.file.close()
+            self.file = None
+
+        if self.aborted:
+            self._done("Aborted")
+            return
+
+        target = reply.attribute(QtNetwork.QNetworkRequest.RedirectionTargetAttribute)
+        if self.status in _REDIRECTS and target is not None:
+            if self.redirects >= MAX_REDIRECTS:
+                self._done("Too many redirects")
+            else:
+                self.redirects += 1
+                self.start(reply.url().resolved(target).toString())
+            return
+
+        if self.status == 416:
+            # The part file doesn't fit what's on the server (anymore), start over
+            os.remove(self.partPath)
+            self._retry("Requested range not satisfiable")
+            return
+
+        if reply.error() != QtNetwork.QNetworkReply.NoError:
+            if self.status in PERMANENT_FAILURES:
+                self._done(reply.errorString())
+            else:
+                self._retry(reply.errorString())
+            return
+
+        if self.status not in (200, 206):
+            self._done("Unexpected HTTP status %s" % self.status)
+            return
+
+        size = os.path.getsize(self.partPath)
+        if self.total and size != self.total:
+            self._retry("Got %d of %d bytes" % (size, self.total))
+            return
+
+        if self.md5 and self.hash.hexdigest() != self.md5:
+            os.remove(self.partPath)
+            self._done("Checksum mismatch")
+            return
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.partPath, self.path)
+        self._done(None)
+
+    def _retry(self, error):
+        if self.attempts >= MAX_ATTEMPTS:
+            self._done(error)
+            return
+        logger.warn("Download of %s failed (%s), trying again" % (self.url, error))
+        QtCore.QTimer.singleShot(RETRY_DELAY * self.attempts, self.start)
+
+    def _done(self, error):
+        self.error = error
+        self.done = True
+        if error:
+            logger.warn("Download of %s failed: %s" % (self.url, error))
+        else:
+            logger.debug("Downloaded %s to %s" % (self.url, self.path))
+        self.engine.downloadDone(self)
+        self.finished.emit()
+
+
+class DownloadEngine(QtCore.QObject):
+    '''
+    Runs up to transfers Downloads at once, over connections that stay open between them.
+    '''
+    def __init__(self, transfers=MAX_TRANSFERS, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.transfers = transfers
+        self.network = QtNetwork.QNetworkAccessManager(self)
+        self.queue = collections.deque()
+        self.active = []
+
+    def download(self, url, path, md5=None):
+        ''' Queues the download of url to path, optionally checked against an md5 hex digest. Returns the Download. '''
+        download = Download(self, url, path, md5)
+        self.queue.append(download)
+        self._startNext()
+        return download
+
+    def downloadDone(self, download):
+        if download in self.active:
+            self.active.remove(download)
+        if download in self.queue:
+            self.queue.remove(download)
+        self._startNext()
+
+    def _startNext(self):
+        while self.queue and len(self.active) < self.transfers:
+            download = self.queue.popleft()
+            self.active.append(download)
+            download.start()
+
+
+def wait(downloads, progress=None):
+    '''
+    Runs an event loop until all downloads are finished, and returns True if they all succeeded.
+    If progress (a QProgressDialog) is given, it shows their combined progress, and cancelling it
+    aborts them.
+    '''
+    loop = QtCore.QEventLoop()
+    pending = set(download for download in downloads if not download.done)
+
+    def finished(download):
+        pending.discard(download)
+        if not pending:
+            loop.quit()
+
+    def update(*args):
+        total = sum(download.total for download in downloads)
+        progress.setMaximum(total if all(download.total for download in downloads) else 0)
+        progress.setValue(sum(download.received for download in downloads))
+
+    def cancel():
+        for download in downloads:
+            download.abort()
+
+    for download in pending:
+        download.finished.connect(lambda download=download: finished(download))
+    if progress is not None:
+        progress.setMinimum(0)
+        for download in downloads:
+            download.progress.connect(update)
+        progress.canceled.connect(cancel)
+        update()
+
+    if pending:
+        loop.exec_()
+
+    if progress is not None:
+        progress.canceled.disconnect(cancel)
+    return all(download.succeeded for download in downloads)
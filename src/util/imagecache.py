@@ -0,0 +1,338 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+The image cache behind util.pixmap() and everything downloaded from the content server
+(map and mod previews, avatars).
+
+Two tiers: a PixmapLRU of decoded QPixmaps, bounded by their size in bytes, and a DiskStore
+that keeps the downloaded files under the hash of their content and remembers the ETag and
+Last-Modified headers they came with, so they can be revalidated instead of downloaded again.
+'''
+
+import collections
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+from PyQt4 import QtCore, QtGui, QtNetwork
+
+logger = logging.getLogger(__name__)
+
+# Bump when the table layout changes, the index is then rebuilt (and the images downloaded again)
+SCHEMA_VERSION = 1
+
+# Decoded pixmaps kept in memory, in bytes
+MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Null pixmaps (files that don't exist) are cached too, this keeps them from piling up for free
+MIN_PIXMAP_COST = 64
+
+# Downloaded images are used without asking the server for this long, in seconds
+REVALIDATE_AFTER = 24 * 3600
+
+# After a 404 the url isn't tried again for this long, in seconds
+NEGATIVE_TTL = 6 * 3600
+
+STATUS_OK = 200
+STATUS_NOT_MODIFIED = 304
+STATUS_NOT_FOUND = 404
+
+# Counted in ImageCache.metrics
+METRICS = ("memory_hits", "memory_misses", "evictions", "disk_hits", "disk_misses",
+           "fetches", "not_modified", "not_found", "negative_hits", "errors")
+
+
+def pixmapCost(pixmap):
+    ''' Bytes a decoded pixmap takes up '''
+    return max(pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8, MIN_PIXMAP_COST)
+
+
+class PixmapLRU(object):
+    '''
+    Least recently used pixmaps, evicted once their total cost goes over budget.
+    '''
+    def __init__(self, budget, metrics):
+        self.budget = budget
+        self.metrics = metrics
+        self.size = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.metrics["memory_misses"] += 1
+            return None
+        self.entries[key] = entry
+        self.metrics["memory_hits"] += 1
+        return entry[0]
+
+    def put(self, key, pixmap):
+        self.discard(key)
+        cost = pixmapCost(pixmap)
+        self.entries[key] = (pixmap, cost)
+        self.size += cost
+
+        # The newest entry always stays, even if it's over budget on its own
+        while self.size > self.budget and len(self.entries) > 1:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+            self.metrics["evictions"] += 1
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# status is STATUS_OK or STATUS_NOT_FOUND (digest is None then). checked is when the server last confirmed it.
+DiskEntry = collections.namedtuple("DiskEntry", "url digest etag last_modified status checked")
+
+
+class DiskStore(object):
+    '''
+    Downloaded images, stored in files named after the sha1 of their content, so an image served
+    under several urls is kept once. An SQLite table maps the urls to their content, the headers
+    needed to revalidate it, and the urls that came back 404.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"))
+
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            logger.info("Creating image cache index in " + directory)
+            with self.db:
+                self.db.execute("DROP TABLE IF EXISTS images")
+                self.db.execute("CREATE TABLE images (url TEXT PRIMARY KEY, digest TEXT, etag TEXT, "
+                                "last_modified TEXT, status INTEGER, checked REAL)")
+                self.db.execute("CREATE INDEX images_digest ON images (digest)")
+                self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+
+    def entry(self, url):
+        row = self.db.execute("SELECT * FROM images WHERE url = ?", (url,)).fetchone()
+        return DiskEntry(*row) if row else None
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, url, data, etag=None, last_modified=None, checked=None):
+        ''' Stores data (a str) as the content of url, and returns the file it's in '''
+        digest = hashlib.sha1(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.isfile(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path + ".part", "wb") as f:
+                f.write(data)
+            os.rename(path + ".part", path)
+
+        self._replace(DiskEntry(url, digest, etag, last_modified, STATUS_OK, checked or time.time()))
+        return path
+
+    def putMissing(self, url, checked=None):
+        ''' Records that url is a 404 '''
+        self._replace(DiskEntry(url, None, None, None, STATUS_NOT_FOUND, checked or time.time()))
+
+    def touch(self, url, checked=None):
+        ''' Records that the server confirmed the content of url is still current '''
+        with self.db:
+            self.db.execute("UPDATE images SET checked = ? WHERE url = ?", (checked or time.time(), url))
+
+    def _replace(self, entry):
+        old = self.entry(entry.url)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)", entry)
+        if old is not None and old.digest and old.digest != entry.digest:
+            self._release(old.digest)
+
+    def _release(self, digest):
+        ''' Deletes the file for digest, unless another url still has that content '''
+        if self.db.execute("SELECT 1 FROM images WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+            return
+        try:
+            os.remove(self.path(digest))
+        except OSError:
+            pass
+
+    def close(self):
+        self.db.close()
+
+
+class ImageCache(QtCore.QObject):
+    '''
+    Memory and disk cache of images by url (or file name, for util.pixmap()). request() gets an
+    image from wherever it's cheapest: memory, a fresh copy on disk, or the server, revalidating
+    the copy on disk if there is one. Requests for a url that's already being fetched wait for
+    that fetch.
+    '''
+    def __init__(self, directory, budget=MEMORY_BUDGET, *args, **kwargs):
+        QtCore.QObject.__init__(self, *args, **kwargs)
+        self.metrics = collections.Counter(dict.fromkeys(METRICS, 0))
+        self.memory = PixmapLRU(budget, self.metrics)
+        self.directory = directory
+        self._disk = None
+
+        self.pending = {}
+        self.network = QtNetwork.QNetworkAccessManager(self)
+        self.network.finished.connect(self.finishedRequest)
+
+    @property
+    def disk(self):
+        # Opened on first use, util creates the cache at import time
+        if self._disk is None:
+            self._disk = DiskStore(self.directory)
+        return self._disk
+
+    def pixmap(self, url):
+        ''' Returns the cached QPixmap for url, from memory or disk, or None. Never goes to the network. '''
+        pixmap = self.memory.get(url)
+        if pixmap is not None:
+            return pixmap
+
+        entry = self.disk.entry(url)
+        if entry is not None and entry.status == STATUS_OK:
+            pixmap = QtGui.QPixmap(self.disk.path(entry.digest))
+            if not pixmap.isNull():
+                self.metrics["disk_hits"] += 1
+                self.memory.put(url, pixmap)
+                return pixmap
+
+        self.metrics["disk_misses"] += 1
+        return None
+
+    def path(self, url, fresh=False):
+        ''' Returns the file holding the image for url, or None. If fresh, only if it's not due for revalidation. '''
+        entry = self.disk.entry(url)
+        if entry is None or entry.status != STATUS_OK:
+            return None
+        if fresh and time.time() - entry.checked >= REVALIDATE_AFTER:
+            return None
+        path = self.disk.path(entry.digest)
+        return path if os.path.isfile(path) else None
+
+    def isMissing(self, url):
+        ''' True if url was a 404 not long ago '''
+        entry = self.disk.entry(url)
+        if entry is not None and entry.status == STATUS_NOT_FOUND and time.time() - entry.checked < NEGATIVE_TTL:
+            self.metrics["negative_hits"] += 1
+            return True
+        return False
+
+    def store(self, url, data, etag=None, last_modified=None):
+        ''' Adds an image downloaded elsewhere, returns the file it's in '''
+        self.memory.discard(url)
+        return self.disk.put(url, data, etag, last_modified)
+
+    def storeMissing(self, url):
+        ''' Records a 404 found elsewhere '''
+        self.memory.discard(url)
+        self.disk.putMissing(url)
+
+    def request(self, url, callback):
+        '''
+        Calls callback with the QPixmap for url, or None if there isn't one. That happens right away
+        if the image is in memory, fresh on disk or a recent 404, otherwise once the server answered.
+        '''
+        pixmap = self.memory.get(url)
+        if pixmap is not None:
+            callback(pixmap)
+            return
+
+        if url in self.pending:
+            self.pending[url].append(callback)
+            return
+
+        if self.isMissing(url):
+            callback(None)
+            return
+
+        if self.path(url, fresh=True):
+            callback(self.pixmap(url))
+            return
+
+        self.pending[url] = [callback]
+
+        request = QtNetwork.QNetworkRequest(QtCore.QUrl(url))
+        request.setAttribute(QtNetwork.QNetworkRequest.User, url)
+        entry = self.disk.entry(url)
+        if entry is not None and entry.status == STATUS_OK and self.path(url):
+            if entry.etag:
+                request.setRawHeader("If-None-Match", entry.etag)
+            if entry.last_modified:
+                request.setRawHeader("If-Modified-Since", entry.last_modified)
+
+        self.metrics["fetches"] += 1
+        self.network.get(request)
+
+    @QtCore.pyqtSlot(QtNetwork.QNetworkReply)
+    def finishedRequest(self, reply):
+        url = reply.request().attribute(QtNetwork.QNetworkRequest.User)
+        status = reply.attribute(QtNetwork.QNetworkRequest.HttpStatusCodeAttribute)
+        pixmap = None
+
+        if status == STATUS_NOT_MODIFIED:
+            self.metrics["not_modified"] += 1
+            self.disk.touch(url)
+            pixmap = self.pixmap(url)
+        elif status == STATUS_NOT_FOUND:
+            self.metrics["not_found"] += 1
+            logger.debug("Image not found: " + url)
+            self.storeMissing(url)
+        elif reply.error() == QtNetwork.QNetworkReply.NoError:
+            data = str(reply.readAll())
+            image = QtGui.QImage()
+            if image.loadFromData(data):
+                self.store(url, data, str(reply.rawHeader("ETag")) or None, str(reply.rawHeader("Last-Modified")) or None)
+                pixmap = QtGui.QPixmap.fromImage(image)
+                self.memory.put(url, pixmap)
+            else:
+                self.metrics["errors"] += 1
+                logger.warn("Not an image: " + url)
+        else:
+            self.metrics["errors"] += 1
+            logger.debug("Image download failed for " + url + ": " + reply.errorString())
+            # A stale copy is better than none
+            pixmap = self.pixmap(url)
+
+        reply.deleteLater()
+        for callback in self.pending.pop(url, []):
+            callback(pixmap)
+
+    def logStats(self):
+        logger.info("Image cache: %d pixmaps (%d KiB) in memory, " % (len(self.memory), self.memory.size // 1024) +
+                    ", ".join("%s %d" % (name, self.metrics[name]) for name in METRICS))
+
+    def close(self):
+        self.logStats()
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
@@ -0,0 +1,87 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+'''
+Turns the text of chat messages into the html the chat shows: escaped, with links.
+
+irc_escape runs for every message of every channel, so the url regex is compiled once, the
+words that can't be urls are told apart without it, and the html of the words that are urls
+is kept in a small LRU cache (the same links get posted over and over).
+'''
+
+import collections
+import re
+
+# Taken from django and adapted. Matched against whole words.
+_URL = re.compile(
+    r'^((https?|faflive|fafgame|fafmap|ftp|ts3server)://)?'  # protocols
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'  # domain name, then TLDs
+    r'(?:ac|ad|ae|aero|af|ag|ai|al|am|an|ao|aq|ar|arpa|as|asia|at|au|aw|ax|az|ba|bb|bd|be|bf|bg|bh|bi|biz|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cat|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|com|coop|cr|cu|cv|cw|cx|cy|cz|de|dj|dk|dm|do|dz|ec|edu|ee|eg|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gov|gp|gq|gr|gs|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|info|int|io|iq|ir|is|it|je|jm|jo|jobs|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|la|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mil|mk|ml|mm|mn|mo|mobi|mp|mq|mr|ms|mt|mu|museum|mv|mw|mx|my|mz|na|name|nc|ne|net|nf|ng|ni|nl|no|np|nr|nu|nz|om|org|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|pro|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|sh|si|sj|sk|sl|sm|sn|so|sr|st|su|sv|sx|sy|sz|tc|td|tel|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|travel|tt|tv|tw|tz|ua|ug|uk|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|xxx|ye|yt|za|zm|zw)'
+    r'|localhost'  # localhost...
+    r'|\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+
+LINK_CACHE_SIZE = 1024
+
+_links = collections.OrderedDict()
+
+
+def html_escape(text):
+    '''Produce entities within text.'''
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    return text.replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace("'", "&apos;")
+
+
+def _mayBeUrl(word):
+    # A url has a domain name or an ip (with a dot), or is localhost
+    return "." in word or "localhost" in word.lower()
+
+
+def _link(word, a_style):
+    ''' The html of a word that may be a url, None if it isn't one '''
+    key = (word, a_style)
+    try:
+        html = _links.pop(key)
+    except KeyError:
+        html = None
+        if _URL.match(word):
+            if "://" in word:
+                html = '<a href="{0}" style="{1}">{0}</a>'.format(word, a_style)
+            else:
+                html = '<a href="http://{0}" style="{1}">{0}</a>'.format(word, a_style)
+        if len(_links) >= LINK_CACHE_SIZE:
+            _links.popitem(last=False)
+    _links[key] = html
+    return html
+
+
+def irc_escape(text, a_style=""):
+    '''
+    The html for the text of a message: html is escaped, urls become links, and white space is
+    collapsed into single spaces.
+    '''
+    words = html_escape(text).split()
+    for i, word in enumerate(words):
+        if _mayBeUrl(word):
+            html = _link(word, a_style)
+            if html is not None:
+                words[i] = html
+    return " ".join(words)
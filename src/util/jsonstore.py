@@ -0,0 +1,73 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+
+'''
+Base for the dicts the client keeps in a json file between runs, like the md5 manifest of the
+updater and the index of installed mods. Like them, this module doesn't depend on Qt.
+'''
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class JsonStore(object):
+    '''
+    A dict of entries kept in a json file. Subclasses fill self.entries and set self.dirty when
+    they change it; save() writes the file if anything changed.
+    '''
+    # What the file holds, for the log
+    kind = "json store"
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(path, "rb") as f:
+                self.entries = json.load(f)
+        except IOError:
+            pass
+        except ValueError:
+            logger.warn("Discarding corrupt %s %s" % (self.kind, path))
+
+    def save(self):
+        '''
+        Writes the entries through a temporary file, so a crash can't leave half a file behind.
+        Returns False if they couldn't be written: the entries are rebuilt next run, it's logged
+        and otherwise ignored.
+        '''
+        if not self.dirty:
+            return True
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.path + ".tmp", "wb") as f:
+                json.dump(self.entries, f)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(self.path + ".tmp", self.path)
+        except (EnvironmentError, ValueError):
+            logger.exception("Couldn't save %s %s" % (self.kind, self.path))
+            return False
+        self.dirty = False
+        return True
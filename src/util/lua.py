@@ -0,0 +1,236 @@
+#-------------------------------------------------------------------------------
+# Copyright (c) 2012 Gael Honorez.
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#-------------------------------------------------------------------------------
+
+'''
+Reader for the Lua data files of the game: game.prefs, mod_info.lua, and the _scenario.lua
+and _save.lua files of maps.
+
+These are Lua chunks of assignments ("name = value") whose values are strings, numbers,
+booleans, tables, and calls like VECTOR3( 1, 2, 3 ), STRING( 'x' ) or GROUP { ... } (whose
+value is the table). One precompiled regex splits the text into tokens, and a recursive descent
+parser turns them into nested dicts.
+
+Tables become dicts. Their positional items are keyed 1, 2, ... like in Lua. With raw=True,
+every key and scalar is a string as written in the file instead (numbers aren't converted,
+true is "true", a call is its source text), and positional items are keyed "0", "1", ... the
+way vault.luaparser always returned them.
+'''
+
+import re
+
+_STRING = r'''"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*\''''
+
+_NUMBER = r'-?(?:0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)'
+
+# Each match is one token, with the white space and comments before it. Assignments ("name =",
+# "['name'] =") and calls with literal arguments are single tokens, it saves going back and forth.
+# The white space and comments are matched in a lookahead and then taken through a backreference:
+# re can't go back into a lookahead, so a token that doesn't match fails at once instead of
+# retrying every way of splitting the spaces and dashes before it.
+_TOKENS = re.compile(r'''
+    (?=(?P<skipped>(?:\s|--\[(?P<commentlevel>=*)\[.*?\](?P=commentlevel)\]|--[^\n]*)*))(?P=skipped)
+    (?:
+        (?P<string>%(string)s)
+      | (?P<number>%(number)s)
+      | (?P<key>(?P<keyname>[A-Za-z_]\w*)\s*=(?!=))
+      | (?P<bracketkey>\[\s*(?P<bracketed>%(string)s|%(number)s)\s*\]\s*=(?!=))
+      | (?P<call>[A-Za-z_]\w*\s*\((?P<args>(?:[^()"'\\]|%(string)s)*)\))
+      | (?P<tablecall>[A-Za-z_]\w*(?=\s*\{))
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<longstring>\[(?P<stringlevel>=*)\[.*?\](?P=stringlevel)\])
+      | (?P<symbol>[{}\[\]=,;()])
+      | (?P<end>\Z)
+    )''' % {"string": _STRING, "number": _NUMBER}, re.VERBOSE | re.DOTALL)
+
+# The arguments of a call token
+_ARGUMENTS = re.compile(r'''(?P<string>%(string)s)|(?P<number>%(number)s)|(?P<name>[A-Za-z_]\w*)'''
+                        % {"string": _STRING, "number": _NUMBER})
+
+_ESCAPES = re.compile(r"\\(\d{1,3}|.)", re.DOTALL)
+
+_ESCAPED = {"n": "\n", "t": "\t", "r": "\r", "a": "\a", "b": "\b", "f": "\f", "v": "\v", "\n": "\n"}
+
+_CONSTANTS = {"true": True, "false": False, "nil": None}
+
+
+class LuaError(ValueError):
+    pass
+
+
+def _unescape(match):
+    escaped = match.group(1)
+    if escaped.isdigit():
+        return chr(int(escaped) % 256)
+    return _ESCAPED.get(escaped, escaped)
+
+
+def _string(literal):
+    string = literal[1:-1]
+    return _ESCAPES.sub(_unescape, string) if "\\" in string else string
+
+
+def _number(literal):
+    if literal.lstrip("-")[:2] in ("0x", "0X"):
+        return int(literal, 16)
+    try:
+        return int(literal)
+    except ValueError:
+        return float(literal)
+
+
+class _Parser(object):
+    def __init__(self, text, raw, lowerKeys, visit):
+        self.text = text
+        self.raw = raw
+        self.lowerKeys = lowerKeys
+        self.visit = visit
+        self.match = _TOKENS.scanner(text).match
+        self.pos = 0
+
+    def error(self, message):
+        line = self.text.count("\n", 0, self.pos) + 1
+        return LuaError("%s at line %d" % (message, line))
+
+    def next(self):
+        ''' The next token, as (kind, match) '''
+        match = self.match()
+        if match is None:
+            raise self.error("Unexpected %r" % self.text[self.pos:self.pos + 10])
+        self.pos = match.end()
+        return match.lastgroup, match
+
+    def expect(self, symbol):
+        kind, match = self.next()
+        if kind != "symbol" or match.group(kind) != symbol:
+            raise self.error("Expected '%s'" % symbol)
+
+    def key(self, key):
+        if self.raw and not isinstance(key, basestring):
+            key = str(key)
+        if self.lowerKeys and isinstance(key, basestring):
+            key = key.lower()
+        return key
+
+    def literal(self, literal):
+        ''' The key in a "['name'] =" or "[1] =" token '''
+        if self.raw and literal[0] not in "\"'":
+            return literal
+        return _string(literal) if literal[0] in "\"'" else _number(literal)
+
+    def chunk(self):
+        ''' Top level assignments (or a returned value), as a dict '''
+        result = {}
+        while True:
+            kind, match = self.next()
+            if kind == "end":
+                return result
+            if kind == "symbol" and match.group(kind) == ";":
+                continue
+            if kind == "name" and match.group(kind) == "return":
+                return self.value(self.next(), "")
+            if kind != "key":
+                raise self.error("Expected an assignment")
+            key = self.key(match.group("keyname"))
+            value = result[key] = self.value(self.next(), ">" + key if self.visit else None)
+            if self.visit:
+                self.visit("", key, value)
+
+    def value(self, token, path):
+        kind, match = token
+        if kind == "string":
+            return _string(match.group(kind))
+        if kind == "number":
+            return match.group(kind) if self.raw else _number(match.group(kind))
+        if kind == "symbol" and match.group(kind) == "{":
+            return self.table(path)
+        if kind == "tablecall":
+            # GROUP { ... } is a call with the table as its only argument
+            return self.value(self.next(), path)
+        if kind == "name":
+            name = match.group(kind)
+            return name if self.raw else _CONSTANTS.get(name, name)
+        if kind == "call":
+            if self.raw:
+                return match.group(kind)
+            args = [self.value((argument.lastgroup, argument), None)
+                    for argument in _ARGUMENTS.finditer(match.group("args"))]
+            return args[0] if len(args) == 1 else tuple(args)
+        if kind == "longstring":
+            level = len(match.group("stringlevel")) + 2
+            string = match.group(kind)[level:-level]
+            # A newline right after the opening bracket isn't part of the string
+            return string[1:] if string.startswith("\n") else string
+        if kind == "end":
+            raise self.error("Unexpected end of text")
+        raise self.error("Unexpected %r" % match.group(kind))
+
+    def table(self, path):
+        result = {}
+        index = 0 if self.raw else 1
+        while True:
+            token = self.next()
+            kind, match = token
+            if kind == "key":
+                key = self.key(match.group("keyname"))
+                token = self.next()
+            elif kind == "bracketkey":
+                key = self.key(self.literal(match.group("bracketed")))
+                token = self.next()
+            elif kind == "symbol" and match.group(kind) in "},;[":
+                symbol = match.group(kind)
+                if symbol == "}":
+                    return result
+                if symbol != "[":
+                    continue
+                key = self.key(self.value(self.next(), None))
+                self.expect("]")
+                self.expect("=")
+                token = self.next()
+            elif kind == "end":
+                raise self.error("Unexpected end of table")
+            else:
+                key = self.key(index)
+                index += 1
+
+            if self.visit:
+                value = result[key] = self.value(token, path + ">" + (key if isinstance(key, basestring) else str(key)))
+                self.visit(path, key, value)
+            else:
+                result[key] = self.value(token, None)
+
+
+def loads(text, raw=False, lowerKeys=False, visit=None):
+    '''
+    Parses a Lua chunk of assignments into a dict of the assigned names (or returns the value
+    of a chunk that's a return statement). visit(parent, key, value) is called for every
+    assignment and table item, in the order they're in the text, once their value is parsed;
+    parent is the path of the table they're in, like ">scenario>markers" (empty at the top).
+    Raises LuaError if the text isn't understood.
+    '''
+    return _Parser(text, raw, lowerKeys, visit).chunk()
+
+
+def decode(text, raw=False, lowerKeys=False):
+    '''
+    Parses a single Lua value, like "{ 1, 2, x = 'y' }"
+    '''
+    parser = _Parser(text, raw, lowerKeys, None)
+    value = parser.value(parser.next(), None)
+    if parser.next()[0] != "end":
+        raise parser.error("Unexpected text after the value")
+    return value
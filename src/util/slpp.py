@@ -1,269 +0,0 @@
-# Copyright (c) 2010, 2011, 2012 SirAnthony <anthony at adsorbtion.org>
-
-# Permission is hereby granted, free of charge, to any person obtaining a copy
-# of this software and associated documentation files (the "Software"), to deal
-# in the Software without restriction, including without limitation the rights
-# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
-# copies of the Software, and to permit persons to whom the Software is
-# furnished to do so, subject to the following conditions:
-
-# The above copyright notice and this permission notice shall be included in
-# all copies or substantial portions of the Software.
-
-# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
-# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
-# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
-# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
-# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
-# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
-# THE SOFTWARE.
-
-import re
-
-ERRORS = {
-    'unexp_end_string': u'Unexpected end of string while parsing Lua string.',
-    'unexp_end_table': u'Unexpected end of table while parsing Lua string.',
-    'mfnumber_minus': u'Malformed number (no digits after initial minus).',
-    'mfnumber_dec_point': u'Malformed number (no digits after decimal point).',
-    'mfnumber_sci': u'Malformed number (bad scientific format).',
-}
-
-
-class ParseError(Exception):
-    pass
-
-
-class SLPP:
-
-    def __init__(self):
-        self.text = ''
-        self.ch = ''
-        self.at = 0
-        self.len = 0
-        self.depth = 0
-        self.space = re.compile('\s', re.M)
-        self.alnum = re.compile('\w', re.M)
-        self.newline = '\n'
-        self.tab = '\t'
-
-    def decode(self, text):
-        
-        if not text or type(text) is not str:
-            return
-        #FIXME: only short comments removed
-        reg = re.compile('--.*$', re.M)
-        text = reg.sub('', text, 0)
-        
-        self.text = text
-        self.at, self.ch, self.depth = 0, '', 0
-        self.len = len(text)
-        self.next_chr()
-        result = self.value()
-        return result
-
-    def encode(self, obj):
-        if not obj:
-            return
-        self.depth = 0
-        return self.__encode(obj)
-
-    def __encode(self, obj, start = ""):
-        s = start
-        tab = '\t'
-        newline = '\n'
-        tp = type(obj).__name__
-        if tp == 'str' or tp == 'unicode':
-            s += '"'+obj+'"'
-        elif tp == 'int' or tp == 'float' or tp == 'long' or tp == 'complex':
-            s += str(obj)
-        elif tp == 'bool':
-            s += str(obj).lower()
-        elif tp == 'list' or tp == 'tuple':
-            s += "{" + newline
-            self.depth += 1
-            for el in obj:
-                s += tab * self.depth + self.__encode(el) + ',' + newline
-            self.depth -= 1
-            s += tab * self.depth + "}"
-        elif tp == 'dict':
-            s += "{" + newline
-            self.depth += 1
-            for key in obj:
-                #TODO: lua cannot into number keys. Add check.
-                if type(key).__name__ == 'int':
-                    s += tab * self.depth + self.__encode(obj[key]) + ',' + newline
-                else:
-                    s += tab * self.depth + key + ' = ' + self.__encode(obj[key]) + ',' + newline
-            self.depth -= 1
-            s += tab * self.depth + "}"
-        return s
-
-    def white(self):
-        while self.ch:
-            if self.space.match(self.ch):
-                self.next_chr()
-            else:
-                break
-
-    def next_chr(self):
-        if self.at >= self.len:
-            self.ch = None
-            return None
-        self.ch = self.text[self.at]
-        self.at += 1
-        return True
-
-    def value(self):
-        self.white()
-        if not self.ch:
-            return
-        if self.ch == '{':
-            return self.object()
-        if self.ch == "[":
-            self.next_chr()
-        if self.ch in ['"',  "'",  '[']:
-            return self.string(self.ch)
-        if self.ch.isdigit() or self.ch == '-':
-            return self.number()
-        return self.word()
-
-    def string(self,  end=None):
-        s = ''
-        start = self.ch
-        if end == '[':
-            end = ']'
-        if start in ['"',  "'",  '[']:
-            while self.next_chr():
-                if self.ch == end:
-                    self.next_chr()
-                    if start != "[" or self.ch == ']':
-                        return s
-                s += self.ch
-        print ERRORS['unexp_end_string']
-
-    def object(self):
-        o = {}
-        k = ''
-        idx = 0
-        numeric_keys = False
-        self.depth += 1
-        self.next_chr()
-        self.white()
-        if self.ch and self.ch == '}':
-            self.depth -= 1
-            self.next_chr()
-            return o #Exit here
-        else:
-            while self.ch:
-                self.white()
-                if self.ch == '{':
-                    o[idx] = self.object()
-                    idx += 1
-                    continue
-                elif self.ch == '}':
-                    self.depth -= 1
-                    self.next_chr()
-                    if k:
-                       o[idx] = k
-                    if not numeric_keys and len([ key for key in o if type(key) in (str,  float,  bool,  tuple)]) == 0:
-                        ar = []
-                        for key in o:
-                           ar.insert(key, o[key])
-                        o = ar
-                    return o #or here
-                else:
-                    if self.ch == ',':
-                        self.next_chr()
-                        continue
-                    else:
-                        k = self.value()
-                        if self.ch == ']':
-                            numeric_keys = True
-                            self.next_chr()
-                    self.white()
-                    if self.ch == '=':
-                        self.next_chr()
-                        self.white()
-                        o[k] = self.value()
-                        idx += 1
-                        k = ''
-                    elif self.ch == ',':
-                        self.next_chr()
-                        self.white()
-                        o[idx] = k
-                        idx += 1
-                        k = ''
-        print ERRORS['unexp_end_table'] #Bad exit here
-
-    def word(self):
-        s = ''
-        if self.ch != '\n':
-          s = self.ch
-        while self.next_chr():
-            if self.alnum.match(self.ch):
-                s += self.ch
-            else:
-                if re.match('^true$', s, re.I):
-                    return True
-                elif re.match('^false$', s, re.I):
-                    return False
-                elif s == 'nil':
-                    return None
-                return str(s)
-
-    def number(self):
-        def next_digit(err):
-            n = self.ch
-            self.next_chr()
-            if not self.ch or not self.ch.isdigit():
-                raise ParseError(err)
-            return n
-        n = ''
-        try:
-            if self.ch == '-':
-                n += next_digit(ERRORS['mfnumber_minus'])
-            n += self.digit()
-            if n == '0' and self.ch in ['x', 'X']:
-                n += self.ch
-                self.next_chr()
-                n += self.hex()
-            else:
-                if self.ch and self.ch == '.':
-                    n += next_digit(ERRORS['mfnumber_dec_point'])
-                    n += self.digit()
-                if self.ch and self.ch in ['e', 'E']:
-                    n += self.ch
-                    self.next_chr()
-                    if not self.ch or self.ch not in ('+', '-'):
-                        raise ParseError(ERRORS['mfnumber_sci'])
-                    n += next_digit(ERRORS['mfnumber_sci'])
-                    n += self.digit()
-        except ParseError as e:
-            print e
-            return 0
-        try:
-            return int(n, 0)
-        except:
-            pass
-        return float(n)
-
-    def digit(self):
-        n = ''
-        while self.ch and self.ch.isdigit():
-            n += self.ch
-            self.next_chr()
-        return n
-
-    def hex(self):
-        n = ''
-        while self.ch and \
-            (self.ch in 'ABCDEFabcdef' or self.ch.isdigit()):
-            n += self.ch
-            self.next_chr()
-        return n
-
-
-slpp = SLPP()
-
-
-__all__ = ['slpp']
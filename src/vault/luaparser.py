@@ -55,10 +55,17 @@ If there is default value for a search entry, error will not be generated. Defau
 		__self__ - returns item name as it is in lua
 		__parent__ - returns item parent
 	destination - you can specify a dictionary for matched items in the resulting array
+
+The file itself is read by util.lua, the searches are matched against each item as it's parsed.
 """
-import re
-import zipfile
+import logging
 import os
+import re
+
+from util import lua
+
+logger = logging.getLogger(__name__)
+
 
 class luaParser:
 	
@@ -66,16 +73,10 @@ class luaParser:
 		self.iszip = False
 		self.zip = None
 		self.__path = luaPath
-		self.__keyFilter = re.compile("[\[\],'\"]")
-		self.__valFilter = re.compile("[\[\]]")
 		self.__searchResult = dict()
 		self.__searchPattern = dict()
 		self.__foundItemsCount = dict()
-		self.__stream = list()
-		self.__lines = list()
-		self.__prevUnfinished = False
-		self.__inString = False
-		self.__stringChar = ""
+		self.__matchers = list()
 		self.__parsedData = dict()
 		self.__defaultValues = dict()
 		self.errors = 0
@@ -85,193 +86,92 @@ class luaParser:
 		self.errorMsg = ""
 		self.loweringKeys = True
 	
-	def __checkUninterruptibleStr(self, char):
-		if char == "\"" or char == "'":
-			if not self.__inString:
-				self.__stringChar = char
-				self.__inString = True
-			elif char == self.__stringChar:
-				self.__inString = False
-		elif not self.__inString and char == "(":
-			self.__inString = True
-			self.__stringChar = ")"
+	def __compileSearch(self, searchKey):
+		#'command:parent>name' - the command is optional, * matches anything (even several levels)
+		valcmd = searchKey.split(":")
+		command = valcmd[0] if len(valcmd) == 2 else "none"
+		path = valcmd[-1]
+		matcher = re.compile(".*>(" + ".*".join(re.escape(part) for part in path.split("*")) + ")$")
+		#cheap test before the regex: the matched path has to end with what follows the last *
+		tail = path.split("*")[-1]
+		return searchKey, command, matcher, tail
 	
-	def __processLine(self, parent=""):
-		#initialize item counter
-		counter = 0
-		#initialize empty array
-		lua = dict()
-		#initialize value
-		value = ""
-		#start cycle
-		while len(self.__stream):
-			#get a line from the list or read next line from the file
-			if len(self.__lines) == 0:
-				line = self.__stream.pop(0)
-				#cut commentary section (either start whit '#' or is a '--[[  ]]--' section
-				comment = re.compile("((#.*))$|((--\[\[).*(\]\]--)$)")
-				line = comment.sub("", line)
-				#process line to see if it one command or a stack of them
-				newLine = 0
-				pos = 0
-				self.__inString = False
-				while len(line) > pos:
-					char = line[pos]
-					self.__checkUninterruptibleStr(char)
-					if char == "{":
-						pos = pos + 1
-						char = line[pos]
-						self.__checkUninterruptibleStr(char)
-						self.__lines.append(line[newLine:pos])
-						newLine = pos
-					elif char == ","  and not self.__inString:
-						self.__lines.append(line[newLine:pos])
-						pos = pos + 1
-						char = line[pos]
-						self.__checkUninterruptibleStr(char)
-						newLine = pos
-					elif char == "}":
-						self.__lines.append(line[newLine:pos])
-						self.__lines.append("}")
-						pos = pos + 1
-						if pos <= len(line):
-							self.__checkUninterruptibleStr(line[pos])
-						newLine = pos
-					pos = pos + 1
-				if len(self.__lines) > 0:
-					line = self.__lines.pop(0)
+	def __visit(self, parent, key, value):
+		#called by the parser for every item, checks it against the searches
+		path = parent + ">" + key
+		for searchKey, valcmd, matcher, tail in self.__matchers:
+			if not path.endswith(tail) or not matcher.match(path):
+				continue
+			#add new value into the resulting array
+			resultKey = self.__searchPattern[searchKey]
+			if valcmd == "count":
+				if isinstance(value, basestring):
+					count = 1
+				else:
+					count = len(value)
+				if self.__searchResult.has_key(resultKey):
+					resultVal = self.__searchResult[resultKey] + count
+				else:
+					resultVal = count
+			else:
+				resultVal = value
+			resultKey = resultKey.replace("__self__", key)
+			resultKey = resultKey.replace("__parent__", parent.split(">")[-1])
+			keycmd = resultKey.split(":")
+			#unpack command from search key
+			if len(keycmd) == 2:
+				resultKey = keycmd[1]
+				keydst = keycmd[0]
+			else:
+				keydst = "__nowhere__"
+			#write result into the array
+			if keydst == "__nowhere__":
+				self.__searchResult[resultKey] = resultVal
 			else:
-				line = self.__lines.pop(0)
-			line = line.strip()
-			#if the string is not empty, proceed
-			if line != "":
-				#split it by '='
-				lineArray = line.split("=")
-				#if result is one element list
-				if len(lineArray) == 1:
-					#this element is value
-					value = lineArray[0].strip()
-					#assign counter value to key
-					key = str(counter)
+				if self.__searchResult.has_key(keydst):
+					if isinstance(self.__searchResult[keydst], dict):
+						self.__searchResult[keydst][resultKey] = resultVal
 				else:
-					#first is key
-					if self.loweringKeys:
-						key = lineArray[0].lower()
-					else:
-						key = lineArray[0]
-					#get rid of redundant chars in key
-					key = self.__keyFilter.sub("", key).strip()
-					#second is value
-					value = lineArray[1].strip()
-				#if value is '}' - which is end of lua array, stop parsing
-				if value == "}":
-					break
-				unfinished = False
-				if len(value) != 0:
-					#remove finishing comma if there is one
-					if value[-1] == ",":
-						value = value[:-1]
-					#get rid of redundant chars in value
-					value = self.__valFilter.sub("", value)
-				if len(value) != 0:
-					#parse value:
-					#if the string starts with '{'
-					if value[-1] == "{":
-						#add new item into the array: recursive function call
-						if self.__prevUnfinished:
-							self.__prevUnfinished = False
-							lua[prevkey] = self.__processLine(parent+">"+prevkey)
-						else:
-							lua[key] = self.__processLine(parent+">"+key)
-					else:
-						#add new item into the array: value itself
-						if value[0] == "\"" or value[0] == "'":
-							value = value[1:]
-						if value[-1] == "\"" or value[-1] == "'":
-							value = value[:-1]
-						lua[key] = value
-				elif len(value) != 0:
-					#add new item into the array: value itself
-					lua[key] = value
-				elif len(key) != 0:
-					self.__prevUnfinished = True
-					prevkey = key
-			#checking line if it suits searchPattern, and adding if so
-				for searchKey in self.__searchPattern:
-					#regkey = re.compile(".*("+searchKey.split(":")[-1].replace("*", ".*")+")$")
-					#if regkey.match(parent+">"+key):
-					if re.match(".*>("+searchKey.split(":")[-1].replace("*", ".*")+")$", parent+">"+key):
-						#get command from key
-						valcmd = searchKey.split(":")
-						valcmd = valcmd[0] if len(valcmd) == 2 else "none"
-						#add new value into the resulting array
-						resultKey = self.__searchPattern[searchKey]
-						if valcmd == "count":
-							if lua.has_key(key):
-								if isinstance(lua[key], str):
-									count = 1
-								else:
-									count = len(lua[key])
-							else:
-								count = 0
-							if self.__searchResult.has_key(resultKey):
-								resultVal = self.__searchResult[resultKey] + count
-							else:
-								resultVal = count
-						else:
-							resultVal = lua[key]
-						resultKey = resultKey.replace("__self__", key)
-						resultKey = resultKey.replace("__parent__", parent.split(">")[-1])
-						keycmd = resultKey.split(":")
-						#unpack command from search key
-						if len(keycmd) == 2:
-							resultKey = keycmd[1]
-							keydst = keycmd[0]
-						else:
-							keydst = "__nowhere__"
-						#write result into the array
-						if keydst == "__nowhere__":
-							self.__searchResult[resultKey] = resultVal
-						else:
-							if self.__searchResult.has_key(keydst):
-								if isinstance(self.__searchResult[keydst], dict):
-									self.__searchResult[keydst][resultKey] = resultVal
-							else:
-								self.__searchResult[keydst] = dict()
-								self.__searchResult[keydst][resultKey] = resultVal
-						if isinstance(resultVal, int):
-							self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + resultVal
-						else:
-							self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + 1
-			#increase counter
-			counter = counter + 1
-		#return resulting array
-		return lua
-        
-	def __parseLua(self):
+					self.__searchResult[keydst] = dict()
+					self.__searchResult[keydst][resultKey] = resultVal
+			if isinstance(resultVal, int):
+				self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + resultVal
+			else:
+				self.__foundItemsCount[searchKey] = self.__foundItemsCount[searchKey] + 1
+	
+	def __readLua(self):
 		#open file
+		f = None
 		if self.iszip == False:
-			f = open(self.__path, "r")
+			f = open(self.__path, "rb")
 		else:
-			if self.zip.testzip() == None :
-				for member in self.zip.namelist() :
-					filename = os.path.basename(member)
-					if not filename:
-						continue
-					if filename == self.__path:
-						f = self.zip.open(member)
-						break
+			# No testzip(): it decompresses every member, a broken member fails when it's read
+			for member in self.zip.namelist() :
+				filename = os.path.basename(member)
+				if not filename:
+					continue
+				if filename == self.__path:
+					f = self.zip.open(member)
+					break
 		if not f :
-			return
-			
-
-		self.__stream = f.readlines()
-		if self.__stream[-1][-1] != "\n": # file doesn't end in a newline
-                        self.__stream[-1] += "\n" # needed to prevent a bug happening when a file doesn't end with a newline.
-		f.close()
-		#call recursive function
-		result = self.__processLine()
-		return result
+			return None
+		try:
+			return f.read()
+		finally:
+			f.close()
+	
+	def __parseLua(self):
+		text = self.__readLua()
+		if text is None:
+			return None
+		try:
+			return lua.loads(text, raw=True, lowerKeys=self.loweringKeys, visit=self.__visit)
+		except lua.LuaError, e:
+			logger.warn("Can't parse %s: %s" % (self.__path, e))
+			self.error = True
+			self.errors = self.errors + 1
+			self.errorMsg = self.errorMsg + "Error: " + str(e) + "\n"
+			return None
 	
 	def __checkErrors(self):
 		for key in self.__foundItemsCount:
@@ -301,6 +201,7 @@ class luaParser:
 		self.__searchPattern.update(luaSearch)
 		self.__defaultValues.update(defValues)
 		self.__foundItemsCount = {}.fromkeys(self.__searchPattern.keys(), 0)
+		self.__matchers = [self.__compileSearch(searchKey) for searchKey in self.__searchPattern]
 		self.__parsedData = self.__parseLua()
 		self.__checkErrors()
 		return self.__searchResult
@@ -0,0 +1,51 @@
+'''
+Benchmarks are tests marked with @pytest.mark.benchmark. They only run
+with --benchmark, and measure through the `rates` fixture, which lists
+the rates at the end of the run instead of asserting on them.
+'''
+import contextlib
+import time
+
+import pytest
+
+
+def pytest_addoption(parser):
+    parser.addoption("--benchmark", action="store_true", default=False,
+                     help="run the benchmarks and report their rates")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: measures rates, only runs with --benchmark")
+    config.benchmark_rates = []
+
+
+def pytest_runtest_setup(item):
+    if "benchmark" in item.keywords and not item.config.getoption("--benchmark"):
+        pytest.skip("benchmark, run with --benchmark")
+
+
+def pytest_terminal_summary(terminalreporter):
+    rates = getattr(terminalreporter.config, "benchmark_rates", None)
+    if rates:
+        terminalreporter.write_sep("=", "benchmarks")
+        for test, what, rate, unit in rates:
+            terminalreporter.write_line("%s: %s %d %s/s" % (test, what, rate, unit))
+
+
+class Rates(object):
+    def __init__(self, rates, test):
+        self.rates = rates
+        self.test = test
+
+    @contextlib.contextmanager
+    def measure(self, what, count, unit):
+        ''' Records count/elapsed for the with block '''
+        started = time.time()
+        yield
+        elapsed = max(time.time() - started, 1e-6)
+        self.rates.append((self.test, what, count / elapsed, unit))
+
+
+@pytest.fixture
+def rates(request):
+    return Rates(request.config.benchmark_rates, request.node.name)
@@ -0,0 +1,45 @@
+from chat.chatlog import ChatLog, ChatLine
+
+
+def line(i):
+    return ChatLine("message", "nick", str(i), "<tr><td>%d</td></tr>" % i, None)
+
+
+def test_lines_are_rendered_once():
+    log = ChatLog(10, 5)
+    log.append(line(1))
+    log.append(line(2))
+
+    assert log.take() == ([line(1), line(2)], False)
+    assert log.take() == ([], False)
+
+
+def test_only_the_last_lines_are_kept():
+    log = ChatLog(3, 5)
+    for i in range(5):
+        log.append(line(i))
+
+    assert list(log.lines) == [line(2), line(3), line(4)]
+
+
+def test_document_is_rebuilt_once_enough_lines_were_dropped():
+    log = ChatLog(3, 2)
+    for i in range(3):
+        log.append(line(i))
+    log.take()
+    log.append(line(3))
+    assert log.take() == ([line(3)], False)
+
+    log.append(line(4))
+    assert log.take() == ([line(2), line(3), line(4)], True)
+    log.append(line(5))
+    assert log.take() == ([line(5)], False)
+
+
+def test_clear():
+    log = ChatLog(3, 2)
+    log.append(line(1))
+    log.clear()
+
+    assert len(log) == 0
+    assert log.take() == ([], False)
@@ -0,0 +1,181 @@
+from PyQt4 import QtCore
+
+from chat import chatter
+from chat.chatter import Chatter
+from chat.chattermodel import ChatterModel, ChatterSortFilterProxy
+
+from flexmock import flexmock
+import pytest
+
+
+class FakeChatter(object):
+    def __init__(self, name, rank=Chatter.RANK_USER, clan=""):
+        self.name = name
+        self.clan = clan
+        self.sortKey = (rank, name.lower())
+
+    def data(self, column, role):
+        if role == QtCore.Qt.DisplayRole and column == Chatter.SORT_COLUMN:
+            return self.name
+        return None
+
+    def isFiltered(self, filter):
+        return filter in self.clan.lower() or filter in self.name.lower()
+
+
+class FakeClient(object):
+    login = "me"
+
+    def __init__(self):
+        self.clans = {}
+        self.friends = set()
+        self.colors = {}
+
+    def getUserCountry(self, name):
+        return None
+
+    def getUserAvatar(self, name):
+        return None
+
+    def getUserRanking(self, name):
+        return None
+
+    def getUserLeague(self, name):
+        return None
+
+    def getUserClan(self, name):
+        return self.clans.get(name, "")
+
+    def isFriend(self, name):
+        return name in self.friends
+
+    def isClanMember(self, name):
+        return False
+
+    def isFoe(self, name):
+        return False
+
+    def isPlayer(self, name):
+        return True
+
+    def getColor(self, name):
+        return "#00ff00"
+
+    def getUserColor(self, name):
+        return "#cccccc"
+
+
+@pytest.fixture
+def lobby(application, monkeypatch):
+    monkeypatch.setattr(chatter.client, "instance", flexmock(urls={}), raising=False)
+    return flexmock(OPERATOR_COLORS={"@": "#ff0000"}, client=FakeClient())
+
+
+def names(proxy):
+    return [proxy.chatterAt(proxy.index(row, 0)).name for row in range(proxy.rowCount())]
+
+
+def test_model_adds_new_chatters_in_one_insertion(application):
+    model = ChatterModel()
+    inserted = []
+    model.rowsInserted.connect(lambda parent, first, last: inserted.append((first, last)))
+
+    model.addChatters([FakeChatter("a"), FakeChatter("b")])
+    model.addChatters([FakeChatter("b"), FakeChatter("c")])
+    model.addChatters([FakeChatter("c")])
+
+    assert inserted == [(0, 1), (2, 2)]
+    assert [c.name for c in model.chatters] == ["a", "b", "c"]
+    assert model.data(model.index(2, Chatter.SORT_COLUMN)) == "c"
+
+
+def test_model_keeps_rows_when_removing(application):
+    model = ChatterModel()
+    model.addChatters([FakeChatter(name) for name in "abcd"])
+
+    model.removeChatter("b")
+    model.removeChatter("missing")
+
+    assert model.rowCount() == 3
+    assert model.rows == {"a": 0, "c": 1, "d": 2}
+    assert all(model.chatterAt(model.index(row, 0)).name == name for name, row in model.rows.items())
+
+
+def test_model_only_signals_chatters_it_has(application):
+    model = ChatterModel()
+    model.addChatters([FakeChatter("a"), FakeChatter("b")])
+    changed = []
+    model.dataChanged.connect(lambda first, last: changed.append((first.row(), first.column(), last.column())))
+
+    model.chatterChanged(model.chatters[1])
+    model.chatterChanged(FakeChatter("gone"))
+
+    assert changed == [(1, 0, Chatter.COLUMNS - 1)]
+
+
+def test_proxy_sorts_on_sort_keys(application):
+    model = ChatterModel()
+    proxy = ChatterSortFilterProxy(model)
+    proxy.sort(Chatter.SORT_COLUMN, QtCore.Qt.AscendingOrder)
+
+    proxy.addChatters([FakeChatter("zed"), FakeChatter("Bob"), FakeChatter("mod", Chatter.RANK_ELEVATION),
+                       FakeChatter("alice")])
+    assert names(proxy) == ["mod", "alice", "Bob", "zed"]
+
+    model.chatters[model.rows["zed"]].sortKey = (Chatter.RANK_FRIEND, "zed")
+    model.chatterChanged(model.chatters[model.rows["zed"]])
+    assert names(proxy) == ["mod", "zed", "alice", "Bob"]
+
+
+def test_proxy_filters_on_name_and_clan(application):
+    model = ChatterModel()
+    proxy = ChatterSortFilterProxy(model)
+    proxy.sort(Chatter.SORT_COLUMN, QtCore.Qt.AscendingOrder)
+    proxy.addChatters([FakeChatter("alice", clan="FAF"), FakeChatter("bob"), FakeChatter("Fafnir")])
+
+    proxy.setFilter("FAF")
+    assert names(proxy) == ["alice", "Fafnir"]
+
+    proxy.setFilter("")
+    assert names(proxy) == ["alice", "bob", "Fafnir"]
+
+
+def test_chatter_shows_remembers_states():
+    c = flexmock(shown={})
+
+    assert not Chatter.shows.__func__(c, "clan", "FAF")
+    assert Chatter.shows.__func__(c, "clan", "FAF")
+    assert not Chatter.shows.__func__(c, "clan", "")
+    assert not Chatter.shows.__func__(c, "status", None)
+    assert Chatter.shows.__func__(c, "status", None)
+
+
+def test_chatter_only_redraws_when_something_changed(lobby):
+    model = ChatterModel()
+    bob = Chatter(model, "bob!bob@host", lobby)
+    model.addChatters([bob])
+    changed = []
+    model.dataChanged.connect(lambda first, last: changed.append(first.row()))
+
+    bob.update()
+    assert changed == []
+
+    lobby.client.clans["bob"] = "FAF"
+    bob.update()
+    assert changed == [0]
+    assert bob.text == "[FAF]bob"
+
+    lobby.client.friends.add("bob")
+    bob.update()
+    assert changed == [0, 0]
+    assert bob.sortKey[0] == Chatter.RANK_FRIEND
+
+
+def test_operators_sort_first(lobby):
+    model = ChatterModel()
+    proxy = ChatterSortFilterProxy(model)
+    proxy.sort(Chatter.SORT_COLUMN, QtCore.Qt.AscendingOrder)
+
+    proxy.addChatters([Chatter(model, user, lobby) for user in ("zed", "@Admin", "me", "bob")])
+
+    assert names(proxy) == ["Admin", "me", "bob", "zed"]
@@ -0,0 +1,145 @@
+import random
+
+import pytest
+
+from chat import irclib
+
+
+LINES = [
+    ":Sheeo!~sheeo@faf.com PRIVMSG #aeolus :anyone up for a 4v4?",
+    ":Sheeo!~sheeo@faf.com PRIVMSG #aeolus ::) gg",
+    ":Sheeo!~sheeo@faf.com PRIVMSG Dostya :\001ACTION waves\001",
+    ":Dostya!~dostya@faf.com JOIN :#aeolus",
+    ":Dostya!~dostya@faf.com PART #aeolus :bye",
+    ":Dostya!~dostya@faf.com QUIT :Quit: leaving",
+    ":ChanServ!services@faf.com MODE #aeolus +o Sheeo",
+    ":irc.faforever.com 353 Dostya = #aeolus :@Sheeo +Dostya Zep",
+    ":irc.faforever.com   001 Dostya :Welcome",
+    "PING :irc.faforever.com",
+    "NOTICE AUTH :*** Looking up your hostname",
+]
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_parser_splits_like_the_rfc_regexp(line):
+    m = irclib._rfc_1459_command_regexp.match(line)
+    arguments = None
+    if m.group("argument"):
+        a = m.group("argument").split(" :", 1)
+        arguments = a[0].split()
+        if len(a) == 2:
+            arguments.append(a[1])
+
+    assert irclib._parse_message(line) == (m.group("prefix"), m.group("command").lower(), arguments)
+
+
+def test_framer_keeps_unfinished_lines():
+    framer = irclib.LineFramer()
+
+    assert framer.feed("PING :a\r\nPRIV") == ["PING :a"]
+    assert framer.feed("MSG #a :") == []
+    assert framer.feed("hi\nJOIN #b\r\n\r\n") == ["PRIVMSG #a :hi", "JOIN #b", ""]
+    assert len(framer) == 0
+
+
+def connection():
+    irc = irclib.IRC()
+    events = []
+    irc.add_global_handler("all_events", lambda c, e: events.append(
+        (e.eventtype(), e.source(), e.target(), e.arguments())))
+    return irc.server(), events
+
+
+def test_events():
+    c, events = connection()
+    c._process_input("\r\n".join(LINES[:8]) + "\r\n")
+
+    events = [event for event in events if event[0] != "all_raw_messages"]
+    assert events == [
+        ("pubmsg", "Sheeo!~sheeo@faf.com", "#aeolus", ["anyone up for a 4v4?"]),
+        ("pubmsg", "Sheeo!~sheeo@faf.com", "#aeolus", [":) gg"]),
+        ("ctcp", "Sheeo!~sheeo@faf.com", "Dostya", ["ACTION", "waves"]),
+        ("action", "Sheeo!~sheeo@faf.com", "Dostya", ["waves"]),
+        ("join", "Dostya!~dostya@faf.com", "#aeolus", []),
+        ("part", "Dostya!~dostya@faf.com", "#aeolus", ["bye"]),
+        ("quit", "Dostya!~dostya@faf.com", None, ["Quit: leaving"]),
+        ("mode", "ChanServ!services@faf.com", "#aeolus", ["+o", "Sheeo"]),
+        ("namreply", "irc.faforever.com", "Dostya", ["=", "#aeolus", "@Sheeo +Dostya Zep"]),
+    ]
+
+
+class RawClient(irclib.SimpleIRCClient):
+    def __init__(self):
+        irclib.SimpleIRCClient.__init__(self)
+        self.lines = []
+
+    def on_all_raw_messages(self, c, e):
+        self.lines.append(e.arguments()[0])
+
+
+def test_raw_messages_only_for_those_who_listen():
+    c, events = connection()
+    c._process_input("JOIN #a\r\n")
+    assert ("all_raw_messages", "", None, ["JOIN #a"]) in events
+
+    raw = RawClient()
+    raw.connection._process_input("JOIN #a\r\nJOIN #b\r\n")
+    assert raw.lines == ["JOIN #a", "JOIN #b"]
+
+    client = Client()
+    assert not client.ircobj._wants_raw_messages(client.connection)
+
+
+def busy_channel_log(lines):
+    ''' IRC traffic like #aeolus's in the evening '''
+    rng = random.Random(42)
+    nicks = ["Player%d" % i for i in range(2000)]
+    log = [":irc.faforever.com 353 Player0 = #aeolus :" + " ".join(nicks[i:i + 50])
+           for i in range(0, len(nicks), 50)]
+    while len(log) < lines:
+        nick = rng.choice(nicks)
+        source = ":%s!~%s@host-%d.example.com" % (nick, nick.lower(), rng.randint(0, 10000))
+        kind = rng.random()
+        if kind < 0.7:
+            log.append(source + " PRIVMSG #aeolus :" + " ".join(rng.choice(nicks) for _ in range(rng.randint(1, 12))))
+        elif kind < 0.8:
+            log.append(source + " JOIN :#aeolus")
+        elif kind < 0.9:
+            log.append(source + " PART #aeolus :Leaving")
+        elif kind < 0.97:
+            log.append(source + " QUIT :Quit: Client closed")
+        else:
+            log.append(":ChanServ!services@faforever.com MODE #aeolus +v " + nick)
+    return "".join(line + "\r\n" for line in log)
+
+
+class Client(irclib.SimpleIRCClient):
+    def __init__(self):
+        irclib.SimpleIRCClient.__init__(self)
+        self.messages = 0
+
+    def on_pubmsg(self, c, e):
+        self.messages += 1
+
+
+def test_busy_channel_log():
+    client = Client()
+    client.connection._process_input(busy_channel_log(2000))
+
+    assert len(client.connection.framer) == 0
+    assert 0.6 * 2000 < client.messages < 0.8 * 2000
+
+
+@pytest.mark.benchmark
+def test_busy_channel_log_benchmark(rates):
+    lines = 100000
+    data = busy_channel_log(lines)
+    client = Client()
+    c = client.connection
+
+    with rates.measure("parsed", lines, "lines"):
+        for i in range(0, len(data), 2 ** 14):
+            c._process_input(data[i:i + 2 ** 14])
+
+    assert len(c.framer) == 0
+    assert 0.6 * lines < client.messages < 0.8 * lines
@@ -0,0 +1,52 @@
+import socket
+
+from chat.ircsockets import IRCSockets
+
+
+def test_socket_is_processed_when_readable(application, qtbot):
+    ours, theirs = socket.socketpair()
+    processed = []
+    sockets = IRCSockets(lambda readable: processed.extend(readable) or ours.recv(100))
+    sockets.add(ours)
+
+    with qtbot.waitSignal(sockets.notifiers[ours.fileno()][0].activated, timeout=1000):
+        theirs.send("PING :x\r\n")
+
+    assert processed == [ours]
+
+
+def test_removed_socket_is_not_processed(application):
+    ours, theirs = socket.socketpair()
+    processed = []
+    sockets = IRCSockets(processed.extend)
+    sockets.add(ours)
+
+    sockets.remove(ours)
+    sockets.remove(ours)
+    sockets.remove(None)
+    theirs.send("PING :x\r\n")
+    application.processEvents()
+
+    assert sockets.notifiers == {}
+    assert processed == []
+
+
+def test_socket_can_be_removed_while_it_is_processed(application, qtbot):
+    ours, theirs = socket.socketpair()
+    processed = []
+
+    def process(readable):
+        processed.extend(readable)
+        sockets.remove(ours)
+
+    sockets = IRCSockets(process)
+    sockets.add(ours)
+    notifier = sockets.notifiers[ours.fileno()][0]
+
+    with qtbot.waitSignal(notifier.activated, timeout=1000):
+        theirs.send("PING :x\r\n")
+    theirs.send("PING :y\r\n")
+    application.processEvents()
+
+    assert processed == [ours]
+    assert not notifier.isEnabled()
@@ -0,0 +1,235 @@
+import random
+import struct
+
+import pytest
+from PyQt4 import QtCore
+
+from fa import gpgnet
+from fa.relayserver import Packet
+
+
+def random_fields(rng, alphabet="abcXYZ09 .:\t\n\x00\xff"):
+    fields = []
+    for _ in range(rng.randint(0, 8)):
+        if rng.random() < 0.4:
+            fields.append(rng.randint(-2**31, 2**31 - 1))
+        else:
+            # no "/" so that escaping round-trips exactly
+            fields.append("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))))
+    return fields
+
+
+def random_messages(seed, count=200, **kwargs):
+    rng = random.Random(seed)
+    return [(rng.choice(["GameState", "PlayerOption", "GameOption", "ProcessNatPacket", "Chat"]), random_fields(rng, **kwargs))
+            for _ in range(count)]
+
+
+# Packet sizes strings before escaping them, so it can only be compared on strings without tabs and newlines
+def test_encode_matches_packet():
+    for header, fields in random_messages(1, alphabet="abcXYZ09 .:\x00\xff"):
+        assert gpgnet.encode(header, fields) == Packet(header, fields).Pack()
+
+
+def test_encode_udp_matches_packet():
+    for header, fields in random_messages(2, alphabet="abcXYZ09 .:\x00\xff"):
+        assert gpgnet.encode_udp(header, fields) == Packet(header, fields).PackUdp()
+
+
+def test_encode_sizes_escaped_strings():
+    assert gpgnet.encode("Chat", ["a\tb"]) == "\x04\x00\x00\x00Chat\x01\x00\x00\x00\x01\x04\x00\x00\x00a/tb"
+
+
+def test_decode_round_trips():
+    messages = random_messages(3)
+    stream = "".join(gpgnet.encode(header, fields) for header, fields in messages)
+
+    assert gpgnet.Decoder().feed(stream) == messages
+
+
+def test_decode_resumes_across_arbitrary_splits():
+    messages = random_messages(4)
+    stream = "".join(gpgnet.encode(header, fields) for header, fields in messages)
+    rng = random.Random(4)
+
+    decoder = gpgnet.Decoder()
+    decoded = []
+    pos = 0
+    while pos < len(stream):
+        step = rng.randint(1, 64)
+        decoded.extend(decoder.feed(stream[pos:pos + step]))
+        pos += step
+
+    assert decoded == messages
+    assert len(decoder.buffer) == 0
+
+
+def test_decode_drops_garbage():
+    decoder = gpgnet.Decoder()
+    good = gpgnet.encode("GameState", ["Idle"])
+    garbage = gpgnet.encode("Bad", range(gpgnet.MAX_FIELDS + 1))
+
+    assert decoder.feed(good + garbage + good) == [("GameState", ["Idle"])]
+    assert len(decoder.buffer) == 0
+    assert decoder.feed(good) == [("GameState", ["Idle"])]
+
+
+def test_decode_drops_negative_sizes():
+    decoder = gpgnet.Decoder()
+    good = gpgnet.encode("GameState", ["Idle"])
+    negative_length = struct.pack("<i", 1) + "A" + struct.pack("<i", 1) + "\x01" + struct.pack("<i", -14)
+    negative_count = struct.pack("<i", 1) + "A" + struct.pack("<i", -1)
+
+    assert decoder.feed(good + negative_length + good) == [("GameState", ["Idle"])]
+    assert len(decoder.buffer) == 0
+    assert decoder.feed(negative_count + good) == []
+    assert decoder.feed(good) == [("GameState", ["Idle"])]
+
+
+def test_decode_drops_oversized_headers():
+    decoder = gpgnet.Decoder()
+    good = gpgnet.encode("GameState", ["Idle"])
+
+    # Would otherwise wait for 4 GiB of header
+    assert decoder.feed(good + struct.pack("<I", 0xffffffff) + "GameState") == [("GameState", ["Idle"])]
+    assert len(decoder.buffer) == 0
+    assert decoder.feed(good) == [("GameState", ["Idle"])]
+
+
+GAME_OPTIONS = [("Victory", "demoralization"), ("Timeouts", "3"), ("CheatsEnabled", "false"),
+                ("CivilianAlliance", "enemy"), ("GameSpeed", "normal"), ("FogOfWar", "explored"),
+                ("UnitCap", "1000"), ("NoRushOption", "Off"), ("PrebuiltUnits", "Off"),
+                ("Share", "ShareUntilDeath"), ("TeamLock", "locked"), ("AllowObservers", False),
+                ("RandomMap", "Off"), ("Score", "no"), ("TeamSpawn", "fixed"), ("Slots", 8),
+                ("ScenarioFile", "maps.scmp_009.scmp_009_scenario.lua")]
+
+
+def lobby_session(players=8):
+    ''' The messages FA sends the relayer over an 8 player lobby and game, in that order '''
+    messages = [("GameState", ["Idle"]), ("GameState", ["Lobby"])]
+    for player in range(1, players + 1):
+        messages.append(("ProcessNatPacket", ["10.0.0.%d:6112" % player, "Hello %d" % player]))
+        messages.append(("Connected", [str(player)]))
+        for key, value in [("Faction", player % 4 + 1), ("Color", player), ("Team", player % 2 + 2),
+                           ("StartSpot", player), ("Army", player), ("Ready", 0), ("Ready", 1)]:
+            messages.append(("PlayerOption", [player, key, value]))
+        messages.extend(("GameOption", [key, str(value)]) for key, value in GAME_OPTIONS)
+        messages.append(("Chat", ["Player%d: gl hf" % player]))
+    messages.append(("GameState", ["Launching"]))
+    for player in range(1, players + 1):
+        messages.append(("GameResult", [player, "score %d" % (player * 1000)]))
+    for player in range(1, players + 1):
+        messages.append(("Disconnected", [str(player)]))
+    messages.append(("Stats", ["{" + ", ".join('"uel%04d": {"built": %d, "lost": %d}' % (unit, unit, unit // 2)
+                                               for unit in range(300)) + "}"]))
+    messages.append(("GameState", ["Ended"]))
+    return messages
+
+
+class ReferenceDecoder(object):
+    ''' The QDataStream parsing Relayer.readData did before gpgnet.Decoder, kept for the benchmark '''
+    def __init__(self):
+        self.device = QtCore.QBuffer()
+        self.device.open(QtCore.QIODevice.ReadWrite)
+        self.headerSizeRead = False
+        self.headerRead = False
+        self.chunkSizeRead = False
+        self.fieldTypeRead = False
+        self.fieldSizeRead = False
+        self.chunks = []
+
+    def feed(self, data):
+        device = self.device
+        pos = device.pos()
+        device.seek(device.size())
+        device.write(data)
+        device.seek(pos)
+
+        messages = []
+        ins = QtCore.QDataStream(device)
+        ins.setByteOrder(QtCore.QDataStream.LittleEndian)
+        while ins.atEnd() == False:
+            if self.headerSizeRead == False:
+                if device.bytesAvailable() < 4:
+                    return messages
+                self.blockSize = ins.readUInt32()
+                self.headerSizeRead = True
+
+            if self.headerRead == False:
+                if device.bytesAvailable() < self.blockSize:
+                    return messages
+                self.action = ins.readRawData(self.blockSize)
+                self.headerRead = True
+
+            if self.chunkSizeRead == False:
+                if device.bytesAvailable() < 4:
+                    return messages
+                self.chunkSize = ins.readInt32()
+                self.chunks = []
+                self.chunkSizeRead = True
+
+            for _ in range(len(self.chunks), self.chunkSize):
+                if self.fieldTypeRead == False:
+                    if device.bytesAvailable() < 1:
+                        return messages
+                    self.fieldType = ins.readBool()
+                    self.fieldTypeRead = True
+
+                if not self.fieldType:
+                    if device.bytesAvailable() < 4:
+                        return messages
+                    self.chunks.append(ins.readInt32())
+                    self.fieldTypeRead = False
+                else:
+                    if self.fieldSizeRead == False:
+                        if device.bytesAvailable() < 4:
+                            return messages
+                        self.fieldSize = ins.readInt32()
+                        self.fieldSizeRead = True
+
+                    if device.bytesAvailable() < self.fieldSize:
+                        return messages
+                    datastring = ins.readRawData(self.fieldSize)
+                    self.chunks.append(datastring.replace("/t", "\t").replace("/n", "\n"))
+                    self.fieldTypeRead = False
+                    self.fieldSizeRead = False
+
+            messages.append((self.action, self.chunks))
+            self.chunks = []
+            self.headerSizeRead = False
+            self.headerRead = False
+            self.chunkSizeRead = False
+            self.fieldTypeRead = False
+            self.fieldSizeRead = False
+        return messages
+
+
+def decode_all(decoder, stream):
+    decoded = []
+    for pos in xrange(0, len(stream), 4096):
+        decoded.extend(decoder.feed(stream[pos:pos + 4096]))
+    return decoded
+
+
+def test_decode_lobby_session():
+    messages = lobby_session()
+    stream = "".join(Packet(header, fields).Pack() for header, fields in messages)
+
+    assert decode_all(gpgnet.Decoder(), stream) == messages
+
+
+@pytest.mark.benchmark
+def test_lobby_session_benchmark(rates):
+    messages = lobby_session() * 100
+
+    with rates.measure("encode before (Packet.Pack)", len(messages), "msgs"):
+        packed = "".join(Packet(header, fields).Pack() for header, fields in messages)
+    with rates.measure("encode after", len(messages), "msgs"):
+        stream = "".join(gpgnet.encode(header, fields) for header, fields in messages)
+    assert stream == packed
+
+    with rates.measure("decode before (QDataStream)", len(messages), "msgs"):
+        before = decode_all(ReferenceDecoder(), stream)
+    with rates.measure("decode after", len(messages), "msgs"):
+        after = decode_all(gpgnet.Decoder(), stream)
+    assert before == after == messages
@@ -0,0 +1,47 @@
+from fa import iothread
+
+from PyQt4 import QtCore
+
+
+def test_histogram_buckets_by_power_of_two_milliseconds():
+    h = iothread.LatencyHistogram()
+    h.record(0.0005)
+    h.record(0.003)
+    h.record(0.003)
+    h.record(0.2)
+
+    assert h.total == 4
+    assert h.counts[0] == 1
+    assert h.counts[2] == 2
+    assert h.counts[8] == 1
+    assert h.percentile(50) == 4
+    assert h.percentile(100) == 256
+
+
+def test_histogram_clamps_huge_samples_into_last_bucket():
+    h = iothread.LatencyHistogram()
+    h.record(3600)
+    assert h.counts[-1] == 1
+
+
+def test_game_traffic_thread_adopts_and_releases(application):
+    traffic = iothread.GameTrafficThread()
+    obj = QtCore.QObject()
+
+    traffic.adopt(obj)
+    assert obj.thread() == traffic
+
+    traffic.start()
+    traffic.stop()
+    assert obj.thread() == QtCore.QThread.currentThread()
+    assert not traffic.isRunning()
+
+
+def test_game_traffic_thread_probes_only_on_request(application):
+    assert iothread.GameTrafficThread().probe is None
+
+    traffic = iothread.GameTrafficThread(probes=True)
+    traffic.start()
+    traffic.stop()
+    assert traffic.probe.thread() == QtCore.QThread.currentThread()
+    assert traffic.guiProbe.timer is None
@@ -0,0 +1,67 @@
+import hashlib
+import os
+
+from fa import manifest
+
+
+def test_md5s_of_missing_files_are_none(tmpdir):
+    m = manifest.HashManifest(str(tmpdir.join("manifest.json")))
+    assert m.md5s([str(tmpdir.join("missing.lua"))]) == {str(tmpdir.join("missing.lua")): None}
+
+
+def test_only_changed_files_are_hashed_again(tmpdir, monkeypatch):
+    hashed = []
+
+    def md5File(path):
+        hashed.append(path)
+        return hashlib.md5(open(path, "rb").read()).hexdigest()
+    monkeypatch.setattr(manifest, "md5File", md5File)
+
+    a, b = tmpdir.join("a.lua"), tmpdir.join("b.lua")
+    a.write("a")
+    b.write("b")
+    paths = [str(a), str(b)]
+
+    m = manifest.HashManifest(str(tmpdir.join("manifest.json")))
+    assert m.md5s(paths) == {str(a): hashlib.md5("a").hexdigest(), str(b): hashlib.md5("b").hexdigest()}
+    assert sorted(hashed) == sorted(paths)
+    m.save()
+
+    del hashed[:]
+    b.write("bb")
+    os.utime(str(b), (0, 12345))
+
+    m = manifest.HashManifest(str(tmpdir.join("manifest.json")))
+    assert m.md5s(paths)[str(b)] == hashlib.md5("bb").hexdigest()
+    assert hashed == [str(b)]
+
+
+def test_md5_file_reads_in_blocks(tmpdir, monkeypatch):
+    monkeypatch.setattr(manifest, "BLOCK_SIZE", 7)
+    data = "".join(chr(i % 256) for i in range(1000))
+    tmpdir.join("big.scd").write(data, mode="wb")
+
+    assert manifest.md5File(str(tmpdir.join("big.scd"))) == hashlib.md5(data).hexdigest()
+
+
+def test_corrupt_manifest_is_discarded(tmpdir):
+    tmpdir.join("manifest.json").write("{not json")
+    assert manifest.HashManifest(str(tmpdir.join("manifest.json"))).entries == {}
+
+
+def test_md5s_async_calls_back_with_md5s_or_error(tmpdir, monkeypatch):
+    tmpdir.join("a.lua").write("a")
+    m = manifest.HashManifest(str(tmpdir.join("manifest.json")))
+    results = []
+
+    m.md5sAsync([str(tmpdir.join("a.lua"))], lambda *args: results.append(args)).join()
+    assert results == [({str(tmpdir.join("a.lua")): hashlib.md5("a").hexdigest()}, None)]
+
+    def md5File(path):
+        raise IOError("locked")
+    monkeypatch.setattr(manifest, "md5File", md5File)
+    tmpdir.join("b.lua").write("b")
+
+    m.md5sAsync([str(tmpdir.join("b.lua"))], lambda *args: results.append(args)).join()
+    assert results[1][0] is None
+    assert isinstance(results[1][1], IOError)
@@ -0,0 +1,112 @@
+import os
+
+from fa import mapregistry
+
+
+def make_map(folder, name, suffixes=mapregistry.MAP_FILE_SUFFIXES):
+    mapdir = folder.mkdir(name)
+    for suffix in suffixes:
+        mapdir.join(name.split(".")[0] + suffix).write("")
+    return mapdir
+
+
+def test_map_version_is_read_from_folder_name():
+    assert mapregistry.mapVersion("canis_river.v0003") == 3
+    assert mapregistry.mapVersion("SCMP_001") is None
+
+
+def test_lookups_ignore_case(tmpdir):
+    make_map(tmpdir, "Canis_River.v0003")
+    registry = mapregistry.MapRegistry([(str(tmpdir), False)])
+
+    assert "canis_river.v0003" in registry
+    local = registry.get("CANIS_RIVER.V0003")
+    assert local.folder == str(tmpdir.join("Canis_River.v0003"))
+    assert local.version == 3
+    assert registry.get("missing") is None
+
+
+def test_earlier_folders_win(tmpdir):
+    user, base = tmpdir.mkdir("user"), tmpdir.mkdir("base")
+    make_map(user, "scmp_001")
+    make_map(base, "scmp_001")
+    registry = mapregistry.MapRegistry([(str(user), False), (str(base), True)])
+
+    assert not registry.get("scmp_001").base
+    assert sorted(registry.names()) == ["scmp_001", "scmp_001"]
+    assert registry.names(str(base)) == ["scmp_001"]
+
+
+def test_map_files_are_found(tmpdir):
+    mapdir = make_map(tmpdir, "Canis_River.v0003")
+    mapdir.join("canis_river.v0003.small.png").write("")
+    local = mapregistry.MapRegistry([(str(tmpdir), False)]).get("canis_river.v0003")
+
+    assert local.isValid()
+    assert local.scenarioFile == "Canis_River_scenario.lua"
+    assert local.saveFile == "Canis_River_save.lua"
+    assert local.previews() == {"small": str(mapdir.join("canis_river.v0003.small.png"))}
+
+
+def test_incomplete_map_is_not_valid(tmpdir):
+    make_map(tmpdir, "broken", (".scmap", "_save.lua"))
+    registry = mapregistry.MapRegistry([(str(tmpdir), False)])
+
+    assert not registry.at(str(tmpdir.join("broken"))).isValid()
+
+
+def test_folders_outside_the_registry_can_be_checked(tmpdir):
+    maps, elsewhere = tmpdir.mkdir("maps"), tmpdir.mkdir("upload")
+    make_map(elsewhere, "new_map")
+    registry = mapregistry.MapRegistry([(str(maps), False)])
+
+    assert registry.at(str(elsewhere.join("new_map"))).isValid()
+
+
+def test_scan_keeps_known_maps_and_drops_removed_ones(tmpdir):
+    make_map(tmpdir, "first")
+    second = make_map(tmpdir, "second")
+    registry = mapregistry.MapRegistry([(str(tmpdir), False)])
+    first = registry.get("first")
+
+    second.remove()
+    make_map(tmpdir, "third")
+    registry.scan(str(tmpdir))
+
+    assert registry.get("first") is first
+    assert "second" not in registry
+    assert "third" in registry
+
+
+def test_changed_map_folder_is_listed_again(tmpdir):
+    mapdir = make_map(tmpdir, "map", ("_scenario.lua",))
+    registry = mapregistry.MapRegistry([(str(tmpdir), False)])
+    local = registry.get("map")
+    assert local.saveFile is None
+
+    mapdir.join("map_save.lua").write("")
+    registry.directoryChanged(local.folder)
+
+    assert local.saveFile == "map_save.lua"
+
+
+def test_empty_maps_folder_is_watched(tmpdir):
+    registry = mapregistry.MapRegistry([(str(tmpdir), False)])
+    assert str(tmpdir) in registry.watcher.directories()
+
+    make_map(tmpdir, "copied")
+    registry.directoryChanged(str(tmpdir))
+
+    assert "copied" in registry
+
+
+def test_maps_folder_is_listed_once_it_appears(tmpdir):
+    maps = tmpdir.join("maps")
+    registry = mapregistry.MapRegistry([(str(maps), False)])
+    assert registry.get("first") is None
+
+    maps.mkdir()
+    make_map(maps, "first")
+
+    assert registry.get("first").folder == str(maps.join("first"))
+    assert str(maps) in registry.watcher.directories()
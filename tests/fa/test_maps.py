@@ -9,3 +9,11 @@ TESTMAP_NAME = "faf_test_map"
 def test_downloader_has_slot_abort(application):
     assert callable(maps.Downloader(TESTMAP_NAME, parent=application).abort)
 
+
+
+def test_bgra_to_rgb_drops_alpha_and_swaps_channels():
+    assert maps.bgraToRgb("\x01\x02\x03\xff\x04\x05\x06\x00") == bytearray("\x03\x02\x01\x06\x05\x04")
+
+
+def test_bgra_to_rgb_ignores_trailing_partial_pixel():
+    assert maps.bgraToRgb("\x01\x02\x03\xff\x04\x05") == bytearray("\x03\x02\x01")
@@ -0,0 +1,105 @@
+import threading
+
+import pytest
+from PyQt4 import QtGui
+
+from fa import maps, previews
+
+
+class FakeDownloader(object):
+    def __init__(self):
+        self.requested = []
+
+    def downloadMapPreview(self, name, callback):
+        self.requested.append((name, callback))
+
+
+def generating(monkeypatch, result):
+    ''' Makes generatePreview give result once the returned event is set '''
+    release = threading.Event()
+    generated = []
+
+    def generatePreview(mapname):
+        release.wait(5)
+        generated.append(mapname)
+        return result
+    monkeypatch.setattr(maps, "generatePreview", generatePreview)
+    release.generated = generated
+    return release
+
+
+@pytest.fixture
+def preview_file(tmpdir):
+    path = str(tmpdir.join("scmp_001.png"))
+    image = QtGui.QImage(4, 4, QtGui.QImage.Format_ARGB32)
+    image.fill(0xff808080)
+    image.save(path)
+    return path
+
+
+@pytest.fixture
+def service(application, monkeypatch, request):
+    monkeypatch.setattr(maps, "cachedPreview", lambda mapname: None)
+    s = previews.MapPreviewService(FakeDownloader(), application)
+    request.addfinalizer(s.waitForDone)
+    return s
+
+
+def test_requests_for_a_map_share_one_generation(service, monkeypatch, preview_file, qtbot):
+    release = generating(monkeypatch, preview_file)
+    future = service.request("scmp_001")
+    assert service.request("scmp_001") is future
+    assert service.icon("scmp_001") is None
+
+    icons = []
+    future.then(icons.append)
+    with qtbot.waitSignal(future.finished, timeout=5000):
+        release.set()
+
+    assert release.generated == ["scmp_001"]
+    assert len(icons) == 1
+    assert future.done
+    assert service.icon("scmp_001") is future.icon
+    assert service.downloader.requested == []
+
+
+def test_then_on_a_ready_preview_calls_right_away(service, monkeypatch, preview_file):
+    monkeypatch.setattr(maps, "cachedPreview", lambda mapname: preview_file)
+
+    icons = []
+    service.request("scmp_001").then(icons.append)
+
+    assert len(icons) == 1
+    assert not icons[0].isNull()
+
+
+def test_maps_that_arent_installed_are_downloaded(service, monkeypatch, preview_file, qtbot):
+    release = generating(monkeypatch, None)
+
+    future = service.request("scmp_001")
+    with qtbot.waitSignal(service.generated, timeout=5000):
+        release.set()
+    [(name, callback)] = service.downloader.requested
+    assert name == "scmp_001"
+
+    icons = []
+    future.then(icons.append)
+    callback(QtGui.QPixmap(preview_file))
+
+    assert len(icons) == 1
+    assert service.request("scmp_001") is future
+
+
+def test_failed_download_is_tried_again(service, monkeypatch, qtbot):
+    release = generating(monkeypatch, None)
+
+    future = service.request("scmp_001")
+    with qtbot.waitSignal(service.generated, timeout=5000):
+        release.set()
+    icons = []
+    future.then(icons.append)
+    service.downloader.requested[0][1](None)
+
+    # The placeholder is shown, but the next request starts over
+    assert len(icons) == 1
+    assert service.request("scmp_001") is not future
@@ -0,0 +1,166 @@
+import collections
+import time
+
+from fa import proxies
+
+from flexmock import flexmock
+from PyQt4 import QtCore, QtNetwork
+import pytest
+
+
+def test_p2p_addr_round_trips():
+    key = proxies.p2p_parse_addr("192.168.1.20:6112")
+    assert key == (0xc0a80114, 6112)
+    assert proxies.p2p_format_addr(key) == "192.168.1.20:6112"
+
+
+def test_p2p_peer_defaults():
+    sock = flexmock(localPort=lambda: 50000)
+    peer = proxies.P2PPeer((0x7f000001, 6112), None, sock)
+
+    assert peer.local_port == 50000
+    assert peer.public_port == 6112
+    assert peer.our_reconn_tag is None
+    assert peer.their_reconn_tag is None
+    assert not peer.connected
+    assert str(peer) == "127.0.0.1:6112"
+
+
+def test_p2p_addr_struct_packs_intermediary_payload():
+    payload = proxies.P2P_ADDR_STRUCT.pack(0x0a000001, 6112)
+    assert payload == "\x0a\x00\x00\x01\x17\xe0"
+    assert proxies.P2P_ADDR_STRUCT.unpack_from("x" * 24 + payload, 24) == (0x0a000001, 6112)
+
+
+class FakeUdpSocket(object):
+    ''' Stands in for the QUdpSocket of the proxies: datagrams to read are queued, written ones recorded '''
+    next_port = 50000
+
+    def __init__(self, parent=None):
+        self.readyRead = flexmock(connect=lambda slot: None)
+        self.pending = collections.deque()
+        self.sent = []
+        self.port = None
+
+    def bind(self, host, port):
+        if not port:
+            FakeUdpSocket.next_port += 1
+            port = FakeUdpSocket.next_port
+        self.port = port
+        return True
+
+    def localPort(self):
+        return self.port
+
+    def hasPendingDatagrams(self):
+        return bool(self.pending)
+
+    def pendingDatagramSize(self):
+        return len(self.pending[0][0])
+
+    def readDatagram(self, size):
+        return self.pending.popleft()
+
+    def writeDatagram(self, dgram, host, port):
+        self.sent.append((dgram, port))
+
+    def close(self):
+        pass
+
+
+class FakeTcpSocket(object):
+    def __init__(self, parent=None):
+        self.connected = self.readyRead = self.disconnected = flexmock(connect=lambda slot: None)
+
+
+@pytest.fixture
+def p2p(application, monkeypatch):
+    monkeypatch.setattr(proxies.QtNetwork, "QUdpSocket", FakeUdpSocket)
+    monkeypatch.setattr(proxies.QtNetwork, "QTcpSocket", FakeTcpSocket)
+    p = proxies.proxies(client=flexmock(gamePort=6112))
+    p.p2p_state_initialize(None)
+    return p
+
+
+def receive(p, dgram, addr):
+    host, port = addr.rsplit(":", 1)
+    p.p2p_public_sock.pending.append((dgram, QtNetwork.QHostAddress(host), int(port)))
+    p.p2p_read_public()
+
+
+def test_game_traffic_is_forwarded_to_fa(p2p):
+    receive(p2p, "game data", "10.0.0.1:6112")
+
+    peer = p2p.p2p_by_public[proxies.p2p_parse_addr("10.0.0.1:6112")]
+    assert peer.local_sock.sent == [("game data", 6113)]
+    assert p2p.p2p_public_sock.sent == []
+
+
+def test_tag_offer_is_acked(p2p):
+    receive(p2p, proxies.P2P_ESCAPE_PREFIX + proxies.P2P_OP_TAG_OFFER + "12345678", "10.0.0.1:6112")
+
+    peer = p2p.p2p_by_public[proxies.p2p_parse_addr("10.0.0.1:6112")]
+    assert peer.their_reconn_tag == "12345678"
+    assert peer.local_sock.sent == []
+    assert p2p.p2p_public_sock.sent == [(proxies.P2P_ESCAPE_PREFIX + proxies.P2P_OP_TAG_ACK + "12345678", 6112)]
+
+
+def test_reconnect_by_intermediary_2_rekeys_the_peer(p2p):
+    receive(p2p, proxies.P2P_ESCAPE_PREFIX + proxies.P2P_OP_TAG_OFFER + "12345678", "10.0.0.1:6112")
+    new_key = proxies.p2p_parse_addr("10.0.0.9:6000")
+    receive(p2p, proxies.P2P_ESCAPE_PREFIX + proxies.P2P_OP_RECONNECT_BY_INTERMEDIARY_2 + "12345678" +
+            proxies.P2P_ADDR_STRUCT.pack(*new_key), "10.0.0.2:6112")
+
+    assert p2p.p2p_by_public[new_key].their_reconn_tag == "12345678"
+    assert proxies.p2p_parse_addr("10.0.0.1:6112") not in p2p.p2p_by_public
+
+
+@pytest.mark.parametrize("dgram", [proxies.P2P_ESCAPE_PREFIX + proxies.P2P_OP_TAG_OFFER + "1234",
+                                   proxies.P2P_ESCAPE_PREFIX + proxies.P2P_OP_RECONNECT_BY_INTERMEDIARY_2 + "12345678\x0a"])
+def test_truncated_control_datagrams_are_dropped(p2p, dgram):
+    receive(p2p, dgram, "10.0.0.1:6112")
+    receive(p2p, "game data", "10.0.0.1:6112")
+
+    peer = p2p.p2p_by_public[proxies.p2p_parse_addr("10.0.0.1:6112")]
+    assert peer.their_reconn_tag is None
+    assert peer.local_sock.sent == [("game data", 6113)]
+
+
+def reference_read_public(psock, by_public, game_port):
+    ''' The forwarding path before peers were keyed by (ipv4, port): "host:port" keys and a QByteArray per datagram '''
+    escape_prefix = QtCore.QByteArray(proxies.P2P_ESCAPE_PREFIX)
+    while psock.hasPendingDatagrams():
+        size = psock.pendingDatagramSize()
+        dgram, host, port = psock.readDatagram(size)
+        remote_str = host.toString() + ':' + str(port)
+        if remote_str in by_public:
+            p2p = by_public[remote_str]
+            dgram = QtCore.QByteArray(dgram)
+            if dgram.startsWith(escape_prefix):
+                continue
+            p2p['pub_last_recv'] = time.time()
+            p2p['local_sock'].writeDatagram(dgram, QtNetwork.QHostAddress.LocalHost, game_port + 1)
+            if p2p['connected'] and (p2p['currently_reconnecting'] or not p2p['our_reconn_tag_ack'] and not 'our_reconn_tag_declined' in p2p):
+                pass
+
+
+@pytest.mark.benchmark
+def test_forwarding_benchmark(p2p, rates):
+    addrs = ["10.0.0.%d:6112" % i for i in range(1, 8)]
+    hosts = [(QtNetwork.QHostAddress(addr.split(":")[0]), 6112) for addr in addrs]
+    dgrams = [("x" * 64, host, port) for _ in range(100000 // len(hosts)) for host, port in hosts]
+
+    psock = FakeUdpSocket()
+    psock.pending.extend(dgrams)
+    by_public = dict((addr, {'local_sock': FakeUdpSocket(), 'connected': 0, 'currently_reconnecting': 0,
+                             'our_reconn_tag_ack': 0}) for addr in addrs)
+    with rates.measure("before", len(dgrams), "datagrams"):
+        reference_read_public(psock, by_public, 6112)
+    assert sum(len(p['local_sock'].sent) for p in by_public.values()) == len(dgrams)
+
+    for addr in addrs:
+        receive(p2p, "hello", addr)
+    p2p.p2p_public_sock.pending.extend(dgrams)
+    with rates.measure("after", len(dgrams), "datagrams"):
+        p2p.p2p_read_public()
+    assert sum(len(peer.local_sock.sent) for peer in p2p.p2p_by_public.values()) == len(dgrams) + len(addrs)
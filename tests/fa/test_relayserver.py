@@ -0,0 +1,71 @@
+import json
+
+import pytest
+from flexmock import flexmock
+
+from fa import relayserver
+from PyQt4 import QtCore
+
+
+class FakeSocket(object):
+    def __init__(self, parent=None):
+        self.readyRead = self.disconnected = flexmock(connect=lambda slot: None)
+        self.written = []
+
+    def connectToHost(self, host, port):
+        pass
+
+    def waitForConnected(self, msecs):
+        return False
+
+    def isOpen(self):
+        return True
+
+    def write(self, data):
+        self.written.append(data)
+
+    def deleteLater(self):
+        pass
+
+
+@pytest.fixture
+def relayer(application, monkeypatch):
+    monkeypatch.setattr(relayserver.QtNetwork, "QTcpSocket", FakeSocket)
+    return relayserver.Relayer(None, None, FakeSocket(), False)
+
+
+def qdatastream_frame(data):
+    block = QtCore.QByteArray()
+    out = QtCore.QDataStream(block, QtCore.QIODevice.ReadWrite)
+    out.setVersion(QtCore.QDataStream.Qt_4_2)
+    out.writeUInt32(0)
+    out.writeQString(data)
+    out.device().seek(0)
+    out.writeUInt32(block.size() - 4)
+    return block.data()
+
+
+def test_frame_for_server_matches_qdatastream():
+    message = dict(action="GameOption", chuncks=["Victory", 3, u"s\xe9raphim"])
+    assert relayserver.frameForServer(message) == qdatastream_frame(json.dumps(message))
+
+
+def test_frames_concatenate():
+    frames = relayserver.frameForServer(dict(action="ping", chuncks=[])) * 2
+    size = int(frames[:4].encode("hex"), 16)
+    assert frames[:size + 4] == frames[size + 4:]
+
+
+def test_messages_sent_in_one_pass_are_written_once(application, relayer):
+    messages = [("GameState", ["Idle"]), ("GameOption", ["Victory", "sandbox"]), ("PlayerOption", [2, "Team", 1])]
+    for action, chunks in messages:
+        relayer.sendToServer(action, chunks)
+
+    assert relayer.relaySocket.written == []
+    application.processEvents()
+
+    frames = "".join(relayserver.frameForServer(dict(action=action, chuncks=chunks)) for action, chunks in messages)
+    assert relayer.relaySocket.written == [frames]
+    assert relayer.messagesSent == 3
+    assert relayer.flushes == 1
+    assert relayer.bytesSent == len(frames)
@@ -15,7 +15,7 @@ urllib.urlretrieve ("http://content.faforever.com/faf/vault/replay_vault/replay.
 
 from PyQt4.QtCore import *
 
-import zlib, base64
+import zlib, base64, json
 
 from fa.FAFReplayReader import FAFReplayReader
 from fa.FAFReplayWriter import FAFReplayWriter
@@ -78,3 +78,92 @@ def test_FAFReplay(qtbot):
 
     fcmp(join(tmpdir, REPLAY_v0), join(tmpdir, REPLAY_v2_OUT))
 
+
+
+def test_FAFReplay_synced_prefix_is_readable(qtbot):
+    # What's on disk after sync() is a complete replay, up to the last synced byte
+    f = QFile(join(tmpdir, REPLAY_v2 + ".part"))
+    f.open(QFile.WriteOnly)
+
+    writer = FAFReplayWriter(f)
+    writer.writeHeader({'name':'banana'})
+    writer.write(replay_data[:4096])
+    writer.sync()
+    f.close()
+
+    f = QFile(join(tmpdir, REPLAY_v2 + ".part"))
+    f.open(QFile.ReadOnly)
+    buf = QBuffer()
+    buf.open(QBuffer.WriteOnly)
+
+    reader = FAFReplayReader(f)
+    assert reader.extract(buf) == 4096
+    assert reader.header == {'name':'banana'}
+    assert buf.data() == replay_data[:4096]
+
+
+def test_FAFReplay_rewriteHeader(qtbot):
+    from fa.FAFReplayWriter import rewriteHeader
+    from fa.FAFReplayReader import readReplayInfoLine
+
+    f = QFile(join(tmpdir, REPLAY_v2))
+    f.open(QFile.WriteOnly)
+    writer = FAFReplayWriter(f)
+    writer.writeHeader({'name':'banana'})
+    writer.write(replay_data)
+    writer.close()
+    f.close()
+
+    source = QFile(join(tmpdir, REPLAY_v2))
+    source.open(QFile.ReadOnly)
+    target = QFile(join(tmpdir, REPLAY_v2 + "_rewritten"))
+    target.open(QFile.WriteOnly)
+    rewriteHeader(source, target, {'name':'banana', 'complete':True})
+    source.close()
+    target.close()
+
+    assert json.loads(readReplayInfoLine(join(tmpdir, REPLAY_v2 + "_rewritten"))) == {'name':'banana', 'complete':True}
+    assert 'uid' in json.loads(readReplayInfoLine(join(tmpdir, REPLAY_v1)))
+
+    f = QFile(join(tmpdir, REPLAY_v2 + "_rewritten"))
+    f.open(QFile.ReadOnly)
+    buf = QBuffer()
+    buf.open(QBuffer.WriteOnly)
+    assert FAFReplayReader(f).extract(buf) == len(replay_data)
+    assert buf.data() == replay_data
+
+
+def test_FAFReplayV3_seekTick(qtbot):
+    from fa.FAFReplayWriter import FAFReplayWriterV3
+
+    buf = QBuffer()
+    buf.open(QBuffer.WriteOnly)
+    writer = FAFReplayWriterV3(buf)
+    writer.writeHeader({'name':'banana'})
+    writer.write(replay_data)
+    writer.close()
+    data = buf.data()
+
+    # Reads sequentially like v2
+    source = QBuffer(data)
+    source.open(QBuffer.ReadOnly)
+    out = QBuffer()
+    out.open(QBuffer.WriteOnly)
+    reader = FAFReplayReader(source)
+    assert reader.extract(out) == len(replay_data)
+    assert reader.header == {'name':'banana'}
+    assert out.data() == replay_data
+
+    source = QBuffer(data)
+    source.open(QBuffer.ReadOnly)
+    reader = FAFReplayReader(source)
+    index = reader.tickIndex()
+    assert len(index) > 1
+
+    tick = reader.seekTick(index[-1][0] + 1)
+    assert tick == index[-1][0]
+    out = QBuffer()
+    out.open(QBuffer.WriteOnly)
+    reader.extract(out)
+    assert replay_data.endswith(out.data().data())
+    assert 0 < out.data().size() < len(replay_data)
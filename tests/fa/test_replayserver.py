@@ -0,0 +1,125 @@
+import os
+
+import pytest
+from flexmock import flexmock
+from PyQt4 import QtCore
+
+import fa
+import util
+from fa import replayserver, scfareplay
+from fa.FAFReplayReader import FAFReplayReader
+
+from .test_scfareplay import header, op, advance
+
+LIVE_PREFIX = "P/1234/Zep\0"
+REPLAY = header() + "".join(op(scfareplay.OP_ISSUE_COMMAND, "x" * 40) + advance() for _ in range(2000))
+
+
+class FakeLocalSocket(object):
+    def __init__(self):
+        self.readyRead = self.disconnected = flexmock(connect=lambda slot: None)
+        self.data = ""
+
+    def setSocketOption(self, option, value):
+        pass
+
+    def bytesAvailable(self):
+        return len(self.data)
+
+    def read(self, size):
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+
+class FakeRelaySocket(object):
+    KeepAliveOption = 1
+
+    def __init__(self, parent=None):
+        self.written = []
+
+    def connectToHost(self, host, port):
+        pass
+
+    def waitForConnected(self, msecs):
+        return False
+
+    def isOpen(self):
+        return True
+
+    def write(self, data):
+        self.written.append(data)
+
+
+@pytest.fixture
+def replay_dir(application, tmpdir, monkeypatch):
+    monkeypatch.setattr(util, "REPLAY_DIR", str(tmpdir))
+    monkeypatch.setattr(util, "settings", flexmock(value=lambda key, default, type=None: key == "fa.record_replay"))
+    monkeypatch.setattr(replayserver.QtNetwork, "QTcpSocket", FakeRelaySocket)
+    return tmpdir
+
+
+def record(monkeypatch, info):
+    ''' Starts a recorder while fa.instance.info is info, and feeds it a live replay in pieces '''
+    monkeypatch.setattr(fa, "instance", flexmock(info=info))
+    sock = FakeLocalSocket()
+    recorder = replayserver.ReplayRecorder(None, sock)
+    data = LIVE_PREFIX + REPLAY
+    for pos in range(0, len(data), 4096):
+        sock.data = data[pos:pos + 4096]
+        recorder.readDatas()
+    return recorder
+
+
+def read_replay(path):
+    source = QtCore.QFile(path)
+    source.open(QtCore.QIODevice.ReadOnly)
+    out = QtCore.QBuffer()
+    out.open(QtCore.QIODevice.WriteOnly)
+    reader = FAFReplayReader(source)
+    reader.extract(out)
+    source.close()
+    return reader.header, str(out.data())
+
+
+def test_interrupted_recording_is_recovered(replay_dir, monkeypatch):
+    monkeypatch.setattr(replayserver, "REPLAY_SYNC_INTERVAL", 1)
+    recorder = record(monkeypatch, None)
+    partname = recorder.replayFile.fileName()
+
+    # The client dies here, the .part file is never finalized
+    replayserver.recoverReplayFiles()
+
+    assert not os.path.exists(partname)
+    assert read_replay(partname[:-len(replayserver.REPLAY_PART_SUFFIX)]) == ({}, REPLAY)
+
+
+def test_part_file_without_replay_data_is_dropped(replay_dir):
+    replay_dir.join("live-1.fafreplay.part").write("FAF_REPLAY_v002\0", mode="wb")
+
+    replayserver.recoverReplayFiles()
+
+    assert replay_dir.listdir() == []
+
+
+def test_finished_recording_gets_the_final_header(replay_dir, monkeypatch):
+    recorder = record(monkeypatch, {'uid': 42, 'recorder': 'Zep'})
+    fa.instance.info = {'uid': 42, 'recorder': 'Zep', 'complete': True}
+    recorder.writeReplayFile()
+
+    assert [path.basename for path in replay_dir.listdir()] == ["42-Zep.fafreplay"]
+    info, data = read_replay(str(replay_dir.join("42-Zep.fafreplay")))
+    assert info['complete']
+    assert 'game_end' in info
+    assert data == REPLAY
+    assert "".join(recorder.relaySocket.written) == LIVE_PREFIX + REPLAY
+
+
+def test_recording_without_game_info_keeps_its_live_name(replay_dir, monkeypatch):
+    recorder = record(monkeypatch, None)
+    filename = os.path.basename(recorder.replayFile.fileName())[:-len(replayserver.REPLAY_PART_SUFFIX)]
+    recorder.writeReplayFile()
+
+    assert [path.basename for path in replay_dir.listdir()] == [filename]
+    info, data = read_replay(str(replay_dir.join(filename)))
+    assert info.keys() == ['game_end']
+    assert data == REPLAY
@@ -0,0 +1,109 @@
+import struct
+
+import pytest
+
+from fa import scfareplay
+
+
+def header(sources=("alice", "bob")):
+    data = "Supreme Commander v1.50.3599\0\0Replay v1.9\r\n/maps/x/x.scmap\0\r\n\x1a\0"
+    data += struct.pack("<I", 3) + "mod"
+    data += struct.pack("<I", 4) + "scen"
+    data += chr(len(sources))
+    for name in sources:
+        data += name + "\0" + struct.pack("<I", 3)
+    data += "\0"  # cheats
+    data += chr(len(sources))
+    for i in range(len(sources)):
+        data += struct.pack("<I", 2) + "ar" + chr(i) + "\0"
+    return data + struct.pack("<I", 1234)
+
+
+def op(kind, payload=""):
+    return struct.pack("<BH", kind, 3 + len(payload)) + payload
+
+
+def advance(ticks=1):
+    return op(scfareplay.OP_ADVANCE, struct.pack("<I", ticks))
+
+
+def source(n):
+    return op(scfareplay.OP_SET_COMMAND_SOURCE, chr(n))
+
+
+def checksum(digest, tick):
+    return op(scfareplay.OP_VERIFY_CHECKSUM, struct.pack("<16sI", digest, tick))
+
+
+def test_parse_header():
+    data = header()
+    h = scfareplay.parse_header(data + "rest")
+
+    assert h.version == "Supreme Commander v1.50.3599"
+    assert h.replay_version == "Replay v1.9"
+    assert h.map == "/maps/x/x.scmap"
+    assert h.sources == ["alice", "bob"]
+    assert h.armies == [("ar", 0), ("ar", 1)]
+    assert h.seed == 1234
+    assert h.size == len(data)
+
+
+def test_parse_header_incomplete():
+    data = header()
+    for cut in (0, 10, len(data) - 1):
+        with pytest.raises(scfareplay.Incomplete):
+            scfareplay.parse_header(data[:cut])
+
+
+def test_read_version():
+    assert scfareplay.read_version(header()) == "Supreme Commander v1.50.3599"
+
+
+def test_operations_track_ticks_and_sources():
+    body = source(0) + op(scfareplay.OP_ISSUE_COMMAND, "xyz") + advance(2) + source(1) + checksum("\x01" * 16, 2)
+    ops = list(scfareplay.operations(body))
+
+    assert [(o.type, o.tick, o.source) for o in ops] == [
+        (scfareplay.OP_SET_COMMAND_SOURCE, 0, 0),
+        (scfareplay.OP_ISSUE_COMMAND, 0, 0),
+        (scfareplay.OP_ADVANCE, 0, 0),
+        (scfareplay.OP_SET_COMMAND_SOURCE, 2, 1),
+        (scfareplay.OP_VERIFY_CHECKSUM, 2, 1),
+    ]
+    assert ops[1].data.tobytes() == "xyz"
+    assert ops[2].data == 2
+    assert ops[4].data == ("01" * 16, 2)
+
+
+def test_operations_drop_truncated_tail():
+    body = advance() + advance()
+    assert len(list(scfareplay.operations(body[:-1]))) == 1
+
+
+def test_stats():
+    body = ""
+    for tick in range(600):
+        body += source(0) + op(scfareplay.OP_ISSUE_COMMAND, "c")
+        if tick % 2:
+            body += source(1) + op(scfareplay.OP_ISSUE_FACTORY_COMMAND, "f")
+        body += checksum("\x00" * 16, tick) + advance()
+    body += source(1) + checksum("\x02" * 16, 10) + op(scfareplay.OP_END_GAME)
+
+    stats = scfareplay.stats(header() + body)
+
+    assert stats.ticks == 600
+    assert stats.seconds == 60
+    assert stats.apm(0) == 600
+    assert stats.apm(1) == 300
+    assert stats.desyncs == [10]
+    assert stats.ended
+
+
+def test_stats_fed_in_pieces():
+    body = (source(1) + op(scfareplay.OP_ISSUE_COMMAND) + advance()) * 5
+    stats = scfareplay.ReplayStats()
+    stats.feed(body)
+    stats.feed(op(scfareplay.OP_ISSUE_COMMAND) + body)
+
+    assert stats.ticks == 10
+    assert stats.actions[1] == 11
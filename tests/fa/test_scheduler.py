@@ -0,0 +1,63 @@
+from fa.scheduler import DeadlineScheduler
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_runs_only_due_callbacks_in_deadline_order(application):
+    clock = FakeClock()
+    scheduler = DeadlineScheduler(clock=clock)
+    fired = []
+
+    scheduler.call_later(5, fired.append, "b")
+    scheduler.call_later(1, fired.append, "a")
+    scheduler.call_later(30, fired.append, "c")
+
+    assert scheduler.run_due() == 0
+    clock.now += 5
+    assert scheduler.run_due() == 2
+    assert fired == ["a", "b"]
+    assert len(scheduler) == 1
+
+
+def test_cancelled_callbacks_do_not_run(application):
+    clock = FakeClock()
+    scheduler = DeadlineScheduler(clock=clock)
+    fired = []
+
+    entry = scheduler.call_later(1, fired.append, "a")
+    scheduler.cancel(entry)
+    clock.now += 2
+
+    assert scheduler.run_due() == 0
+    assert fired == []
+    assert len(scheduler) == 0
+
+
+def test_callbacks_can_reschedule_themselves(application):
+    clock = FakeClock()
+    scheduler = DeadlineScheduler(clock=clock)
+    fired = []
+
+    def tick():
+        fired.append(clock.now)
+        scheduler.call_later(1, tick)
+
+    scheduler.call_later(1, tick)
+    for _ in range(3):
+        clock.now += 1
+        scheduler.run_due()
+
+    assert fired == [1001.0, 1002.0, 1003.0]
+
+
+def test_clear_drops_everything(application):
+    scheduler = DeadlineScheduler(clock=FakeClock())
+    scheduler.call_later(1, lambda: None)
+    scheduler.clear()
+    assert len(scheduler) == 0
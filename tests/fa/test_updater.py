@@ -1,8 +1,15 @@
 __author__ = 'Thygrrr'
 
+import hashlib
+import json
+import os
+import struct
+
 from fa import updater
-from PyQt4 import QtGui, QtCore
+from fa import manifest
+from PyQt4 import QtGui, QtCore, QtNetwork
 import pytest
+import util
 
 
 class NoIsFinished(QtCore.QObject):
@@ -91,3 +98,204 @@ def test_updater_does_not_hide_and_accept_before_all_watches_are_finished(applic
     assert u.isVisible()
     assert not u.result() == QtGui.QDialog.Accepted
 
+
+class FakeUpdateServer(QtNetwork.QTcpServer):
+    """
+    Stands in for the update server, serving the same files for every file group.
+    """
+    def __init__(self, files, manifest=True):
+        QtNetwork.QTcpServer.__init__(self)
+        self.files = files
+        self.manifest = manifest
+        self.requests = []
+        self.buffer = ""
+        self.newConnection.connect(self.connection)
+        self.listen(QtNetwork.QHostAddress.LocalHost, 0)
+
+    def connection(self):
+        self.socket = self.nextPendingConnection()
+        self.socket.readyRead.connect(self.read)
+
+    def read(self):
+        self.buffer += str(self.socket.readAll())
+        while len(self.buffer) >= 4:
+            size = struct.unpack(">I", self.buffer[:4])[0]
+            if len(self.buffer) < 4 + size:
+                return
+            stream = QtCore.QDataStream(QtCore.QByteArray(self.buffer[4:4 + size]))
+            stream.setVersion(QtCore.QDataStream.Qt_4_2)
+            self.buffer = self.buffer[4 + size:]
+            self.handle(stream.readQString(), stream)
+
+    def handle(self, action, stream):
+        self.requests.append(action)
+        if action == "HELLO" and self.manifest:
+            self.send("CAPABILITIES", json.dumps(["UPDATE_MANIFEST"]))
+        elif action == "GET_FILES_TO_UPDATE":
+            self.send("LIST_FILES_TO_UP", str(sorted(self.files)))
+        elif action == "UPDATE_MANIFEST" and self.manifest:
+            destination, _ = stream.readQString(), stream.readQString()
+            for name, md5 in json.loads(stream.readQString()).items():
+                self.sendFile(destination, name, md5)
+        elif action == "UPDATE":
+            self.sendFile(stream.readQString(), stream.readQString(), stream.readQString())
+        elif action == "REQUEST_PATH":
+            self.sendFile(stream.readQString(), stream.readQString(), None)
+
+    def sendFile(self, destination, name, md5):
+        if md5 == hashlib.md5(self.files[name]).hexdigest():
+            self.send("UP_TO_DATE", name)
+        else:
+            self.send("SEND_FILE", destination, name, len(self.files[name]), self.files[name])
+
+    def send(self, action, *args):
+        block = QtCore.QByteArray()
+        out = QtCore.QDataStream(block, QtCore.QIODevice.ReadWrite)
+        out.setVersion(QtCore.QDataStream.Qt_4_2)
+        out.writeUInt32(0)
+        out.writeQString(action)
+        for arg in args:
+            if isinstance(arg, int):
+                out.writeInt(arg)
+            elif action == "SEND_FILE" and arg is args[-1]:
+                out.writeRawData(arg)
+            else:
+                out.writeQString(arg)
+        out.device().seek(0)
+        out.writeUInt32(block.size() - 4)
+        self.socket.write(block)
+
+
+@pytest.fixture(scope="function")
+def appdata(tmpdir, monkeypatch):
+    monkeypatch.setattr(util, "APPDATA_DIR", str(tmpdir))
+    monkeypatch.setattr(util, "LUA_DIR", str(tmpdir.join("bin")))
+    monkeypatch.setattr(util, "CACHE_DIR", str(tmpdir.join("cache")))
+    monkeypatch.setattr(updater, "_manifest", None)
+    return tmpdir
+
+
+def run_updater(server):
+    u = updater.Updater("testmod")
+    u.HOST = "127.0.0.1"
+    u.SOCKET = server.serverPort()
+    return u.run()
+
+
+def test_updater_sends_one_manifest_per_file_group(application, appdata):
+    server = FakeUpdateServer({"a.lua": "a", "b.lua": "b"})
+
+    assert run_updater(server) == updater.Updater.RESULT_SUCCESS
+    assert server.requests == ["HELLO"] + ["GET_FILES_TO_UPDATE", "UPDATE_MANIFEST"] * 2
+    assert appdata.join("gamedata", "a.lua").read() == "a"
+    assert appdata.join("bin", "b.lua").read() == "b"
+
+
+def test_updater_does_not_hash_unchanged_files_again(application, appdata, monkeypatch):
+    # The first run downloads the files, the second one hashes them
+    for _ in range(2):
+        assert run_updater(FakeUpdateServer({"a.lua": "a", "b.lua": "b"})) == updater.Updater.RESULT_SUCCESS
+
+    hashed = []
+    md5File = manifest.md5File
+    monkeypatch.setattr(manifest, "md5File", lambda path: hashed.append(path) or md5File(path))
+    monkeypatch.setattr(updater, "_manifest", None)
+
+    assert run_updater(FakeUpdateServer({"a.lua": "a", "b.lua": "b"})) == updater.Updater.RESULT_SUCCESS
+    assert hashed == []
+
+
+def test_updater_requests_single_files_from_older_servers(application, appdata):
+    server = FakeUpdateServer({"a.lua": "a"}, manifest=False)
+
+    assert run_updater(server) == updater.Updater.RESULT_SUCCESS
+    assert server.requests == ["HELLO", "GET_FILES_TO_UPDATE", "REQUEST_PATH", "GET_FILES_TO_UPDATE", "REQUEST_PATH"]
+    assert appdata.join("gamedata", "a.lua").read() == "a"
+
+
+def test_updater_ignores_answers_for_files_it_is_done_with(application, appdata):
+    server = FakeUpdateServer({"a.lua": "a", "b.lua": "b"})
+    sendFile = server.sendFile
+
+    def sendTwice(destination, name, md5):
+        sendFile(destination, name, md5)
+        sendFile(destination, name, md5)
+    server.sendFile = sendTwice
+
+    assert run_updater(server) == updater.Updater.RESULT_SUCCESS
+    assert appdata.join("bin", "b.lua").read() == "b"
+
+
+def test_updater_start_returns_right_away_and_emits_finished(application, appdata, qtbot):
+    server = FakeUpdateServer({"a.lua": "a"})
+    u = updater.Updater("testmod")
+    u.HOST = "127.0.0.1"
+    u.SOCKET = server.serverPort()
+    results = []
+    u.finished.connect(results.append)
+
+    with qtbot.waitSignal(u.finished, timeout=5000):
+        u.start()
+        assert results == []
+
+    assert results == [updater.Updater.RESULT_SUCCESS]
+    assert appdata.join("gamedata", "a.lua").read() == "a"
+
+
+def test_updater_fails_on_unknown_mod(application, appdata, monkeypatch):
+    monkeypatch.setattr(updater, "failureDialog", lambda: None)
+    server = FakeUpdateServer({})
+    server.handle = lambda action, stream: server.send("UNKNOWN_APP")
+
+    assert run_updater(server) == updater.Updater.RESULT_FAILURE
+
+
+def send_file_block(path, name, data):
+    block = QtCore.QByteArray()
+    out = QtCore.QDataStream(block, QtCore.QIODevice.WriteOnly)
+    out.setVersion(QtCore.QDataStream.Qt_4_2)
+    for string in ("SEND_FILE", path, name):
+        out.writeQString(string)
+    out.writeInt(len(data))
+    out.writeRawData(data)
+    return str(block)
+
+
+def test_send_file_header_is_read_from_the_start_of_the_block(application):
+    block = send_file_block("gamedata", "units.scd", "x" * 100)
+
+    assert updater.sendFileHeader(block) == ("gamedata", "units.scd", 100, len(block) - 100)
+    assert updater.sendFileHeader(block[:20]) is None
+
+
+def test_send_file_header_ignores_other_actions(application):
+    block = QtCore.QByteArray()
+    out = QtCore.QDataStream(block, QtCore.QIODevice.WriteOnly)
+    out.setVersion(QtCore.QDataStream.Qt_4_2)
+    out.writeQString("UP_TO_DATE")
+    out.writeQString("units.scd")
+
+    assert updater.sendFileHeader(str(block)) is False
+
+
+def test_incoming_file_replaces_the_old_one_once_complete(tmpdir):
+    tmpdir.join("units.scd").write("old")
+    incoming = updater.IncomingFile(str(tmpdir), "units.scd", 6)
+
+    incoming.write("new")
+    assert tmpdir.join("units.scd").read() == "old"
+    incoming.write("new")
+
+    assert incoming.remaining == 0
+    assert incoming.commit()
+    assert tmpdir.join("units.scd").read() == "newnew"
+    assert not tmpdir.join("units.scd.part").check()
+
+
+def test_updater_streams_big_files_to_disk(application, appdata):
+    data = "".join(chr(i % 251) for i in range(3 * updater.RECEIVE_CHUNK_SIZE))
+    server = FakeUpdateServer({"units.scd": data})
+
+    assert run_updater(server) == updater.Updater.RESULT_SUCCESS
+    assert appdata.join("gamedata", "units.scd").read(mode="rb") == data
+    assert not appdata.join("gamedata", "units.scd.part").check()
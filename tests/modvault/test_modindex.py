@@ -0,0 +1,94 @@
+import os
+
+from modvault import modindex
+
+
+def make_mod(folder, name, version=1):
+    moddir = folder.mkdir(name)
+    moddir.join("mod_info.lua").write("name = '%s'\nversion = %d\n" % (name, version))
+    return str(moddir)
+
+
+def counting_parse(parsed):
+    def parse(path):
+        parsed.append(path)
+        return {"name": os.path.basename(path)}
+    return parse
+
+
+def test_mods_are_parsed_once(tmpdir):
+    paths = [make_mod(tmpdir, "a"), make_mod(tmpdir, "b")]
+    parsed = []
+    index = modindex.ModIndex(str(tmpdir.join("modindex.json")))
+
+    assert index.infos(paths, counting_parse(parsed)) == {paths[0]: {"name": "a"}, paths[1]: {"name": "b"}}
+    assert index.infos(paths, counting_parse(parsed))[paths[1]] == {"name": "b"}
+    assert sorted(parsed) == sorted(paths)
+
+
+def test_index_is_kept_on_disk(tmpdir):
+    paths = [make_mod(tmpdir, "a")]
+    index = modindex.ModIndex(str(tmpdir.join("modindex.json")))
+    index.infos(paths, counting_parse([]))
+    index.save()
+
+    parsed = []
+    assert modindex.ModIndex(str(tmpdir.join("modindex.json"))).infos(paths, counting_parse(parsed)) == \
+        {paths[0]: {"name": "a"}}
+    assert parsed == []
+
+
+def test_changed_mod_info_is_parsed_again(tmpdir):
+    path = make_mod(tmpdir, "a")
+    parsed = []
+    index = modindex.ModIndex(str(tmpdir.join("modindex.json")))
+    index.infos([path], counting_parse(parsed))
+
+    tmpdir.join("a", "mod_info.lua").write("name = 'a'\nversion = 20\n")
+    index.infos([path], counting_parse(parsed))
+
+    assert parsed == [path, path]
+
+
+def test_invalid_mods_are_remembered_too(tmpdir):
+    path = str(tmpdir.join("broken.zip"))
+    tmpdir.join("broken.zip").write("not a zip")
+    parsed = []
+    index = modindex.ModIndex(str(tmpdir.join("modindex.json")))
+
+    def parse(path):
+        parsed.append(path)
+        return None
+
+    assert index.infos([path, str(tmpdir.join("missing"))], parse) == {path: None}
+    assert index.infos([path], parse) == {path: None}
+    assert parsed == [path]
+
+
+def test_prune_forgets_removed_mods(tmpdir):
+    paths = [make_mod(tmpdir, "a"), make_mod(tmpdir, "b")]
+    index = modindex.ModIndex(str(tmpdir.join("modindex.json")))
+    index.infos(paths, counting_parse([]))
+
+    index.prune(paths[:1])
+
+    assert list(index.entries) == paths[:1]
+
+
+def test_latin1_mod_info_is_saved(tmpdir):
+    path = make_mod(tmpdir, "a")
+    index = modindex.ModIndex(str(tmpdir.join("modindex.json")))
+
+    info = index.infos([path], lambda path: {"author": "Jos\xe9", "description": "caf\xc3\xa9"})[path]
+    assert info == {u"author": u"Jos\xe9", u"description": u"caf\xe9"}
+    assert index.save()
+    assert modindex.ModIndex(str(tmpdir.join("modindex.json"))).entries[path][2] == info
+
+
+def test_failed_save_is_not_raised(tmpdir):
+    tmpdir.join("modindex.json").mkdir()
+    index = modindex.ModIndex(str(tmpdir.join("modindex.json")))
+    index.infos([make_mod(tmpdir, "a")], counting_parse([]))
+
+    assert not index.save()
+    assert index.dirty
@@ -0,0 +1,87 @@
+import json
+import os
+
+from replays import localindex
+
+
+def write_replay(directory, name, info):
+    directory.join(name).write(json.dumps(info) + "\nZGF0YQ==")
+
+
+def complete_info(**kwargs):
+    info = dict(complete=True, game_time=1420070400, title="Game", mapname="scmp_009", featured_mod="faf",
+                teams={"1": ["Alice"], "2": ["Bob"]}, recorder="Alice")
+    info.update(kwargs)
+    return info
+
+
+def test_index_reads_replay_headers(tmpdir):
+    replay_dir = tmpdir.mkdir("replays")
+    write_replay(replay_dir, "1-Alice.fafreplay", complete_info())
+    write_replay(replay_dir, "2-Alice.fafreplay", {"complete": False})
+    replay_dir.join("3-Alice.fafreplay").write("garbage")
+    replay_dir.join("old.scfareplay").write("")
+    replay_dir.join("notes.txt").write("")
+
+    index = localindex.LocalReplayIndex(str(tmpdir.join("index.sqlite")), str(replay_dir))
+    assert index.refresh() == 4
+    assert len(index) == 4
+
+    buckets = dict(index.buckets())
+    assert buckets[localindex.BUCKET_INCOMPLETE] == 1
+    assert buckets[localindex.BUCKET_BROKEN] == 1
+    assert buckets[localindex.BUCKET_LEGACY] == 1
+
+    date = [bucket for bucket in buckets if bucket[0].isdigit()][0]
+    replay, = index.replays(date)
+    assert replay.filename == "1-Alice.fafreplay"
+    assert replay.title == "Game"
+    assert sorted(replay.players.split(", ")) == ["Alice", "Bob"]
+
+
+def test_refresh_only_reads_changed_replays(tmpdir, monkeypatch):
+    replay_dir = tmpdir.mkdir("replays")
+    write_replay(replay_dir, "1-Alice.fafreplay", complete_info())
+    write_replay(replay_dir, "2-Alice.fafreplay", complete_info())
+
+    index = localindex.LocalReplayIndex(str(tmpdir.join("index.sqlite")), str(replay_dir))
+    index.refresh()
+
+    described = []
+    describe = localindex.describeReplay
+    monkeypatch.setattr(localindex, "describeReplay", lambda *args: described.append(args[1]) or describe(*args))
+
+    assert index.refresh() == 0
+    assert described == []
+
+    write_replay(replay_dir, "1-Alice.fafreplay", complete_info(title="Renamed game"))
+    os.utime(str(replay_dir.join("1-Alice.fafreplay")), (0, 0))
+    replay_dir.join("2-Alice.fafreplay").remove()
+    assert index.refresh() == 2
+    assert described == ["1-Alice.fafreplay"]
+    assert [replay.title for replay in index.replays(index.buckets()[0][0])] == ["Renamed game"]
+
+
+def test_index_persists(tmpdir):
+    replay_dir = tmpdir.mkdir("replays")
+    write_replay(replay_dir, "1-Alice.fafreplay", complete_info())
+
+    localindex.LocalReplayIndex(str(tmpdir.join("index.sqlite")), str(replay_dir)).refresh()
+
+    index = localindex.LocalReplayIndex(str(tmpdir.join("index.sqlite")), str(replay_dir))
+    assert len(index) == 1
+    assert index.refresh() == 0
+
+
+def test_replays_are_paged(tmpdir):
+    replay_dir = tmpdir.mkdir("replays")
+    for i in range(5):
+        write_replay(replay_dir, "%d-Alice.fafreplay" % i, complete_info(game_time=1420070400 + i))
+
+    index = localindex.LocalReplayIndex(str(tmpdir.join("index.sqlite")), str(replay_dir))
+    index.refresh()
+    bucket, count = index.buckets()[0]
+
+    assert count == 5
+    assert [replay.filename for replay in index.replays(bucket, 1, 2)] == ["3-Alice.fafreplay", "2-Alice.fafreplay"]
+    assert len(index.replays(bucket, 4)) == 1
@@ -0,0 +1,66 @@
+from PyQt4 import QtCore
+
+from replays import replaymodel
+
+
+class FakePreviews(QtCore.QObject):
+    previewLoaded = QtCore.pyqtSignal(str)
+
+    def icon(self, mapname):
+        return None
+
+
+class FakeReplay(object):
+    def __init__(self, uid, day, mapname="scmp_009"):
+        self.uid = uid
+        self.startDate = day
+        self.mapname = mapname
+        self.viewtext = str(uid)
+
+
+def test_online_model_pages_big_buckets(application):
+    model = replaymodel.OnlineReplayModel(FakePreviews())
+    model.setReplays([FakeReplay(i, "2015-01-0%d" % (i % 2 + 1)) for i in range(1000)])
+
+    assert model.rowCount() == 2
+    day = model.index(0, 0)
+    assert model.bucketName(day) == "2015-01-02"
+    assert model.rowCount(day) == 0
+    assert model.hasChildren(day)
+
+    model.fetchMore(day)
+    assert model.rowCount(day) == replaymodel.PAGE_SIZE
+    assert model.replay(model.index(0, 0, day)).uid == 999
+    assert model.parent(model.index(3, 0, day)) == day
+    assert model.replay(day) is None
+
+    while model.canFetchMore(day):
+        model.fetchMore(day)
+    assert model.rowCount(day) == 500
+
+
+def test_online_model_data(application):
+    model = replaymodel.OnlineReplayModel(FakePreviews())
+    model.setReplays([FakeReplay(7, "2015-01-01")])
+    day = model.index(0, 0)
+    model.fetchMore(day)
+
+    replay = model.index(0, 0, day)
+    assert model.data(replay) == "7"
+    assert model.data(replay, QtCore.Qt.UserRole).uid == 7
+    assert "1 replays" in model.data(model.index(0, 1))
+
+
+def test_loaded_preview_only_updates_rows_on_that_map(application):
+    previews = FakePreviews()
+    model = replaymodel.OnlineReplayModel(previews)
+    model.setReplays([FakeReplay(i, "2015-01-01", "scmp_00%d" % (i % 3)) for i in range(9)])
+    day = model.index(0, 0)
+    model.fetchMore(day)
+    changed = []
+    model.dataChanged.connect(lambda first, last: changed.append((first.row(), last.row())))
+
+    previews.previewLoaded.emit("scmp_001")
+
+    assert [model.replay(model.index(first, 0, day)).uid for first, last in changed] == [7, 4, 1]
+    assert all(first == last for first, last in changed)
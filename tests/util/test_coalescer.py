@@ -0,0 +1,40 @@
+from util.coalescer import Coalescer
+
+
+def test_items_are_flushed_once_per_burst(application, qtbot):
+    coalescer = Coalescer(10)
+    flushed = []
+    coalescer.flushed.connect(flushed.append)
+
+    with qtbot.waitSignal(coalescer.flushed, timeout=1000):
+        coalescer.add(["a", "b"])
+        coalescer.add(["a"])
+        coalescer.add([])
+        assert flushed == []
+
+    assert [sorted(items) for items in flushed] == [["a", "b"]]
+    assert not coalescer.timer.isActive()
+
+
+def test_nothing_is_flushed_without_items(application):
+    coalescer = Coalescer(10)
+    flushed = []
+    coalescer.flushed.connect(flushed.append)
+
+    coalescer.add([])
+    assert not coalescer.timer.isActive()
+    coalescer.flush()
+    assert flushed == []
+
+
+def test_flush_hands_items_on_right_away(application):
+    coalescer = Coalescer(10)
+    flushed = []
+    coalescer.flushed.connect(flushed.append)
+
+    coalescer.add(["a"])
+    coalescer.flush()
+    coalescer.add(["b"])
+
+    assert flushed == [["a"]]
+    assert coalescer.pending == set(["b"])
@@ -0,0 +1,97 @@
+import BaseHTTPServer
+import hashlib
+import threading
+
+import pytest
+
+from util import downloadengine
+
+DATA = "".join(chr(i % 251) for i in range(200000))
+
+
+class ContentHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.ranges.append(self.headers.get("Range"))
+        if self.path == "/missing.zip":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get("Range"):
+            start = int(self.headers.get("Range").split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(DATA) - 1, len(DATA)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(DATA) - start))
+        self.end_headers()
+        self.wfile.write(DATA[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def server(request):
+    httpd = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), ContentHandler)
+    httpd.ranges = []
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(httpd.shutdown)
+    httpd.url = "http://127.0.0.1:%d/" % httpd.server_address[1]
+    return httpd
+
+
+def test_downloads_to_path(application, server, tmpdir):
+    engine = downloadengine.DownloadEngine(parent=application)
+    target = str(tmpdir.join("map.zip"))
+    download = engine.download(server.url + "map.zip", target, hashlib.md5(DATA).hexdigest())
+
+    assert downloadengine.wait([download])
+    assert open(target, "rb").read() == DATA
+    assert not tmpdir.join("map.zip" + downloadengine.PART_SUFFIX).check()
+
+
+def test_resumes_part_file(application, server, tmpdir):
+    engine = downloadengine.DownloadEngine(parent=application)
+    target = str(tmpdir.join("map.zip"))
+    tmpdir.join("map.zip" + downloadengine.PART_SUFFIX).write(DATA[:5000], mode="wb")
+    download = engine.download(server.url + "map.zip", target, hashlib.md5(DATA).hexdigest())
+
+    assert downloadengine.wait([download])
+    assert server.ranges == ["bytes=5000-"]
+    assert open(target, "rb").read() == DATA
+
+
+def test_checksum_mismatch_fails(application, server, tmpdir):
+    engine = downloadengine.DownloadEngine(parent=application)
+    target = str(tmpdir.join("map.zip"))
+    download = engine.download(server.url + "map.zip", target, "0" * 32)
+
+    assert not downloadengine.wait([download])
+    assert download.error == "Checksum mismatch"
+    assert not tmpdir.join("map.zip").check()
+
+
+def test_404_is_not_retried(application, server, tmpdir):
+    engine = downloadengine.DownloadEngine(parent=application)
+    download = engine.download(server.url + "missing.zip", str(tmpdir.join("missing.zip")))
+
+    assert not downloadengine.wait([download])
+    assert download.status == 404
+    assert len(server.ranges) == 1
+
+
+def test_runs_at_most_transfers_at_once(application, server, tmpdir):
+    engine = downloadengine.DownloadEngine(2, parent=application)
+    downloads = [engine.download(server.url + "mod%d.zip" % i, str(tmpdir.join("mod%d.zip" % i))) for i in range(5)]
+
+    assert len(engine.active) == 2
+    assert len(engine.queue) == 3
+    assert downloadengine.wait(downloads)
+    assert not engine.active and not engine.queue
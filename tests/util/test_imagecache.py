@@ -0,0 +1,236 @@
+import BaseHTTPServer
+import collections
+import os
+import threading
+import time
+
+import pytest
+from PyQt4 import QtCore, QtGui
+
+from util import imagecache
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Sat, 17 Oct 2026 12:00:00 GMT"
+
+
+class FakePixmap(object):
+    def __init__(self, width, height, depth=32):
+        self._width, self._height, self._depth = width, height, depth
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def depth(self):
+        return self._depth
+
+
+def test_lru_evicts_least_recently_used_over_budget():
+    metrics = collections.Counter()
+    lru = imagecache.PixmapLRU(3 * 100 * 100 * 4, metrics)
+    for key in "abc":
+        lru.put(key, FakePixmap(100, 100))
+    assert lru.get("a") is not None
+
+    lru.put("d", FakePixmap(100, 100))
+
+    assert "b" not in lru
+    assert all(key in lru for key in "acd")
+    assert lru.size == 3 * 100 * 100 * 4
+    assert metrics["evictions"] == 1
+    assert metrics["memory_hits"] == 1
+
+
+def test_lru_keeps_newest_entry_even_over_budget():
+    lru = imagecache.PixmapLRU(1024, collections.Counter())
+    lru.put("small", FakePixmap(4, 4))
+    lru.put("huge", FakePixmap(1000, 1000))
+
+    assert len(lru) == 1
+    assert "huge" in lru
+
+
+def test_lru_replacing_a_key_updates_size():
+    lru = imagecache.PixmapLRU(10 ** 6, collections.Counter())
+    lru.put("a", FakePixmap(10, 10))
+    lru.put("a", FakePixmap(20, 20))
+
+    assert lru.size == 20 * 20 * 4
+    lru.discard("a")
+    assert lru.size == 0
+
+
+def test_null_pixmaps_still_cost_something():
+    assert imagecache.pixmapCost(FakePixmap(0, 0)) == imagecache.MIN_PIXMAP_COST
+
+
+def test_disk_store_shares_identical_content(tmpdir):
+    store = imagecache.DiskStore(str(tmpdir))
+    first = store.put(u"http://example.com/a.png", "image", etag='"1"')
+    second = store.put(u"http://example.com/b.png", "image")
+
+    assert first == second
+    assert open(first, "rb").read() == "image"
+    assert store.entry(u"http://example.com/a.png").etag == '"1"'
+
+    # a.png changes, the old content is still used by b.png
+    store.put(u"http://example.com/a.png", "other")
+    assert os.path.isfile(first)
+
+    # and once b.png is gone too, the file goes
+    store.putMissing(u"http://example.com/b.png")
+    assert not os.path.isfile(first)
+    assert store.entry(u"http://example.com/b.png").status == imagecache.STATUS_NOT_FOUND
+
+
+def test_disk_store_touch_updates_checked(tmpdir):
+    store = imagecache.DiskStore(str(tmpdir))
+    store.put(u"http://example.com/a.png", "image", checked=1.0)
+    store.touch(u"http://example.com/a.png", checked=2.0)
+
+    assert store.entry(u"http://example.com/a.png").checked == 2.0
+
+
+def test_disk_store_survives_reopening(tmpdir):
+    imagecache.DiskStore(str(tmpdir)).put(u"http://example.com/a.png", "image", last_modified="yesterday")
+    entry = imagecache.DiskStore(str(tmpdir)).entry(u"http://example.com/a.png")
+
+    assert entry.last_modified == "yesterday"
+    assert entry.status == imagecache.STATUS_OK
+
+
+class ImageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since")))
+        if self.path == "/missing.png":
+            self.send_response(404)
+        elif self.path.startswith("/broken"):
+            self.send_response(500)
+        elif self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(self.server.png)))
+            self.send_header("ETag", ETAG)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+            self.end_headers()
+            self.wfile.write(self.server.png)
+            return
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def png():
+    image = QtGui.QImage(4, 4, QtGui.QImage.Format_ARGB32)
+    image.fill(0xff808080)
+    data = QtCore.QByteArray()
+    buf = QtCore.QBuffer(data)
+    buf.open(QtCore.QIODevice.WriteOnly)
+    image.save(buf, "PNG")
+    return str(data)
+
+
+@pytest.fixture(scope="function")
+def server(application, request):
+    httpd = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), ImageHandler)
+    httpd.requests = []
+    httpd.png = png()
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.addfinalizer(httpd.shutdown)
+    httpd.url = "http://127.0.0.1:%d/" % httpd.server_address[1]
+    return httpd
+
+
+@pytest.fixture(scope="function")
+def cache(application, tmpdir, request):
+    images = imagecache.ImageCache(str(tmpdir), parent=application)
+    request.addfinalizer(images.close)
+    return images
+
+
+def fetch(qtbot, cache, url):
+    pixmaps = []
+    with qtbot.waitSignal(cache.network.finished, timeout=5000):
+        cache.request(url, pixmaps.append)
+    return pixmaps
+
+
+def test_requests_for_a_url_share_one_fetch(cache, server, qtbot):
+    url = server.url + "a.png"
+    pixmaps = []
+    with qtbot.waitSignal(cache.network.finished, timeout=5000):
+        cache.request(url, pixmaps.append)
+        cache.request(url, pixmaps.append)
+
+    assert len(server.requests) == 1
+    assert len(pixmaps) == 2
+    assert pixmaps[0] is pixmaps[1]
+    assert not pixmaps[0].isNull()
+    assert cache.metrics["fetches"] == 1
+    assert cache.disk.entry(url).etag == ETAG
+
+    # From memory now, right away
+    cache.request(url, pixmaps.append)
+    assert len(pixmaps) == 3
+    assert len(server.requests) == 1
+
+
+def test_fresh_copy_on_disk_is_used_without_asking(cache, server):
+    url = server.url + "a.png"
+    cache.disk.put(url, server.png, ETAG, LAST_MODIFIED)
+    pixmaps = []
+    cache.request(url, pixmaps.append)
+
+    assert not pixmaps[0].isNull()
+    assert server.requests == []
+    assert cache.metrics["disk_hits"] == 1
+
+
+def test_stale_copy_is_revalidated(cache, server, qtbot):
+    url = server.url + "a.png"
+    cache.disk.put(url, server.png, ETAG, LAST_MODIFIED, checked=1.0)
+    pixmaps = fetch(qtbot, cache, url)
+
+    assert server.requests == [("/a.png", ETAG, LAST_MODIFIED)]
+    assert cache.metrics["not_modified"] == 1
+    assert not pixmaps[0].isNull()
+    # the 304 touched the entry, it's fresh again
+    assert cache.disk.entry(url).checked > time.time() - 60
+    assert cache.path(url, fresh=True)
+
+
+def test_404_is_remembered_for_a_while(cache, server, qtbot, monkeypatch):
+    url = server.url + "missing.png"
+
+    assert fetch(qtbot, cache, url) == [None]
+    assert cache.isMissing(url)
+    assert cache.metrics["not_found"] == 1
+
+    pixmaps = []
+    cache.request(url, pixmaps.append)
+    assert pixmaps == [None]
+    assert len(server.requests) == 1
+
+    monkeypatch.setattr(imagecache, "NEGATIVE_TTL", 0)
+    assert not cache.isMissing(url)
+    assert fetch(qtbot, cache, url) == [None]
+    assert len(server.requests) == 2
+
+
+def test_failed_revalidation_falls_back_to_the_stale_copy(cache, server, qtbot):
+    url = server.url + "broken.png"
+    cache.disk.put(url, server.png, checked=1.0)
+
+    pixmaps = fetch(qtbot, cache, url)
+    assert not pixmaps[0].isNull()
+    assert cache.metrics["errors"] == 1
+
+    assert fetch(qtbot, cache, server.url + "broken-too.png") == [None]
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from util import ircformat
+
+WORDS = ["gg", "lol", "anyone", "for", "setons?", "4v4", "need", "1", "more", "<3", "it's", "a&b",
+         "\"ok\"", "rating", "1500+", "replay", "faf.com", "Hi", "ty", "mod", "vault", "...", "x.x"]
+
+LINKS = ["http://www.faforever.com/forums/viewtopic.php?f=2&t=1", "faforever.com", "www.youtube.com/watch?v=abc",
+         "faflive://lobby.faforever.com/12345/Zock.SCFAreplay", "ts3server://ts.example.org:9987", "localhost:8080",
+         "127.0.0.1/index.html"]
+
+
+def reference_escape(text, a_style=""):
+    ''' irc_escape the way it was written before: per character escaping, every word matched '''
+    table = {"&": "&amp;", '"': "&quot;", "'": "&apos;", ">": "&gt;", "<": "&lt;"}
+    result = []
+    for fragment in "".join(table.get(c, c) for c in text).split():
+        if ircformat._URL.match(fragment):
+            if "://" in fragment:
+                fragment = '<a href="{0}" style="{1}">{0}</a>'.format(fragment, a_style)
+            else:
+                fragment = '<a href="http://{0}" style="{1}">{0}</a>'.format(fragment, a_style)
+        result.append(fragment)
+    return " ".join(result)
+
+
+def traffic(lines, seed=1):
+    ''' Chat lines shaped like a busy channel: mostly short chatter, a link now and then '''
+    rng = random.Random(seed)
+    for _ in range(lines):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(1, 14))]
+        if rng.random() < 0.05:
+            words.insert(rng.randint(0, len(words)), rng.choice(LINKS))
+        yield " ".join(words)
+
+
+def test_html_is_escaped():
+    assert ircformat.html_escape("<b>\"Tom\" & 'Jerry'</b>") == \
+        "&lt;b&gt;&quot;Tom&quot; &amp; &apos;Jerry&apos;&lt;/b&gt;"
+
+
+def test_urls_become_links():
+    assert ircformat.irc_escape("see faforever.com  and https://github.com/FAForever", "color:red") == \
+        'see <a href="http://faforever.com" style="color:red">faforever.com</a> and ' \
+        '<a href="https://github.com/FAForever" style="color:red">https://github.com/FAForever</a>'
+
+
+def test_words_that_are_not_urls_are_kept():
+    assert ircformat.irc_escape("gg wp... 1.5 x.notatld <3") == "gg wp... 1.5 x.notatld &lt;3"
+
+
+def test_cached_links_keep_their_style():
+    assert "style=\"a\"" in ircformat.irc_escape("faforever.com", "a")
+    assert "style=\"b\"" in ircformat.irc_escape("faforever.com", "b")
+
+
+def test_cache_is_bounded():
+    for i in range(ircformat.LINK_CACHE_SIZE + 10):
+        ircformat.irc_escape("host%d.com" % i)
+    assert len(ircformat._links) == ircformat.LINK_CACHE_SIZE
+
+
+def test_same_html_as_before():
+    for line in traffic(2000, seed=7):
+        assert ircformat.irc_escape(line, "color:blue") == reference_escape(line, "color:blue")
+
+
+@pytest.mark.benchmark
+def test_a_day_of_chat(rates):
+    lines = list(traffic(100000))
+
+    with rates.measure("escaped before", len(lines), "lines"):
+        for line in lines:
+            reference_escape(line)
+
+    with rates.measure("escaped after", len(lines), "lines"):
+        for line in lines:
+            ircformat.irc_escape(line)
@@ -0,0 +1,115 @@
+import pytest
+
+from util import lua
+
+MARKER = """        ['%s'] = {
+          ['size'] = FLOAT( 1.000000 ),
+          ['resource'] = BOOLEAN( true ),
+          ['color'] = STRING( 'ff808080' ),
+          ['editorIcon'] = STRING( '/textures/editor/marker_mass.bmp' ),
+          ['type'] = STRING( 'Mass' ),
+          ['prop'] = STRING( '/env/common/props/markers/M_Mass_prop.bp' ),
+          ['orientation'] = VECTOR3( 0, -0, 0 ),
+          ['position'] = VECTOR3( %d.5, 20.25, 300.5 ),
+        },
+"""
+
+
+def save_file(markers):
+    return ("version = 3 -- Lua Version. Dont touch this\n"
+            "Scenario = {\n  MasterChain = {\n    ['_MASTERCHAIN_'] = {\n      Markers = {\n" +
+            "".join(MARKER % ("Mass %d" % i, i) for i in range(markers)) +
+            "      },\n    },\n  },\n}\n")
+
+
+def test_assignments_become_a_dict():
+    assert lua.loads("name = 'x' ; version = 3 -- comment\nenabled = true\nicon = nil") == \
+        {"name": "x", "version": 3, "enabled": True, "icon": None}
+
+
+def test_tables_are_keyed_like_in_lua():
+    assert lua.decode("{ 'a', 'b', x = 1.5, ['y z'] = { }, [10] = -0x10, }") == \
+        {1: "a", 2: "b", "x": 1.5, "y z": {}, 10: -16}
+
+
+def test_strings():
+    assert lua.decode(r'''{ "q\"\65\n", 'it''s', [==[
+long ]] string]==] }''') == {1: 'q"A\n', 2: "it", 3: "s", 4: "long ]] string"}
+
+
+def test_calls_give_their_arguments():
+    assert lua.decode("{ VECTOR3( 1.5, -0, 3 ), STRING( 'ff808080' ), BOOLEAN( true ) }") == \
+        {1: (1.5, 0, 3), 2: "ff808080", 3: True}
+
+
+def test_comments_are_skipped():
+    assert lua.loads("--[[ a\nblock ]]\na = { --[==[ x ]==] 1, -- 2\n}") == {"a": {1: 1}}
+
+
+def test_raw_keeps_the_text():
+    assert lua.decode("{ 'a', Size = 1.000, On = true, Pos = VECTOR3( 1, 2, 3 ) }", raw=True, lowerKeys=True) == \
+        {"0": "a", "size": "1.000", "on": "true", "pos": "VECTOR3( 1, 2, 3 )"}
+
+
+def test_visit_is_called_in_order_with_the_path():
+    visited = []
+    lua.loads("a = { b = { 1 }, c = 2 }", visit=lambda parent, key, value: visited.append((parent, key)))
+
+    assert visited == [(">a>b", 1), (">a", "b"), (">a", "c"), ("", "a")]
+
+
+def test_call_with_a_table_gives_the_table():
+    text = """Armies = {
+        ['ARMY_1'] = {
+            Units = GROUP {
+                orders = '',
+                Units = {
+                    ['UNIT_1'] = { type = 'uel0001', Position = VECTOR3( 1, 2, 3 ) },
+                },
+            },
+        },
+    }"""
+
+    assert lua.loads(text) == \
+        {"Armies": {"ARMY_1": {"Units": {"orders": "", "Units": {"UNIT_1": {"type": "uel0001", "Position": (1, 2, 3)}}}}}}
+    assert lua.loads(text, raw=True, lowerKeys=True)["armies"]["army_1"]["units"]["units"]["unit_1"] == \
+        {"type": "uel0001", "position": "VECTOR3( 1, 2, 3 )"}
+
+
+@pytest.mark.parametrize("text", ["a = { 1, 2", "a = { 1, @ }", "a 1", "a = "])
+def test_bad_text_raises(text):
+    with pytest.raises(lua.LuaError):
+        lua.loads(text)
+
+
+def test_save_file_markers():
+    text = save_file(100)
+
+    positions = {}
+    lua.loads(text, raw=True, lowerKeys=True,
+              visit=lambda parent, key, value: key == "position" and positions.__setitem__(parent, value))
+
+    assert len(positions) == 100
+    assert positions[">scenario>masterchain>_masterchain_>markers>mass 42"] == "VECTOR3( 42.5, 20.25, 300.5 )"
+
+
+@pytest.mark.parametrize("text", ["x = " + " " * 5000 + "@",
+                                  "x = {" + "\n" * 5000 + "@ }",
+                                  "x = 1 " + "-" * 5000 + "\n@",
+                                  "x = 1 " + "-- " * 2000 + "\n@"])
+def test_bad_text_after_long_blanks_raises(text):
+    with pytest.raises(lua.LuaError):
+        lua.loads(text)
+
+
+@pytest.mark.benchmark
+def test_5mb_save_file(rates):
+    text = save_file(12000)
+    assert len(text) > 5 * 1000 * 1000
+
+    positions = {}
+    with rates.measure("parsed", len(text) // 1024, "KiB"):
+        lua.loads(text, raw=True, lowerKeys=True,
+                  visit=lambda parent, key, value: key == "position" and positions.__setitem__(parent, value))
+
+    assert len(positions) == 12000